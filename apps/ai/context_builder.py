@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Dựng phần history gửi kèm prompt GPT theo ngân sách token (thay cho "20 tin gần nhất" / cả history).
+
+- Đếm token cục bộ, xấp xỉ (apps.ai.tokens)
+- Giữ các tin mới nhất vừa ngân sách (tối đa CONTEXT_MAX_MESSAGES tin)
+- Tin cũ hơn được gộp dần vào 1 bản tóm tắt lưu cạnh hội thoại (`chat:<id>:summary`);
+  chỉ tóm tắt lại khi có >= SUMMARY_REFRESH_EVERY tin chưa gộp (chạy nền qua pool speculative)
+
+HISTORY_WINDOW phải > CONTEXT_MAX_MESSAGES + SUMMARY_REFRESH_EVERY để tin không trượt khỏi
+cửa sổ trước khi được gộp.
+"""
+import hashlib
+import os
+import threading
+from typing import List, Optional
+
+from openai import OpenAI
+
+from apps.ai.prompts import get_prompt, record_call, register_prompt
+from apps.ai.tokens import count_tokens, message_tokens, messages_tokens
+from apps.extensions import cache
+from apps.utils import metrics
+from apps.utils.conversation_store import TTL as HISTORY_TTL, ConversationWindow
+from apps.vector import speculative
+
+REPLY_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+NLU_BUDGET = int(os.getenv("NLU_CONTEXT_TOKEN_BUDGET", 600))
+MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", 12))
+REFRESH_EVERY = int(os.getenv("SUMMARY_REFRESH_EVERY", 6))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o")
+SUMMARY_MAX_TOKENS = 300
+
+# hội thoại đang được tóm tắt nền (NLU + reply cùng turn chỉ chạy 1 lượt)
+_INFLIGHT = set()
+_INFLIGHT_LOCK = threading.Lock()
+
+SUMMARY_PROMPT = (
+    "Bạn tóm tắt hội thoại giữa khách và trợ lý spa. "
+    "Gộp bản tóm tắt cũ với các tin mới thành 1 bản ngắn gọn (tối đa 5 gạch đầu dòng): "
+    "spa/dịch vụ/thời gian khách quan tâm, lịch đã đặt, câu hỏi còn dang dở. "
+    "Chỉ trả về bản tóm tắt."
+)
+
+
+@register_prompt("summary")
+def _render_summary_prompt(catalog) -> str:
+    return SUMMARY_PROMPT
+
+
+def fit_budget(history: List[dict], budget: int, max_messages: int = MAX_MESSAGES) -> List[dict]:
+    """Các tin mới nhất vừa `budget` token (luôn giữ tin cuối cùng)."""
+    kept, used = [], 0
+    for msg in reversed(history[-max_messages:]):
+        t = message_tokens(msg)
+        if kept and used + t > budget:
+            break
+        kept.append(msg)
+        used += t
+    kept.reverse()
+    return kept
+
+
+# ============================
+#        ROLLING SUMMARY
+# ============================
+def _summary_key(conversation_key: str) -> str:
+    return f"{conversation_key}:summary"
+
+
+def _fingerprint(msg: dict) -> str:
+    raw = f"{msg.get('role')}|{msg.get('content')}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def load_summary(conversation_key: str) -> Optional[dict]:
+    """{"text", "last": fingerprint tin cuối đã gộp} hoặc None."""
+    try:
+        return cache.get(_summary_key(conversation_key))
+    except Exception:
+        return None
+
+
+def _unfolded(older: List[dict], summary: Optional[dict]) -> List[dict]:
+    """Các tin trong `older` chưa có trong tóm tắt."""
+    last = (summary or {}).get("last")
+    if last:
+        for i in range(len(older) - 1, -1, -1):
+            if _fingerprint(older[i]) == last:
+                return older[i + 1:]
+    return older
+
+
+def refresh_summary(client: OpenAI, conversation_key: str, previous: Optional[dict], new_msgs: List[dict]) -> Optional[dict]:
+    """Gộp `new_msgs` vào tóm tắt cũ (1 lượt LLM) rồi lưu cạnh hội thoại."""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in new_msgs)
+    old_text = (previous or {}).get("text") or "(chưa có)"
+    prompt = get_prompt("summary")
+    messages = [prompt.message(), {"role": "user", "content": f"TÓM TẮT CŨ:\n{old_text}\n\nTIN MỚI:\n{transcript}"}]
+    try:
+        completion = client.chat.completions.create(model=SUMMARY_MODEL, messages=messages, max_tokens=SUMMARY_MAX_TOKENS)
+        record_call(prompt, messages, completion)
+        text = completion.choices[0].message.content.strip()
+    except Exception:
+        metrics.incr("context.summary_error")
+        return None
+    summary = {"text": text, "last": _fingerprint(new_msgs[-1])}
+    cache.set(_summary_key(conversation_key), summary, timeout=HISTORY_TTL)
+    metrics.incr("context.summary_refresh")
+    return summary
+
+
+def _schedule_refresh(client: OpenAI, conversation_key: str, previous: Optional[dict], new_msgs: List[dict]):
+    with _INFLIGHT_LOCK:
+        if conversation_key in _INFLIGHT:
+            return
+        _INFLIGHT.add(conversation_key)
+
+    def run():
+        try:
+            return refresh_summary(client, conversation_key, previous, new_msgs)
+        finally:
+            with _INFLIGHT_LOCK:
+                _INFLIGHT.discard(conversation_key)
+
+    if speculative.submit(run) is None:
+        with _INFLIGHT_LOCK:
+            _INFLIGHT.discard(conversation_key)
+        metrics.incr("context.summary_deferred")  # pool đầy → để turn sau
+
+
+# ============================
+#          BUILDER
+# ============================
+def build_context(history: List[dict], budget: int, client: Optional[OpenAI] = None,
+                  max_messages: int = MAX_MESSAGES) -> List[dict]:
+    """History đã cắt theo ngân sách, kèm tin system tóm tắt phần cũ (nếu có)."""
+    key = history.key if isinstance(history, ConversationWindow) else None
+    session = history.session if key else None
+    if session is not None:
+        summary = session.get("summary")  # đã nạp cùng pipeline đầu turn
+    else:
+        summary = load_summary(key) if key else None
+    summary_msg = None
+    if summary and summary.get("text"):
+        summary_msg = {"role": "system", "content": f"Tóm tắt hội thoại trước đó:\n{summary['text']}"}
+        budget = max(0, budget - message_tokens(summary_msg))
+
+    kept = fit_budget(history, budget, max_messages)
+    older = history[:len(history) - len(kept)]
+    if key and client is not None and older:
+        new_msgs = _unfolded(older, summary)
+        if len(new_msgs) >= REFRESH_EVERY:
+            _schedule_refresh(client, key, summary, new_msgs)
+
+    out = ([summary_msg] if summary_msg else []) + kept
+    metrics.incr("context.builds")
+    metrics.incr("context.tokens", messages_tokens(out))
+    metrics.incr("context.dropped", len(older))
+    return out
+
+
+def context_stats() -> dict:
+    builds = metrics.get("context.builds")
+    return {
+        "builds": builds,
+        "avg_history_tokens": round(metrics.get("context.tokens") / builds, 1) if builds else 0.0,
+        "dropped": metrics.get("context.dropped"),
+        "summary_refresh": metrics.get("context.summary_refresh"),
+        "summary_deferred": metrics.get("context.summary_deferred"),
+        "summary_error": metrics.get("context.summary_error"),
+    }
+
+
+metrics.register_view("context", context_stats)
+
+__all__ = ["count_tokens", "message_tokens", "messages_tokens", "fit_budget", "build_context",
+           "load_summary", "refresh_summary", "REPLY_BUDGET", "NLU_BUDGET"]
@@ -2,7 +2,6 @@
 from __future__ import annotations
 import json
 import re
-import unicodedata
 from enum import Enum
 from typing import Optional, Literal, Dict, Any, List
 from datetime import datetime, timedelta
@@ -11,9 +10,15 @@ from zoneinfo import ZoneInfo
 from pydantic import BaseModel, Field
 from openai import OpenAI
 
-from apps.utils.spa_locations import spa_locations
-from apps.utils.spa_services import spa_services
+from apps.ai.context_builder import NLU_BUDGET, build_context
+from apps.ai.llm_client import get_llm_client
+from apps.ai.prompts import get_prompt, record_call, register_prompt
+from apps.utils.catalog_index import get_catalog_index
+from apps.utils.catalog_store import build_city_keywords, get_catalog, register_derived  # noqa: F401 (tên cũ)
+from apps.utils.text_normalize import fold_text
+from apps.vector.keyword_matcher import PhraseAutomaton
 from apps.vector.parse_time_text import ParseTimeText
+from apps.vector.vector_index import get_catalog_vectors
 
 # rapidfuzz (tuỳ chọn). Nếu không có, code sẽ fallback sang difflib
 try:  # pragma: no cover
@@ -65,32 +70,9 @@ _pt = ParseTimeText()
 VN = ZoneInfo("Asia/Ho_Chi_Minh")
 
 
-def _normalize(s: str) -> str:
-    s = (s or "").casefold().strip()
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-    s = s.replace("đ", "d").replace("Đ", "D")
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-
-def build_city_keywords(spas):
-    city_map = {}
-    for spa in spas:
-        parts = [p.strip().lower() for p in spa.get("address", "").split(",")]
-        if len(parts) >= 2:
-            city = parts[-1]
-            city_map.setdefault(city, set()).add(city)
-    city_map.setdefault("hồ chí minh", set()).update({
-        "hồ chí minh", "ho chi minh", "tp hcm", "tp.hcm", "tp. hcm", "hcm",
-        "sài gòn", "sai gon", "sg", "ho chi minh city"
-    })
-    city_map.setdefault("hà nội", set()).update({"hà nội", "ha noi", "hn", "ha noi city"})
-    return {k: list(v) for k, v in city_map.items()}
-
-
-CITY_KWS = build_city_keywords(spa_locations)
-SPA_NAMES: List[str] = list(spa_services.keys())
+_normalize = fold_text
+
+
 ALIAS_STOPWORDS = {"spa", "tham", "my", "vien", "tmv"}
 
 
@@ -98,10 +80,9 @@ def map_city(raw: Optional[str]) -> Optional[str]:
     if not raw:
         return None
     msg = _normalize(raw)
-    for city, keys in CITY_KWS.items():
-        for k in keys:
-            if _normalize(k) in msg:
-                return city
+    for city, k_norm in get_catalog().derived("city_keywords"):
+        if k_norm in msg:
+            return city
     return None
 
 
@@ -126,37 +107,37 @@ def build_spa_alias_index(spa_names: List[str]) -> Dict[str, str]:
     return alias_map
 
 
-SPA_ALIAS_MAP = build_spa_alias_index(SPA_NAMES)
+@register_derived("intents.spa_alias_matcher")
+def _spa_alias_matcher(catalog) -> PhraseAutomaton:
+    return PhraseAutomaton(build_spa_alias_index(catalog.spa_names))
 
 
 def map_spa_name(raw: Optional[str]) -> Optional[str]:
     if not raw:
         return None
     msg = _normalize(raw)
-    # 1) match alias theo word-boundary
-    hits = []
-    for alias_norm, canonical in SPA_ALIAS_MAP.items():
-        if re.search(rf"\b{re.escape(alias_norm)}\b", msg):
-            hits.append((len(alias_norm), canonical))
-    if hits:
-        hits.sort(reverse=True)
-        return hits[0][1]
+    catalog = get_catalog()
+    # 1) match alias theo word-boundary (alias dài nhất)
+    canonical = catalog.derived("intents.spa_alias_matcher").longest(msg)
+    if canonical:
+        return canonical
     # 2) chứa nguyên tên đầy đủ
-    for name in SPA_NAMES:
-        if _normalize(name) in msg:
+    folded_names = catalog.derived("spa_names_folded")
+    for folded, name in folded_names:
+        if folded in msg:
             return name
     # 3) fuzzy
     if rf_process:
-        match = rf_process.extractOne(msg, SPA_NAMES, scorer=rf_fuzz.token_set_ratio)
+        match = rf_process.extractOne(msg, catalog.spa_names, scorer=rf_fuzz.token_set_ratio)
         if match and match[1] >= 75:
             return match[0]
     else:
         from difflib import get_close_matches
-        cand = get_close_matches(msg, [_normalize(s) for s in SPA_NAMES], n=1, cutoff=0.6)
+        cand = get_close_matches(msg, [folded for folded, _name in folded_names], n=1, cutoff=0.6)
         if cand:
-            for s in SPA_NAMES:
-                if _normalize(s) == cand[0]:
-                    return s
+            for folded, name in folded_names:
+                if folded == cand[0]:
+                    return name
     return None
 
 
@@ -164,23 +145,14 @@ def map_service_name(raw: Optional[str]) -> Optional[str]:
     if not raw:
         return None
     msg = _normalize(raw)
+    index = get_catalog_index()
     # exact contains
-    for spa, services in spa_services.items():
-        for s in services:
-            name_norm = _normalize(s["name"])
-            if name_norm in msg:
-                return s["name"]
+    exact = index.first_service_in_text(msg)
+    if exact:
+        return exact.name
     # token overlap >=2
-    best = None
-    best_score = 0
-    for spa, services in spa_services.items():
-        for s in services:
-            name_norm = _normalize(s["name"]) 
-            toks = [t for t in name_norm.split() if len(t) >= 3]
-            score = sum(1 for t in toks if t in msg)
-            if score > best_score:
-                best, best_score = s["name"], score
-    return best if best_score >= 2 else None
+    best, best_score = index.best_overlap(msg, 3)
+    return best.name if best_score >= 2 else None
 
 
 def parse_datetime(raw: Optional[str]):
@@ -254,16 +226,25 @@ SYS_PROMPT = (
 )
 
 
-def parse_message_with_llm(client: OpenAI, message: str, history: list) -> NLUResult:
-    msgs = [{"role": "system", "content": SYS_PROMPT}] + history + [
-        {"role": "user", "content": message}
-    ]
+@register_prompt("nlu")
+def _render_nlu_prompt(catalog) -> str:
+    return SYS_PROMPT
+
+
+def parse_message_with_llm(client: Optional[OpenAI], message: str, history: list) -> NLUResult:
+    client = client or get_llm_client()
+    prompt = get_prompt("nlu")
+    msgs = [prompt.message()] + build_context(history, NLU_BUDGET, client)
+    user_msg = {"role": "user", "content": message}
+    if msgs[-1] != user_msg:  # history của turn thường đã có sẵn câu user
+        msgs.append(user_msg)
     try:
         out = client.chat.completions.create(
             model="gpt-4o",
             messages=msgs,
             response_format={"type": "json_object"},
         )
+        record_call(prompt, msgs, out)
         data = json.loads(out.choices[0].message.content)
         nlu = NLUResult(**data)
     except Exception:
@@ -288,6 +269,11 @@ def parse_message_with_llm(client: OpenAI, message: str, history: list) -> NLURe
         else:
             nlu = NLUResult(intent=Intent.FALLBACK, confidence=0.1)
 
+    return apply_heuristics(nlu, message)
+
+
+def apply_heuristics(nlu: NLUResult, message: str) -> NLUResult:
+    """Hậu xử lý chung cho NLU (LLM hoặc cục bộ)."""
     # Heuristic hậu xử lý: câu có cụm thời gian → gán time_range
     tr = extract_time_range_phrases(message)
     if tr and (nlu.intent in {Intent.FALLBACK, Intent.SUGGEST_RELAX, Intent.SKINCARE_QA, Intent.GREETING} or nlu.intent == Intent.BOOKING):
@@ -308,33 +294,29 @@ def parse_message_with_llm(client: OpenAI, message: str, history: list) -> NLURe
 
 def suggest_spas_from_text(text: str, limit: int = 5, cutoff: int = 60):
     """Trả về list [(spa_name, score)] gợi ý gần đúng từ câu người dùng.
-    - Dùng RapidFuzz nếu có; fallback sang difflib nếu không.
+    - Dùng index vector n-gram cục bộ (score = cosine x 100).
     """
-    msg = _normalize(text)
-    if rf_process:  # pragma: no cover
-        results = rf_process.extract(msg, SPA_NAMES, scorer=rf_fuzz.token_set_ratio, limit=limit)
-        return [(name, int(score)) for name, score, _ in results if score >= cutoff]
-    else:
-        from difflib import SequenceMatcher
-        scored = []
-        for name in SPA_NAMES:
-            score = int(100 * SequenceMatcher(None, msg, _normalize(name)).ratio())
-            if score >= cutoff:
-                scored.append((name, score))
-        scored.sort(key=lambda x: -x[1])
-        return scored[:limit]
+    return [
+        (name, int(round(100 * score)))
+        for name, score in get_catalog_vectors().similar_spas(text, k=limit)
+        if 100 * score >= cutoff
+    ]
 
 
 # ============================
 #        ENRICH SLOTS
 # ============================
 
-def enrich_slots(nlu: NLUResult) -> Dict[str, Any]:
-    """Trả về dict slots đã chuẩn hoá: city, spa_name, service_name, dt (datetime obj hoặc None)."""
+def enrich_slots(nlu: NLUResult, analysis=None) -> Dict[str, Any]:
+    """Trả về dict slots đã chuẩn hoá: city, spa_name, service_name, dt (datetime obj hoặc None).
+    `analysis` (MessageAnalysis của turn): datetime_raw chính là câu của turn → dùng lại giờ đã parse."""
     city = map_city(nlu.city_raw)
     spa = map_spa_name(nlu.spa_name_raw)
     service = map_service_name(nlu.service_name_raw)
-    dt = parse_datetime(nlu.datetime_raw)
+    if analysis is not None and nlu.datetime_raw and analysis.matches(nlu.datetime_raw):
+        dt = analysis.datetime
+    else:
+        dt = parse_datetime(nlu.datetime_raw)
     return {
         "city": city,
         "spa_name": spa,
@@ -348,6 +330,7 @@ __all__ = [
     "TimeRange",
     "NLUResult",
     "parse_message_with_llm",
+    "apply_heuristics",
     "enrich_slots",
     "suggest_spas_from_text",
     # mappers (tuỳ chọn export)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+OpenAI client dùng chung cho cả worker (tạo lười ở request đầu tiên).
+
+Trước đây mỗi request tạo `OpenAI(...)` mới → mất connection pool httpx,
+mỗi lần gọi GPT lại bắt tay TLS từ đầu. Ở đây 1 client / process với pool keep-alive,
+giới hạn kết nối + timeout chỉnh được qua biến môi trường:
+
+- A_SECRET_KEY             : API key
+- OPENAI_BASE_URL          : trỏ sang server giả lập (test / benchmark)
+- LLM_MAX_CONNECTIONS      : tổng kết nối tối đa (mặc định 20)
+- LLM_MAX_KEEPALIVE        : số kết nối giữ sống (mặc định 10)
+- LLM_KEEPALIVE_EXPIRY     : giây giữ kết nối rảnh (mặc định 60)
+- LLM_TIMEOUT              : timeout đọc/ghi (giây, mặc định 60)
+- LLM_CONNECT_TIMEOUT      : timeout kết nối (giây, mặc định 5)
+- LLM_MAX_RETRIES          : số lần retry của SDK (mặc định 2)
+"""
+import os
+import threading
+from typing import Optional
+
+import httpx
+from openai import OpenAI
+
+_LOCK = threading.Lock()
+_CLIENT: Optional[OpenAI] = None
+_CLIENT_PID: Optional[int] = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def build_llm_client(base_url: Optional[str] = None, api_key: Optional[str] = None) -> OpenAI:
+    """Tạo client mới với pool httpx riêng (dùng `get_llm_client()` thay vì gọi trực tiếp)."""
+    timeout = httpx.Timeout(
+        _env_float("LLM_TIMEOUT", 60.0),
+        connect=_env_float("LLM_CONNECT_TIMEOUT", 5.0),
+    )
+    limits = httpx.Limits(
+        max_connections=_env_int("LLM_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=_env_int("LLM_MAX_KEEPALIVE", 10),
+        keepalive_expiry=_env_float("LLM_KEEPALIVE_EXPIRY", 60.0),
+    )
+    return OpenAI(
+        api_key=api_key or os.getenv("A_SECRET_KEY"),
+        base_url=base_url or os.getenv("OPENAI_BASE_URL") or None,
+        timeout=timeout,
+        max_retries=_env_int("LLM_MAX_RETRIES", 2),
+        http_client=httpx.Client(limits=limits, timeout=timeout),
+    )
+
+
+def get_llm_client() -> OpenAI:
+    """
+    Client dùng chung của worker hiện tại.
+    Kiểm tra pid → sau khi fork (gunicorn --preload) mỗi worker tự có pool riêng.
+    """
+    global _CLIENT, _CLIENT_PID
+    pid = os.getpid()
+    if _CLIENT is None or _CLIENT_PID != pid:
+        with _LOCK:
+            if _CLIENT is None or _CLIENT_PID != pid:
+                _CLIENT = build_llm_client()
+                _CLIENT_PID = pid
+    return _CLIENT
+
+
+def reset_llm_client():
+    """Đóng pool hiện tại; lần gọi `get_llm_client()` kế tiếp sẽ tạo lại (đổi cấu hình / test)."""
+    global _CLIENT, _CLIENT_PID
+    with _LOCK:
+        client, _CLIENT, _CLIENT_PID = _CLIENT, None, None
+    if client is not None:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+__all__ = ["get_llm_client", "build_llm_client", "reset_llm_client"]
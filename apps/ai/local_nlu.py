@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+NLU cục bộ (luật) chạy trước `parse_message_with_llm`.
+
+Dựa trên MessageAnalysis của turn (catalog, parser thời gian, tín hiệu từ khoá) + booking context
+để dựng `NLUResult` kèm độ tự tin. Đủ tự tin (>= NLU_LOCAL_THRESHOLD) → bỏ qua LLM;
+câu mơ hồ (không luật nào khớp, hoặc 2 intent khác nhau điểm sát nhau) → vẫn hỏi LLM.
+
+Metrics: nlu.local / nlu.llm + local_share (GET /api/metrics).
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from apps.ai.intents import Intent, NLUResult, TimeRange, apply_heuristics, parse_message_with_llm
+from apps.utils import metrics
+
+LOCAL_THRESHOLD = float(os.getenv("NLU_LOCAL_THRESHOLD", 0.8))
+# 2 intent khác nhau cách nhau < AMBIGUITY_MARGIN → coi là mơ hồ
+AMBIGUITY_MARGIN = 0.1
+
+GREETINGS = {"xin chao", "chao", "chao ban", "chao em", "hello", "hi", "hey", "alo", "glow ai", "glowai"}
+RELAX_WORDS = ("thu gian", "relax", "xa stress", "met moi", "massage thu gian", "cang thang")
+INTRO_WORDS = ("gioi thieu", "thong tin", "o dau", "tot khong", "la gi", "dia chi")
+
+_DIGIT_RE = re.compile(r"^\s*\d{1,2}\s*$")
+_CLOCK_RE = re.compile(r"^\s*\d{1,2}\s*[:h]\s*\d{0,2}\s*$")
+
+Candidate = Tuple[Intent, float, Dict[str, Any]]
+
+
+def _booking_slots(a) -> Dict[str, Any]:
+    slots: Dict[str, Any] = {}
+    if a.spa_name:
+        slots["spa_name_raw"] = a.spa_name
+    svc = a.exact_service
+    if svc:
+        slots["service_name_raw"] = svc["service"]["name"]
+    if a.datetime:
+        slots["datetime_raw"] = a.message
+    return slots
+
+
+def _candidates(a, ctx: Dict[str, Any]) -> List[Candidate]:
+    folded, sig = a.folded, a.signals
+    in_booking = bool(ctx.get("active"))
+    out: List[Candidate] = []
+
+    # chào hỏi ngắn
+    if folded in GREETINGS or (folded.startswith(("xin chao", "chao ")) and len(a.tokens) <= 4):
+        out.append((Intent.GREETING, 0.95, {}))
+
+    # đang đặt lịch: chọn số / nói giờ / xác nhận
+    if in_booking:
+        if _DIGIT_RE.match(a.message) and (ctx.get("available_slots") or ctx.get("earliest_options")):
+            out.append((Intent.BOOKING, 0.9, {}))
+        if _CLOCK_RE.match(a.message) or a.datetime:
+            out.append((Intent.BOOKING, 0.9, {"datetime_raw": a.message}))
+        if "confirm" in sig:
+            out.append((Intent.BOOKING, 0.9, {"is_confirm": True}))
+        if "change_time" in sig:
+            out.append((Intent.BOOKING, 0.9, {}))
+
+    if any(w in folded for w in RELAX_WORDS):
+        out.append((Intent.SUGGEST_RELAX, 0.8, {}))
+
+    if "spa_list" in sig:
+        out.append((Intent.LIST_SPAS, 0.9 if a.city else 0.75, {"city_raw": a.city}))
+
+    if "service_list" in sig and "booking" not in sig:
+        out.append((Intent.LIST_SERVICES, 0.9 if a.spa_name else 0.7, {"spa_name_raw": a.spa_name}))
+
+    # lịch hẹn của tôi / xem lịch hẹn (+ khoảng thời gian)
+    is_appt = "appt_word" in sig and ("appt_owner" in sig or "lookup_verb" in sig)
+    if is_appt or a.helper.is_appointments_lookup_intent(a.message):
+        rng = a.appointment_range
+        if rng:
+            start, end, _title = rng  # tiêu đề lấy lại từ analysis ở policy._appt_lookup
+            tr = TimeRange(start_iso=start.isoformat(), end_iso=end.isoformat())
+            out.append((Intent.APPT_LOOKUP, 0.9, {"time_range": tr}))
+        elif is_appt:
+            out.append((Intent.APPT_LIST_ALL, 0.85, {}))
+
+    if "booking" in sig and not is_appt:
+        out.append((Intent.BOOKING, 0.9, _booking_slots(a)))
+
+    if a.spa_name:
+        if any(w in folded for w in INTRO_WORDS):
+            out.append((Intent.SPA_INTRO, 0.85, {"spa_name_raw": a.spa_name}))
+        elif len(a.tokens) <= 4:  # gần như chỉ nêu tên spa
+            out.append((Intent.SPA_INTRO, 0.8, {"spa_name_raw": a.spa_name}))
+
+    if a.exact_service and "booking" not in sig:
+        out.append((Intent.SERVICE_DETAIL, 0.85, {"service_name_raw": a.exact_service["service"]["name"]}))
+
+    if a.helper.is_skin_question_local(a.message):
+        out.append((Intent.SKINCARE_QA, 0.85, {}))
+
+    return out
+
+
+def parse_message_local(analysis, ctx: Optional[Dict[str, Any]] = None) -> NLUResult:
+    """NLUResult từ luật cục bộ; confidence thấp khi không khớp gì hoặc mơ hồ."""
+    cands = _candidates(analysis, ctx or {})
+    if not cands:
+        return NLUResult(intent=Intent.FALLBACK, confidence=0.0)
+    cands.sort(key=lambda c: -c[1])
+    intent, conf, fields = cands[0]
+    for other, other_conf, _ in cands[1:]:
+        if other != intent and round(conf - other_conf, 6) < AMBIGUITY_MARGIN:
+            conf = min(conf, 0.5)
+            break
+    fields = {k: v for k, v in fields.items() if v is not None}
+    return NLUResult(intent=intent, confidence=conf, **fields)
+
+
+def parse_message(client: Optional[OpenAI], message: str, history: list,
+                  analysis, ctx: Optional[Dict[str, Any]] = None) -> NLUResult:
+    """NLU cục bộ trước; chỉ gọi LLM khi độ tự tin < LOCAL_THRESHOLD."""
+    nlu = parse_message_local(analysis, ctx)
+    if nlu.confidence >= LOCAL_THRESHOLD:
+        metrics.incr("nlu.local")
+        return apply_heuristics(nlu, message)
+    metrics.incr("nlu.llm")
+    return parse_message_with_llm(client, message, history)
+
+
+def nlu_stats() -> dict:
+    local, llm = metrics.get("nlu.local"), metrics.get("nlu.llm")
+    return {"local": local, "llm": llm, "local_share": metrics.ratio("nlu.local", "nlu.llm")}
+
+
+metrics.register_view("nlu", nlu_stats)
+
+__all__ = ["parse_message", "parse_message_local", "LOCAL_THRESHOLD"]
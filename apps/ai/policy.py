@@ -2,12 +2,14 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Callable, Dict, Any, List
-from datetime import datetime, timedelta
+from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from apps.ai.intents import NLUResult, Intent, suggest_spas_from_text
-from apps.utils.spa_locations import spa_locations
-from apps.utils.spa_services import spa_services
+from apps.ai.intents import NLUResult, Intent
+from apps.utils.catalog_store import get_catalog
+from apps.utils.catalog_index import get_catalog_index
+from apps.utils.availability import get_availability_store
+from apps.utils.booking_flow import BookingEvent, BookingState
 
 VN = ZoneInfo("Asia/Ho_Chi_Minh")
 
@@ -36,8 +38,13 @@ def _now_vn():
     return datetime.now(VN)
 
 
+def _analysis(env):
+    """MessageAnalysis của turn (dùng chung với controller, không tính lại)."""
+    return env.get("analysis") or env["helper"].analyze(env.get("message", ""))
+
+
 def _save_suggestions_as_last_list(helper, env, names: List[str]):
-    items = [s for s in spa_locations if s.get("name") in names]
+    items = [s for s in get_catalog().locations if s.get("name") in names]
     if not items:
         items = [{"name": n, "address": "(đang cập nhật)"} for n in names]
     helper.save_last_spa_list(env["conversation_key"], items)
@@ -47,7 +54,7 @@ def _infer_default_city():
     # Ưu tiên thành phố xuất hiện nhiều nhất trong dữ liệu spa
     from collections import Counter
     cities = []
-    for spa in spa_locations:
+    for spa in get_catalog().locations:
         parts = [p.strip().lower() for p in spa.get("address", "").split(",")]
         if len(parts) >= 2:
             cities.append(parts[-1])
@@ -58,52 +65,55 @@ def _infer_default_city():
 
 def _pick_relax_spa_and_service(city: str):
     # Chọn spa trong city có dịch vụ thuộc RELAX_SERVICE_CANDIDATES; ưu tiên Spa Serenity
+    catalog = get_catalog()
     spas = []
-    for spa in spa_locations:
+    for spa in catalog.locations:
         if city.casefold() in spa.get("address", "").casefold():
             spas.append(spa["name"])
     if not spas:
-        spas = [s["name"] for s in spa_locations]
+        spas = [s["name"] for s in catalog.locations]
     # ưu tiên Serenity nếu có
     if "Spa Serenity" in spas:
         for svc_name in RELAX_SERVICE_CANDIDATES:
-            for s in spa_services.get("Spa Serenity", []):
+            for s in catalog.services.get("Spa Serenity", []):
                 if s["name"].casefold() == svc_name.casefold():
                     return "Spa Serenity", s["name"]
     # fallback: spa đầu tiên có 1 dịch vụ relax
     for sp in spas:
-        for s in spa_services.get(sp, []):
+        for s in catalog.services.get(sp, []):
             if any(s["name"].casefold() == cand.casefold() for cand in RELAX_SERVICE_CANDIDATES):
                 return sp, s["name"]
     # cuối cùng: spa đầu tiên với dịch vụ đầu tiên
     sp = spas[0]
-    sv = spa_services.get(sp, [{}])[0].get("name", "")
+    sv = (catalog.services.get(sp) or [{}])[0].get("name", "")
     return sp, sv
 
 
-def _two_slots_for_range(start_iso: str, end_iso: str):
+def _slots_for_range(flow, start_iso: str, end_iso: str):
+    """2 giờ còn trống thật của spa/dịch vụ trong khoảng; khoảng đã kín → 2 giờ trống kế tiếp."""
     start = datetime.fromisoformat(start_iso).astimezone(VN)
     end = datetime.fromisoformat(end_iso).astimezone(VN)
-    # đề xuất 2 khung: 14:30 và 16:00 nếu nằm trong khoảng & sau thời điểm hiện tại
-    proposals = []
-    for h, m in [(14,30), (16,0)]:
-        cand = start.replace(hour=h, minute=m, second=0, microsecond=0)
-        if cand < start:
-            cand = cand + timedelta(days=0)  # giữ nguyên ngày
-        if start <= cand <= end and cand > _now_vn():
-            proposals.append(cand)
-    # nếu rỗng, tạo 2 slot kế tiếp mỗi 90'
-    if not proposals:
-        cur = max(start, _now_vn() + timedelta(minutes=30))
-        proposals = [cur, cur + timedelta(minutes=90)]
-    return [
-        {"label": d.strftime("%d/%m/%Y %H:%M"), "iso": d.isoformat()} for d in proposals
-    ]
+    spread = 90  # 2 gợi ý cách nhau ít nhất 90'
+    store = get_availability_store()
+    slots = store.find_slots(flow.get("spa_name"), flow.get("service_name"), start=start, end=end,
+                             limit=2, spread_minutes=spread)
+    if not slots:
+        slots = store.find_slots(flow.get("spa_name"), flow.get("service_name"), start=end,
+                                 limit=2, spread_minutes=spread)
+    return slots
+
+
+def _slot_hm(slot) -> str:
+    """HH:MM giờ VN của slot (iso không có tz đã là giờ VN, không đổi múi)."""
+    dt = datetime.fromisoformat(slot["iso"])
+    return (dt if dt.tzinfo is None else dt.astimezone(VN)).strftime("%H:%M")
 
 
 def _format_slots_line(slots):
     # "14:30 hoặc 16:00"
-    hm = [datetime.fromisoformat(s["iso"]).astimezone(VN).strftime("%H:%M") for s in slots]
+    hm = [_slot_hm(s) for s in slots]
+    if not hm:
+        return ""
     if len(hm) == 1:
         return hm[0]
     return f"{hm[0]} hoặc {hm[1]}"
@@ -125,9 +135,10 @@ def _suggest_relax(nlu: NLUResult, env: Dict[str, Any]):
     spa_name, service_name = _pick_relax_spa_and_service(city)
 
     # Set context để sau câu "chiều nay" có thể nhảy thẳng ra slot
-    ctx = h.get_booking_context(env["user_id"]) or {}
-    ctx.update({"active": True, "spa_name": spa_name, "service_name": service_name})
-    h.set_booking_context(env["user_id"], ctx)
+    flow = h.booking_flow(env["user_id"])
+    flow.activate()
+    flow.fire(BookingEvent.PICK_SPA, spa_name)
+    flow.fire(BookingEvent.PICK_SERVICE, service_name)
 
     promo = PROMOS.get((spa_name, service_name))
     promo_line = f" – {promo}." if promo else "."
@@ -144,7 +155,7 @@ def _city_list(nlu: NLUResult, env: Dict[str, Any]):
     city = env["slots"].get("city")
     if not city:
         return h.finalize_reply("Bạn muốn tìm spa ở **thành phố** nào ạ?", env["conversation_key"], env["history"])
-    spas = h.find_spas_by_city(spa_locations, city)
+    spas = h.find_spas_by_city(get_catalog().locations, city)
     return h.reply_spa_list(city, spas, env["conversation_key"], env["history"])
 
 
@@ -153,105 +164,127 @@ def _spa_intro(nlu: NLUResult, env: Dict[str, Any]):
     spa_name = env["slots"].get("spa_name")
     if not spa_name:
         # gợi ý gần đúng
-        names = [n for n,_ in suggest_spas_from_text(env["message"], limit=5, cutoff=60)]
+        names = [n for n,_ in _analysis(env).spa_suggestions]
         if names:
             _save_suggestions_as_last_list(h, env, names)
             return h.reply_choose_spa_from_last_list(env["conversation_key"], env["history"], note="từ gợi ý gần đúng")
         return h.finalize_reply("Bạn cho mình **tên spa** để giới thiệu chi tiết nhé.", env["conversation_key"], env["history"])
-    return h.reply_spa_intro(spa_name, spa_locations, env["conversation_key"], env["history"])
+    return h.reply_spa_intro(spa_name, get_catalog().locations, env["conversation_key"], env["history"])
 
 
 def _list_services(nlu: NLUResult, env: Dict[str, Any]):
     h = env["helper"]
     spa_name = env["slots"].get("spa_name")
     if not spa_name:
-        names = [n for n,_ in suggest_spas_from_text(env["message"], limit=5, cutoff=60)]
+        names = [n for n,_ in _analysis(env).spa_suggestions]
         if names:
             _save_suggestions_as_last_list(h, env, names)
             return h.reply_choose_spa_from_last_list(env["conversation_key"], env["history"], note="từ gợi ý gần đúng")
         return h.finalize_reply("Bạn muốn xem **danh sách dịch vụ** của **spa nào**?", env["conversation_key"], env["history"])
-    return h.reply_service_list(spa_name, spa_services, env["conversation_key"], env["history"])
+    return h.reply_service_list(spa_name, get_catalog().services, env["conversation_key"], env["history"])
 
 
 def _booking(nlu: NLUResult, env: Dict[str, Any]):
     h = env["helper"]; user_id = env["user_id"]; msg = env["message"]
-    ctx = h.get_booking_context(user_id) or {"active": True}
+    flow = h.booking_flow(user_id)
+
+    # vòng trước gợi ý giờ sớm nhất ở nhiều spa → số thứ tự chọn luôn spa + giờ, coi như xác nhận
+    if h.pick_earliest_option(flow, msg):
+        nlu.is_confirm = True
 
     # nếu đang ở flow relax → đã có spa+service
     # override theo slots đã enrich
     slots = env.get("slots", {})
-    if slots.get("spa_name"): ctx["spa_name"] = slots["spa_name"]
-    if slots.get("service_name"): ctx["service_name"] = slots["service_name"]
-
-    # 1) nếu user nêu time_range (ví dụ: chiều nay) & chưa có slot → đề xuất 2 khung giờ
-    if nlu.time_range and not ctx.get("slot"):
-        cand_slots = _two_slots_for_range(nlu.time_range.start_iso, nlu.time_range.end_iso)
-        ctx["available_slots"] = cand_slots
-        h.set_booking_context(user_id, ctx)
-        line = _format_slots_line(cand_slots)
-        reply = f"Có {len(cand_slots)} khung giờ khả dụng: {line}. Anh muốn em đặt luôn không?"
-        return h.finalize_reply(reply, env["conversation_key"], env["history"])
+    if slots.get("spa_name"): flow.fire(BookingEvent.PICK_SPA, slots["spa_name"])
+    if slots.get("service_name"): flow.fire(BookingEvent.PICK_SERVICE, slots["service_name"])
+
+    # 1) nếu user nêu time_range (ví dụ: chiều nay) & chưa có slot → đề xuất 2 khung giờ trống
+    #    (chưa biết spa → nhớ khoảng thời gian, hỏi spa trước)
+    if nlu.time_range and not flow.get("slot"):
+        flow.fire(BookingEvent.SET_TIME_RANGE, {"start_iso": nlu.time_range.start_iso, "end_iso": nlu.time_range.end_iso})
+        if flow.get("spa_name"):
+            cand_slots = _slots_for_range(flow, nlu.time_range.start_iso, nlu.time_range.end_iso)
+            flow.fire(BookingEvent.OFFER_SLOTS, cand_slots)
+            if not cand_slots:
+                return h.finalize_reply(f"**{flow.get('spa_name')}** đã kín lịch trong những ngày tới. Anh muốn chọn spa khác không?",
+                                        env["conversation_key"], env["history"])
+            line = _format_slots_line(cand_slots)
+            reply = f"Có {len(cand_slots)} khung giờ khả dụng: {line}. Anh muốn em đặt luôn không?"
+            return h.finalize_reply(reply, env["conversation_key"], env["history"])
 
     # 2) nếu user chọn giờ bằng text (16:00) hoặc số thứ tự
+    offered = flow.get("available_slots")
     pick_time = re.search(r"\b(\d{1,2}):(\d{2})\b", msg)
-    if (ctx.get("available_slots") and pick_time) or (ctx.get("available_slots") and msg.strip() in {"1","2"}):
+    if offered and (pick_time or msg.strip() in {"1","2"}):
         chosen = None
         if msg.strip() in {"1","2"}:
             idx = int(msg.strip()) - 1
-            if 0 <= idx < len(ctx["available_slots"]):
-                chosen = ctx["available_slots"][idx]
+            if 0 <= idx < len(offered):
+                chosen = offered[idx]
         else:
             hm = f"{pick_time.group(1).zfill(2)}:{pick_time.group(2).zfill(2)}"
-            for s in ctx["available_slots"]:
-                if datetime.fromisoformat(s["iso"]).astimezone(VN).strftime("%H:%M") == hm:
+            for s in offered:
+                if _slot_hm(s) == hm:
                     chosen = s; break
         if chosen:
-            ctx["slot"] = chosen
-            h.set_booking_context(user_id, ctx)
+            flow.fire(BookingEvent.PICK_SLOT, chosen)
             nlu.is_confirm = True  # chọn giờ + ngữ cảnh đặt → coi như xác nhận nhanh
 
-    # 3) khi đã đủ thông tin & có xác nhận → chốt ngay
-    if nlu.is_confirm and ctx.get("spa_name") and ctx.get("service_name") and ctx.get("slot"):
-        confirmation = h.confirm_booking(ctx)
-        h.add_appointment(user_id, ctx)
-        h.clear_booking_context(user_id)
+    # 3) khi đã đủ thông tin (AWAIT_CONFIRM) & có xác nhận → chốt ngay
+    if nlu.is_confirm and flow.fire(BookingEvent.CONFIRM):
+        if not h.add_appointment(user_id, flow.data):
+            return h.reply_slot_taken(user_id, flow, env["conversation_key"], env["history"])
+        confirmation = h.confirm_booking(flow.data)
+        flow.fire(BookingEvent.BOOKED)
         # tuỳ chọn: thêm dòng QR nếu app hỗ trợ
         confirmation += "\nBạn sẽ nhận được mã QR check-in ngay trên ứng dụng."
         return h.finalize_reply(confirmation, env["conversation_key"], env["history"])
 
     # 4) nếu còn thiếu slot mà không có time_range → gợi ý slot chuẩn helper
-    if ctx.get("spa_name") and ctx.get("service_name") and not ctx.get("slot"):
-        slots2 = h.get_available_slots(ctx["spa_name"])  # dùng helper mặc định
-        ctx["available_slots"] = slots2[:2]
-        h.set_booking_context(user_id, ctx)
-        line = _format_slots_line(ctx["available_slots"])
+    if flow.state is BookingState.NEED_SLOT:
+        rng = flow.get("time_range")
+        if rng:
+            slots2 = _slots_for_range(flow, rng["start_iso"], rng["end_iso"])
+        else:
+            slots2 = h.get_available_slots(flow.get("spa_name"), flow.get("service_name"), limit=2)
+        flow.fire(BookingEvent.OFFER_SLOTS, slots2[:2])
+        if not slots2:
+            return h.finalize_reply(f"**{flow.get('spa_name')}** đã kín lịch trong những ngày tới. Anh muốn chọn spa khác không?",
+                                    env["conversation_key"], env["history"])
+        line = _format_slots_line(flow.get("available_slots"))
         return h.finalize_reply(f"Lịch gần nhất: {line}. Anh chọn khung nào?", env["conversation_key"], env["history"])
 
     # 5) thiếu spa/service → hỏi kèm gợi ý gần đúng
-    if not ctx.get("spa_name"):
-        names = [n for n,_ in suggest_spas_from_text(msg, limit=5, cutoff=60)]
+    if not flow.get("spa_name"):
+        names = [n for n,_ in _analysis(env).spa_suggestions]
         if names:
             _save_suggestions_as_last_list(h, env, names)
             return h.reply_choose_spa_from_last_list(env["conversation_key"], env["history"], note="từ gợi ý gần đúng để đặt lịch")
         return h.finalize_reply("Bạn muốn đặt tại **spa** nào?", env["conversation_key"], env["history"])
-    if not ctx.get("service_name"):
-        names = [s["name"] for s in spa_services.get(ctx["spa_name"], [])]
-        return h.reply_choose_service_for_spa(ctx["spa_name"], names, env["conversation_key"], env["history"])
+    if not flow.get("service_name"):
+        names = [s["name"] for s in get_catalog().services.get(flow.get("spa_name"), [])]
+        return h.reply_choose_service_for_spa(flow.get("spa_name"), names, env["conversation_key"], env["history"])
 
     # fallback
     return h.finalize_reply("Bạn muốn đặt **dịch vụ gì**, tại **spa nào** và **khi nào** ạ?", env["conversation_key"], env["history"])
 
 
+def _earliest_slot(nlu: NLUResult, env: Dict[str, Any]):
+    h = env["helper"]
+    reply = h.reply_earliest_for_message(env["user_id"], env["message"], env["conversation_key"], env["history"])
+    if reply is None:  # chưa rõ dịch vụ → flow đặt lịch thường hỏi tiếp
+        return _booking(nlu, env)
+    return reply
+
+
 def _service_detail(nlu: NLUResult, env: Dict[str, Any]):
     h = env["helper"]
     svc = env["slots"].get("service_name")
     if svc:
-        for spa_name, services in spa_services.items():
-            for s in services:
-                if s["name"] == svc:
-                    exact = {"spa_name": spa_name, "service": s}
-                    return h.reply_service_detail(exact, env["conversation_key"], env["history"])
-    exact = h.find_exact_service_by_name(env.get("message", ""), spa_services)
+        entry = get_catalog_index().service_by_name(svc)
+        if entry:
+            return h.reply_service_detail(entry.as_match(), env["conversation_key"], env["history"])
+    exact = _analysis(env).exact_service
     if exact:
         return h.reply_service_detail(exact, env["conversation_key"], env["history"])
     return h.finalize_reply("Bạn cho mình **tên dịch vụ** cụ thể để giới thiệu chi tiết nhé.", env["conversation_key"], env["history"])
@@ -259,6 +292,10 @@ def _service_detail(nlu: NLUResult, env: Dict[str, Any]):
 
 def _appt_lookup(nlu: NLUResult, env: Dict[str, Any]):
     h = env["helper"]
+    rng = _analysis(env).appointment_range
+    if rng:
+        s, e, title = rng
+        return h.reply_my_appointments_in_range(env["user_id"], s, e, title, env["conversation_key"], env["history"])
     tr = nlu.time_range
     if tr and tr.start_iso and tr.end_iso:
         try:
@@ -296,6 +333,7 @@ import re
 RULES = [
     Rule("greeting",        110, lambda nlu, env: nlu.intent == Intent.GREETING, _greeting),
     Rule("booking_confirm", 100, lambda nlu, env: nlu.intent == Intent.BOOKING and nlu.is_confirm, _booking),
+    Rule("earliest_slot",    97, lambda nlu, env: "earliest" in _analysis(env).signals, _earliest_slot),
     Rule("booking",          95, lambda nlu, env: nlu.intent == Intent.BOOKING, _booking),
     Rule("suggest_relax",    90, lambda nlu, env: nlu.intent == Intent.SUGGEST_RELAX, _suggest_relax),
     Rule("service_detail",   80, lambda nlu, env: nlu.intent == Intent.SERVICE_DETAIL, _service_detail),
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Registry system prompt cho các lượt gọi GPT.
+
+- Mỗi prompt đăng ký 1 hàm render(catalog) → text; render 1 lần cho mỗi phiên bản catalog
+  (CatalogIndex.version), các lượt gọi dùng lại đúng chuỗi đó (byte-identical)
+- Thứ tự message cố định: [system prompt] + [tóm tắt] + history (+ câu user) → phần đầu
+  giống hệt nhau giữa các lượt gọi, provider-side prompt caching có thể hit
+- Token của prompt tính sẵn lúc render (apps.ai.tokens)
+
+`record_call` ghi metrics theo từng prompt: số lượt, token prompt, tỉ lệ lượt đủ điều kiện
+prefix cache (cả prompt >= PROMPT_CACHE_MIN_TOKENS), cached_tokens provider trả về (nếu có).
+"""
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from apps.ai.tokens import count_tokens, messages_tokens
+from apps.utils import metrics
+from apps.utils.catalog_index import CatalogIndex, get_catalog_index
+
+# OpenAI chỉ cache prefix từ 1024 token trở lên
+CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", 1024))
+
+_RENDERERS: Dict[str, Callable[[CatalogIndex], str]] = {}
+_RENDERED: Dict[Tuple[str, str], "Prompt"] = {}
+_LOCK = threading.Lock()
+
+
+@dataclass(frozen=True)
+class Prompt:
+    name: str
+    version: str  # phiên bản catalog lúc render
+    text: str
+    tokens: int
+    digest: str  # sha1 ngắn của text (kiểm tra prefix ổn định)
+
+    def message(self) -> dict:
+        return {"role": "system", "content": self.text}
+
+
+def register_prompt(name: str):
+    """Decorator: @register_prompt("reply") def render(catalog) -> str."""
+    def deco(fn: Callable[[CatalogIndex], str]):
+        _RENDERERS[name] = fn
+        return fn
+    return deco
+
+
+def get_prompt(name: str, catalog: Optional[CatalogIndex] = None) -> Prompt:
+    catalog = catalog or get_catalog_index()
+    key = (name, catalog.version)
+    prompt = _RENDERED.get(key)
+    if prompt is not None:
+        return prompt
+    text = _RENDERERS[name](catalog)
+    prompt = Prompt(
+        name=name, version=catalog.version, text=text,
+        tokens=count_tokens(text), digest=hashlib.sha1(text.encode("utf-8")).hexdigest()[:12],
+    )
+    with _LOCK:
+        # bỏ bản render của catalog cũ
+        for old in [k for k in _RENDERED if k[0] == name]:
+            del _RENDERED[old]
+        _RENDERED[key] = prompt
+    metrics.incr("prompt.renders")
+    return prompt
+
+
+def record_call(prompt: Prompt, messages: List[dict], completion=None):
+    """Metrics cho 1 lượt gọi: kích thước prompt + điều kiện prefix cache."""
+    tokens = messages_tokens(messages)
+    metrics.incr(f"prompt.{prompt.name}.calls")
+    metrics.incr(f"prompt.{prompt.name}.tokens", tokens)
+    if tokens >= CACHE_MIN_TOKENS:
+        metrics.incr(f"prompt.{prompt.name}.cache_eligible")
+    usage = getattr(completion, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None)
+    if isinstance(cached, int):
+        metrics.incr(f"prompt.{prompt.name}.cached_tokens", cached)
+
+
+def prompt_stats() -> dict:
+    out = {"renders": metrics.get("prompt.renders"), "cache_min_tokens": CACHE_MIN_TOKENS}
+    for (name, version), prompt in list(_RENDERED.items()):
+        calls = metrics.get(f"prompt.{name}.calls")
+        out[name] = {
+            "version": version,
+            "digest": prompt.digest,
+            "static_tokens": prompt.tokens,
+            "calls": calls,
+            "avg_prompt_tokens": round(metrics.get(f"prompt.{name}.tokens") / calls, 1) if calls else 0.0,
+            "cache_eligible_share": round(metrics.get(f"prompt.{name}.cache_eligible") / calls, 4) if calls else 0.0,
+            "cached_tokens": metrics.get(f"prompt.{name}.cached_tokens"),
+        }
+    return out
+
+
+metrics.register_view("prompt", prompt_stats)
+
+__all__ = ["Prompt", "register_prompt", "get_prompt", "record_call", "prompt_stats", "CACHE_MIN_TOKENS"]
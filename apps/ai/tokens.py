@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Đếm token xấp xỉ, cục bộ (không cần tokenizer) cho prompt chat.
+
+Từ ASCII ~1 token/6 ký tự, âm tiết tiếng Việt có dấu ~2 token, dấu câu 1 token;
+mỗi message cộng thêm MESSAGE_OVERHEAD (role, phân tách).
+"""
+import re
+from functools import lru_cache
+from typing import List
+
+# overhead mỗi message của chat format (role, phân tách)
+MESSAGE_OVERHEAD = 4
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    n = 0
+    for tok in _TOKEN_RE.findall(text or ""):
+        if tok.isascii():
+            n += 1 + len(tok) // 6
+        else:
+            n += 1 + (sum(1 for ch in tok if not ch.isascii()) + 1) // 2
+    return n
+
+
+def message_tokens(msg: dict) -> int:
+    return MESSAGE_OVERHEAD + count_tokens(msg.get("content") or "")
+
+
+def messages_tokens(messages: List[dict]) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+__all__ = ["count_tokens", "message_tokens", "messages_tokens", "MESSAGE_OVERHEAD"]
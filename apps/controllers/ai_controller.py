@@ -1,42 +1,66 @@
 from apps.dto.ai_dto import AIDto
 from apps.controllers._base_controller import BaseController
-import os
-from openai import OpenAI
-from apps.extensions import cache
 from apps.vector.training_vector import TrainingVector
 from flask_restx import Resource
-from apps.ai.intents import parse_message_with_llm, enrich_slots
+from apps.ai.intents import enrich_slots
+from apps.ai.local_nlu import parse_message
+from apps.ai.llm_client import get_llm_client
 from apps.ai.policy import route
+from apps.utils.conversation_session import ConversationSession
+from apps.utils.sse import sse_response
+from apps.utils.turn_lock import TURN_BUSY_MESSAGE, TurnLockTimeout, turn_lock
 
 
 @AIDto.api.route('/messages')
 class PostAI(BaseController, Resource):
     @AIDto.api.expect(AIDto.post_message, validate=True)
     def post(self):
-        req = self.get_request() or {}
+        return self.answer(self.get_request() or {})
+
+    def answer(self, req, stream=False):
         message = req.get('message', '')
         user_id = req.get('user_id') or 123
-        conversation_key = f"chat:{user_id}"
-        history = cache.get(conversation_key) or []
-        history.append({"role": "user", "content": message})
-
-        helper = TrainingVector()
-        client = OpenAI(api_key=os.getenv("A_SECRET_KEY"))
-
-        # --- NLU 1 lần ---
-        nlu = parse_message_with_llm(client, message, history)
-        slots = enrich_slots(nlu)
-
-        # --- Env cho policy ---
-        env = {
-            "helper": helper,
-            "conversation_key": conversation_key,
-            "history": history,
-            "user_id": user_id,
-            "client": client,
-            "message": message,
-            "slots": slots,
-        }
-
-        # --- Route theo priority ---
-        return route(nlu, env)
\ No newline at end of file
+        # turn của cùng 1 user chạy tuần tự (gửi đúp / gateway retry không ghi đè nhau)
+        try:
+            with turn_lock(user_id) as lease:
+                # history + booking + last_* của user: nạp 1 round trip, ghi 1 round trip cuối turn
+                session = ConversationSession.load(user_id, lease=lease)
+                conversation_key = session.conversation_key
+                history = session.history
+                history.append({"role": "user", "content": message})
+
+                client = get_llm_client()
+                helper = TrainingVector(client, stream=stream, session=session)
+
+                # --- NLU 1 lần (luật cục bộ trước, LLM khi mơ hồ) ---
+                analysis = helper.analyze(message)
+                nlu = parse_message(client, message, history, analysis, helper.get_booking_context(user_id))
+                slots = enrich_slots(nlu, analysis)
+
+                # --- Env cho policy ---
+                env = {
+                    "helper": helper,
+                    "conversation_key": conversation_key,
+                    "history": history,
+                    "user_id": user_id,
+                    "client": client,
+                    "message": message,
+                    "analysis": analysis,
+                    "slots": slots,
+                }
+
+                # --- Route theo priority ---
+                result = route(nlu, env)
+                helper.commit_booking()  # trạng thái đặt lịch: ghi 1 lần / turn
+                session.flush()
+                return lease.hold_until_complete(result)
+        except TurnLockTimeout:
+            return self.json_response(None, 429, TURN_BUSY_MESSAGE)
+
+
+@AIDto.api.route('/messages/stream')
+class PostAIStream(PostAI):
+    """Như /messages nhưng trả về text/event-stream (token GPT stream dần)."""
+    @AIDto.api.expect(AIDto.post_message, validate=True)
+    def post(self):
+        return sse_response(self.answer(self.get_request() or {}, stream=True))
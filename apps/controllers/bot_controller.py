@@ -1,11 +1,17 @@
 from apps.dto.bot_dto import BotDto
 from apps.controllers._base_controller import BaseController
-import os
-from openai import OpenAI
 import re
-from apps.utils.spa_locations import spa_locations
-from apps.utils.spa_services import spa_services
-from apps.extensions import cache
+from datetime import datetime
+from flask import request
+from apps.ai.llm_client import get_llm_client
+from apps.ai.prompts import get_prompt, record_call, register_prompt
+from apps.utils.catalog_store import get_catalog
+from apps.utils.booking_flow import BookingEvent, BookingState, slot_of
+from apps.utils.conversation_session import ConversationSession
+from apps.utils.conversation_store import get_conversation_store
+from apps.utils.sse import sse_response
+from apps.utils.turn_lock import TURN_BUSY_MESSAGE, TurnLockTimeout, turn_lock
+from apps.vector.speculative import speculative_enabled
 from apps.vector.training_vector import TrainingVector
 from flask_restx import Resource
 
@@ -32,6 +38,29 @@ def is_request_for_spa_intro(message, spa_name):
     return any(re.search(p, message_lower) for p in patterns)
 
 
+# Danh sách spa cố định của endpoint cũ /messages (không theo catalog)
+LEGACY_SPA_LOCATIONS = [
+    {"name": "Spa Lily", "address": "123 Lê Lợi, Quận 1, TP. Hồ Chí Minh"},
+    {"name": "Thẩm mỹ viện Hoa Mai", "address": "456 Hai Bà Trưng, Quận 3, TP. Hồ Chí Minh"},
+    {"name": "PMT", "address": "456 Hai Bà Trưng, Quận 3, TP. Hồ Chí Minh"},
+    {"name": "Bella Spa", "address": "789 Nguyễn Văn Cừ, Quận 5, TP. Hồ Chí Minh"},
+    {"name": "Serenity Spa", "address": "88 Phan Đình Phùng, TP. Đà Nẵng"},
+]
+
+
+@register_prompt("legacy_consultant")
+def _render_legacy_prompt(catalog) -> str:
+    spa_info = "\n".join(f"- {spa['name']} — {spa['address']}" for spa in LEGACY_SPA_LOCATIONS)
+    return (
+        "Bạn là một chuyên gia tư vấn spa và thẩm mỹ viện. Bạn có danh sách các spa sau:\n\n"
+        f"{spa_info}\n\n"
+        "Nếu người dùng hỏi tìm spa ở tỉnh/thành nào, bạn chỉ được gợi ý từ danh sách trên.\n\n"
+        "Nếu câu hỏi không liên quan đến làm đẹp hoặc spa, hãy trả lời: "
+        "\"Xin lỗi, tôi chỉ hỗ trợ các câu hỏi về làm đẹp, chăm sóc da và spa.\"\n\n"
+        "Trả lời thân thiện, đúng thông tin."
+    )
+
+
 @BotDto.api.route('/messages')
 class Message(BaseController):
   def get(self):
@@ -40,7 +69,7 @@ class Message(BaseController):
   @BotDto.api.expect(BotDto.post_message, validate=True)
   def post(self):
     message = self.get_request()['message']
-    client = OpenAI(api_key=os.getenv('A_SECRET_KEY'))
+    client = get_llm_client()
     # system_prompt = """
     # Bạn là một chuyên gia tư vấn spa và thẩm mỹ viện.
     # Bạn **chỉ được trả lời** các câu hỏi liên quan đến:
@@ -54,37 +83,16 @@ class Message(BaseController):
     # Trả lời thân thiện, rõ ràng và ngắn gọn.
     # """
 
-    spa_locations = [
-      {"name": "Spa Lily", "address": "123 Lê Lợi, Quận 1, TP. Hồ Chí Minh"},
-      {"name": "Thẩm mỹ viện Hoa Mai", "address": "456 Hai Bà Trưng, Quận 3, TP. Hồ Chí Minh"},
-      {"name": "PMT", "address": "456 Hai Bà Trưng, Quận 3, TP. Hồ Chí Minh"},
-      {"name": "Bella Spa", "address": "789 Nguyễn Văn Cừ, Quận 5, TP. Hồ Chí Minh"},
-      {"name": "Serenity Spa", "address": "88 Phan Đình Phùng, TP. Đà Nẵng"},
+    prompt = get_prompt("legacy_consultant")
+    messages = [
+      prompt.message(),
+      {
+        "role": "user",
+        "content": message,
+      },
     ]
-    spa_info = "\n".join([f"- {spa['name']} — {spa['address']}" for spa in spa_locations])
-
-    system_prompt = f"""
-        Bạn là một chuyên gia tư vấn spa và thẩm mỹ viện. Bạn có danh sách các spa sau:
-
-        {spa_info}
-
-        Nếu người dùng hỏi tìm spa ở tỉnh/thành nào, bạn chỉ được gợi ý từ danh sách trên.
-
-        Nếu câu hỏi không liên quan đến làm đẹp hoặc spa, hãy trả lời: "Xin lỗi, tôi chỉ hỗ trợ các câu hỏi về làm đẹp, chăm sóc da và spa."
-
-        Trả lời thân thiện, đúng thông tin.
-        """
-
-    completion = client.chat.completions.create(
-      model="gpt-4o",
-      messages=[
-        {"role": "system", "content": system_prompt},
-        {
-          "role": "user",
-          "content": message,
-        },
-      ],
-    )
+    completion = client.chat.completions.create(model="gpt-4o", messages=messages)
+    record_call(prompt, messages, completion)
     return self.json_response(completion.choices[0].message.content)
 
 #######
@@ -93,208 +101,243 @@ class GetMessageV2(BaseController):
     @BotDto.api.param('user_id', '', _in='path', required=True)
     def get(self, user_id):
         conversation_key = f"chat:{user_id}"
-        history = cache.get(conversation_key) or []
+        history = get_conversation_store().all(conversation_key)
         return self.json_response(history)
 
     @BotDto.api.param('user_id', '', _in='path', required=True)
     def delete(self, user_id):
         conversation_key = f"chat:{user_id}"
-        cache.delete(conversation_key)
+        get_conversation_store().clear(conversation_key)
         return self.json_response({"message": "Conversation history deleted."})
 
+@BotDto.api.route('/slots/earliest')
+class EarliestSlots(BaseController):
+    @BotDto.api.param('service', 'Tên dịch vụ', required=True)
+    @BotDto.api.param('city', 'Thành phố (lọc theo địa chỉ spa)')
+    @BotDto.api.param('district', 'Quận, vd. "Quận 1"')
+    @BotDto.api.param('start', 'Từ thời điểm (ISO 8601, mặc định: bây giờ)')
+    @BotDto.api.param('end', 'Đến thời điểm (ISO 8601)')
+    @BotDto.api.param('limit', 'Số lựa chọn (mặc định 5, tối đa 50)', type=int)
+    def get(self):
+        args = request.args
+        service = (args.get('service') or '').strip()
+        if not service:
+            return self.json_response(None, 400, "Thiếu tham số service")
+        try:
+            start = datetime.fromisoformat(args['start']) if args.get('start') else None
+            end = datetime.fromisoformat(args['end']) if args.get('end') else None
+        except ValueError:
+            return self.json_response(None, 400, "start / end phải là ISO 8601")
+        limit = min(max(args.get('limit', default=5, type=int), 1), 50)
+        options = TrainingVector().find_earliest_slots(
+            service, city=args.get('city'), district=args.get('district'), start=start, end=end, limit=limit
+        )
+        return self.json_response(options)
+
+
 @BotDto.api.route('/messages/v2')
 class MessageV2(BaseController, Resource):
     @BotDto.api.expect(BotDto.post_message, validate=True)
     def post(self):
+        return self.answer(self.get_request() or {})
+
+    def answer(self, req, stream=False):
         # --- Input ---
-        req = self.get_request() or {}
         message = req.get('message', '')
         user_id = req.get('user_id') or 123
 
-        conversation_key = f"chat:{user_id}"
-        history = cache.get(conversation_key) or []
+        # turn của cùng 1 user chạy tuần tự (gửi đúp / gateway retry không ghi đè nhau)
+        try:
+            with turn_lock(user_id) as lease:
+                # history + booking + last_* của user: nạp 1 round trip, ghi 1 round trip cuối turn
+                session = ConversationSession.load(user_id, lease=lease)
+                helper = TrainingVector(get_llm_client(), stream=stream, session=session)
+                result = self._answer(message, user_id, helper)
+                helper.commit_booking()  # trạng thái đặt lịch: ghi 1 lần / turn
+                session.flush()
+                return lease.hold_until_complete(result)
+        except TurnLockTimeout:
+            return self.json_response(None, 429, TURN_BUSY_MESSAGE)
+
+    def _answer(self, message, user_id, helper):
+        session = helper.session
+        conversation_key = session.conversation_key
+        history = session.history
         history.append({"role": "user", "content": message})
 
-        helper = TrainingVector()
-        client = OpenAI(api_key=os.getenv("A_SECRET_KEY"))
-        ctx = helper.get_booking_context(user_id)  # {active, spa_name, service_name, slot, ...}
+        client = helper.client
+        turn = helper.analyze(message)  # bỏ dấu / dò spa / dịch vụ / giờ... tính 1 lần cho cả turn
+        flow = helper.booking_flow(user_id)  # bản nháp đặt lịch + trạng thái (NEED_SERVICE ... DONE)
 
         # Nếu đang booking mà hỏi DS spa theo vị trí → dừng booking
-        if helper.is_request_for_spa_list(message) and ctx.get("active"):
-            helper.clear_booking_context(user_id)
-            ctx = {"active": False}
+        if helper.is_request_for_spa_list(message) and flow.active:
+            flow.fire(BookingEvent.CANCEL)
 
         # Nếu user nói "đặt hẹn thêm ..." → reset context cũ trước khi vào flow mới
-        if hasattr(helper, "is_additional_booking") and helper.is_additional_booking(message):
-            helper.clear_booking_context(user_id)
-            ctx = {"active": False}
+        if helper.is_additional_booking(message):
+            flow.fire(BookingEvent.CANCEL)
 
         # ===== 0) Tra cứu lịch hẹn theo khoảng thời gian (hôm nay/ngày mai/tuần này...) =====
         if helper.is_appointments_lookup_intent(message):
-            parsed = helper.parse_appointment_range(message)
+            parsed = turn.appointment_range
             if parsed:
                 s, e, title = parsed
                 return helper.reply_my_appointments_in_range(user_id, s, e, title, conversation_key, history)
 
         # ===== 1) Skincare chung (ưu tiên sớm) =====
         is_skin = getattr(helper, "is_skin_question_local", lambda _m: False)(message)
-        if is_skin or helper.is_general_skin_question_gpt(message, client):
-            if ctx.get("active"):
-                helper.clear_booking_context(user_id)
+        if not is_skin:
+            if speculative_enabled():
+                # LLM chạy nền; bước cục bộ 2–7 quyết định trước thì huỷ/bỏ qua kết quả
+                is_skin = helper.start_skin_gate(message, client)
+            else:
+                is_skin = helper.is_general_skin_question(message, client)
+        if is_skin:
+            if flow.active:
+                flow.fire(BookingEvent.CANCEL)
             return helper.reply_with_gpt_history(client, history, message, user_id)
 
         # ===== 2) Danh sách spa theo vị trí =====
-        city_keywords = helper.extract_city_keywords(spa_locations)
-        city = helper.extract_city_from_message(message, city_keywords)
+        city = turn.city
         if city and helper.is_request_for_spa_list(message):
-            matched_spas = helper.find_spas_by_city(spa_locations, city)
+            matched_spas = helper.find_spas_by_city(get_catalog().locations, city)
             return helper.reply_spa_list(city, matched_spas, conversation_key, history)
 
         # ===== 3) Tên spa → giới thiệu spa =====
-        spa_names = list(spa_services.keys())
-        spa_name = helper.detect_spa_in_message(message, spa_names)
+        spa_name = turn.spa_name
         if spa_name and helper.is_request_for_spa_intro(message, spa_name):
-            return helper.reply_spa_intro(spa_name, spa_locations, conversation_key, history)
+            return helper.reply_spa_intro(spa_name, get_catalog().locations, conversation_key, history)
 
         # ===== 4) Danh sách dịch vụ (LUÔN clear booking context để không dính giờ cũ) =====
         if helper.is_request_for_service_list(message):
-            target_spa = spa_name or ctx.get("spa_name") or cache.get(f"{conversation_key}:last_spa_focus")
-            helper.clear_booking_context(user_id)  # reset slot/confirmed/...
+            target_spa = spa_name or flow.get("spa_name") or helper.get_last_spa_focus(conversation_key)
+            flow.fire(BookingEvent.CANCEL)  # reset slot/confirmed/...
             if target_spa:
-                return helper.reply_service_list(target_spa, spa_services, conversation_key, history)
+                return helper.reply_service_list(target_spa, get_catalog().services, conversation_key, history)
 
             last_list = helper.get_last_spa_list(conversation_key)
             if last_list:
                 picked = helper.resolve_spa_selection_from_message(message, last_list)
                 if picked:
-                    return helper.reply_service_list(picked, spa_services, conversation_key, history)
+                    return helper.reply_service_list(picked, get_catalog().services, conversation_key, history)
                 return helper.reply_choose_spa_from_last_list(conversation_key, history, note="để xem danh sách dịch vụ")
 
             return helper.finalize_reply("Bạn muốn xem **danh sách dịch vụ** của **spa nào** ạ?", conversation_key, history)
 
+        # ===== 4b) Giờ trống sớm nhất của 1 dịch vụ ở mọi spa ("massage sớm nhất ở quận 1") =====
+        if helper.is_earliest_slot_request(message):
+            reply = helper.reply_earliest_for_message(user_id, message, conversation_key, history)
+            if reply is not None:
+                return reply
+
         # ===== 5) BOOKING (ƯU TIÊN TRƯỚC 'XEM LỊCH HẸN TỔNG') =====
-        if helper.is_booking_request(message) or ctx.get("active"):
-            # 5.a — ƯU TIÊN GIỜ MỚI NÓI; KHÔNG NÓI GIỜ → XÓA SLOT CŨ (tránh dính)
-            new_dt = helper.parse_datetime_from_message(message)
-            if helper.is_booking_request(message) and not ctx.get("active"):
-                # bắt đầu phiên booking mới
-                if new_dt:
-                    ctx["slot"] = {"label": new_dt.strftime("%d/%m/%Y %H:%M"), "iso": new_dt.isoformat()}
-                    ctx.pop("available_slots", None); ctx.pop("confirmed", None)
-                else:
-                    # không kèm giờ => xoá mọi thời gian cũ
-                    ctx.pop("slot", None); ctx.pop("available_slots", None); ctx.pop("confirmed", None)
-            else:
-                # đang ở phiên booking: nếu user nói giờ mới → cập nhật & xoá flag phụ
-                if new_dt:
-                    ctx["slot"] = {"label": new_dt.strftime("%d/%m/%Y %H:%M"), "iso": new_dt.isoformat()}
-                    ctx.pop("available_slots", None); ctx.pop("confirmed", None)
-
-            # 5.b0 — nếu vòng trước đã gợi ý danh sách dịch vụ → đọc lựa chọn lần này
-            if ctx.get("service_candidates") and not ctx.get("service_name"):
-                chosen = helper.resolve_service_selection_from_message(message, ctx["service_candidates"])
-                if chosen:
-                    # đổi dịch vụ ⇒ sạch giờ cũ
-                    if ctx.get("service_name") and ctx["service_name"] != chosen:
-                        ctx.pop("slot", None); ctx.pop("available_slots", None); ctx.pop("confirmed", None)
-                    ctx["service_name"] = chosen
-                    ctx.pop("service_candidates", None)
-
-            # 5.b1 — lấy DỊCH VỤ từ câu nói / 'dịch vụ này' / fuzzy
-            if not ctx.get("service_name"):
-                if helper.is_referring_prev_service(message):
-                    last = cache.get(f"{conversation_key}:last_context")
-                    if last:
-                        ctx["service_name"] = last.get("service_name")
-                        ctx.setdefault("spa_name", last.get("spa_name"))
-
-                if not ctx.get("service_name"):
-                    mentioned = helper.find_services_in_text(message, spa_services)
-                    if mentioned:
-                        unique = sorted({m["service"]["name"] for m in mentioned})
-                        if len(unique) == 1:
-                            # đổi dịch vụ ⇒ sạch giờ cũ
-                            if ctx.get("service_name") and ctx["service_name"] != unique[0]:
-                                ctx.pop("slot", None); ctx.pop("available_slots", None); ctx.pop("confirmed", None)
-                            ctx["service_name"] = unique[0]
-                        else:
-                            ctx["service_candidates"] = unique
-                            helper.set_booking_context(user_id, {**ctx, "active": True})
-                            return helper.reply_choose_service(unique, conversation_key, history)
-
-            # 5.b2 — XÁC ĐỊNH SPA (từ message > last_spa_focus > theo dịch vụ)
-            if not ctx.get("spa_name"):
-                spa_from_msg = spa_name or helper.detect_spa_in_message(message, spa_names)
-                if spa_from_msg:
-                    # đổi spa ⇒ sạch giờ cũ
-                    if ctx.get("spa_name") and ctx["spa_name"] != spa_from_msg:
-                        ctx.pop("slot", None); ctx.pop("available_slots", None); ctx.pop("confirmed", None)
-                    ctx["spa_name"] = spa_from_msg
-                else:
-                    last_focus = cache.get(f"{conversation_key}:last_spa_focus")
-                    if last_focus:
-                        ctx["spa_name"] = last_focus
-                    elif ctx.get("service_name"):
-                        spas_for_service = helper.get_spas_by_service_name(ctx["service_name"])
-                        helper.set_booking_context(user_id, {**ctx, "active": True})
-                        if len(spas_for_service) == 0:
-                            return helper.finalize_reply(
-                                "Dịch vụ này hiện chưa có spa nào trong hệ thống. Bạn muốn chọn dịch vụ khác không?",
-                                conversation_key, history
-                            )
-                        elif len(spas_for_service) == 1:
-                            ctx["spa_name"] = spas_for_service[0]["name"]
-                        else:
-                            slot_label = ctx["slot"]["label"] if ctx.get("slot") else None
-                            return helper.reply_choose_spa_for_service(
-                                ctx["service_name"], spas_for_service, conversation_key, history, slot_label=slot_label
-                            )
-                    else:
-                        helper.set_booking_context(user_id, {**ctx, "active": True})
-                        return helper.finalize_reply(
-                            "Bạn muốn đặt **dịch vụ** nào và tại **spa** nào ạ? (Bạn có thể trả lời: 'tên dịch vụ + tên spa')",
-                            conversation_key, history
-                        )
-
-            # 5.b3 — Nếu đã biết SPA mà CHƯA có dịch vụ → hỏi chọn dịch vụ của spa đó
-            # (ƯU TIÊN BẮT DỊCH VỤ TRONG PHẠM VI SPA TRƯỚC)
-            if ctx.get("spa_name") and not ctx.get("service_name"):
-                picked_in_spa = getattr(helper, "find_service_in_text_for_spa", lambda *_: None)(message, ctx["spa_name"])
-                if picked_in_spa:
-                    ctx["service_name"] = picked_in_spa
-                else:
-                    service_list = [s["name"] for s in spa_services.get(ctx["spa_name"], [])]
-                    ctx["service_candidates"] = service_list
-                    helper.set_booking_context(user_id, {**ctx, "active": True})
-                    return helper.reply_choose_service_for_spa(ctx["spa_name"], service_list, conversation_key, history)
-
-            # 5.c — Nếu CHƯA có slot → gợi ý slot
-            if not ctx.get("slot"):
-                slots = helper.get_available_slots(ctx["spa_name"])
-                ctx["available_slots"] = slots
-                helper.set_booking_context(user_id, {**ctx, "active": True})
-                return helper.ask_booking_info(slots, conversation_key, history)
-
-            # 5.d — Xác nhận (tên/điện thoại đã tắt theo yêu cầu)
-            filled, ctx, ask = helper.handle_booking_details(ctx, message)
-            helper.set_booking_context(user_id, {**ctx, "active": True})
-            if not filled:
-                return helper.finalize_reply(ask, conversation_key, history)
-
-            # 5.e — Lưu + clean context cũ (sạch hoàn toàn slot/flags cho lần đặt mới)
-            confirmation = helper.confirm_booking(ctx)
-            helper.add_appointment(user_id, ctx)
-            helper.clear_booking_context(user_id)
-            return helper.finalize_reply(confirmation, conversation_key, history)
+        if helper.is_booking_request(message) or flow.active:
+            return self._booking(helper, flow, turn, message, user_id, conversation_key, history)
 
         # ===== 6) Danh sách lịch hẹn (tổng) =====
         if helper.is_request_for_my_appointments(message):
             return helper.reply_my_appointments(user_id, conversation_key, history)
 
         # ===== 7) Giới thiệu dịch vụ cụ thể (chỉ khi KHÔNG booking) =====
-        exact = helper.find_exact_service_by_name(message, spa_services)
+        exact = turn.exact_service
         if exact and not helper.is_booking_request(message):
             return helper.reply_service_detail(exact, conversation_key, history)
 
         # ===== 8) Fallback (GPT tư vấn chung) =====
-        return helper.reply_with_gpt_history(client, history, message, user_id)
\ No newline at end of file
+        return helper.reply_with_gpt_history(client, history, message, user_id)
+
+
+    @staticmethod
+    def _booking(helper, flow, turn, message, user_id, conversation_key, history):
+        """Bước 5: mỗi nhánh chỉ bắn sự kiện vào flow; bản nháp được ghi 1 lần cuối turn."""
+        # 5.0 — vòng trước gợi ý giờ sớm nhất ở nhiều spa → số thứ tự chọn luôn spa + giờ
+        helper.pick_earliest_option(flow, message)
+
+        # 5.a — phiên mới thì bỏ giờ cũ; giờ mới nói trong câu luôn được ưu tiên
+        if helper.is_booking_request(message) and not flow.active:
+            flow.fire(BookingEvent.START)
+        flow.activate()
+        if turn.datetime:
+            flow.fire(BookingEvent.PICK_SLOT, slot_of(turn.datetime))
+
+        # 5.b0 — nếu vòng trước đã gợi ý danh sách dịch vụ → đọc lựa chọn lần này
+        candidates = flow.get("service_candidates")
+        if candidates and not flow.get("service_name"):
+            chosen = helper.resolve_service_selection_from_message(message, candidates)
+            if chosen:
+                flow.fire(BookingEvent.PICK_SERVICE, chosen)
+
+        # 5.b1 — lấy DỊCH VỤ từ 'dịch vụ này' / câu nói
+        if not flow.get("service_name") and helper.is_referring_prev_service(message):
+            last = helper.get_last_context(conversation_key) or {}
+            if last.get("service_name"):
+                flow.fire(BookingEvent.PICK_SERVICE, last["service_name"])
+            if last.get("spa_name") and not flow.get("spa_name"):
+                flow.fire(BookingEvent.PICK_SPA, last["spa_name"])
+        if not flow.get("service_name"):
+            unique = sorted({m["service"]["name"] for m in turn.services})
+            if len(unique) == 1:
+                flow.fire(BookingEvent.PICK_SERVICE, unique[0])
+            elif unique:
+                flow.fire(BookingEvent.OFFER_SERVICES, unique)
+                return helper.reply_choose_service(unique, conversation_key, history)
+
+        # 5.b2 — XÁC ĐỊNH SPA (từ message > last_spa_focus > theo dịch vụ)
+        if not flow.get("spa_name"):
+            spa_name = turn.spa_name or helper.get_last_spa_focus(conversation_key)
+            if spa_name:
+                flow.fire(BookingEvent.PICK_SPA, spa_name)
+            elif flow.get("service_name"):
+                spas_for_service = helper.get_spas_by_service_name(flow.get("service_name"))
+                if not spas_for_service:
+                    return helper.finalize_reply(
+                        "Dịch vụ này hiện chưa có spa nào trong hệ thống. Bạn muốn chọn dịch vụ khác không?",
+                        conversation_key, history
+                    )
+                if len(spas_for_service) > 1:
+                    return helper.reply_choose_spa_for_service(
+                        flow.get("service_name"), spas_for_service, conversation_key, history,
+                        slot_label=flow.get("slot", {}).get("label")
+                    )
+                flow.fire(BookingEvent.PICK_SPA, spas_for_service[0]["name"])
+            else:
+                return helper.finalize_reply(
+                    "Bạn muốn đặt **dịch vụ** nào và tại **spa** nào ạ? (Bạn có thể trả lời: 'tên dịch vụ + tên spa')",
+                    conversation_key, history
+                )
+
+        # 5.b3 — Nếu đã biết SPA mà CHƯA có dịch vụ → hỏi chọn dịch vụ của spa đó
+        # (ƯU TIÊN BẮT DỊCH VỤ TRONG PHẠM VI SPA TRƯỚC)
+        if not flow.get("service_name"):
+            picked_in_spa = helper.find_service_in_text_for_spa(message, flow.get("spa_name"))
+            if not picked_in_spa:
+                service_list = [s["name"] for s in get_catalog().services.get(flow.get("spa_name"), [])]
+                flow.fire(BookingEvent.OFFER_SERVICES, service_list)
+                return helper.reply_choose_service_for_spa(flow.get("spa_name"), service_list, conversation_key, history)
+            flow.fire(BookingEvent.PICK_SERVICE, picked_in_spa)
+
+        # 5.c — CHƯA có slot và chưa gợi ý → gợi ý slot (đã gợi ý → 5.d đọc số thứ tự)
+        if flow.state is BookingState.NEED_SLOT and not flow.get("available_slots"):
+            slots = helper.get_available_slots(flow.get("spa_name"), flow.get("service_name"))
+            flow.fire(BookingEvent.OFFER_SLOTS, slots)
+            return helper.ask_booking_info(slots, conversation_key, history)
+
+        # 5.d — Chốt giờ + xác nhận (tên/điện thoại đã tắt theo yêu cầu)
+        ask = helper.handle_booking_details(flow, message)
+        if ask:
+            return helper.finalize_reply(ask, conversation_key, history)
+
+        # 5.e — Giữ chỗ + lưu; thành công → bản nháp rỗng cho lần đặt mới
+        if not helper.add_appointment(user_id, flow.data):
+            return helper.reply_slot_taken(user_id, flow, conversation_key, history)
+        confirmation = helper.confirm_booking(flow.data)
+        flow.fire(BookingEvent.BOOKED)
+        return helper.finalize_reply(confirmation, conversation_key, history)
+
+
+@BotDto.api.route('/messages/v2/stream')
+class MessageV2Stream(MessageV2):
+    """Như /messages/v2 nhưng trả về text/event-stream (token GPT stream dần)."""
+    @BotDto.api.expect(BotDto.post_message, validate=True)
+    def post(self):
+        return sse_response(self.answer(self.get_request() or {}, stream=True))
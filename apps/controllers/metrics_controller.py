@@ -0,0 +1,9 @@
+from apps.dto.metrics_dto import MetricsDto
+from apps.controllers._base_controller import BaseController
+from apps.utils import metrics
+
+@MetricsDto.api.route('')
+class Metrics(BaseController):
+  def get(self):
+    # số liệu của worker đang xử lý request này
+    return self.json_response(metrics.snapshot())
@@ -1,7 +1,21 @@
 from apps.dto.organization_dto import OrganizationDto
 from apps.controllers._base_controller import BaseController
+from apps.middlewares.auth_middleware import auth_required
+from apps.utils.catalog_store import get_catalog, get_catalog_store, request_reload
 
 @OrganizationDto.api.route('')
 class Organizations(BaseController):
   def get(self):
-    return self.json_response({})
\ No newline at end of file
+    return self.json_response({})
+
+@OrganizationDto.api.route('/catalog')
+class OrganizationCatalog(BaseController):
+  def get(self):
+    # version / nguồn / số spa của snapshot catalog ở worker đang xử lý request này
+    get_catalog()  # thấy version mới → bắt đầu nạp lại ở nền như mọi request khác
+    return self.json_response(get_catalog_store().stats())
+
+  @auth_required()
+  def post(self):
+    # gọi sau khi sửa spa / dịch vụ trong DB: mọi worker nạp lại catalog ở nền, không restart
+    return self.json_response({'generation': request_reload()}, message='Catalog reload requested')
@@ -0,0 +1,4 @@
+from flask_restx import Namespace
+
+class MetricsDto:
+  api = Namespace('Metrics')
@@ -0,0 +1,21 @@
+import os
+
+from apps.configs.mysql_config import db
+
+class ServiceModel(db.Model):
+  # bảng dịch vụ của từng spa (organizations.id); tên bảng đổi được qua CATALOG_SERVICES_TABLE
+  __tablename__ = os.getenv("CATALOG_SERVICES_TABLE", "services")
+
+  id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+  organization_id = db.Column(db.BigInteger, index=True)
+  name = db.Column(db.String(255))
+  description = db.Column(db.Text)
+  deleted_at = db.Column(db.DateTime)
+
+  def to_dict(self):
+        return {
+            'id': self.id,
+            'organization_id': self.organization_id,
+            'name': self.name,
+            'description': self.description,
+        }
@@ -10,6 +10,8 @@ from apps.dto.organization_dto import OrganizationDto
 from apps.controllers import org_controller
 from apps.dto.ai_dto import AIDto
 from apps.controllers import ai_controller
+from apps.dto.metrics_dto import MetricsDto
+from apps.controllers import metrics_controller
 
 class Route:
     def __init__(self, api):
@@ -22,6 +24,7 @@ class Route:
         self.api.add_namespace(BotDto.api, path='/api/bots')
         self.api.add_namespace(AIDto.api, path='/api/ai')
         self.api.add_namespace(MediaDto.api, path='/api/media')
+        self.api.add_namespace(MetricsDto.api, path='/api/metrics')
         
         return
 
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Lịch hẹn của user, đánh chỉ mục theo thời gian slot.
+
+Redis (mỗi user 2 khoá, cùng key_prefix với flask-caching):
+- `appt:<user_id>:idx`  : sorted set, member = id lịch hẹn, score = epoch của slot (giờ VN)
+- `appt:<user_id>:data` : hash id -> JSON bản ghi
+Thêm mới: HSETNX giữ chỗ id (trùng id → thêm hậu tố -2, -3, ...) rồi ZADD + EXPIRE trong
+1 MULTI/EXEC — không đọc-sửa-ghi cả list, 2 worker ghi cùng lúc không mất bản ghi nào.
+Tra khoảng: ZRANGEBYSCORE [start, end) rồi HMGET — đã sắp theo giờ, không parse ISO từng mục.
+
+Cache không phải Redis (SimpleCache khi dev) → `MemoryAppointmentRepository`.
+Khoá cũ `appointments:<user_id>` (list pickle) được chuyển sang ở lần đọc đầu tiên.
+"""
+import bisect
+import json
+import math
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from apps.extensions import cache
+from apps.utils import metrics
+
+VN_TZ = ZoneInfo("Asia/Ho_Chi_Minh")
+TTL = 30 * 24 * 3600  # như khoá list cũ
+LEGACY_KEY = "appointments:{user_id}"
+MAX_ID_SUFFIX = 100
+
+
+def slot_score(slot_iso: Optional[str]) -> float:
+    """Epoch của slot (ISO không có tz coi là giờ VN); không đọc được → +inf (xếp cuối)."""
+    try:
+        dt = datetime.fromisoformat(slot_iso)
+    except (TypeError, ValueError):
+        return math.inf
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=VN_TZ)
+    return dt.timestamp()
+
+
+def _epoch(dt: datetime) -> float:
+    return (dt.replace(tzinfo=VN_TZ) if dt.tzinfo is None else dt).timestamp()
+
+
+class AppointmentRepository(ABC):
+    # ---------- API chung ----------
+    def add(self, user_id, record: dict) -> str:
+        """Lưu 1 bản ghi (đã có "id"), trả về id thực tế (có hậu tố nếu id đã tồn tại)."""
+        self._migrate_legacy(user_id)
+        appt_id = self._insert(user_id, record["id"], slot_score(record.get("slot_iso")), record)
+        metrics.incr("appointments.add")
+        return appt_id
+
+    def all(self, user_id) -> List[dict]:
+        """Mọi lịch hẹn, sắp theo giờ slot."""
+        self._migrate_legacy(user_id)
+        return self._range(user_id, -math.inf, math.inf, inclusive_end=True)
+
+    def between(self, user_id, start: datetime, end: datetime) -> List[dict]:
+        """Lịch hẹn có slot trong [start, end), sắp theo giờ."""
+        self._migrate_legacy(user_id)
+        return self._range(user_id, _epoch(start), _epoch(end))
+
+    def _migrate_legacy(self, user_id):
+        if self._has_index(user_id):
+            return
+        key = LEGACY_KEY.format(user_id=user_id)
+        try:
+            legacy = cache.get(key)
+        except Exception:
+            legacy = None
+        if not isinstance(legacy, list) or not legacy:
+            return
+        for rec in legacy:
+            if rec.get("id"):
+                self._insert(user_id, rec["id"], slot_score(rec.get("slot_iso")), rec)
+        try:
+            cache.delete(key)
+        except Exception:
+            pass
+        metrics.incr("appointments.migrated")
+
+    @staticmethod
+    def _candidates(appt_id: str):
+        yield appt_id
+        for n in range(2, MAX_ID_SUFFIX + 1):
+            metrics.incr("appointments.id_collision")
+            yield f"{appt_id}-{n}"
+
+    # ---------- backend ----------
+    @abstractmethod
+    def _insert(self, user_id, appt_id: str, score: float, record: dict) -> str:
+        ...
+
+    @abstractmethod
+    def _range(self, user_id, lo: float, hi: float, inclusive_end: bool = False) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def _has_index(self, user_id) -> bool:
+        ...
+
+
+class RedisAppointmentRepository(AppointmentRepository):
+    def __init__(self, backend, ttl: int = TTL):
+        self._backend = backend
+        self._write = backend._write_client
+        self._read = getattr(backend, "_read_client", None) or self._write
+        self.ttl = ttl
+        self._checked = set()  # user đã kiểm tra khoá cũ trong worker này
+
+    def _keys(self, user_id) -> Tuple[str, str]:
+        prefix = self._backend._get_prefix() or ""
+        return f"{prefix}appt:{user_id}:idx", f"{prefix}appt:{user_id}:data"
+
+    def _insert(self, user_id, appt_id: str, score: float, record: dict) -> str:
+        idx, data = self._keys(user_id)
+        for candidate in self._candidates(appt_id):
+            record = {**record, "id": candidate}
+            if self._write.hsetnx(data, candidate, json.dumps(record, ensure_ascii=False)):
+                break
+        else:
+            raise RuntimeError(f"Không cấp được id lịch hẹn cho {appt_id}")
+        pipe = self._write.pipeline(transaction=True)
+        pipe.zadd(idx, {candidate: score})
+        pipe.expire(data, self.ttl)
+        pipe.expire(idx, self.ttl)
+        pipe.execute()
+        return candidate
+
+    def _range(self, user_id, lo: float, hi: float, inclusive_end: bool = False) -> List[dict]:
+        idx, data = self._keys(user_id)
+        max_arg = "+inf" if math.isinf(hi) else (hi if inclusive_end else f"({hi}")
+        ids = self._read.zrangebyscore(idx, "-inf" if math.isinf(lo) else lo, max_arg)
+        if not ids:
+            return []
+        return [json.loads(raw) for raw in self._read.hmget(data, ids) if raw]
+
+    def _has_index(self, user_id) -> bool:
+        # chỉ hỏi Redis 1 lần / user / worker; khoá cũ không còn được ghi nữa
+        if user_id in self._checked:
+            return True
+        self._checked.add(user_id)
+        return bool(self._read.exists(self._keys(user_id)[0]))
+
+
+class MemoryAppointmentRepository(AppointmentRepository):
+    """Bản trong process (dev / test): list (score, id) sắp sẵn + dict bản ghi."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Dict[str, List[Tuple[float, str]]] = {}
+        self._data: Dict[str, Dict[str, dict]] = {}
+
+    def _insert(self, user_id, appt_id: str, score: float, record: dict) -> str:
+        with self._lock:
+            data = self._data.setdefault(str(user_id), {})
+            index = self._index.setdefault(str(user_id), [])
+            candidate = next((c for c in self._candidates(appt_id) if c not in data), None)
+            if candidate is None:
+                raise RuntimeError(f"Không cấp được id lịch hẹn cho {appt_id}")
+            data[candidate] = {**record, "id": candidate}
+            bisect.insort(index, (score, candidate))
+            return candidate
+
+    def _range(self, user_id, lo: float, hi: float, inclusive_end: bool = False) -> List[dict]:
+        with self._lock:
+            index = self._index.get(str(user_id), [])
+            data = self._data.get(str(user_id), {})
+            i = bisect.bisect_left(index, (lo, ""))
+            out = []
+            for score, appt_id in index[i:]:
+                if score > hi or (score == hi and not inclusive_end):
+                    break
+                out.append(dict(data[appt_id]))
+            return out
+
+    def _has_index(self, user_id) -> bool:
+        with self._lock:
+            return bool(self._index.get(str(user_id)))
+
+
+_MEMORY_REPO = MemoryAppointmentRepository()
+_REPOS: Dict[int, AppointmentRepository] = {}
+
+
+def get_appointment_repository() -> AppointmentRepository:
+    """Repository theo backend cache của app hiện tại (Redis nếu có, ngược lại in-memory)."""
+    backend = cache.cache
+    if not hasattr(backend, "_write_client"):
+        return _MEMORY_REPO
+    repo = _REPOS.get(id(backend))
+    if repo is None:
+        repo = _REPOS[id(backend)] = RedisAppointmentRepository(backend)
+    return repo
+
+
+__all__ = ["AppointmentRepository", "RedisAppointmentRepository", "MemoryAppointmentRepository",
+           "get_appointment_repository", "slot_score"]
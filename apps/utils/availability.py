@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Lịch trống thật của spa: bitmap theo ngày, mỗi ô 15 phút.
+
+Mỗi spa có `capacity` làn (giường / kỹ thuật viên), mỗi làn 96 bit / ngày (12 byte):
+bit offset = lane * 96 + ô (ô 0 = 00:00). Redis: 1 string / spa / ngày, khoá
+`avail:<spa>:<YYYYMMDD>` (cùng key_prefix với flask-caching), hết hạn sau ngày đó 1 ngày.
+
+- Tìm slot: đọc bitmap các ngày cần xét (1 MGET), mỗi làn: rảnh = ~bận & giờ mở cửa,
+  "rảnh liền `n` ô bắt đầu tại ô c" tính bằng AND các bản dịch bit (O(log n) phép),
+  OR qua các làn dịch vụ được dùng → mọi giờ bắt đầu hợp lệ trong ngày
+- Giữ chỗ: script Lua kiểm tra + set bit từng làn, nguyên tử trên Redis → 2 worker giữ
+  cùng ô cuối cùng thì chỉ 1 bên thành công. Cache không phải Redis → bản trong process (lock)
+
+Cấu hình (không có trong dữ liệu → mặc định từ biến môi trường):
+- spa: "open_hours" ("09:00-20:00"), "capacity" (số làn)
+- dịch vụ: "duration_minutes", "capacity" (chỉ dùng `capacity` làn đầu, vd. 1 máy)
+SPA_OPEN_HOURS, SPA_CAPACITY, SERVICE_DEFAULT_MINUTES, SLOT_STEP_MINUTES (bước giờ gợi ý),
+SLOT_SPREAD_MINUTES (khoảng cách tối thiểu giữa 2 gợi ý cùng ngày), SLOT_LEAD_MINUTES
+(không gợi ý giờ sát hiện tại), AVAILABILITY_DAYS (số ngày xét).
+
+Tìm giờ sớm nhất trên nhiều spa (`earliest_slots`): mỗi ngày 1 MGET bitmap của mọi spa,
+lưới giờ bắt đầu tính bằng mảng NumPy (spa × làn × 96 ô, run liền nhau qua cumsum),
+rồi heapq.merge các dòng giờ trống của từng spa → N lựa chọn sớm nhất; dừng ngay khi đủ N.
+"""
+import heapq
+import math
+import os
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from apps.extensions import cache
+from apps.utils import metrics
+from apps.utils.catalog_index import get_catalog_index
+
+VN_TZ = ZoneInfo("Asia/Ho_Chi_Minh")
+CELL_MINUTES = 15
+CELLS_PER_DAY = 24 * 60 // CELL_MINUTES  # 96
+LANE_BYTES = CELLS_PER_DAY // 8  # 12
+FULL = (1 << CELLS_PER_DAY) - 1
+
+OPEN_HOURS = os.getenv("SPA_OPEN_HOURS", "09:00-20:00")
+CAPACITY = int(os.getenv("SPA_CAPACITY", 3))
+SERVICE_MINUTES = int(os.getenv("SERVICE_DEFAULT_MINUTES", 60))
+STEP_MINUTES = int(os.getenv("SLOT_STEP_MINUTES", 30))
+SPREAD_MINUTES = int(os.getenv("SLOT_SPREAD_MINUTES", 120))
+LEAD_MINUTES = int(os.getenv("SLOT_LEAD_MINUTES", 30))
+SEARCH_DAYS = int(os.getenv("AVAILABILITY_DAYS", 7))
+
+
+# ---------- Bit helpers (ô c của 1 làn = bit 95 - c, giống thứ tự bit của Redis) ----------
+def _bit(cell: int) -> int:
+    return 1 << (CELLS_PER_DAY - 1 - cell)
+
+
+def cells_mask(start: int, end: int) -> int:
+    """Mask các ô [start, end)."""
+    start, end = max(start, 0), min(end, CELLS_PER_DAY)
+    if start >= end:
+        return 0
+    return ((1 << (end - start)) - 1) << (CELLS_PER_DAY - end)
+
+
+def run_starts(free: int, n: int) -> int:
+    """Bit c bật ⇔ các ô c .. c+n-1 đều bật trong `free`."""
+    run, have = free, 1
+    while have < n:
+        step = min(have, n - have)
+        run &= run << step
+        have += step
+    return run & FULL
+
+
+def iter_cells(mask: int):
+    """Các ô đang bật, theo giờ tăng dần."""
+    while mask:
+        top = mask.bit_length() - 1
+        yield CELLS_PER_DAY - 1 - top
+        mask ^= 1 << top
+
+
+def lanes_of(raw: Optional[bytes], capacity: int) -> List[int]:
+    raw = raw or b""
+    return [int.from_bytes(raw[i * LANE_BYTES:(i + 1) * LANE_BYTES].ljust(LANE_BYTES, b"\0"), "big")
+            for i in range(capacity)]
+
+
+def _cell_of(hhmm: str) -> int:
+    h, m = hhmm.strip().split(":")
+    return (int(h) * 60 + int(m)) // CELL_MINUTES
+
+
+@lru_cache(maxsize=8)
+def _step_mask(step_minutes: int) -> int:
+    every = max(step_minutes // CELL_MINUTES, 1)
+    mask = 0
+    for c in range(0, CELLS_PER_DAY, every):
+        mask |= _bit(c)
+    return mask
+
+
+@lru_cache(maxsize=256)
+def _mask_row(mask: int) -> np.ndarray:
+    """Mask 96 bit → mảng bool 96 ô (ô 0 trước)."""
+    row = np.unpackbits(np.frombuffer(mask.to_bytes(LANE_BYTES, "big"), dtype=np.uint8)).astype(bool)
+    row.flags.writeable = False
+    return row
+
+
+def start_grid(raws: List[Optional[bytes]], open_rows: np.ndarray, lane_ok: np.ndarray,
+               cells: np.ndarray) -> np.ndarray:
+    """
+    Bản vector hoá của `free_starts` cho nhiều spa cùng 1 ngày.
+    open_rows (S, 96) bool, lane_ok (S, L) bool, cells (S,) int → (S, 96) bool.
+    """
+    n_spas, n_lanes = lane_ok.shape
+    width = n_lanes * LANE_BYTES
+    buf = b"".join((raw or b"")[:width].ljust(width, b"\0") for raw in raws)
+    busy = np.unpackbits(np.frombuffer(buf, dtype=np.uint8).reshape(n_spas, n_lanes, LANE_BYTES), axis=-1)
+    free = (busy == 0) & open_rows[:, None, :] & lane_ok[:, :, None]
+    # cs[..., k] = số ô trống trong [0, k) → [c, c+n) trống hết ⇔ cs[c+n] - cs[c] == n
+    cs = np.zeros((n_spas, n_lanes, CELLS_PER_DAY + 1), dtype=np.int8)
+    np.cumsum(free, axis=-1, dtype=np.int8, out=cs[..., 1:])
+    out = np.zeros((n_spas, CELLS_PER_DAY), dtype=bool)
+    # gom theo thời lượng (thường chỉ vài giá trị) → cắt lát thay vì gather theo từng spa
+    for n in np.unique(cells).tolist():
+        rows = np.flatnonzero(cells == n)
+        part = cs[rows]
+        out[rows, :CELLS_PER_DAY + 1 - n] = ((part[..., n:] - part[..., :CELLS_PER_DAY + 1 - n]) == n).any(axis=1)
+    return out
+
+
+def _spread(cells: np.ndarray, spread: int, k: int, tag: int):
+    """(ô, tag) cho tối đa k ô (đã sắp tăng) cách nhau ít nhất `spread` ô."""
+    last = None
+    for cell in cells.tolist():
+        if last is None or cell - last >= spread:
+            yield cell, tag
+            last = cell
+            k -= 1
+            if not k:
+                return
+
+
+# ---------- Cấu hình spa / dịch vụ ----------
+@dataclass(frozen=True)
+class ServiceSchedule:
+    spa_name: str
+    open_mask: int
+    cells: int  # số ô 1 lượt dịch vụ chiếm
+    lanes: int  # số làn được dùng (làn 0 .. lanes-1)
+
+
+def service_schedule(spa_name: str, service_name: Optional[str] = None) -> ServiceSchedule:
+    return _service_schedule(get_catalog_index().version, spa_name, service_name)
+
+
+@lru_cache(maxsize=8)
+def _open_mask(hours: str) -> int:
+    opening, _, closing = hours.partition("-")
+    return cells_mask(_cell_of(opening), _cell_of(closing))
+
+
+@lru_cache(maxsize=16384)
+def _service_schedule(version: str, spa_name: str, service_name: Optional[str]) -> ServiceSchedule:
+    """Ghi nhớ theo phiên bản catalog (catalog đổi → tính lại)."""
+    index = get_catalog_index()
+    entry = index.spa_by_name.get(spa_name)
+    spa = entry.data if entry else {}
+    capacity = int(spa.get("capacity") or CAPACITY)
+
+    svc = {}
+    if service_name:
+        folded = service_name.casefold()
+        svc = next((e.data for e in index.services_by_spa.get(spa_name, ()) if e.name.casefold() == folded), {})
+    minutes = int(svc.get("duration_minutes") or SERVICE_MINUTES)
+    lanes = min(int(svc.get("capacity") or capacity), capacity)
+    return ServiceSchedule(
+        spa_name=spa_name,
+        open_mask=_open_mask(str(spa.get("open_hours") or OPEN_HOURS)),
+        cells=-(-minutes // CELL_MINUTES),
+        lanes=max(lanes, 1),
+    )
+
+
+def free_starts(raw: Optional[bytes], sched: ServiceSchedule) -> int:
+    """Mọi ô bắt đầu mà ít nhất 1 làn còn trống đủ `sched.cells` ô trong giờ mở cửa."""
+    out = 0
+    for busy in lanes_of(raw, sched.lanes):
+        out |= run_starts(~busy & sched.open_mask, sched.cells)
+    return out
+
+
+@dataclass(frozen=True)
+class Reservation:
+    spa_name: str
+    day: str  # YYYYMMDD
+    lane: int
+    start: int  # ô bắt đầu
+    cells: int
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _day_key(day: date) -> str:
+    return day.strftime("%Y%m%d")
+
+
+def _expire_at(day: date) -> int:
+    return int(datetime.combine(day + timedelta(days=2), time(), VN_TZ).timestamp())
+
+
+def _as_vn(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=VN_TZ) if dt.tzinfo is None else dt.astimezone(VN_TZ)
+
+
+def _window(start: Optional[datetime], end: Optional[datetime]) -> Tuple[datetime, datetime, List[date]]:
+    """[start, end) đã chuẩn giờ VN (không sớm hơn bây giờ + SLOT_LEAD_MINUTES) + các ngày trong đó."""
+    earliest = datetime.now(VN_TZ) + timedelta(minutes=LEAD_MINUTES)
+    start = max(_as_vn(start), earliest) if start else earliest
+    end = _as_vn(end) if end else datetime.combine(start.date() + timedelta(days=SEARCH_DAYS), time(), VN_TZ)
+    days = [start.date() + timedelta(days=i) for i in range((end.date() - start.date()).days + 1)]
+    return start, end, days
+
+
+def _day_bounds(day: date, start: datetime, end: datetime) -> Tuple[int, int]:
+    """Ô [lo, hi) của `day` nằm trong [start, end)."""
+    lo = -(-(start.hour * 60 + start.minute) // CELL_MINUTES) if day == start.date() else 0
+    hi = (end.hour * 60 + end.minute) // CELL_MINUTES if day == end.date() else CELLS_PER_DAY
+    return lo, hi
+
+
+def _slot(day: date, cell: int) -> dict:
+    dt = datetime.combine(day, time()) + timedelta(minutes=cell * CELL_MINUTES)
+    return {"label": dt.strftime("%d/%m/%Y %H:%M"), "iso": dt.isoformat()}
+
+
+class AvailabilityStore(ABC):
+    # ---------- API chung ----------
+    def find_slots(self, spa_name: str, service_name: Optional[str] = None,
+                   start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   limit: int = 8, per_day: int = 4, spread_minutes: int = SPREAD_MINUTES) -> List[dict]:
+        """
+        Giờ còn trống gần nhất trong [start, end) (mặc định: từ bây giờ, AVAILABILITY_DAYS ngày),
+        dạng {"label", "iso"} như các helper cũ; mỗi ngày tối đa `per_day` giờ cách nhau
+        ít nhất `spread_minutes`.
+        """
+        sched = service_schedule(spa_name, service_name)
+        start, end, days = _window(start, end)
+        if not days:
+            return []
+
+        step = _step_mask(STEP_MINUTES)
+        spread = max(spread_minutes // CELL_MINUTES, 1)
+        out: List[dict] = []
+        for day, raw in zip(days, self._load(spa_name, days)):
+            starts = free_starts(raw, sched) & step & cells_mask(*_day_bounds(day, start, end))
+            picked, last = 0, None
+            for cell in iter_cells(starts):
+                if last is not None and cell - last < spread:
+                    continue
+                out.append(_slot(day, cell))
+                picked, last = picked + 1, cell
+                if picked >= per_day or len(out) >= limit:
+                    break
+            if len(out) >= limit:
+                break
+        metrics.incr("availability.search")
+        return out
+
+    def earliest_slots(self, spa_names: List[str], service_name: Optional[str] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None,
+                       limit: int = 5, per_spa: int = 1, spread_minutes: int = SPREAD_MINUTES) -> List[dict]:
+        """
+        `limit` giờ trống sớm nhất trên mọi spa trong `spa_names` (cùng quy tắc với find_slots),
+        dạng {"spa_name", "label", "iso"}; mỗi spa tối đa `per_spa` lựa chọn.
+        """
+        spa_names = list(dict.fromkeys(spa_names))
+        start, end, days = _window(start, end)
+        if not spa_names or not days or limit <= 0:
+            return []
+        scheds = [service_schedule(name, service_name) for name in spa_names]
+        open_rows = np.stack([_mask_row(s.open_mask) for s in scheds])
+        lane_ok = np.arange(max(s.lanes for s in scheds))[None, :] < np.array([s.lanes for s in scheds])[:, None]
+        cells = np.array([s.cells for s in scheds])
+        step = _mask_row(_step_mask(STEP_MINUTES))
+        spread = max(spread_minutes // CELL_MINUTES, 1)
+
+        taken = [0] * len(spa_names)
+        out: List[dict] = []
+        for day in days:
+            grid = start_grid(self._load_day(spa_names, day), open_rows, lane_ok, cells)
+            grid &= step & _mask_row(cells_mask(*_day_bounds(day, start, end)))
+            grid[np.array(taken) >= per_spa] = False
+            # giờ sớm nhất của từng spa; chỉ spa có giờ đầu <= giờ đầu thứ `còn thiếu` mới góp vào kết quả
+            heads = np.where(grid.any(axis=1), grid.argmax(axis=1), CELLS_PER_DAY)
+            need = min(limit - len(out), len(heads))
+            cutoff = np.partition(heads, need - 1)[need - 1]
+            if cutoff >= CELLS_PER_DAY:
+                cutoff = CELLS_PER_DAY - 1
+            # trùng giờ đầu = cutoff thì xếp theo thứ tự spa → chỉ cần vài spa đầu
+            before = np.flatnonzero(heads < cutoff)
+            tied = np.flatnonzero(heads == cutoff)[:max(need - len(before), 0)]
+            # mỗi spa 1 dòng giờ tăng dần; heap gộp các dòng → giờ sớm nhất toàn cục trước
+            streams = [_spread(np.flatnonzero(grid[i]), spread, per_spa - taken[i], i)
+                       for i in np.concatenate([before, tied]).tolist()]
+            for cell, i in heapq.merge(*streams):
+                taken[i] += 1
+                out.append({"spa_name": spa_names[i], **_slot(day, cell)})
+                if len(out) >= limit:
+                    break
+            if len(out) >= limit:
+                break
+        metrics.incr("availability.multi_search")
+        return out
+
+    def reserve(self, spa_name: str, service_name: Optional[str], when: datetime) -> Optional[Reservation]:
+        """
+        Giữ chỗ nguyên tử cho 1 lượt dịch vụ bắt đầu lúc `when`; None nếu hết chỗ / ngoài giờ / đã qua.
+        Giờ lệch ô (vd. 10:10) → giữ từ ô chứa giờ bắt đầu đến ô chứa giờ kết thúc (10:00-11:15).
+        """
+        sched = service_schedule(spa_name, service_name)
+        when = _as_vn(when)
+        if when < datetime.now(VN_TZ):
+            metrics.incr("availability.past")
+            return None
+        cell_seconds = CELL_MINUTES * 60
+        offset = (when - datetime.combine(when.date(), time(), VN_TZ)).total_seconds()
+        start = int(offset // cell_seconds)
+        cells = math.ceil((offset + sched.cells * cell_seconds) / cell_seconds) - start
+        need = cells_mask(start, start + cells)
+        if start + cells > CELLS_PER_DAY or need & ~sched.open_mask:
+            metrics.incr("availability.closed")
+            return None
+        lane = self._reserve(spa_name, when.date(), start, cells, sched.lanes)
+        if lane < 0:
+            metrics.incr("availability.conflict")
+            return None
+        metrics.incr("availability.reserved")
+        return Reservation(spa_name, _day_key(when.date()), lane, start, cells)
+
+    def release(self, reservation: Reservation):
+        day = datetime.strptime(reservation.day, "%Y%m%d").date()
+        self._release(reservation.spa_name, day, reservation.lane, reservation.start, reservation.cells)
+        metrics.incr("availability.released")
+
+    # ---------- backend ----------
+    @abstractmethod
+    def _load(self, spa_name: str, days: List[date]) -> List[Optional[bytes]]:
+        ...
+
+    @abstractmethod
+    def _load_day(self, spa_names: List[str], day: date) -> List[Optional[bytes]]:
+        ...
+
+    @abstractmethod
+    def _reserve(self, spa_name: str, day: date, start: int, cells: int, lanes: int) -> int:
+        ...
+
+    @abstractmethod
+    def _release(self, spa_name: str, day: date, lane: int, start: int, cells: int):
+        ...
+
+
+# KEYS[1] = bitmap ngày; ARGV = ô bắt đầu, số ô, số làn, số ô / làn, expireat
+# Trả về làn đã giữ, -1 nếu mọi làn đều vướng.
+_RESERVE_LUA = """
+local start, n, lanes, width = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+for lane = 0, lanes - 1 do
+  local base = lane * width + start
+  local free = true
+  for i = 0, n - 1 do
+    if redis.call('GETBIT', KEYS[1], base + i) == 1 then
+      free = false
+      break
+    end
+  end
+  if free then
+    for i = 0, n - 1 do
+      redis.call('SETBIT', KEYS[1], base + i, 1)
+    end
+    redis.call('EXPIREAT', KEYS[1], ARGV[5])
+    return lane
+  end
+end
+return -1
+"""
+
+
+class RedisAvailabilityStore(AvailabilityStore):
+    def __init__(self, backend):
+        self._backend = backend
+        self._write = backend._write_client
+        self._read = getattr(backend, "_read_client", None) or self._write
+        self._script = self._write.register_script(_RESERVE_LUA)
+
+    def _key(self, spa_name: str, day: date) -> str:
+        return f"{self._backend._get_prefix() or ''}avail:{spa_name}:{_day_key(day)}"
+
+    def _load(self, spa_name: str, days: List[date]) -> List[Optional[bytes]]:
+        return self._read.mget([self._key(spa_name, d) for d in days])
+
+    def _load_day(self, spa_names: List[str], day: date) -> List[Optional[bytes]]:
+        return self._read.mget([self._key(name, day) for name in spa_names])
+
+    def _reserve(self, spa_name: str, day: date, start: int, cells: int, lanes: int) -> int:
+        return int(self._script(keys=[self._key(spa_name, day)],
+                                args=[start, cells, lanes, CELLS_PER_DAY, _expire_at(day)]))
+
+    def _release(self, spa_name: str, day: date, lane: int, start: int, cells: int):
+        # chỉ chủ lượt giữ chỗ xoá đúng các bit của mình → không cần script
+        key = self._key(spa_name, day)
+        pipe = self._write.pipeline(transaction=True)
+        for i in range(cells):
+            pipe.setbit(key, lane * CELLS_PER_DAY + start + i, 0)
+        pipe.execute()
+
+
+class MemoryAvailabilityStore(AvailabilityStore):
+    """Bản trong process (dev / test): bytearray cùng bố cục bit với Redis, kiểm tra + set dưới lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._days: Dict[Tuple[str, str], bytearray] = {}
+
+    def _load(self, spa_name: str, days: List[date]) -> List[Optional[bytes]]:
+        keys = [(spa_name, _day_key(d)) for d in days]
+        with self._lock:
+            return [bytes(self._days[k]) if k in self._days else None for k in keys]
+
+    def _load_day(self, spa_names: List[str], day: date) -> List[Optional[bytes]]:
+        day_key = _day_key(day)
+        with self._lock:
+            return [bytes(self._days[(name, day_key)]) if (name, day_key) in self._days else None
+                    for name in spa_names]
+
+    def _reserve(self, spa_name: str, day: date, start: int, cells: int, lanes: int) -> int:
+        need = cells_mask(start, start + cells)
+        with self._lock:
+            buf = self._days.setdefault((spa_name, _day_key(day)), bytearray(LANE_BYTES * lanes))
+            if len(buf) < LANE_BYTES * lanes:
+                buf.extend(bytes(LANE_BYTES * lanes - len(buf)))
+            for lane, busy in enumerate(lanes_of(bytes(buf), lanes)):
+                if not busy & need:
+                    buf[lane * LANE_BYTES:(lane + 1) * LANE_BYTES] = (busy | need).to_bytes(LANE_BYTES, "big")
+                    return lane
+            return -1
+
+    def _release(self, spa_name: str, day: date, lane: int, start: int, cells: int):
+        with self._lock:
+            buf = self._days.get((spa_name, _day_key(day)))
+            if buf is None or len(buf) < (lane + 1) * LANE_BYTES:
+                return
+            busy = int.from_bytes(buf[lane * LANE_BYTES:(lane + 1) * LANE_BYTES], "big")
+            busy &= ~cells_mask(start, start + cells) & FULL
+            buf[lane * LANE_BYTES:(lane + 1) * LANE_BYTES] = busy.to_bytes(LANE_BYTES, "big")
+
+
+_MEMORY_STORE = MemoryAvailabilityStore()
+_STORES: Dict[int, AvailabilityStore] = {}
+
+
+def get_availability_store() -> AvailabilityStore:
+    """Store theo backend cache của app hiện tại (Redis nếu có, ngược lại in-memory)."""
+    backend = cache.cache
+    if not hasattr(backend, "_write_client"):
+        return _MEMORY_STORE
+    store = _STORES.get(id(backend))
+    if store is None:
+        store = _STORES[id(backend)] = RedisAvailabilityStore(backend)
+    return store
+
+
+__all__ = ["AvailabilityStore", "RedisAvailabilityStore", "MemoryAvailabilityStore", "Reservation",
+           "ServiceSchedule", "get_availability_store", "service_schedule", "free_starts", "start_grid",
+           "run_starts", "cells_mask", "iter_cells"]
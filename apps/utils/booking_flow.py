@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Luồng đặt lịch dạng máy trạng thái, dùng chung cho /api/bots (v2) và /api/ai (policy).
+
+Trạng thái (suy ra từ bản nháp, không lưu riêng):
+    NEED_SERVICE → NEED_SPA → NEED_SLOT → AWAIT_CONFIRM → DONE
+Mọi thay đổi bản nháp đi qua `BookingFlow.fire(event, value)`: bảng chuyển trạng thái
+`TRANSITIONS` được compile 1 lần thành dict (trạng thái, sự kiện) → hành động; sự kiện không
+hợp lệ ở trạng thái hiện tại bị bỏ qua (metric booking.ignored).
+
+Bất biến nằm trong hành động, không rải ở handler:
+- đổi dịch vụ / spa khác → bỏ giờ cũ (slot, slot gợi ý, cờ xác nhận)
+- chọn giờ mới → bỏ slot gợi ý + cờ xác nhận, nhớ giờ trước đó (previous_slot)
+- đặt thành công → bản nháp rỗng (xoá khoá khi ghi)
+
+Bản nháp vẫn là dict như khoá `booking:<user_id>` cũ (active, spa_name, service_name, slot,
+available_slots, service_candidates, earliest_options, time_range, confirmed, previous_slot);
+khi lưu Redis được mã hoá gọn qua apps.utils.codec.BookingDraft.
+Ghi đúng 1 lần / turn: `commit(save)` gọi `save(dict)` (hoặc `save(None)` = xoá) nếu có đổi.
+
+Module không phụ thuộc Flask / Redis → test / benchmark trực tiếp.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from apps.utils import metrics
+
+
+class BookingState(str, Enum):
+    NEED_SERVICE = "need_service"    # chưa biết dịch vụ
+    NEED_SPA = "need_spa"            # có dịch vụ, chưa biết spa
+    NEED_SLOT = "need_slot"          # có spa + dịch vụ, chưa có giờ
+    AWAIT_CONFIRM = "await_confirm"  # đủ thông tin, chờ user đồng ý
+    DONE = "done"                    # đã xác nhận (chờ / đã lưu lịch hẹn)
+
+
+class BookingEvent(str, Enum):
+    START = "start"                    # bắt đầu phiên mới: active, bỏ giờ cũ
+    CANCEL = "cancel"                  # bỏ phiên (hỏi việc khác / đặt thêm)
+    OFFER_SERVICES = "offer_services"  # value = [tên dịch vụ] đã gợi ý
+    PICK_SERVICE = "pick_service"      # value = tên dịch vụ
+    PICK_SPA = "pick_spa"              # value = tên spa
+    SET_TIME_RANGE = "set_time_range"  # value = {"start_iso", "end_iso"}
+    OFFER_SLOTS = "offer_slots"        # value = [slot] đã gợi ý
+    PICK_SLOT = "pick_slot"            # value = {"label", "iso"}
+    OFFER_EARLIEST = "offer_earliest"  # value = (tên dịch vụ | None nếu nhiều dịch vụ, [lựa chọn spa + giờ])
+    PICK_OPTION = "pick_option"        # value = số thứ tự trong earliest_options (từ 1)
+    CONFIRM = "confirm"
+    SLOT_TAKEN = "slot_taken"          # value = [slot] gợi ý lại (giữ chỗ thất bại lúc chốt)
+    BOOKED = "booked"                  # đã lưu lịch hẹn
+
+
+_TIME_FIELDS = ("slot", "available_slots", "confirmed")
+
+
+def slot_of(dt: datetime) -> dict:
+    """Slot {"label", "iso"} từ giờ user nói."""
+    return {"label": dt.strftime("%d/%m/%Y %H:%M"), "iso": dt.isoformat()}
+
+
+def derive_state(data: Dict[str, Any]) -> BookingState:
+    if not data.get("service_name"):
+        return BookingState.NEED_SERVICE
+    if not data.get("spa_name"):
+        return BookingState.NEED_SPA
+    if not data.get("slot"):
+        return BookingState.NEED_SLOT
+    if not data.get("confirmed"):
+        return BookingState.AWAIT_CONFIRM
+    return BookingState.DONE
+
+
+def is_empty(data: Dict[str, Any]) -> bool:
+    """Bản nháp không còn gì (không active, không trường nào) → xoá khoá thay vì ghi."""
+    return not any(v for v in data.values())
+
+
+# ---------- Hành động (sửa bản nháp tại chỗ) ----------
+def _clear_time(d: dict):
+    for k in _TIME_FIELDS:
+        d.pop(k, None)
+
+
+def _start(d: dict, _value):
+    d["active"] = True
+    _clear_time(d)
+    d.pop("previous_slot", None)
+
+
+def _cancel(d: dict, _value):
+    d.clear()
+    d["active"] = False
+
+
+def _offer_services(d: dict, names):
+    d["service_candidates"] = list(names)
+
+
+def _pick_service(d: dict, name):
+    if d.get("service_name") and d["service_name"] != name:
+        _clear_time(d)
+    d["service_name"] = name
+    d.pop("service_candidates", None)
+
+
+def _pick_spa(d: dict, name):
+    if d.get("spa_name") and d["spa_name"] != name:
+        _clear_time(d)
+    d["spa_name"] = name
+
+
+def _set_time_range(d: dict, rng):
+    d["time_range"] = dict(rng)
+
+
+def _offer_slots(d: dict, slots):
+    d["available_slots"] = list(slots)
+
+
+def _pick_slot(d: dict, slot):
+    prev = d.get("slot")
+    if prev and prev.get("iso") != slot.get("iso"):
+        d["previous_slot"] = prev
+    d["slot"] = dict(slot)
+    d.pop("available_slots", None)
+    d.pop("confirmed", None)
+
+
+def _offer_earliest(d: dict, value):
+    service_name, options = value
+    d.clear()
+    d.update({"active": True, "service_name": service_name, "earliest_options": list(options)})
+
+
+def _pick_option(d: dict, n):
+    opt = d["earliest_options"][n - 1]
+    if opt.get("service_name"):
+        # gợi ý trên nhiều dịch vụ → mỗi lựa chọn mang dịch vụ riêng
+        _pick_service(d, opt["service_name"])
+    _pick_spa(d, opt["spa_name"])
+    _pick_slot(d, {"label": opt["label"], "iso": opt["iso"]})
+    d.pop("earliest_options", None)
+
+
+def _confirm(d: dict, _value):
+    d["confirmed"] = True
+
+
+def _slot_taken(d: dict, slots):
+    d.pop("slot", None)
+    d.pop("confirmed", None)
+    d["available_slots"] = list(slots or [])
+
+
+def _booked(d: dict, _value):
+    _cancel(d, None)
+
+
+@dataclass(frozen=True)
+class Transition:
+    event: BookingEvent
+    sources: FrozenSet[BookingState]
+    action: Callable[[dict, Any], None]
+    target: Optional[BookingState] = None  # None → suy ra từ bản nháp sau hành động
+
+
+_OPEN = frozenset(s for s in BookingState if s is not BookingState.DONE)
+_ANY = frozenset(BookingState)
+_E, _S = BookingEvent, BookingState
+
+TRANSITIONS: List[Transition] = [
+    Transition(_E.START, _ANY, _start),
+    Transition(_E.CANCEL, _ANY, _cancel, target=_S.NEED_SERVICE),
+    Transition(_E.OFFER_SERVICES, _OPEN, _offer_services),
+    Transition(_E.PICK_SERVICE, _OPEN, _pick_service),
+    Transition(_E.PICK_SPA, _OPEN, _pick_spa),
+    Transition(_E.SET_TIME_RANGE, _OPEN, _set_time_range),
+    Transition(_E.OFFER_SLOTS, _OPEN, _offer_slots),
+    Transition(_E.PICK_SLOT, _OPEN, _pick_slot),
+    Transition(_E.OFFER_EARLIEST, _ANY, _offer_earliest),
+    Transition(_E.PICK_OPTION, _OPEN, _pick_option),
+    Transition(_E.CONFIRM, frozenset({_S.AWAIT_CONFIRM}), _confirm),
+    Transition(_E.SLOT_TAKEN, frozenset({_S.AWAIT_CONFIRM, _S.DONE}), _slot_taken),
+    Transition(_E.BOOKED, frozenset({_S.DONE}), _booked),  # bản nháp rỗng → NEED_SERVICE
+]
+
+
+def compile_transitions(transitions: Iterable[Transition]) -> Dict[Tuple[BookingState, BookingEvent], Transition]:
+    table = {}
+    for t in transitions:
+        for state in t.sources:
+            if (state, t.event) in table:
+                raise ValueError(f"trùng chuyển trạng thái {state.value} --{t.event.value}-->")
+            table[(state, t.event)] = t
+    return table
+
+
+_TABLE = compile_transitions(TRANSITIONS)
+
+
+class BookingFlow:
+    """Bản nháp đặt lịch của 1 user trong 1 turn: đổi qua `fire`, ghi 1 lần bằng `commit`."""
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        self.data: Dict[str, Any] = dict(data or {"active": False})
+        self.state = derive_state(self.data)
+        self._dirty = False
+
+    # ---------- Đọc ----------
+    def get(self, name: str, default: Any = None) -> Any:
+        value = self.data.get(name)
+        return default if value is None else value
+
+    @property
+    def active(self) -> bool:
+        return bool(self.data.get("active"))
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty
+
+    def can(self, event: BookingEvent) -> bool:
+        return (self.state, event) in _TABLE
+
+    # ---------- Chuyển trạng thái ----------
+    def fire(self, event: BookingEvent, value: Any = None) -> bool:
+        """Áp 1 sự kiện; False nếu không hợp lệ ở trạng thái hiện tại (bản nháp giữ nguyên)."""
+        t = _TABLE.get((self.state, event))
+        if t is None:
+            metrics.incr("booking.ignored")
+            return False
+        t.action(self.data, value)
+        self.state = t.target or derive_state(self.data)
+        self._dirty = True
+        return True
+
+    def activate(self):
+        """Đánh dấu đang trong phiên đặt lịch (không đổi trường nào khác)."""
+        if not self.active:
+            self.data["active"] = True
+            self._dirty = True
+
+    def pick_offered_slot(self, n: int) -> bool:
+        """Chọn slot thứ n (từ 1) trong các slot đã gợi ý."""
+        offered = self.data.get("available_slots") or []
+        return 1 <= n <= len(offered) and self.fire(BookingEvent.PICK_SLOT, offered[n - 1])
+
+    def pick_option(self, n: int) -> bool:
+        """Chọn lựa chọn thứ n (từ 1) trong các giờ sớm nhất ở nhiều spa đã gợi ý."""
+        options = self.data.get("earliest_options") or []
+        return 1 <= n <= len(options) and self.fire(BookingEvent.PICK_OPTION, n)
+
+    def replace(self, data: Dict[str, Any]):
+        """Thay cả bản nháp (API cũ set_booking_context)."""
+        self.data = dict(data)
+        self.state = derive_state(self.data)
+        self._dirty = True
+
+    # ---------- Ghi ----------
+    def commit(self, save: Callable[[Optional[Dict[str, Any]]], None]) -> bool:
+        """Ghi bản nháp nếu có đổi: save(dict), hoặc save(None) khi bản nháp rỗng (xoá khoá)."""
+        if not self._dirty:
+            return False
+        save(None if is_empty(self.data) else dict(self.data))
+        self._dirty = False
+        metrics.incr("booking.commit")
+        return True
+
+
+__all__ = ["BookingEvent", "BookingFlow", "BookingState", "TRANSITIONS", "Transition", "compile_transitions",
+           "derive_state", "is_empty", "slot_of"]
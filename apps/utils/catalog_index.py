@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Chỉ mục catalog (spa + dịch vụ) tính sẵn 1 lần, chỉ đọc.
+
+Thay cho các vòng lặp lồng `for spa ... for service ... _normalize(name)` ở mỗi turn:
+- tên đã bỏ dấu + tập token của từng dịch vụ / spa
+- inverted index token -> dịch vụ (lọc ứng viên theo token có trong câu)
+- map tên dịch vụ (bỏ dấu) -> các spa cung cấp
+- tra cứu theo id
+- `version`: hash nội dung catalog (prompt / cache dẫn xuất dựng lại khi catalog đổi)
+
+Chỉ mục mặc định thuộc snapshot catalog hiện tại (apps.utils.catalog_store), dựng 1 lần / version.
+"""
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+from apps.utils.text_normalize import fold_text
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(folded: str) -> List[str]:
+    """Tách token từ chuỗi đã fold (bỏ dấu câu)."""
+    return _TOKEN_RE.findall(folded or "")
+
+
+@dataclass(frozen=True, eq=False, slots=True)
+class SpaEntry:
+    id: int
+    name: str
+    folded: str
+    data: Mapping
+
+
+@dataclass(frozen=True, eq=False, slots=True)
+class ServiceEntry:
+    id: int
+    spa_name: str
+    name: str
+    folded: str
+    tokens: Tuple[str, ...]
+    data: Mapping
+
+    def overlap(self, msg_tokens: FrozenSet[str], min_len: int) -> int:
+        return sum(1 for t in self.tokens if len(t) >= min_len and t in msg_tokens)
+
+    def as_match(self) -> dict:
+        """Dạng {'spa_name', 'service'} mà các helper cũ đang dùng."""
+        return {"spa_name": self.spa_name, "service": self.data}
+
+
+def _freeze(d: Dict[str, list]) -> Mapping[str, tuple]:
+    return MappingProxyType({k: tuple(v) for k, v in d.items()})
+
+
+@dataclass(frozen=True, eq=False)
+class CatalogIndex:
+    spas: Tuple[SpaEntry, ...]
+    services: Tuple[ServiceEntry, ...]
+    spa_by_name: Mapping[str, SpaEntry]
+    services_by_spa: Mapping[str, Tuple[ServiceEntry, ...]]
+    services_by_folded: Mapping[str, Tuple[ServiceEntry, ...]]
+    services_by_name: Mapping[str, Tuple[ServiceEntry, ...]]
+    spas_by_service: Mapping[str, Tuple[dict, ...]]
+    token_index: Mapping[str, Tuple[int, ...]]
+    version: str = ""
+
+    # ---------- Build ----------
+    @classmethod
+    def build(cls, locations: Iterable[dict], services_dict: Mapping[str, List[dict]],
+              version: Optional[str] = None) -> "CatalogIndex":
+        """`version` đã tính sẵn (vd. catalog_store) → không hash lại cả catalog."""
+        locations = list(locations)
+        spas = tuple(
+            SpaEntry(id=i, name=spa["name"], folded=fold_text(spa["name"]), data=spa)
+            for i, spa in enumerate(locations)
+        )
+
+        services: List[ServiceEntry] = []
+        by_spa: Dict[str, List[ServiceEntry]] = {}
+        by_folded: Dict[str, List[ServiceEntry]] = {}
+        by_name: Dict[str, List[ServiceEntry]] = {}
+        token_index: Dict[str, List[int]] = {}
+        # catalog lớn lặp lại rất nhiều tên dịch vụ → fold / tách token 1 lần cho mỗi tên
+        tokens_by_name: Dict[str, Tuple[str, Tuple[str, ...], Tuple[str, ...]]] = {}
+        for spa_name, items in services_dict.items():
+            for s in items:
+                name = s["name"]
+                parsed = tokens_by_name.get(name)
+                if parsed is None:
+                    folded = fold_text(name)
+                    tokens = tuple(tokenize(folded))
+                    parsed = tokens_by_name[name] = (folded, tokens, tuple(set(tokens)))
+                folded, tokens, unique_tokens = parsed
+                entry = ServiceEntry(id=len(services), spa_name=spa_name, name=name, folded=folded,
+                                     tokens=tokens, data=s)
+                services.append(entry)
+                by_spa.setdefault(spa_name, []).append(entry)
+                by_folded.setdefault(folded, []).append(entry)
+                by_name.setdefault(name, []).append(entry)
+                for t in unique_tokens:
+                    token_index.setdefault(t, []).append(entry.id)
+
+        # dịch vụ (bỏ dấu) -> spa cung cấp, theo thứ tự spa_locations
+        spas_by_service: Dict[str, List[dict]] = {}
+        for spa in locations:
+            seen = set()
+            for entry in by_spa.get(spa["name"], []):
+                if entry.folded not in seen:
+                    seen.add(entry.folded)
+                    spas_by_service.setdefault(entry.folded, []).append(spa)
+
+        return cls(
+            spas=spas,
+            services=tuple(services),
+            spa_by_name=MappingProxyType({s.name: s for s in spas}),
+            services_by_spa=_freeze(by_spa),
+            services_by_folded=_freeze(by_folded),
+            services_by_name=_freeze(by_name),
+            spas_by_service=_freeze(spas_by_service),
+            token_index=_freeze(token_index),
+            version=version or catalog_version(locations, services_dict),
+        )
+
+    # ---------- Lookup by id ----------
+    def service_by_id(self, service_id: int) -> Optional[ServiceEntry]:
+        return self.services[service_id] if 0 <= service_id < len(self.services) else None
+
+    def spa_by_id(self, spa_id: int) -> Optional[SpaEntry]:
+        return self.spas[spa_id] if 0 <= spa_id < len(self.spas) else None
+
+    # ---------- Matching ----------
+    def candidates(self, msg_tokens: Iterable[str], entries: Optional[Iterable[ServiceEntry]] = None) -> List[ServiceEntry]:
+        """Dịch vụ có ít nhất 1 token xuất hiện trong câu (theo thứ tự catalog)."""
+        ids = set()
+        for t in set(msg_tokens):
+            ids.update(self.token_index.get(t, ()))
+        if entries is not None:
+            allowed = {e.id for e in entries}
+            ids &= allowed
+        return [self.services[i] for i in sorted(ids)]
+
+    def services_in_text(self, folded_msg: str, min_overlap: int = 2, min_token_len: int = 3) -> List[ServiceEntry]:
+        """Dịch vụ có tên nằm trọn trong câu, hoặc trùng >= min_overlap token."""
+        msg_tokens = frozenset(tokenize(folded_msg))
+        found = []
+        for e in self.candidates(msg_tokens):
+            if e.folded in folded_msg or e.overlap(msg_tokens, min_token_len) >= min_overlap:
+                found.append(e)
+        return found
+
+    def first_service_in_text(self, folded_msg: str, entries: Optional[Iterable[ServiceEntry]] = None) -> Optional[ServiceEntry]:
+        """Dịch vụ đầu tiên (theo thứ tự catalog) có tên nằm trọn trong câu."""
+        for e in self.candidates(tokenize(folded_msg), entries):
+            if e.folded in folded_msg:
+                return e
+        return None
+
+    def best_overlap(self, folded_msg: str, min_token_len: int,
+                     entries: Optional[Iterable[ServiceEntry]] = None) -> Tuple[Optional[ServiceEntry], int]:
+        """Dịch vụ trùng nhiều token nhất (hoà → lấy cái đứng trước)."""
+        msg_tokens = frozenset(tokenize(folded_msg))
+        best, best_score = None, 0
+        for e in self.candidates(msg_tokens, entries):
+            score = e.overlap(msg_tokens, min_token_len)
+            if score > best_score:
+                best, best_score = e, score
+        return best, best_score
+
+    def spas_for_service(self, service_name: str) -> List[dict]:
+        return list(self.spas_by_service.get(fold_text(service_name), ()))
+
+    def service_by_name(self, name: str) -> Optional[ServiceEntry]:
+        hits = self.services_by_name.get(name)
+        return hits[0] if hits else None
+
+    def folded_service_names(self) -> List[str]:
+        return list(self.services_by_folded.keys())
+
+
+def catalog_version(locations: Iterable[dict], services_dict: Dict[str, List[dict]]) -> str:
+    """Hash ngắn, ổn định của nội dung catalog."""
+    raw = json.dumps([list(locations), services_dict], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def get_catalog_index() -> CatalogIndex:
+    """Chỉ mục của snapshot catalog hiện tại (apps.utils.catalog_store: DB hoặc dữ liệu tĩnh)."""
+    from apps.utils.catalog_store import get_catalog  # catalog_store import module này
+    return get_catalog().index
+
+
+def catalog_index_for(services_dict: Optional[Mapping[str, List[dict]]] = None) -> CatalogIndex:
+    """Trả về chỉ mục mặc định, hoặc dựng riêng nếu caller truyền 1 dict dịch vụ khác."""
+    from apps.utils.catalog_store import get_catalog
+    catalog = get_catalog()
+    if services_dict is None or services_dict is catalog.services:
+        return catalog.index
+    return CatalogIndex.build(catalog.locations, services_dict)
+
+
+__all__ = ["CatalogIndex", "SpaEntry", "ServiceEntry", "get_catalog_index", "catalog_index_for", "catalog_version", "tokenize"]
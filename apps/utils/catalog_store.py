@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Catalog (spa + dịch vụ) dạng snapshot bất biến trong bộ nhớ, nạp từ MySQL, đổi nóng không restart.
+
+- Nguồn: CATALOG_SOURCE=db → bảng organizations (OrganizationModel) + dịch vụ (ServiceModel);
+  mặc định / DB lỗi lúc khởi động → dữ liệu tĩnh apps/utils/spa_locations.py + spa_services.py
+- `CatalogSnapshot`: locations, services, CatalogIndex (tên bỏ dấu, token index, ...) và các cấu
+  trúc dẫn xuất đã đăng ký (`register_derived`: alias, từ khoá thành phố, ...) — dựng hết 1 lần
+  cho mỗi version, TRƯỚC khi đưa vào dùng
+- Đổi nóng: `request_reload()` tăng version namespace "catalog" (apps.utils.tiered_cache: INCR +
+  pub/sub). Mỗi worker thấy version mới ở lần `get_catalog()` kế tiếp → nạp + dựng snapshot ở
+  thread nền, xong thì gán 1 tham chiếu (nguyên tử); request vẫn đọc snapshot cũ trong lúc đó.
+  Request không bao giờ đọc DB cho catalog
+- Nội dung không đổi (cùng hash) → giữ snapshot cũ (kể cả cấu trúc dẫn xuất), chỉ cập nhật version
+- Nạp lại lỗi → giữ snapshot hiện tại, thử lại sau CATALOG_RETRY_S giây
+
+Snapshot chỉ đọc: container là tuple / MappingProxyType; bản ghi spa / dịch vụ là dict thường
+(để pickle vào cache hội thoại được) — không sửa tại chỗ.
+
+Biến môi trường:
+- CATALOG_SOURCE          : "static" (mặc định) | "db"
+- CATALOG_RETRY_S         : chờ trước khi thử nạp lại sau lỗi, giây (mặc định 30)
+- CATALOG_SERVICES_TABLE  : tên bảng dịch vụ (mặc định "services", xem ServiceModel)
+"""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+from flask import current_app, has_app_context
+
+from apps.utils import metrics
+from apps.utils.catalog_index import CatalogIndex, catalog_version
+from apps.utils.text_normalize import fold_text
+from apps.utils.tiered_cache import tiered_cache
+
+SOURCE = os.getenv("CATALOG_SOURCE", "static").lower()
+RETRY_S = float(os.getenv("CATALOG_RETRY_S", 30))
+NAMESPACE = "catalog"
+
+# Dữ liệu dẫn xuất từ catalog dùng chung giữa các worker (alias spa theo tập tên, ...):
+# cùng namespace với version catalog → request_reload() cũng bỏ luôn các mục này ở mọi worker
+CATALOG_CACHE = tiered_cache(NAMESPACE, l1_ttl=3600, l2_ttl=86400)
+
+log = logging.getLogger(__name__)
+
+_DERIVED: Dict[str, Callable[["CatalogSnapshot"], Any]] = {}
+_MISSING = object()
+
+
+def register_derived(name: str):
+    """Decorator: @register_derived("city_keywords") def build(snapshot) -> giá trị (dựng 1 lần / version)."""
+    def deco(fn: Callable[["CatalogSnapshot"], Any]):
+        _DERIVED[name] = fn
+        return fn
+    return deco
+
+
+@dataclass(frozen=True, eq=False)
+class CatalogSnapshot:
+    version: str                            # hash nội dung (= index.version)
+    generation: int                         # version namespace "catalog" lúc nạp
+    source: str                             # "db" | "static"
+    locations: Tuple[dict, ...]
+    services: Mapping[str, Tuple[dict, ...]]
+    index: CatalogIndex
+    spa_names: Tuple[str, ...]              # thứ tự của dict dịch vụ (như list(spa_services.keys()) cũ)
+    loaded_at: float
+    load_ms: float = 0.0
+    build_ms: float = 0.0
+    _derived: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    def derived(self, name: str) -> Any:
+        value = self._derived.get(name, _MISSING)
+        if value is _MISSING:
+            # đăng ký sau khi snapshot đã dựng → dựng lần đầu dùng (vẫn 1 lần / version)
+            value = self._derived[name] = _DERIVED[name](self)
+        return value
+
+
+def build_snapshot(locations: List[dict], services: Dict[str, List[dict]], source: str,
+                   generation: int = 0, load_ms: float = 0.0, version: Optional[str] = None) -> CatalogSnapshot:
+    """Snapshot + CatalogIndex + mọi cấu trúc dẫn xuất đã đăng ký."""
+    started = time.perf_counter()
+    version = version or catalog_version(locations, services)  # hash trên list/dict gốc, trước khi đóng băng
+    locations = tuple(locations)
+    services = MappingProxyType({name: tuple(items) for name, items in services.items()})
+    index = CatalogIndex.build(locations, services, version=version)
+    snapshot = CatalogSnapshot(version=index.version, generation=generation, source=source,
+                               locations=locations, services=services, index=index,
+                               spa_names=tuple(services.keys()), loaded_at=time.time(), load_ms=load_ms)
+    for name in list(_DERIVED):
+        snapshot.derived(name)
+    return replace(snapshot, build_ms=round((time.perf_counter() - started) * 1000, 1))
+
+
+def build_city_keywords(spas) -> Dict[str, List[str]]:
+    """{thành phố: [từ khoá]} — thành phố lấy từ phần cuối địa chỉ spa, thêm các cách viết HCM / Hà Nội."""
+    city_map = {}
+    for spa in spas:
+        parts = [p.strip().lower() for p in spa.get("address", "").split(",")]
+        if len(parts) >= 2:
+            city = parts[-1]
+            city_map.setdefault(city, set()).add(city)
+    city_map.setdefault("hồ chí minh", set()).update({
+        "hồ chí minh", "ho chi minh", "tp hcm", "tp.hcm", "tp. hcm", "hcm",
+        "sài gòn", "sai gon", "sg", "ho chi minh city"
+    })
+    city_map.setdefault("hà nội", set()).update({"hà nội", "ha noi", "hn", "ha noi city"})
+    return {k: list(v) for k, v in city_map.items()}
+
+
+@register_derived("city_keywords")
+def _city_keywords(catalog: CatalogSnapshot) -> Tuple[Tuple[str, str], ...]:
+    """[(thành phố, từ khoá đã bỏ dấu)] — bảng duy nhất cho TrainingVector.detect_city và intents.map_city."""
+    return tuple((city, fold_text(k)) for city, keys in build_city_keywords(catalog.locations).items() for k in keys)
+
+
+@register_derived("spa_names_folded")
+def _spa_names_folded(catalog: CatalogSnapshot) -> Tuple[Tuple[str, str], ...]:
+    """[(tên bỏ dấu, tên spa)] theo thứ tự spa_names — khớp tên / fuzzy không fold lại mỗi câu."""
+    return tuple((fold_text(name), name) for name in catalog.spa_names)
+
+
+# ---------- Nguồn ----------
+def load_static() -> Tuple[List[dict], Dict[str, List[dict]]]:
+    from apps.utils.spa_locations import spa_locations
+    from apps.utils.spa_services import spa_services
+    return list(spa_locations), dict(spa_services)
+
+
+def _coord(value) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def load_from_db(session=None) -> Tuple[List[dict], Dict[str, List[dict]]]:
+    """
+    organizations + dịch vụ, 2 câu SELECT chỉ lấy cột cần (không dựng ORM object).
+    Trùng tên spa → giữ spa có id nhỏ nhất (dịch vụ của spa trùng bị bỏ, metric catalog.duplicate_spa).
+    """
+    from sqlalchemy import select
+    from apps.configs.mysql_config import db
+    from apps.models.organization_model import OrganizationModel as Org
+    from apps.models.service_model import ServiceModel as Svc
+
+    session = session or db.session
+    locations: List[dict] = []
+    services: Dict[str, List[dict]] = {}
+    names_by_id: Dict[int, str] = {}
+    rows = session.execute(
+        select(Org.id, Org.name, Org.address, Org.latitude, Org.longitude)
+        .where(Org.name.isnot(None)).order_by(Org.id))
+    for org_id, name, address, lat, lng in rows:
+        name = name.strip()
+        if not name:
+            continue
+        if name in services:
+            metrics.incr("catalog.duplicate_spa")
+            continue
+        names_by_id[org_id] = name
+        services[name] = []
+        locations.append({"id": org_id, "name": name, "address": address or "", "description": "",
+                          "latitude": _coord(lat), "longitude": _coord(lng)})
+    rows = session.execute(
+        select(Svc.organization_id, Svc.name, Svc.description)
+        .where(Svc.deleted_at.is_(None), Svc.name.isnot(None)).order_by(Svc.organization_id, Svc.id))
+    for org_id, name, description in rows:
+        spa_name = names_by_id.get(org_id)
+        if spa_name is not None and name.strip():
+            services[spa_name].append({"name": name.strip(), "description": description or ""})
+    return locations, services
+
+
+# ---------- Store ----------
+class CatalogStore:
+    def __init__(self, source: str = SOURCE):
+        self.source = source
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._lock = threading.Lock()
+        self._reloading = False
+        self._retry_at = 0.0
+
+    def current(self) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load(CATALOG_CACHE.version(), initial=True)
+                    metrics.incr("catalog.loads")
+            return self._snapshot
+        if (CATALOG_CACHE.version() != snapshot.generation and not self._reloading
+                and time.monotonic() >= self._retry_at):
+            self._reload_async()
+        return snapshot
+
+    def _load(self, generation: int, initial: bool = False) -> CatalogSnapshot:
+        started = time.perf_counter()
+        source = self.source
+        if source == "db":
+            try:
+                locations, services = load_from_db()
+                if not locations:
+                    raise ValueError("bảng organizations rỗng")
+            except Exception as e:
+                if not initial:
+                    raise
+                # khởi động mà DB lỗi → vẫn chạy được với catalog tĩnh
+                metrics.incr("catalog.fallback")
+                log.warning("catalog: không nạp được từ DB (%s), dùng dữ liệu tĩnh", e)
+                source = "static"
+        if source != "db":
+            locations, services = load_static()
+        load_ms = round((time.perf_counter() - started) * 1000, 1)
+        version = catalog_version(locations, services)
+        current = self._snapshot
+        if current is not None and current.version == version:
+            metrics.incr("catalog.unchanged")
+            return replace(current, generation=generation, loaded_at=time.time(), load_ms=load_ms)
+        return build_snapshot(locations, services, source, generation=generation, load_ms=load_ms, version=version)
+
+    def reload(self, generation: Optional[int] = None) -> CatalogSnapshot:
+        """Nạp + dựng snapshot mới rồi hoán đổi (đồng bộ; cần app context nếu nguồn là DB)."""
+        snapshot = self._load(CATALOG_CACHE.version() if generation is None else generation)
+        self._snapshot = snapshot  # gán 1 tham chiếu: request thấy trọn snapshot cũ hoặc trọn snapshot mới
+        metrics.incr("catalog.swaps")
+        return snapshot
+
+    def _reload_async(self):
+        if not has_app_context():
+            return
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+        app = current_app._get_current_object()
+        generation = CATALOG_CACHE.version()
+        threading.Thread(target=self._run_reload, args=(app, generation), name="catalog-reload", daemon=True).start()
+
+    def _run_reload(self, app, generation: int):
+        try:
+            with app.app_context():
+                self.reload(generation)
+        except Exception as e:
+            metrics.incr("catalog.reload_error")
+            self._retry_at = time.monotonic() + RETRY_S
+            log.warning("catalog: nạp lại lỗi (%s), giữ snapshot version %s", e,
+                        self._snapshot.version if self._snapshot else None)
+        finally:
+            self._reloading = False
+
+    def stats(self) -> dict:
+        s = self._snapshot
+        return {
+            "version": s.version if s else None,
+            "generation": s.generation if s else None,
+            "source": s.source if s else None,
+            "spas": len(s.locations) if s else 0,
+            "services": len(s.index.services) if s else 0,
+            "load_ms": s.load_ms if s else 0.0,
+            "build_ms": s.build_ms if s else 0.0,
+            "loads": metrics.get("catalog.loads"),
+            "swaps": metrics.get("catalog.swaps"),
+            "unchanged": metrics.get("catalog.unchanged"),
+            "fallback": metrics.get("catalog.fallback"),
+            "reload_error": metrics.get("catalog.reload_error"),
+            "cache": CATALOG_CACHE.stats(),
+        }
+
+
+_STORE = CatalogStore()
+metrics.register_view(NAMESPACE, _STORE.stats)
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Snapshot hiện tại (lần đầu: nạp đồng bộ; sau đó chỉ đọc bộ nhớ, nạp lại ở thread nền)."""
+    return _STORE.current()
+
+
+def get_catalog_store() -> CatalogStore:
+    return _STORE
+
+
+def request_reload() -> int:
+    """Báo mọi worker nạp lại catalog (sau khi sửa spa / dịch vụ trong DB)."""
+    return CATALOG_CACHE.invalidate()
+
+
+__all__ = ["CATALOG_CACHE", "CatalogSnapshot", "CatalogStore", "build_city_keywords", "build_snapshot", "get_catalog",
+           "get_catalog_store",
+           "load_from_db", "load_static", "register_derived", "request_reload"]
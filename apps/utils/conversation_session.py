@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Trạng thái hội thoại của 1 user trong 1 turn: nạp 1 lần, sửa trong bộ nhớ, ghi 1 lần.
+
+- `ConversationSession.load(user_id)`: MGET các khoá per-user (SESSION_KEYS) + LRANGE đuôi
+  history trong 1 pipeline (1 round trip Redis)
+- Handler đọc/ghi qua `get` / `set` / `delete` (không round trip)
+- `flush()`: SET (TTL riêng từng khoá) / DEL các khoá đã đổi + RPUSH history mới, 1 pipeline
+
+Sau lần flush cuối turn, thay đổi muộn (vd. reply SSE xong mới lưu history) được ghi ngay.
+Nạp với `lease` (apps.utils.turn_lock) → flush chỉ ghi khi lease còn là lease mới nhất.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from apps.utils import metrics
+from apps.utils.conversation_store import TTL as HISTORY_TTL, ConversationStore, get_conversation_store
+
+# tên: (mẫu khoá cache, TTL giây)
+SESSION_KEYS: Dict[str, Tuple[str, int]] = {
+    "booking": ("booking:{user_id}", 1800),
+    "last_spa_focus": ("{conversation_key}:last_spa_focus", 1800),
+    "last_context": ("{conversation_key}:last_context", 900),
+    "last_spa_list": ("{conversation_key}:last_spa_list", 1800),
+    "summary": ("{conversation_key}:summary", HISTORY_TTL),  # chỉ đọc (context_builder ghi nền)
+}
+
+_MISSING = object()
+
+
+def conversation_key_for(user_id) -> str:
+    return f"chat:{user_id}"
+
+
+class ConversationSession:
+    def __init__(self, user_id, store: ConversationStore, history, values: Dict[str, Any], lease=None):
+        self.user_id = user_id
+        self.lease = lease
+        self.conversation_key = conversation_key_for(user_id)
+        self.store = store
+        self.history = history
+        self.history.session = self
+        self._values = values
+        self._dirty = set()
+        self._flushed = False
+
+    @classmethod
+    def load(cls, user_id, store: Optional[ConversationStore] = None, lease=None) -> "ConversationSession":
+        store = store or get_conversation_store()
+        names = list(SESSION_KEYS)
+        keys = [cls._cache_key(name, user_id) for name in names]
+        history, values = store.load_turn(conversation_key_for(user_id), keys)
+        metrics.incr("session.load")
+        return cls(user_id, store, history, dict(zip(names, values)), lease=lease)
+
+    @staticmethod
+    def _cache_key(name: str, user_id) -> str:
+        pattern, _ttl = SESSION_KEYS[name]
+        return pattern.format(user_id=user_id, conversation_key=conversation_key_for(user_id))
+
+    def owns(self, conversation_key: str) -> bool:
+        return conversation_key == self.conversation_key
+
+    # ---------- Đọc / ghi trong bộ nhớ ----------
+    def get(self, name: str, default: Any = None) -> Any:
+        value = self._values.get(name, _MISSING)
+        return default if value is _MISSING or value is None else value
+
+    def set(self, name: str, value: Any):
+        self._values[name] = value
+        self._dirty.add(name)
+        self._after_change()
+
+    def delete(self, name: str):
+        self.set(name, None)
+
+    def history_changed(self):
+        """Gọi sau khi append vào `history` (mục mới được ghi ở flush)."""
+        self._after_change()
+
+    def _after_change(self):
+        if self._flushed:
+            self.flush()
+
+    # ---------- Ghi ----------
+    def flush(self) -> bool:
+        """Ghi các khoá đã đổi + history mới trong 1 round trip.
+        False nếu không có gì để ghi, hoặc lease đã bị turn khác thay thế (bỏ lượt ghi)."""
+        self._flushed = True
+        entries = self.history.pending()
+        if not self._dirty and not entries:
+            return False
+        sets, deletes = {}, []
+        for name in sorted(self._dirty):
+            key = self._cache_key(name, self.user_id)
+            value = self._values.get(name)
+            if value is None:
+                deletes.append(key)
+            else:
+                sets[key] = (value, SESSION_KEYS[name][1])
+        if not self.store.flush_turn(self.conversation_key, entries, sets, deletes, lease=self.lease):
+            return False
+        self.history.mark_saved()
+        self._dirty.clear()
+        metrics.incr("session.flush")
+        return True
+
+
+__all__ = ["ConversationSession", "SESSION_KEYS", "conversation_key_for"]
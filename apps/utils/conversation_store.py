@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Lưu lịch sử hội thoại dạng append-only (Redis list) thay vì ghi đè cả blob mỗi turn.
+
+- Đọc: LRANGE phần đuôi (HISTORY_WINDOW mục gần nhất) → turn chỉ đọc đúng cửa sổ cần dùng
+- Ghi: RPUSH các mục mới của turn + LTRIM giữ HISTORY_MAX_ENTRIES + EXPIRE, 1 pipeline
+- Mỗi mục là 1 khung gọn của apps.utils.codec (HistoryEntry); mục JSON {"role", "content"} cũ vẫn đọc được
+- Giá trị khoá per-user qua `CompactSerializer` (bản nháp đặt lịch → khung gọn, còn lại như cũ)
+
+Cache không phải Redis (SimpleCache khi dev) → `MemoryConversationStore` trong process.
+Khoá cũ (cả list pickle qua `cache.set`) được chuyển sang list ở lần đọc đầu tiên; mỗi worker
+chỉ hỏi khoá cũ 1 lần / hội thoại (khoá cũ không còn được ghi nữa).
+
+`flush_turn(..., lease=)`: ghi có fencing token (apps.utils.turn_lock) — lease đã bị turn khác
+thay thế thì không ghi gì (Redis: kiểm tra + ghi trong 1 script, vẫn 1 round trip).
+
+Biến môi trường:
+- HISTORY_WINDOW       : số mục đọc mỗi turn (mặc định 20)
+- HISTORY_MAX_ENTRIES  : số mục tối đa giữ lại cho 1 hội thoại (mặc định 200)
+- HISTORY_TTL          : TTL, giây (mặc định 1 ngày)
+"""
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from apps.extensions import cache
+from apps.utils import metrics
+from apps.utils.codec import CompactSerializer, decode_entry, encode_entry
+
+WINDOW = int(os.getenv("HISTORY_WINDOW", 20))
+MAX_ENTRIES = int(os.getenv("HISTORY_MAX_ENTRIES", 200))
+TTL = int(os.getenv("HISTORY_TTL", 86400))
+LIST_SUFFIX = ":log"
+
+log = logging.getLogger(__name__)
+
+
+class ConversationWindow(list):
+    """Đuôi hội thoại đã nạp; các mục append thêm trong turn là `pending()` (chưa ghi)."""
+
+    def __init__(self, key: str, entries: Iterable[dict] = ()):
+        super().__init__(entries)
+        self.key = key
+        self.session = None  # ConversationSession sở hữu window (nếu có)
+        self._saved = len(self)
+
+    def pending(self) -> List[dict]:
+        return self[self._saved:]
+
+    def mark_saved(self):
+        self._saved = len(self)
+
+
+class ConversationStore(ABC):
+    def __init__(self, window: int = WINDOW, max_entries: int = MAX_ENTRIES, ttl: int = TTL):
+        self.window_size = window
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._checked = set()  # hội thoại đã kiểm tra khoá cũ trong worker này
+
+    # ---------- API chung ----------
+    def window(self, key: str, size: Optional[int] = None) -> ConversationWindow:
+        """`size` mục gần nhất (mặc định HISTORY_WINDOW)."""
+        return self._make_window(key, self._tail(key, size or self.window_size), size)
+
+    def load_turn(self, key: str, kv_keys: List[str], size: Optional[int] = None) -> Tuple[ConversationWindow, List[Any]]:
+        """Window + giá trị các khoá cache `kv_keys` (Redis: 1 round trip)."""
+        values = cache.get_many(*kv_keys) if kv_keys else []
+        return self.window(key, size), list(values)
+
+    def flush_turn(self, key: str, entries: List[dict], sets: Dict[str, Tuple[Any, int]], deletes: List[str],
+                   lease=None) -> bool:
+        """Ghi các mục history mới + set (kèm TTL) / xoá khoá cache (Redis: 1 round trip).
+        False nếu `lease` không còn là lease mới nhất (không ghi gì)."""
+        if lease is not None and not lease.is_current():
+            return _fenced_out(key)
+        for k, (value, ttl) in sets.items():
+            cache.set(k, value, timeout=ttl)
+        if deletes:
+            cache.delete_many(*deletes)
+        self.append(key, *entries)
+        return True
+
+    def _make_window(self, key: str, entries: List[dict], size: Optional[int] = None) -> ConversationWindow:
+        if not entries:
+            entries = self._migrate_legacy(key)[-(size or self.window_size):]
+        return ConversationWindow(key, entries)
+
+    def all(self, key: str) -> List[dict]:
+        """Toàn bộ phần còn giữ (tối đa HISTORY_MAX_ENTRIES) — cho GET /messages/v2/<user_id>."""
+        return self._tail(key, self.max_entries) or self._migrate_legacy(key)
+
+    def save(self, key: str, history: list):
+        """Ghi các mục mới của turn. List thường (không phải window) → ghi đè như cách cũ."""
+        if isinstance(history, ConversationWindow) and history.key == key:
+            new = history.pending()
+            if new:
+                self.append(key, *new)
+            history.mark_saved()
+            return
+        self.clear(key)
+        self.append(key, *history[-self.max_entries:])
+
+    def append(self, key: str, *entries: dict):
+        if entries:
+            self._push(key, list(entries))
+            metrics.incr("history.append", len(entries))
+
+    def clear(self, key: str):
+        self._delete(key)
+        try:
+            cache.delete(key)  # khoá blob kiểu cũ (nếu còn)
+        except Exception:
+            pass
+
+    def _migrate_legacy(self, key: str) -> List[dict]:
+        # history rỗng thì mỗi turn đều tới đây → chỉ GET khoá cũ lần đầu (Redis lỗi → thử lại lần sau)
+        if key in self._checked:
+            return []
+        try:
+            legacy = cache.get(key)
+        except Exception:
+            return []
+        self._checked.add(key)
+        if not isinstance(legacy, list) or not legacy:
+            return []
+        legacy = legacy[-self.max_entries:]
+        self._push(key, legacy)
+        try:
+            cache.delete(key)
+        except Exception:
+            pass
+        metrics.incr("history.migrated")
+        return legacy
+
+    # ---------- backend ----------
+    @abstractmethod
+    def _tail(self, key: str, n: int) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def _push(self, key: str, entries: List[dict]):
+        ...
+
+    @abstractmethod
+    def _delete(self, key: str):
+        ...
+
+
+class RedisConversationStore(ConversationStore):
+    """Redis list qua client của flask-caching (cùng key_prefix)."""
+
+    def __init__(self, backend, **kwargs):
+        super().__init__(**kwargs)
+        self._backend = backend
+        self._write = backend._write_client
+        self._read = getattr(backend, "_read_client", None) or self._write
+        self._serializer = CompactSerializer(backend.serializer)
+        self._fenced = self._write.register_script(_FENCED_FLUSH_LUA)
+
+    def _prefix(self) -> str:
+        return self._backend._get_prefix() or ""
+
+    def _list_key(self, key: str) -> str:
+        return f"{self._prefix()}{key}{LIST_SUFFIX}"
+
+    def _tail(self, key: str, n: int) -> List[dict]:
+        raw = self._read.lrange(self._list_key(key), -n, -1)
+        return [decode_entry(item) for item in raw]
+
+    def _push(self, key: str, entries: List[dict]):
+        pipe = self._write.pipeline(transaction=False)
+        self._queue_push(pipe, key, entries)
+        pipe.execute()
+
+    def _queue_push(self, pipe, key: str, entries: List[dict]):
+        lk = self._list_key(key)
+        pipe.rpush(lk, *(encode_entry(e) for e in entries))
+        pipe.ltrim(lk, -self.max_entries, -1)
+        pipe.expire(lk, self.ttl)
+
+    def load_turn(self, key: str, kv_keys: List[str], size: Optional[int] = None) -> Tuple[ConversationWindow, List[Any]]:
+        prefix = self._prefix()
+        pipe = self._read.pipeline(transaction=False)
+        if kv_keys:
+            pipe.mget([prefix + k for k in kv_keys])
+        pipe.lrange(self._list_key(key), -(size or self.window_size), -1)
+        res = pipe.execute()
+        values = [self._serializer.loads(v) for v in res[0]] if kv_keys else []
+        entries = [decode_entry(item) for item in res[-1]]
+        return self._make_window(key, entries, size), values
+
+    def flush_turn(self, key: str, entries: List[dict], sets: Dict[str, Tuple[Any, int]], deletes: List[str],
+                   lease=None) -> bool:
+        prefix = self._prefix()
+        if lease is not None:
+            if hasattr(lease.lock, "fence_key"):
+                return self._fenced_flush(key, entries, sets, deletes, lease)
+            if not lease.is_current():
+                return _fenced_out(key)
+        pipe = self._write.pipeline(transaction=False)
+        for k, (value, ttl) in sets.items():
+            pipe.set(prefix + k, self._serializer.dumps(value), ex=ttl)
+        if deletes:
+            pipe.delete(*(prefix + k for k in deletes))
+        if entries:
+            self._queue_push(pipe, key, entries)
+            metrics.incr("history.append", len(entries))
+        if len(pipe):
+            pipe.execute()
+        return True
+
+    def _fenced_flush(self, key, entries, sets, deletes, lease) -> bool:
+        prefix = self._prefix()
+        keys = [lease.lock.fence_key(lease.user_id), self._list_key(key)]
+        keys += [prefix + k for k in sets] + [prefix + k for k in deletes]
+        args = [lease.token, len(sets), len(deletes), self.max_entries, self.ttl]
+        for value, ttl in sets.values():
+            args += [self._serializer.dumps(value), ttl]
+        args += [encode_entry(e) for e in entries]
+        if not int(self._fenced(keys=keys, args=args)):
+            return _fenced_out(key)
+        if entries:
+            metrics.incr("history.append", len(entries))
+        return True
+
+    def _delete(self, key: str):
+        self._write.delete(self._list_key(key))
+
+
+# KEYS = fence, list history, khoá set..., khoá xoá...
+# ARGV = token, số set, số xoá, max entries, TTL list, (giá trị, TTL) mỗi set..., các mục history...
+_FENCED_FLUSH_LUA = """
+local fence = redis.call('GET', KEYS[1])
+if fence and tonumber(fence) ~= tonumber(ARGV[1]) then
+  return 0
+end
+local n_sets, n_dels = tonumber(ARGV[2]), tonumber(ARGV[3])
+local a = 6
+for i = 1, n_sets do
+  redis.call('SET', KEYS[2 + i], ARGV[a], 'EX', ARGV[a + 1])
+  a = a + 2
+end
+for i = 1, n_dels do
+  redis.call('DEL', KEYS[2 + n_sets + i])
+end
+if #ARGV >= a then
+  local unpack = unpack or table.unpack
+  redis.call('RPUSH', KEYS[2], unpack(ARGV, a))
+  redis.call('LTRIM', KEYS[2], -tonumber(ARGV[4]), -1)
+  redis.call('EXPIRE', KEYS[2], ARGV[5])
+end
+return 1
+"""
+
+
+def _fenced_out(key: str) -> bool:
+    metrics.incr("turn_lock.fenced_out")
+    log.warning("bỏ lượt ghi của %s: lease đã bị turn khác thay thế", key)
+    return False
+
+
+class MemoryConversationStore(ConversationStore):
+    """Bản trong process (dev / SimpleCache): deque có giới hạn, không TTL."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._logs: Dict[str, deque] = defaultdict(lambda: deque(maxlen=self.max_entries))
+
+    def _tail(self, key: str, n: int) -> List[dict]:
+        with self._lock:
+            log = self._logs.get(key)
+            return [dict(e) for e in list(log)[-n:]] if log else []
+
+    def _push(self, key: str, entries: List[dict]):
+        with self._lock:
+            self._logs[key].extend(dict(e) for e in entries)
+
+    def _delete(self, key: str):
+        with self._lock:
+            self._logs.pop(key, None)
+
+
+_MEMORY_STORE = MemoryConversationStore()
+_STORES: Dict[int, ConversationStore] = {}
+
+
+def get_conversation_store() -> ConversationStore:
+    """Store theo backend cache của app hiện tại (Redis nếu có, ngược lại in-memory)."""
+    backend = cache.cache
+    if not hasattr(backend, "_write_client"):
+        return _MEMORY_STORE
+    store = _STORES.get(id(backend))
+    if store is None:
+        store = _STORES[id(backend)] = RedisConversationStore(backend)
+    return store
+
+
+__all__ = ["ConversationStore", "ConversationWindow", "RedisConversationStore", "MemoryConversationStore",
+           "get_conversation_store", "WINDOW", "MAX_ENTRIES"]
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Cấp id lịch hẹn duy nhất giữa các thread / worker gunicorn / node.
+
+Trước đây `APPT-{timestamp giây}` → 2 lượt đặt trong cùng 1 giây trùng id.
+
+- `SnowflakeIdAllocator` (mặc định): 41 bit ms (tính từ EPOCH_MS) | 10 bit worker | 12 bit sequence,
+  tối đa 4096 id / ms / worker, không round trip nào khi cấp id
+- `RedisBlockIdAllocator`: INCRBY thuê 1 khối id (ID_BLOCK_SIZE) rồi cấp dần trong process,
+  1 round trip / khối; id tăng dần toàn cục
+
+Worker id (snowflake): APPT_WORKER_ID nếu có; không thì INCR `id_alloc:worker_seq` trên Redis
+(mod 1024); cache không phải Redis → pid % 1024 (dev, 1 máy).
+Tạo lười theo pid → sau khi fork (gunicorn --preload) mỗi worker có worker id riêng.
+
+Biến môi trường: APPT_ID_ALLOCATOR=snowflake|redis_block, APPT_WORKER_ID, ID_BLOCK_SIZE.
+"""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from apps.extensions import cache
+from apps.utils import metrics
+
+EPOCH_MS = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", 1000))
+WORKER_SEQ_KEY = "id_alloc:worker_seq"
+BLOCK_KEY = "id_alloc:appointments"
+
+_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def to_base36(n: int) -> str:
+    out = []
+    while True:
+        n, r = divmod(n, 36)
+        out.append(_ALPHABET[r])
+        if not n:
+            return "".join(reversed(out))
+
+
+class IdAllocator(ABC):
+    prefix = "APPT-"
+
+    @abstractmethod
+    def next_int(self) -> int:
+        ...
+
+    def next_id(self) -> str:
+        """Id dạng chuỗi cho người dùng đọc (vd. APPT-1Q2W3E4R5T)."""
+        return f"{self.prefix}{to_base36(self.next_int())}"
+
+
+class SnowflakeIdAllocator(IdAllocator):
+    def __init__(self, worker_id: int, clock=None):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id phải trong [0, {MAX_WORKER_ID}]")
+        self.worker_id = worker_id
+        self._clock = clock or (lambda: int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._seq = 0
+
+    def next_int(self) -> int:
+        with self._lock:
+            now = self._clock()
+            if now < self._last_ms:
+                # đồng hồ lùi (NTP chỉnh) → giữ mốc cũ, không bao giờ cấp lại id đã cấp
+                metrics.incr("id_alloc.clock_backwards")
+                now = self._last_ms
+            if now == self._last_ms:
+                self._seq = (self._seq + 1) & MAX_SEQUENCE
+                if self._seq == 0:
+                    # hết 4096 id trong ms này → chờ ms kế tiếp
+                    metrics.incr("id_alloc.sequence_wait")
+                    while now <= self._last_ms:
+                        now = self._clock()
+            else:
+                self._seq = 0
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._seq
+
+
+class RedisBlockIdAllocator(IdAllocator):
+    """INCRBY thuê khối [hi - block + 1, hi]; cấp dần trong process."""
+
+    def __init__(self, incrby, block_size: int = BLOCK_SIZE):
+        self._incrby = incrby  # callable(amount) -> giá trị mới của bộ đếm
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = -1
+
+    def next_int(self) -> int:
+        with self._lock:
+            if self._next > self._end:
+                hi = int(self._incrby(self.block_size))
+                self._next, self._end = hi - self.block_size + 1, hi
+                metrics.incr("id_alloc.block_lease")
+            value = self._next
+            self._next += 1
+            return value
+
+
+def _redis_backend():
+    backend = cache.cache
+    return backend if hasattr(backend, "_write_client") else None
+
+
+def resolve_worker_id() -> int:
+    env = os.getenv("APPT_WORKER_ID")
+    if env not in (None, ""):
+        return int(env) & MAX_WORKER_ID
+    backend = _redis_backend()
+    if backend is not None:
+        try:
+            seq = backend._write_client.incr(f"{backend._get_prefix() or ''}{WORKER_SEQ_KEY}")
+            return int(seq) & MAX_WORKER_ID
+        except Exception:
+            pass
+    return os.getpid() & MAX_WORKER_ID
+
+
+def build_id_allocator(kind: Optional[str] = None) -> IdAllocator:
+    kind = (kind or os.getenv("APPT_ID_ALLOCATOR", "snowflake")).lower()
+    if kind == "redis_block":
+        backend = _redis_backend()
+        if backend is None:
+            raise RuntimeError("APPT_ID_ALLOCATOR=redis_block cần CACHE_TYPE=RedisCache")
+        key = f"{backend._get_prefix() or ''}{BLOCK_KEY}"
+        return RedisBlockIdAllocator(lambda n: backend._write_client.incrby(key, n))
+    return SnowflakeIdAllocator(resolve_worker_id())
+
+
+_LOCK = threading.Lock()
+_ALLOCATOR: Optional[IdAllocator] = None
+_ALLOCATOR_PID: Optional[int] = None
+
+
+def get_id_allocator() -> IdAllocator:
+    """Allocator của worker hiện tại (tạo lại sau fork)."""
+    global _ALLOCATOR, _ALLOCATOR_PID
+    pid = os.getpid()
+    if _ALLOCATOR is None or _ALLOCATOR_PID != pid:
+        with _LOCK:
+            if _ALLOCATOR is None or _ALLOCATOR_PID != pid:
+                _ALLOCATOR = build_id_allocator()
+                _ALLOCATOR_PID = pid
+    return _ALLOCATOR
+
+
+def reset_id_allocator():
+    global _ALLOCATOR
+    with _LOCK:
+        _ALLOCATOR = None
+
+
+__all__ = ["IdAllocator", "SnowflakeIdAllocator", "RedisBlockIdAllocator", "build_id_allocator",
+           "get_id_allocator", "reset_id_allocator", "resolve_worker_id", "to_base36"]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Bộ đếm metrics trong process (mỗi worker 1 bộ), đọc qua GET /api/metrics.
+
+Tên metric dạng "nhóm.tên" (vd. "skin_cache.l1_hit"); `snapshot()` gom theo nhóm.
+Module nào cần số liệu dẫn xuất (tỉ lệ hit, ...) thì `register_view(nhóm, hàm)`.
+"""
+import threading
+from collections import defaultdict
+from typing import Callable, Dict
+
+_LOCK = threading.Lock()
+_COUNTERS: Dict[str, int] = defaultdict(int)
+_VIEWS: Dict[str, Callable[[], dict]] = {}
+
+
+def incr(name: str, n: int = 1):
+    with _LOCK:
+        _COUNTERS[name] += n
+
+
+def get(name: str) -> int:
+    return _COUNTERS.get(name, 0)
+
+
+def ratio(part: str, *others: str) -> float:
+    """part / (part + others) — vd. ratio("x.hit", "x.miss")."""
+    num = get(part)
+    total = num + sum(get(o) for o in others)
+    return round(num / total, 4) if total else 0.0
+
+
+def register_view(group: str, fn: Callable[[], dict]):
+    """Thay phần `group` trong snapshot bằng kết quả fn() (vd. có thêm hit_ratio)."""
+    _VIEWS[group] = fn
+
+
+def snapshot() -> Dict[str, dict]:
+    with _LOCK:
+        items = list(_COUNTERS.items())
+    grouped: Dict[str, dict] = {}
+    for name, value in sorted(items):
+        group, _, key = name.partition(".")
+        grouped.setdefault(group, {})[key or group] = value
+    for group, fn in _VIEWS.items():
+        grouped[group] = fn()
+    return grouped
+
+
+def reset():
+    with _LOCK:
+        _COUNTERS.clear()
+
+
+__all__ = ["incr", "get", "ratio", "register_view", "snapshot", "reset"]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Server-Sent Events cho các endpoint chat ở chế độ stream.
+
+Giao thức (mỗi event là 1 JSON):
+- event `delta`: {"text": "..."}   — từng đoạn token khi GPT đang sinh câu trả lời
+- event `done` : {"status", "message", "context"} — câu trả lời đầy đủ, cùng dạng với json_response
+
+Câu trả lời cố định (danh sách spa, hỏi đặt lịch...) chỉ gửi đúng 1 event `done`.
+"""
+import json
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from flask import Response, stream_with_context
+
+
+class StreamedReply:
+    """Câu trả lời dạng stream: các đoạn text + callback nhận full text khi stream xong."""
+
+    def __init__(self, chunks: Iterable[str], on_complete: Optional[Callable[[str], None]] = None):
+        self.chunks = chunks
+        self.on_complete = on_complete
+        self.streamed = True
+        self._on_close: List[Callable[[], None]] = []
+
+    @classmethod
+    def single(cls, text: str) -> "StreamedReply":
+        reply = cls([text])
+        reply.streamed = False
+        return reply
+
+    def add_close_callback(self, fn: Callable[[], None]):
+        """Gọi khi response đóng, kể cả lúc client ngắt trước khi stream bắt đầu (events() chưa chạy)."""
+        self._on_close.append(fn)
+
+    def close(self):
+        callbacks, self._on_close = self._on_close, []
+        for fn in callbacks:
+            fn()
+
+    def events(self) -> Iterator[str]:
+        parts = []
+        try:
+            for chunk in self.chunks:
+                if not chunk:
+                    continue
+                parts.append(chunk)
+                if self.streamed:
+                    yield sse_event("delta", {"text": chunk})
+        finally:
+            text = "".join(parts)
+            if self.on_complete is not None:
+                self.on_complete(text)
+        yield sse_event("done", {"status": 200, "message": None, "context": text})
+
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_response(result) -> Response:
+    """Bọc kết quả controller (StreamedReply hoặc tuple json_response) thành text/event-stream."""
+    status = 200
+    if isinstance(result, StreamedReply):
+        events = result.events()
+    else:
+        body, status = result if isinstance(result, tuple) else (result, 200)
+        events = iter([sse_event("done", body if isinstance(body, dict) else {"status": status, "context": body})])
+    response = Response(
+        stream_with_context(events),
+        status=status,  # 429 (turn trước chưa xong)... giữ đúng mã HTTP, không gói vào 200
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    if isinstance(result, StreamedReply):
+        # WSGI server luôn gọi close() của response → nhả khoá turn dù generator chưa từng chạy
+        response.call_on_close(result.close)
+    return response
+
+
+__all__ = ["StreamedReply", "sse_event", "sse_response"]
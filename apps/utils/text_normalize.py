@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Bỏ dấu tiếng Việt (fold) dùng chung cho toàn bộ app.
+
+Trước đây mỗi module (TrainingVector, intents, ParseTimeText, ConvertMessageUtils)
+tự NFD + gọi `unicodedata.name()` cho từng ký tự → rất chậm khi gọi hàng chục lần/turn.
+Ở đây bảng dịch ký tự được tính sẵn 1 lần (Latin-1, Latin Extended, Vietnamese),
+ký tự lạ được tính lần đầu rồi ghi nhớ, và kết quả theo chuỗi có LRU giới hạn.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+FOLD_CACHE_SIZE = 4096
+
+# Dải ký tự Latin có dấu (bao trọn bảng chữ cái tiếng Việt)
+_PRECOMPUTED_RANGES = (
+    (0x00C0, 0x0250),  # Latin-1 Supplement + Latin Extended-A/B
+    (0x0300, 0x0370),  # Combining diacritical marks (chuỗi đã ở dạng NFD)
+    (0x1E00, 0x1F00),  # Latin Extended Additional (ạ, ả, ấ, ầ, ẩ, ẫ, ậ, ...)
+)
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _fold_char(ch: str) -> str:
+    """Fold 1 ký tự (đã casefold): NFD, bỏ dấu Mn, 'LATIN ... LETTER X WITH ...' -> x, đ -> d."""
+    out = []
+    for c in unicodedata.normalize("NFD", ch):
+        if unicodedata.category(c) == "Mn":
+            continue
+        if c.isascii():
+            out.append(c)
+            continue
+        name = unicodedata.name(c, "")
+        if name.startswith("LATIN") and " LETTER " in name and " WITH " in name:
+            base = name.split(" LETTER ", 1)[1].split(" WITH ", 1)[0]
+            letter = next((b.lower() for b in base if b.isalpha()), None)
+            if letter:
+                out.append(letter)
+                continue
+        if c in ("đ", "Đ"):
+            out.append("d")
+            continue
+        out.append(c)
+    return "".join(out)
+
+
+class _FoldTable(dict):
+    """Bảng cho `str.translate`: ký tự chưa có thì tính 1 lần rồi lưu lại."""
+
+    def __missing__(self, codepoint):
+        folded = _fold_char(chr(codepoint))
+        self[codepoint] = folded
+        return folded
+
+
+def _build_table() -> _FoldTable:
+    table = _FoldTable()
+    for start, end in _PRECOMPUTED_RANGES:
+        for cp in range(start, end):
+            table[cp] = _fold_char(chr(cp))
+    return table
+
+
+_FOLD_TABLE = _build_table()
+
+
+def _translate(s: str) -> str:
+    if s.isascii():
+        return s
+    return s.translate(_FOLD_TABLE)
+
+
+@lru_cache(maxsize=FOLD_CACHE_SIZE)
+def fold_text(s: str) -> str:
+    """
+    Chuẩn hoá chuỗi để so khớp: casefold, bỏ dấu tiếng Việt, đ -> d, gộp khoảng trắng.
+    "Gội đầu Dưỡng sinh" -> "goi dau duong sinh"
+    """
+    s = (s or "").casefold().strip()
+    s = _translate(s)
+    return _WS_RE.sub(" ", s)
+
+
+def fold_cache_info():
+    """Thống kê LRU (hits/misses/currsize) — tiện cho benchmark/giám sát."""
+    return fold_text.cache_info()
+
+
+__all__ = ["fold_text", "fold_cache_info", "FOLD_CACHE_SIZE"]
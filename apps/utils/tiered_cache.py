@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Cache 2 tầng cho dữ liệu tĩnh / đọc nhiều (catalog dẫn xuất, kết quả LLM lặp lại).
+
+- L1: LRU trong process, có giới hạn số mục + TTL từng mục → không round trip mạng
+- L2: `apps.extensions.cache` (Redis dùng chung giữa các worker), TTL riêng
+- Mỗi namespace có 1 version (Redis: khoá `tc:ver:<namespace>`). Khoá L2 kèm version, mục L1
+  ghi version lúc nạp → `invalidate(namespace)` = INCR version: mục cũ ở mọi worker thành rác
+  (L2 tự hết TTL, L1 bị thay ở lần đọc sau)
+- Worker đọc lại version tối đa mỗi CACHE_VERSION_CHECK_S giây / namespace; `invalidate` còn
+  PUBLISH lên kênh `tc:invalidate` → worker đang nghe kiểm tra lại ngay ở lần đọc kế tiếp
+- Cache không phải Redis (dev) → version trong process, không pub/sub
+
+Metrics theo namespace: `<namespace>.l1_hit / l2_hit / miss`, view có hit_ratio, số mục L1, version.
+
+Biến môi trường:
+- CACHE_L1_SIZE          : số mục L1 mặc định mỗi namespace (mặc định 1024)
+- CACHE_L1_TTL           : TTL L1 mặc định, giây (mặc định 300)
+- CACHE_VERSION_CHECK_S  : chu kỳ đọc lại version, giây (mặc định 5; 0 = mỗi lần đọc)
+- CACHE_PUBSUB=0         : tắt nghe pub/sub (chỉ dựa vào chu kỳ trên)
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from apps.extensions import cache
+from apps.utils import metrics
+
+L1_SIZE = int(os.getenv("CACHE_L1_SIZE", 1024))
+L1_TTL = float(os.getenv("CACHE_L1_TTL", 300))
+VERSION_CHECK_S = float(os.getenv("CACHE_VERSION_CHECK_S", 5))
+CHANNEL = "tc:invalidate"
+_VERSION_KEY = "tc:ver:"
+
+log = logging.getLogger(__name__)
+
+
+def pubsub_enabled() -> bool:
+    return os.getenv("CACHE_PUBSUB", "1").lower() not in ("0", "false", "no")
+
+
+# ---------- Version theo namespace ----------
+class _MemoryVersions:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+
+    def get(self, namespace: str) -> int:
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace: str) -> int:
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return self._versions[namespace]
+
+
+class _RedisVersions:
+    def __init__(self, backend):
+        self._backend = backend
+        self._write = backend._write_client
+        self._read = getattr(backend, "_read_client", None) or self._write
+        self._listener: Optional[Tuple[int, threading.Thread]] = None
+
+    def _prefix(self) -> str:
+        return self._backend._get_prefix() or ""
+
+    def get(self, namespace: str) -> int:
+        self._ensure_listener()
+        return int(self._read.get(f"{self._prefix()}{_VERSION_KEY}{namespace}") or 0)
+
+    def bump(self, namespace: str) -> int:
+        pipe = self._write.pipeline(transaction=False)
+        pipe.incr(f"{self._prefix()}{_VERSION_KEY}{namespace}")
+        pipe.publish(f"{self._prefix()}{CHANNEL}", namespace)
+        return int(pipe.execute()[0])
+
+    def _ensure_listener(self):
+        # theo pid: gunicorn preload fork sau khi master đã tạo thread → worker tự tạo lại
+        if not pubsub_enabled():
+            return
+        current = self._listener
+        if current is not None and current[0] == os.getpid() and current[1].is_alive():
+            return
+        with _REGISTRY_LOCK:
+            current = self._listener
+            if current is not None and current[0] == os.getpid() and current[1].is_alive():
+                return
+            thread = threading.Thread(target=self._listen, name="tiered-cache-invalidate", daemon=True)
+            self._listener = (os.getpid(), thread)
+            thread.start()
+
+    def _listen(self):
+        channel = f"{self._prefix()}{CHANNEL}"
+        while True:
+            try:
+                pubsub = self._write.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(channel)
+                for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    data = message.get("data")
+                    _mark_stale(data.decode("utf-8") if isinstance(data, bytes) else str(data))
+            except Exception as e:  # mất kết nối → nghe lại sau 1s, chu kỳ version vẫn đảm bảo hội tụ
+                metrics.incr("tiered_cache.pubsub_error")
+                log.warning("tiered cache: mất kết nối pub/sub (%s), thử lại", e)
+                time.sleep(1.0)
+
+
+_MEMORY_VERSIONS = _MemoryVersions()
+_VERSIONS: Dict[int, _RedisVersions] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _versions():
+    """Nguồn version theo backend cache của app hiện tại (Redis nếu có, ngược lại in-process)."""
+    backend = cache.cache
+    if not hasattr(backend, "_write_client"):
+        return _MEMORY_VERSIONS
+    versions = _VERSIONS.get(id(backend))
+    if versions is None:
+        versions = _VERSIONS[id(backend)] = _RedisVersions(backend)
+    return versions
+
+
+# ---------- Cache ----------
+_MISSING = object()
+
+
+class TieredCache:
+    """
+    1 namespace. Giá trị None không được cache (dùng làm "miss").
+    `hash_keys=True` → khoá L2 là sha1 của khoá (khoá dài như câu chat).
+    """
+
+    def __init__(self, namespace: str, l1_size: int = L1_SIZE, l1_ttl: float = L1_TTL,
+                 l2_ttl: Optional[int] = 86400, hash_keys: bool = False):
+        self.namespace = namespace
+        self.l1_size = l1_size
+        self.l1_ttl = l1_ttl
+        self.l2_ttl = l2_ttl
+        self.hash_keys = hash_keys
+        self._l1: "OrderedDict[str, Tuple[int, float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._checked_at = 0.0
+
+    # ---------- Version ----------
+    def version(self) -> int:
+        now = time.monotonic()
+        if now - self._checked_at >= VERSION_CHECK_S:
+            try:
+                version = _versions().get(self.namespace)
+            except Exception:
+                version = self._version  # Redis lỗi → giữ version đang biết
+            self._version, self._checked_at = version, now
+        return self._version
+
+    def invalidate(self) -> int:
+        """Bỏ mọi giá trị của namespace ở tất cả worker (tăng version)."""
+        version = _versions().bump(self.namespace)
+        with self._lock:
+            self._l1.clear()
+            self._version, self._checked_at = version, time.monotonic()
+        metrics.incr(f"{self.namespace}.invalidate")
+        return version
+
+    def _mark_stale(self):
+        self._checked_at = 0.0
+
+    # ---------- Đọc / ghi ----------
+    def _l2_key(self, key: str, version: int) -> str:
+        if self.hash_keys:
+            key = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return f"tc:{self.namespace}:{version}:{key}"
+
+    def get(self, key: str, local_only: bool = False) -> Any:
+        version = self.version()
+        value = self._l1_get(key, version)
+        if value is not _MISSING:
+            metrics.incr(f"{self.namespace}.l1_hit")
+            return value
+        if not local_only:
+            try:
+                value = cache.get(self._l2_key(key, version))
+            except Exception:
+                value = None  # Redis lỗi → coi như miss
+            if value is not None:
+                metrics.incr(f"{self.namespace}.l2_hit")
+                self._l1_put(key, version, value)
+                return value
+        metrics.incr(f"{self.namespace}.miss")
+        return None
+
+    def set(self, key: str, value: Any, local_only: bool = False):
+        if value is None:
+            return
+        version = self.version()
+        self._l1_put(key, version, value)
+        if not local_only:
+            try:
+                cache.set(self._l2_key(key, version), value, timeout=self.l2_ttl)
+            except Exception:
+                pass
+
+    def get_or_build(self, key: str, build: Callable[[], Any], local_only: bool = False) -> Any:
+        """Giá trị đã cache, hoặc build() rồi ghi cả 2 tầng (`local_only` → chỉ L1, vd. object không pickle)."""
+        value = self.get(key, local_only=local_only)
+        if value is None:
+            value = build()
+            self.set(key, value, local_only=local_only)
+        return value
+
+    def _l1_get(self, key: str, version: int) -> Any:
+        with self._lock:
+            item = self._l1.get(key)
+            if item is None:
+                return _MISSING
+            item_version, expires_at, value = item
+            if item_version != version or expires_at <= time.monotonic():
+                del self._l1[key]
+                return _MISSING
+            self._l1.move_to_end(key)
+            return value
+
+    def _l1_put(self, key: str, version: int, value: Any):
+        with self._lock:
+            self._l1[key] = (version, time.monotonic() + self.l1_ttl, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def clear_local(self):
+        with self._lock:
+            self._l1.clear()
+
+    def stats(self) -> dict:
+        l1, l2, miss = (metrics.get(f"{self.namespace}.{k}") for k in ("l1_hit", "l2_hit", "miss"))
+        total = l1 + l2 + miss
+        return {
+            "l1_hit": l1,
+            "l2_hit": l2,
+            "miss": miss,
+            "hit_ratio": round((l1 + l2) / total, 4) if total else 0.0,
+            "l1_hit_ratio": round(l1 / total, 4) if total else 0.0,
+            "l1_size": len(self._l1),
+            "version": self._version,
+            "invalidate": metrics.get(f"{self.namespace}.invalidate"),
+        }
+
+
+_NAMESPACES: Dict[str, TieredCache] = {}
+
+
+def _mark_stale(namespace: str):
+    tc = _NAMESPACES.get(namespace)
+    if tc is not None:
+        tc._mark_stale()
+
+
+def register(tc: TieredCache) -> TieredCache:
+    """Đăng ký cache (lớp con của TieredCache) để nhận pub/sub + view metrics cùng tên namespace."""
+    with _REGISTRY_LOCK:
+        _NAMESPACES[tc.namespace] = tc
+    metrics.register_view(tc.namespace, tc.stats)
+    return tc
+
+
+def tiered_cache(namespace: str, **kwargs) -> TieredCache:
+    """Cache của 1 namespace (tạo 1 lần / process)."""
+    tc = _NAMESPACES.get(namespace)
+    return tc if tc is not None else register(TieredCache(namespace, **kwargs))
+
+
+def invalidate(namespace: str) -> int:
+    return tiered_cache(namespace).invalidate()
+
+
+__all__ = ["TieredCache", "tiered_cache", "register", "invalidate", "pubsub_enabled", "CHANNEL"]
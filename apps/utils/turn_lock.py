@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Tuần tự hoá các turn của cùng 1 user (khác user vẫn chạy song song hoàn toàn).
+
+User gửi đúp / gateway retry → 2 worker cùng xử lý 1 hội thoại: nạp cùng trạng thái, ghi đè
+context của nhau. Mỗi turn giữ 1 lease trên khoá `turn_lock:<user_id>`:
+
+- Redis: SET NX PX (TTL = TURN_LOCK_TTL_MS) + INCR `turn_lock:<user_id>:fence` trong 1 script →
+  mỗi lease có fencing token tăng dần. Chờ bằng poll có backoff (tối đa TURN_LOCK_WAIT_MS)
+- Ghi cuối turn (ConversationStore.flush_turn) kiểm tra token ngay trong script ghi: lease đã
+  hết hạn và worker khác đã lấy khoá → lượt ghi muộn bị từ chối (metric turn_lock.fenced_out)
+- Nhả khoá: chỉ xoá nếu vẫn là chủ. Reply SSE → nhả khi stream xong (lúc history được ghi),
+  hoặc khi response đóng / reply bị thu gom mà stream chưa chạy (client ngắt trước byte đầu);
+  TTL chỉ là lưới an toàn cuối cùng
+- Cache không phải Redis → lock trong process theo user (dev / 1 worker)
+
+Metrics nhóm "turn_lock": số lượt, số lượt phải chờ, thời gian chờ (avg / p50 / p95 / max).
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from apps.extensions import cache
+from apps.utils import metrics
+
+LEASE_TTL_MS = int(os.getenv("TURN_LOCK_TTL_MS", 30000))
+WAIT_MS = int(os.getenv("TURN_LOCK_WAIT_MS", 15000))
+FENCE_TTL = 86400
+_POLL_MIN = 0.005
+_POLL_MAX = 0.05
+TURN_BUSY_MESSAGE = "Tin nhắn trước của bạn vẫn đang được xử lý, vui lòng thử lại sau giây lát."
+
+log = logging.getLogger(__name__)
+
+
+class TurnLockTimeout(Exception):
+    """Chờ quá TURN_LOCK_WAIT_MS mà turn trước của user vẫn chưa xong."""
+
+
+class Lease:
+    """1 lượt giữ khoá của 1 turn. `token` tăng dần theo từng lượt giữ của cùng user."""
+
+    def __init__(self, lock: "TurnLock", user_id, token: int, owner: str):
+        self.lock = lock
+        self.user_id = user_id
+        self.token = token
+        self.owner = owner
+        self._released = False
+        self._deferred = False
+        self._guard = threading.Lock()  # nhả từ on_complete / close / finalize: chỉ 1 lần
+
+    def is_current(self) -> bool:
+        """Token này còn là token mới nhất (chưa có turn nào khác lấy khoá sau nó)."""
+        return self.lock.current_token(self.user_id) == self.token
+
+    def release(self):
+        with self._guard:
+            if self._released:
+                return
+            self._released = True
+        self.lock.release(self)
+
+    def hold_until_complete(self, result):
+        """
+        Reply SSE: giữ khoá tới khi stream xong (history ghi ở on_complete) rồi mới nhả.
+        Generator có thể không bao giờ chạy (client ngắt trước next() đầu tiên) → nhả thêm ở
+        close của response (StreamedReply.add_close_callback) và khi reply bị thu gom.
+        """
+        on_complete = getattr(result, "on_complete", None)
+        if getattr(result, "streamed", False) and on_complete is not None:
+            def done(text, _inner=on_complete):
+                try:
+                    _inner(text)
+                finally:
+                    self.release()
+            result.on_complete = done
+            result.add_close_callback(self.release)
+            weakref.finalize(result, self.release)
+            self._deferred = True
+        return result
+
+
+class TurnLock(ABC):
+    def acquire(self, user_id, wait_ms: int = WAIT_MS) -> Lease:
+        started = time.monotonic()
+        deadline = started + wait_ms / 1000.0
+        delay = _POLL_MIN
+        contended = False
+        while True:
+            lease = self._try_acquire(user_id)
+            if lease is not None:
+                _record_wait((time.monotonic() - started) * 1000.0, contended)
+                return lease
+            contended = True
+            now = time.monotonic()
+            if now >= deadline:
+                metrics.incr("turn_lock.timeouts")
+                raise TurnLockTimeout(f"turn của user {user_id} đang được xử lý")
+            time.sleep(min(delay, deadline - now))
+            delay = min(delay * 2, _POLL_MAX)
+
+    @abstractmethod
+    def release(self, lease: Lease):
+        ...
+
+    @abstractmethod
+    def current_token(self, user_id) -> int:
+        ...
+
+    @abstractmethod
+    def _try_acquire(self, user_id) -> Optional[Lease]:
+        ...
+
+
+# KEYS = khoá lease, khoá fence; ARGV = owner, TTL ms, TTL fence (giây) → token, 0 nếu đang bị giữ
+_ACQUIRE_LUA = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+  local token = redis.call('INCR', KEYS[2])
+  redis.call('EXPIRE', KEYS[2], ARGV[3])
+  return token
+end
+return 0
+"""
+
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisTurnLock(TurnLock):
+    def __init__(self, backend, ttl_ms: int = LEASE_TTL_MS):
+        self._backend = backend
+        self._write = backend._write_client
+        self.ttl_ms = ttl_ms
+        self._acquire = self._write.register_script(_ACQUIRE_LUA)
+        self._release = self._write.register_script(_RELEASE_LUA)
+
+    def lease_key(self, user_id) -> str:
+        return f"{self._backend._get_prefix() or ''}turn_lock:{user_id}"
+
+    def fence_key(self, user_id) -> str:
+        return f"{self.lease_key(user_id)}:fence"
+
+    def _try_acquire(self, user_id) -> Optional[Lease]:
+        owner = uuid.uuid4().hex
+        token = int(self._acquire(keys=[self.lease_key(user_id), self.fence_key(user_id)],
+                                  args=[owner, self.ttl_ms, FENCE_TTL]))
+        return Lease(self, user_id, token, owner) if token else None
+
+    def release(self, lease: Lease):
+        if not int(self._release(keys=[self.lease_key(lease.user_id)], args=[lease.owner])):
+            # TTL hết trước khi turn xong → turn sau có thể đã chạy song song
+            metrics.incr("turn_lock.expired")
+            log.warning("turn lock của user %s hết hạn trước khi nhả", lease.user_id)
+
+    def current_token(self, user_id) -> int:
+        return int(self._write.get(self.fence_key(user_id)) or 0)
+
+
+class _UserLock:
+    __slots__ = ("lock", "token", "__weakref__")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.token = 0
+
+
+class MemoryTurnLock(TurnLock):
+    """Bản trong process: 1 threading.Lock / user (giữ bằng weakref, user không hoạt động tự dọn)."""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._users: "weakref.WeakValueDictionary[str, _UserLock]" = weakref.WeakValueDictionary()
+        self._held: Dict[int, _UserLock] = {}  # id(lease) → khoá đang giữ (giữ sống _UserLock)
+
+    def _user(self, user_id) -> _UserLock:
+        with self._guard:
+            entry = self._users.get(str(user_id))
+            if entry is None:
+                entry = self._users[str(user_id)] = _UserLock()
+            return entry
+
+    def acquire(self, user_id, wait_ms: int = WAIT_MS) -> Lease:
+        entry = self._user(user_id)
+        started = time.monotonic()
+        contended = not entry.lock.acquire(blocking=False)
+        if contended and not entry.lock.acquire(timeout=wait_ms / 1000.0):
+            metrics.incr("turn_lock.timeouts")
+            raise TurnLockTimeout(f"turn của user {user_id} đang được xử lý")
+        _record_wait((time.monotonic() - started) * 1000.0, contended)
+        return self._lease(user_id, entry)
+
+    def _try_acquire(self, user_id) -> Optional[Lease]:
+        entry = self._user(user_id)
+        return self._lease(user_id, entry) if entry.lock.acquire(blocking=False) else None
+
+    def _lease(self, user_id, entry: _UserLock) -> Lease:
+        with self._guard:
+            entry.token += 1
+            lease = Lease(self, user_id, entry.token, "")
+            self._held[id(lease)] = entry
+        return lease
+
+    def release(self, lease: Lease):
+        with self._guard:
+            entry = self._held.pop(id(lease), None)
+        if entry is not None:
+            entry.lock.release()
+
+    def current_token(self, user_id) -> int:
+        entry = self._users.get(str(user_id))
+        return entry.token if entry is not None else 0
+
+
+# ---------- Metrics ----------
+_WAITS = deque(maxlen=2048)  # thời gian chờ gần đây (ms)
+_WAITS_LOCK = threading.Lock()
+
+
+def _record_wait(wait_ms: float, contended: bool):
+    metrics.incr("turn_lock.acquired")
+    if contended:
+        metrics.incr("turn_lock.contended")
+    with _WAITS_LOCK:
+        _WAITS.append(wait_ms)
+
+
+def turn_lock_stats() -> dict:
+    with _WAITS_LOCK:
+        waits = sorted(_WAITS)
+
+    def pct(p):
+        return round(waits[min(int(len(waits) * p), len(waits) - 1)], 2) if waits else 0.0
+
+    return {
+        "acquired": metrics.get("turn_lock.acquired"),
+        "contended": metrics.get("turn_lock.contended"),
+        "timeouts": metrics.get("turn_lock.timeouts"),
+        "expired": metrics.get("turn_lock.expired"),
+        "fenced_out": metrics.get("turn_lock.fenced_out"),
+        "wait_ms_avg": round(sum(waits) / len(waits), 2) if waits else 0.0,
+        "wait_ms_p50": pct(0.5),
+        "wait_ms_p95": pct(0.95),
+        "wait_ms_max": round(waits[-1], 2) if waits else 0.0,
+    }
+
+
+metrics.register_view("turn_lock", turn_lock_stats)
+
+
+_MEMORY_LOCK = MemoryTurnLock()
+_LOCKS: Dict[int, TurnLock] = {}
+
+
+def get_turn_lock() -> TurnLock:
+    """Lock theo backend cache của app hiện tại (Redis nếu có, ngược lại in-process)."""
+    backend = cache.cache
+    if not hasattr(backend, "_write_client"):
+        return _MEMORY_LOCK
+    lock = _LOCKS.get(id(backend))
+    if lock is None:
+        lock = _LOCKS[id(backend)] = RedisTurnLock(backend)
+    return lock
+
+
+@contextmanager
+def turn_lock(user_id, wait_ms: int = WAIT_MS):
+    """
+    with turn_lock(user_id) as lease: ...  — nhả khi ra khỏi khối, trừ khi
+    `lease.hold_until_complete(reply)` đã hoãn tới lúc stream SSE xong.
+    """
+    lease = get_turn_lock().acquire(user_id, wait_ms)
+    try:
+        yield lease
+    except BaseException:
+        lease.release()
+        raise
+    if not lease._deferred:
+        lease.release()
+
+
+__all__ = ["TURN_BUSY_MESSAGE", "TurnLock", "RedisTurnLock", "MemoryTurnLock", "Lease", "TurnLockTimeout", "get_turn_lock",
+           "turn_lock", "turn_lock_stats"]
@@ -3,7 +3,7 @@
 def try_handle_appt_lookup_dynamic(tv, client, message, user_id, conversation_key, history, ctx):
     if not tv.is_appointments_lookup_intent(message):
         return False
-    pr = tv.parse_appointment_range(message)
+    pr = tv.analyze(message).appointment_range
     if pr:
         start, end, title = pr
         tv.reply_my_appointments_in_range(user_id, start, end, title, conversation_key, history)
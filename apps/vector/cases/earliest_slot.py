@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+
+def try_handle_earliest_slot(tv, client, message, user_id, conversation_key, history, ctx):
+    # "massage sớm nhất ở quận 1" → giờ trống sớm nhất ở mọi spa có dịch vụ đó
+    if not tv.is_earliest_slot_request(message):
+        return False
+    return tv.reply_earliest_for_message(user_id, message, conversation_key, history) is not None
@@ -1,19 +1,18 @@
 # -*- coding: utf-8 -*-
-from apps.utils.spa_services import spa_services
+from apps.utils.catalog_store import get_catalog
 
 def try_handle_service_list(tv, client, message, user_id, conversation_key, history, ctx):
     if not tv.is_request_for_service_list(message):
         return False
 
-    spa_names = list(spa_services.keys())
-    spa_name = tv.detect_spa_in_message(message, spa_names)
+    spa_name = tv.analyze(message).spa_name
 
     # Ưu tiên lấy spa từ: câu nói > ctx.spa_name > last_spa_focus > last_spa_list
-    target_spa = spa_name or ctx.get("spa_name") or tv.cache.get(f"{conversation_key}:last_spa_focus")
+    target_spa = spa_name or ctx.get("spa_name") or tv.get_last_spa_focus(conversation_key)
     if target_spa:
         if ctx.get("active"):
             tv.clear_booking_context(user_id)
-        tv.reply_service_list(target_spa, spa_services, conversation_key, history)
+        tv.reply_service_list(target_spa, get_catalog().services, conversation_key, history)
         return True
 
     last_list = tv.get_last_spa_list(conversation_key)
@@ -22,7 +21,7 @@ def try_handle_service_list(tv, client, message, user_id, conversation_key, hist
         if picked:
             if ctx.get("active"):
                 tv.clear_booking_context(user_id)
-            tv.reply_service_list(picked, spa_services, conversation_key, history)
+            tv.reply_service_list(picked, get_catalog().services, conversation_key, history)
             return True
         if ctx.get("active"):
             tv.clear_booking_context(user_id)
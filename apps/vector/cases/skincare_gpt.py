@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 def try_handle_skincare_or_fallback(tv, client, message, user_id, conversation_key, history, ctx):
-    if tv.is_general_skin_question_gpt(message, client):
+    if tv.is_general_skin_question(message, client):
         tv.reply_with_gpt_history(client, history, message, user_id)
         return True
     # Fallback GPT
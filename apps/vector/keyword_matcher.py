@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+Bộ so khớp nhiều từ khoá 1 lượt (Aho-Corasick) cho các tín hiệu intent.
+
+Mỗi nhóm từ khoá (booking, spa_list, confirm, ...) được gom vào 1 automaton;
+quét câu đã bỏ dấu đúng 1 lần → tập tên nhóm xuất hiện. Các hàm `is_*`
+của TrainingVector chỉ còn là phép kiểm tra trên tập này.
+Ngữ nghĩa giữ nguyên kiểu `k in msg` (khớp chuỗi con).
+"""
+from abc import ABC, abstractmethod
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from apps.utils.text_normalize import fold_text
+
+
+def _fold_keyword(kw: str) -> str:
+    """Fold từ khoá nhưng giữ khoảng trắng ở biên ('tu ', ' gio') vì nó là 1 phần của mẫu."""
+    core = fold_text(kw)
+    if not core:
+        return ""
+    lead = " " if kw[:1].isspace() else ""
+    trail = " " if kw[-1:].isspace() else ""
+    return f"{lead}{core}{trail}"
+
+
+class _AhoCorasick(ABC):
+    """Trie + fail link dùng chung cho các automaton bên dưới."""
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+
+    def _new_node(self) -> int:
+        self._goto.append({})
+        self._fail.append(0)
+        return len(self._goto) - 1
+
+    def _insert(self, kw: str) -> int:
+        node = 0
+        for ch in kw:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = self._new_node()
+                self._goto[node][ch] = nxt
+            node = nxt
+        return node
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._merge_output(nxt, self._fail[nxt])
+
+    @abstractmethod
+    def _merge_output(self, node: int, fail_node: int):
+        ...
+
+    def _walk(self, text: str):
+        """Sinh (vị trí, node) sau mỗi ký tự — chỉ các node khác gốc."""
+        goto, fail = self._goto, self._fail
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if node:
+                yield i, node
+
+
+class KeywordAutomaton(_AhoCorasick):
+    """
+    Automaton Aho-Corasick trên nhiều nhóm từ khoá.
+    - groups: {tên_nhóm: [từ khoá, ...]}
+    - padded_groups: nhóm được so trên " " + text + " " (tương đương `k in f" {msg} "`),
+      các nhóm còn lại tương đương `k in msg`.
+    """
+
+    def __init__(self, groups: Dict[str, Iterable[str]], padded_groups: Iterable[str] = ()):
+        super().__init__()
+        self.names: Tuple[str, ...] = tuple(groups)
+        padded = set(padded_groups)
+        self._padded_mask = 0
+        for bit, name in enumerate(self.names):
+            if name in padded:
+                self._padded_mask |= 1 << bit
+
+        # _mask: nhóm luôn hợp lệ khi tới node; _edge: (độ dài, bit) của từ khoá có khoảng trắng biên
+        self._mask: List[int] = [0]
+        self._edge: List[Tuple[Tuple[int, int], ...]] = [()]
+
+        for bit, name in enumerate(self.names):
+            for kw in groups[name]:
+                self._add(_fold_keyword(kw), 1 << bit)
+        self._build_fail_links()
+
+    # ---------- Build ----------
+    def _new_node(self) -> int:
+        self._mask.append(0)
+        self._edge.append(())
+        return super()._new_node()
+
+    def _add(self, kw: str, bit: int):
+        if not kw:
+            return
+        node = self._insert(kw)
+        # Từ khoá không có khoảng trắng biên không thể "dính" khoảng trắng đệm → luôn hợp lệ
+        if bit & self._padded_mask or (kw[0] != " " and kw[-1] != " "):
+            self._mask[node] |= bit
+        else:
+            self._edge[node] += ((len(kw), bit),)
+
+    def _merge_output(self, node: int, fail_node: int):
+        self._mask[node] |= self._mask[fail_node]
+        self._edge[node] += self._edge[fail_node]
+
+    # ---------- Scan ----------
+    def scan_mask(self, folded: str) -> int:
+        """Quét " " + folded + " " đúng 1 lượt, trả về bitmask các nhóm xuất hiện."""
+        text = f" {folded} "
+        last = len(text) - 1
+        mask, edge = self._mask, self._edge
+        found = 0
+        for i, node in self._walk(text):
+            found |= mask[node]
+            for length, bit in edge[node]:
+                # nhóm thường: khớp không được chạm khoảng trắng đệm ở 2 đầu
+                if i - length + 1 >= 1 and i < last:
+                    found |= bit
+        return found
+
+    def scan(self, folded: str) -> FrozenSet[str]:
+        return self.names_of(self.scan_mask(folded))
+
+    def names_of(self, mask: int) -> FrozenSet[str]:
+        return frozenset(n for bit, n in enumerate(self.names) if mask >> bit & 1)
+
+
+def _is_word(ch: str) -> bool:
+    # tương đương \w của `re` trên str
+    return ch.isalnum() or ch == "_"
+
+
+class PhraseAutomaton(_AhoCorasick):
+    """
+    Automaton trên tập cụm từ (vd. alias spa đã bỏ dấu) → giá trị (tên spa chuẩn).
+    `longest()` tương đương chạy `re.search(rf"\\b{re.escape(p)}\\b", text)` cho từng cụm
+    rồi lấy cụm dài nhất — nhưng chỉ quét text 1 lượt.
+    """
+
+    def __init__(self, phrases: Dict[str, str]):
+        super().__init__()
+        self._out: List[Tuple[Tuple[int, str, str], ...]] = [()]
+        for phrase, value in phrases.items():
+            if phrase:
+                node = self._insert(phrase)
+                self._out[node] += ((len(phrase), phrase, value),)
+        self._build_fail_links()
+
+    def _new_node(self) -> int:
+        self._out.append(())
+        return super()._new_node()
+
+    def _merge_output(self, node: int, fail_node: int):
+        self._out[node] += self._out[fail_node]
+
+    @staticmethod
+    def _boundary(text: str, pos: int) -> bool:
+        """Có ranh giới từ (\\b) tại vị trí pos không."""
+        before = pos > 0 and _is_word(text[pos - 1])
+        after = pos < len(text) and _is_word(text[pos])
+        return before != after
+
+    def find_all(self, text: str, word_boundary: bool = True) -> List[Tuple[int, int, str, str]]:
+        """Mọi lần khớp (start, end, cụm, giá trị)."""
+        hits = []
+        for i, node in self._walk(text):
+            for length, phrase, value in self._out[node]:
+                start, end = i - length + 1, i + 1
+                if word_boundary and not (self._boundary(text, start) and self._boundary(text, end)):
+                    continue
+                hits.append((start, end, phrase, value))
+        return hits
+
+    def longest(self, text: str, word_boundary: bool = True) -> Optional[str]:
+        """Giá trị của cụm dài nhất (hoà → giữ thứ tự như `sort(reverse=True)` trước đây)."""
+        best = None
+        for _start, _end, phrase, value in self.find_all(text, word_boundary):
+            key = (len(phrase), value)
+            if best is None or key > best:
+                best = key
+        return best[1] if best else None
+
+
+# ============================
+#     TỪ KHOÁ THEO INTENT
+# ============================
+INTENT_KEYWORDS: Dict[str, List[str]] = {
+    "booking": [
+        "dat lich", "dat hen", "booking", "book", "dat ngay",
+        "muon hen", "muon dat", "hen lich", "dat lich hen",
+        "dat slot", "giu cho", "giup minh dat", "dang ky lich",
+        # coi 'đặt thêm' cũng là booking
+        "dat hen them", "dat them", "dat lich them", "them mot lich", "them lich",
+    ],
+    "additional_booking": ["dat hen them", "dat them", "dat lich them", "them mot lich", "them lich"],
+    "spa_list": ["tim spa o", "spa o", "danh sach spa", "spa gan", "spa quanh", "spa khu vuc", "spa tai"],
+    "service_list": [
+        "danh sach dich vu", "bang gia", "cac dich vu", "co gi", "gom nhung gi", "dich vu cua",
+    ],
+    "change_time": [
+        "doi gio", "doi thoi gian", "doi lich", "sua gio", "chinh gio",
+        "chuyen sang", "doi sang", "doi qua", "reschedule", "change time",
+        "doi thoi diem", "doi khung gio", "doi slot", "doi gio hen",
+    ],
+    # giờ trống sớm nhất ở bất kỳ spa nào ("massage sớm nhất ở quận 1")
+    "earliest": [
+        "som nhat", "lich gan nhat", "gio gan nhat", "slot gan nhat", "khung gio gan nhat",
+        "con trong som", "soonest", "earliest",
+    ],
+    "confirm": ["dong y", "xac nhan", "confirm", "ok", "oke", "okie"],
+    "confirm_strict": ["dong y", "xac nhan", "confirm"],
+    # skincare chung (triệu chứng | routine | hoạt chất | bước skincare)
+    "skin_term": [
+        "mun", "mun an", "mun viem", "mun dau den", "mun dau trang",
+        "tham", "nam", "tan nhang", "lo chan long", "do dau", "da kho",
+        "kich ung", "kich ung da", "viem da",
+        "skincare", "routine", "chuong trinh duong da", "duong am", "tay da chet",
+        "tay trang", "sua rua mat", "cleanser", "toner", "serum", "kem chong nang",
+        "retinol", "tre", "bha", "aha", "paha", "niacinamide", "vitamin c", "ha", "hyaluronic",
+    ],
+    "skin_ask": [
+        "lam sao", "nhu the nao", "giai phap", "nen dung", "chi minh", "tu van",
+        "cach tri", "tri nhu the nao", "co nen", "huong dan", "khac phuc", "meo",
+    ],
+    "service_list_hint": ["dich vu", "danh sach", "bang gia"],
+    # lịch hẹn
+    "appt_word": ["lich hen", "booking"],
+    "appt_owner": ["cua toi", "cua minh", "toi"],
+    "calendar": ["lich hen", "dat hen", "booking", "lich"],
+    "lookup_verb": ["xem", "kiem tra", "kiemtra", "danh sach", "liet ke"],
+    "appt_time_phrase": [
+        "hom nay", "ngay mai", "hom qua",
+        "tuan nay", "tuan sau", "tuan truoc",
+        "thang nay", "thang sau", "thang truoc",
+        "this week", "next week", "last week",
+        "this month", "next month", "last month",
+        "tu ", "toi ", "den ",  # 'từ ... đến ...'
+        "trong ", "ngay toi", "tuan toi", "thang toi", "qua", "yesterday", "today", "tomorrow",
+    ],
+    "yesno_co": [" co "],
+    "yesno_khong": [" khong"],
+    # diễn đạt thời gian (so trên câu có đệm khoảng trắng)
+    "time_hint": [
+        "sang", "trua", "chieu", "toi", "dem", "khuya",
+        "hom nay", "ngay mai", "hom qua", "tuan nay", "tuan sau", "tuan truoc",
+        "thang nay", "thang sau", "thang truoc",
+        " am", " pm",
+        " gio", " gio ", " gio.", " gio,", "g", "h", "kem", "ruoi",
+        ":",
+    ],
+}
+
+PADDED_GROUPS = ("yesno_co", "time_hint")
+
+INTENT_AUTOMATON = KeywordAutomaton(INTENT_KEYWORDS, padded_groups=PADDED_GROUPS)
+
+
+@lru_cache(maxsize=1024)
+def scan_intents(folded: str) -> FrozenSet[str]:
+    """Tập nhóm từ khoá xuất hiện trong câu đã fold (1 lượt quét, có ghi nhớ)."""
+    return INTENT_AUTOMATON.scan(folded)
+
+
+__all__ = ["KeywordAutomaton", "PhraseAutomaton", "INTENT_KEYWORDS", "INTENT_AUTOMATON", "scan_intents"]
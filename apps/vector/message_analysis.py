@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Phân tích 1 tin nhắn cho 1 turn: tính lười + ghi nhớ, dùng chung cho mọi bước routing.
+
+Trước đây cùng 1 câu bị bỏ dấu, dò spa, dò dịch vụ, parse giờ... lặp lại ở từng case/helper.
+`MessageAnalysis` chỉ tính mỗi bước khi cần lần đầu; `counters` đếm số lần thực sự tính
+(mỗi bước tối đa 1 lần/turn).
+"""
+from collections import Counter
+from functools import wraps
+from typing import Any, Dict
+
+from apps.utils.catalog_index import tokenize
+from apps.utils.catalog_store import get_catalog
+from apps.utils.text_normalize import fold_text
+from apps.vector.keyword_matcher import scan_intents
+
+
+def _step(fn):
+    """Property ghi nhớ kết quả + đếm số lần tính."""
+    name = fn.__name__
+
+    @wraps(fn)
+    def getter(self):
+        values = self._values
+        if name not in values:
+            self.counters[name] += 1
+            values[name] = fn(self)
+        return values[name]
+
+    return property(getter)
+
+
+class MessageAnalysis:
+    def __init__(self, helper, message: str):
+        self.helper = helper
+        self.message = message or ""
+        self.counters: Counter = Counter()
+        self._values: Dict[str, Any] = {}
+
+    def matches(self, message: str) -> bool:
+        return message is not None and message.strip() == self.message.strip()
+
+    # ---------- Text ----------
+    @_step
+    def folded(self) -> str:
+        return fold_text(self.message)
+
+    @_step
+    def tokens(self):
+        return tokenize(self.folded)
+
+    @_step
+    def signals(self):
+        """Tập nhóm từ khoá intent (booking, spa_list, confirm, ...)."""
+        return scan_intents(self.folded)
+
+    # ---------- Catalog ----------
+    @_step
+    def spa_name(self):
+        return self.helper.detect_spa_in_message(self.message, get_catalog().spa_names)
+
+    @_step
+    def services(self):
+        """[{'spa_name', 'service'}] các dịch vụ được nhắc tới (kể cả fuzzy)."""
+        return self.helper.find_services_in_text(self.message, get_catalog().services)
+
+    @_step
+    def exact_service(self):
+        return self.helper.find_exact_service_by_name(self.message, get_catalog().services)
+
+    @_step
+    def city(self):
+        return self.helper.detect_city(self.message)
+
+    @_step
+    def spa_suggestions(self):
+        from apps.ai.intents import suggest_spas_from_text
+        return suggest_spas_from_text(self.message, limit=5, cutoff=60)
+
+    # ---------- Time ----------
+    @_step
+    def datetime(self):
+        return self.helper.dt_parser.parse(self.message)
+
+    @_step
+    def appointment_range(self):
+        return self.helper._parse_appointment_range(self.message)
+
+    # ---------- Debug ----------
+    def stats(self) -> Dict[str, int]:
+        """{bước: số lần tính} — mỗi giá trị phải <= 1."""
+        return dict(self.counters)
+
+
+__all__ = ["MessageAnalysis"]
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 import re
-import unicodedata
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 
+from apps.utils.text_normalize import fold_text
+
 
 class ParseTimeText:
     """
@@ -67,26 +68,7 @@ class ParseTimeText:
     # ---------- Internals ----------
     @staticmethod
     def _normalize(s: str) -> str:
-        s = (s or "").casefold().strip()
-        s = unicodedata.normalize("NFD", s)
-        s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-
-        def fold_char(ch: str) -> str:
-            if ch.isascii():
-                return ch
-            name = unicodedata.name(ch, "")
-            if name.startswith("LATIN") and " LETTER " in name and " WITH " in name:
-                base = name.split(" LETTER ", 1)[1].split(" WITH ", 1)[0]
-                for c in base:
-                    if c.isalpha():
-                        return c.lower()
-            if ch in ("đ", "Đ"):
-                return "d"
-            return ch
-
-        s = "".join(fold_char(ch) for ch in s)
-        s = re.sub(r"\s+", " ", s)
-        return s
+        return fold_text(s)
 
     @staticmethod
     def _clamp_next_day_if_past(dt: datetime, now: datetime, has_explicit_date: bool) -> datetime:
@@ -4,6 +4,7 @@ from apps.vector.cases.spa_intro import try_handle_spa_intro
 from apps.vector.cases.service_list import try_handle_service_list
 from apps.vector.cases.appt_lookup_dynamic import try_handle_appt_lookup_dynamic
 from apps.vector.cases.appt_list_all import try_handle_appt_list_all
+from apps.vector.cases.earliest_slot import try_handle_earliest_slot
 from apps.vector.cases.booking import try_handle_booking
 from apps.vector.cases.service_detail import try_handle_service_detail
 from apps.vector.cases.skincare_gpt import try_handle_skincare_or_fallback
@@ -20,6 +21,8 @@ CASES_IN_ORDER = [
     try_handle_appt_lookup_dynamic,
     # 3d) Xem tất cả lịch hẹn của tôi
     try_handle_appt_list_all,
+    # 3e) Giờ trống sớm nhất của 1 dịch vụ ở mọi spa (theo khu vực / khoảng thời gian)
+    try_handle_earliest_slot,
     # 4) Booking (ưu tiên hơn service detail)
     try_handle_booking,
     # 5) Giới thiệu dịch vụ cụ thể (KHI KHÔNG có ý định đặt hẹn)
@@ -33,9 +36,12 @@ def route_message(tv, client, message, user_id, conversation_key, history):
     """
     Chạy lần lượt từng case. Case nào xử lý được thì kết thúc.
     """
+    tv.analyze(message)  # MessageAnalysis dùng chung cho mọi case của turn này
     ctx = tv.get_booking_context(user_id)
-    for case in CASES_IN_ORDER:
-        handled = case(tv, client, message, user_id, conversation_key, history, ctx)
-        if handled:
-            return True
-    return False
+    try:
+        for case in CASES_IN_ORDER:
+            if case(tv, client, message, user_id, conversation_key, history, ctx):
+                return True
+        return False
+    finally:
+        tv.commit_booking()  # bản nháp đặt lịch: ghi 1 lần / turn
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Bộ phân loại cục bộ "câu hỏi skincare chung?" (thay cho lượt gọi gpt-4o YES/NO).
+
+- Đặc trưng: vector băm n-gram ký tự (dùng chung `embed` với vector_index)
+- Mô hình: hồi quy logistic (NumPy, gradient descent full-batch, L2)
+- Dữ liệu: corpus hạt giống sinh từ từ khoá của `is_skin_question_local`
+  (INTENT_KEYWORDS) + các nhóm intent trong SYS_PROMPT + tên spa/dịch vụ trong catalog
+- Lưu: `storage/models/skin_gate-<fingerprint>.npz` (~8KB), nạp lúc khởi động;
+  chưa có file (hoặc corpus đổi) → train lại (< 1s) rồi lưu.
+- Model là cấu trúc dẫn xuất của snapshot catalog (`register_derived`): nạp lại catalog
+  (apps.utils.catalog_store) → corpus mới → fingerprint mới → model mới, dựng ở thread nạp nền.
+
+Chỉ khi độ tự tin < SKIN_LOCAL_CONFIDENCE mới hỏi LLM (xem TrainingVector.is_general_skin_question).
+"""
+import hashlib
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from apps.utils import metrics
+from apps.utils.catalog_index import CatalogIndex, get_catalog_index
+from apps.utils.catalog_store import CatalogSnapshot, get_catalog, register_derived
+from apps.vector.keyword_matcher import INTENT_KEYWORDS
+from apps.vector.vector_index import DEFAULT_DIM, embed
+
+MODEL_DIR = os.getenv("MODEL_DIR", "storage/models")
+# Ngưỡng tự tin max(p, 1-p) để quyết định cục bộ (thấp hơn → hỏi LLM)
+CONFIDENCE_THRESHOLD = float(os.getenv("SKIN_LOCAL_CONFIDENCE", 0.8))
+
+EPOCHS = 400
+LEARNING_RATE = 4.0
+L2 = 1e-4
+
+# ============================
+#      CORPUS HẠT GIỐNG
+# ============================
+_SKIN_TEMPLATES = [
+    "{t}", "bị {t} phải làm sao", "cách trị {t}", "{t} nên dùng gì", "da mình bị {t}",
+    "tư vấn giúp mình về {t}", "{t} có nên đi spa không", "làm sao hết {t}", "{t} là gì",
+]
+_SKIN_EXTRA = [
+    "chăm sóc da như thế nào", "da nhạy cảm nên dùng gì", "làm đẹp da mặt tại nhà",
+    "chống lão hóa da", "da bị lão hóa sớm", "dưỡng da ban đêm", "da mặt bị khô ráp",
+    "nên dưỡng ẩm mấy lần một ngày", "da dầu nên dùng gì", "trị mụn thế nào",
+    "routine skincare cho người mới", "thứ tự các bước skincare", "da xỉn màu phải làm sao",
+    "làm sao cho da trắng sáng", "đi spa chăm sóc da có tốt không", "bôi kem chống nắng có cần không",
+    "how to treat acne", "skincare routine for oily skin",
+]
+_OTHER_TEMPLATES = {
+    "booking": ["tôi muốn {t}", "{t} massage", "{t} chiều nay", "giúp mình {t} nhé"],
+    "spa_list": ["{t} hồ chí minh", "{t} hà nội", "{t} quận 1"],
+    "service_list": ["{t} spa", "cho xem {t}", "{t} của spa"],
+    "change_time": ["{t}", "mình muốn {t}"],
+    "confirm": ["{t}", "{t} nhé"],
+    "lookup_verb": ["{t} lịch hẹn", "{t} lịch hẹn của tôi"],
+    "appt_time_phrase": ["lịch hẹn {t}", "có lịch hẹn {t} không"],
+}
+_OTHER_EXTRA = [
+    "xin chào", "chào bạn", "hello", "hi", "cảm ơn", "tạm biệt", "1", "2", "3",
+    "16:00", "15/12/2030 14:00", "9h sáng mai", "ok", "không", "có",
+    "thời tiết hôm nay thế nào", "kết quả bóng đá", "giá vàng hôm nay", "viết code python",
+    "tôi đói quá", "mấy giờ rồi", "kể chuyện cười đi", "giá xăng bao nhiêu",
+    "thư giãn xả stress", "mệt mỏi muốn massage", "gợi ý chỗ thư giãn",
+    "spa ở đâu", "giờ mở cửa", "địa chỉ spa", "có chỗ gửi xe không",
+]
+
+
+def build_seed_corpus(catalog: Optional[CatalogIndex] = None) -> List[Tuple[str, int]]:
+    """
+    [(câu, nhãn)] — 1 = câu hỏi skincare chung, 0 = còn lại (booking, tra cứu, dịch vụ cụ thể, ngoài lề).
+    catalog: chỉ mục dùng lấy tên spa / dịch vụ (mặc định: snapshot hiện tại).
+    """
+    data: List[Tuple[str, int]] = []
+    for term in INTENT_KEYWORDS["skin_term"]:
+        data.extend((tpl.format(t=term), 1) for tpl in _SKIN_TEMPLATES)
+    for ask in INTENT_KEYWORDS["skin_ask"]:
+        data.append((f"da mụn {ask}", 1))
+    data.extend((s, 1) for s in _SKIN_EXTRA)
+
+    for group, templates in _OTHER_TEMPLATES.items():
+        for kw in INTENT_KEYWORDS[group]:
+            data.extend((tpl.format(t=kw.strip()), 0) for tpl in templates)
+    data.extend((s, 0) for s in _OTHER_EXTRA)
+
+    # tên spa / dịch vụ cụ thể → không phải câu hỏi chung
+    catalog = catalog or get_catalog_index()
+    for spa in catalog.spas:
+        data.extend([(spa.name, 0), (f"giới thiệu {spa.name}", 0), (f"{spa.name} ở đâu", 0)])
+    for name in catalog.services_by_name:
+        data.extend([(name, 0), (f"đặt lịch {name}", 0), (f"{name} giá bao nhiêu", 0)])
+    return data
+
+
+# ============================
+#          MODEL
+# ============================
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class SkinQuestionClassifier:
+    def __init__(self, weights: np.ndarray, bias: float):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.dim = self.weights.shape[0]
+
+    @classmethod
+    def train(cls, corpus: Sequence[Tuple[str, int]], dim: int = DEFAULT_DIM,
+              epochs: int = EPOCHS, lr: float = LEARNING_RATE, l2: float = L2) -> "SkinQuestionClassifier":
+        X = np.vstack([embed(text, dim) for text, _ in corpus]).astype(np.float32)
+        y = np.array([label for _, label in corpus], dtype=np.float32)
+        # cân bằng 2 lớp
+        pos = max(1.0, float(y.sum()))
+        neg = max(1.0, float(len(y) - y.sum()))
+        sample_w = np.where(y == 1, len(y) / (2 * pos), len(y) / (2 * neg)).astype(np.float32)
+        w = np.zeros(dim, dtype=np.float32)
+        b = 0.0
+        n = float(len(y))
+        for _ in range(epochs):
+            err = (_sigmoid(X @ w + b) - y) * sample_w
+            w -= lr * (X.T @ err / n + l2 * w)
+            b -= lr * float(err.sum() / n)
+        return cls(w, b)
+
+    def predict_proba(self, text: str) -> float:
+        """Xác suất câu là câu hỏi skincare chung."""
+        return float(_sigmoid(float(embed(text, self.dim) @ self.weights) + self.bias))
+
+    def decide(self, text: str, threshold: float = CONFIDENCE_THRESHOLD) -> Tuple[Optional[bool], float]:
+        """(True/False nếu đủ tự tin, None nếu cần hỏi LLM), kèm xác suất."""
+        p = self.predict_proba(text)
+        if max(p, 1.0 - p) >= threshold:
+            return p >= 0.5, p
+        return None, p
+
+    # ---------- Persist ----------
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp, weights=self.weights, bias=np.float32(self.bias))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SkinQuestionClassifier"]:
+        try:
+            with np.load(path) as data:
+                return cls(data["weights"], float(data["bias"]))
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def _fingerprint(corpus: Sequence[Tuple[str, int]], dim: int) -> str:
+    h = hashlib.sha1(f"{dim}|{EPOCHS}|{LEARNING_RATE}|{L2}".encode())
+    for text, label in corpus:
+        h.update(f"{label}|{text}\n".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def load_or_train(dim: int = DEFAULT_DIM, model_dir: str = MODEL_DIR,
+                  catalog: Optional[CatalogIndex] = None) -> SkinQuestionClassifier:
+    corpus = build_seed_corpus(catalog)
+    path = os.path.join(model_dir, f"skin_gate-{_fingerprint(corpus, dim)}.npz")
+    model = SkinQuestionClassifier.load(path)
+    if model is not None and model.dim == dim:
+        return model
+    model = SkinQuestionClassifier.train(corpus, dim)
+    try:
+        model.save(path)
+    except OSError:
+        pass
+    return model
+
+
+@register_derived("skin_classifier")
+def _skin_classifier(catalog: CatalogSnapshot) -> SkinQuestionClassifier:
+    return load_or_train(catalog=catalog.index)
+
+
+def get_skin_classifier() -> SkinQuestionClassifier:
+    """Model của snapshot catalog hiện tại (dựng 1 lần / version catalog)."""
+    return get_catalog().derived("skin_classifier")
+
+
+def gate_stats() -> dict:
+    """Số câu quyết định cục bộ / phải hỏi LLM, quy ra số lượt LLM tránh được trên 1.000 câu."""
+    local, llm = metrics.get("skin_gate.local"), metrics.get("skin_gate.llm")
+    total = local + llm
+    return {
+        "local": local,
+        "llm": llm,
+        "llm_avoided_per_1000": round(1000 * local / total, 1) if total else 0.0,
+    }
+
+
+metrics.register_view("skin_gate", gate_stats)
+
+__all__ = ["SkinQuestionClassifier", "build_seed_corpus", "load_or_train", "get_skin_classifier",
+           "gate_stats", "CONFIDENCE_THRESHOLD"]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Cache 2 tầng cho bộ lọc YES/NO "câu hỏi skincare chung" (gpt-4o).
+
+Namespace "skin_cache" của apps.utils.tiered_cache:
+- L1: LRU trong process (không round-trip mạng)
+- L2: Redis dùng chung giữa các worker (qua flask-caching `cache`), có TTL
+- `invalidate()` (vd. sau khi sửa prompt skin_gate) bỏ kết quả cũ ở mọi worker
+Khoá = câu đã bỏ dấu (fold_text) → "Trị mụn thế nào?" và "tri mun the nao?" dùng chung kết quả.
+
+Biến môi trường:
+- SKIN_CACHE_L1_SIZE   : số mục LRU (mặc định 2048)
+- SKIN_CACHE_TTL       : TTL (cả 2 tầng), giây (mặc định 7 ngày)
+- SKIN_CACHE_BYPASS=1  : bỏ qua cache (đo chi phí khi không cache)
+"""
+import os
+from typing import Optional
+
+from apps.utils import metrics
+from apps.utils.text_normalize import fold_text
+from apps.utils.tiered_cache import TieredCache, register
+
+L1_SIZE = int(os.getenv("SKIN_CACHE_L1_SIZE", 2048))
+L2_TTL = int(os.getenv("SKIN_CACHE_TTL", 7 * 86400))
+NAMESPACE = "skin_cache"
+
+
+def bypass_enabled() -> bool:
+    return os.getenv("SKIN_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+
+class SkinQuestionCache(TieredCache):
+    def __init__(self, l1_size: int = L1_SIZE, ttl: int = L2_TTL):
+        # khoá L2 băm sha1 → khoá Redis ngắn, không phụ thuộc độ dài câu
+        super().__init__(NAMESPACE, l1_size=l1_size, l1_ttl=ttl, l2_ttl=ttl, hash_keys=True)
+        self.ttl = ttl
+
+    @staticmethod
+    def key_for(message: str) -> str:
+        return fold_text(message)
+
+    def get(self, key: str, local_only: bool = False) -> Optional[bool]:
+        value = super().get(key, local_only=local_only)
+        return None if value is None else bool(value)
+
+    def set(self, key: str, value: bool, local_only: bool = False):
+        super().set(key, bool(value), local_only=local_only)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "bypass": metrics.get("skin_cache.bypass")}
+
+
+SKIN_QUESTION_CACHE = register(SkinQuestionCache())
+
+__all__ = ["SkinQuestionCache", "SKIN_QUESTION_CACHE", "bypass_enabled"]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Chạy đầu cơ (speculative) 1 lượt gọi chậm (LLM) song song với các bước routing cục bộ.
+
+- Pool luồng giới hạn SPECULATIVE_WORKERS; hết chỗ → trả None để caller gọi tuần tự.
+- Hàm chạy trong app context của request (flask-caching cần current_app).
+- Case cục bộ quyết định trước → `cancel()`: huỷ nếu chưa chạy, ngược lại bỏ qua kết quả
+  (lượt gọi vẫn chạy xong ở nền, kết quả vẫn vào cache của nó).
+
+Bật bằng SKIN_GATE_MODE=speculative (mặc định: sequential).
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from flask import current_app, has_app_context
+
+from apps.utils import metrics
+
+MAX_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", 4))
+
+_POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="speculative")
+_SLOTS = threading.BoundedSemaphore(MAX_WORKERS)
+
+
+def speculative_enabled() -> bool:
+    return os.getenv("SKIN_GATE_MODE", "sequential").lower() == "speculative"
+
+
+class Speculation:
+    def __init__(self, future: Future):
+        self.future = future
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        return self.future.result(timeout=timeout)
+
+    def cancel(self) -> str:
+        """'cancelled' nếu chưa kịp chạy, 'ignored' nếu đang/đã chạy."""
+        if self.future.cancel():
+            _SLOTS.release()  # run() sẽ không bao giờ chạy để tự trả slot
+            metrics.incr("speculative.cancelled")
+            return "cancelled"
+        metrics.incr("speculative.ignored")
+        return "ignored"
+
+
+def submit(fn: Callable, *args, **kwargs) -> Optional[Speculation]:
+    if not _SLOTS.acquire(blocking=False):
+        metrics.incr("speculative.saturated")
+        return None
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def run():
+        try:
+            if app is None:
+                return fn(*args, **kwargs)
+            with app.app_context():
+                return fn(*args, **kwargs)
+        finally:
+            _SLOTS.release()
+
+    metrics.incr("speculative.started")
+    return Speculation(_POOL.submit(run))
+
+
+__all__ = ["Speculation", "submit", "speculative_enabled", "MAX_WORKERS"]
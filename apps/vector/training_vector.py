@@ -1,146 +1,216 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import heapq
 import re
-import unicodedata
 from datetime import datetime, timedelta
 from difflib import get_close_matches
+from itertools import islice
 
 from apps.controllers._base_controller import BaseController
+from apps.ai.context_builder import REPLY_BUDGET, build_context
+from apps.ai.llm_client import get_llm_client
+from apps.ai.prompts import get_prompt, record_call, register_prompt
 from apps.extensions import cache
-from apps.utils.spa_locations import spa_locations
-from apps.utils.spa_services import spa_services
+from apps.utils.catalog_index import catalog_index_for, get_catalog_index
+from apps.utils.catalog_store import CATALOG_CACHE, build_city_keywords, get_catalog
+from apps.utils import metrics
+from apps.utils.appointment_repository import get_appointment_repository
+from apps.utils.availability import get_availability_store
+from apps.utils.booking_flow import BookingEvent, BookingFlow, slot_of
+from apps.utils.codec import BookingDraft
+from apps.utils.conversation_store import get_conversation_store
+from apps.utils.id_allocator import get_id_allocator
+from apps.utils.sse import StreamedReply
+from apps.utils.text_normalize import fold_text
+from apps.vector.keyword_matcher import PhraseAutomaton, scan_intents
+from apps.vector.message_analysis import MessageAnalysis
 from openai import OpenAI
 from apps.vector.parse_time_text import ParseTimeText
+from apps.vector import speculative
+from apps.vector.skin_classifier import get_skin_classifier
+from apps.vector.skin_question_cache import SKIN_QUESTION_CACHE, bypass_enabled as skin_cache_bypass
+from apps.vector.vector_index import get_catalog_vectors
 from zoneinfo import ZoneInfo
 
+SKIN_GATE_PROMPT = (
+    "Bạn là một bộ lọc phân loại câu hỏi.\n"
+    "Nếu người dùng hỏi về các vấn đề liên quan đến chăm sóc da, làm đẹp, mụn, thâm, nám, lão hóa, dưỡng da, spa nói chung (nhưng không hỏi tên dịch vụ cụ thể), trả lời: YES.\n"
+    "Nếu không phải, trả lời: NO.\n"
+    "Chỉ trả về một từ duy nhất: YES hoặc NO."
+)
+
+REPLY_PROMPT_TEMPLATE = """
+Bạn là trợ lý tư vấn spa & chăm sóc da.
+
+DANH SÁCH SPA:
+{spa_info}
+
+QUY TẮC TRẢ LỜI:
+1) Danh sách spa theo vị trí → liệt kê đúng thành phố (chỉ trong danh sách).
+2) Tên spa → giới thiệu spa.
+3) Danh sách dịch vụ của spa → liệt kê dịch vụ của spa đó.
+4) Nếu người dùng nêu tên dịch vụ → giới thiệu chi tiết; nếu có ý định đặt hẹn → chuyển luồng đặt hẹn.
+5) Đặt hẹn → dùng thời gian user đã cung cấp (nếu có), hỏi tên/SĐT & xác nhận; không gợi ý slot nếu đã có thời gian.
+6) Skincare → trả lời đúng trọng tâm skincare.
+7) Ngoài phạm vi → nói: "Xin lỗi, tôi chỉ hỗ trợ các câu hỏi về làm đẹp, chăm sóc da và spa."
+8) Văn phong: thân thiện, rõ ràng, ngắn gọn, bám đúng chủ đề của tin nhắn.
+"""
+
+
+@register_prompt("skin_gate")
+def _render_skin_gate_prompt(catalog) -> str:
+    return SKIN_GATE_PROMPT
+
+
+@register_prompt("reply")
+def _render_reply_prompt(catalog) -> str:
+    spa_info = "\n".join(f"- {spa.data['name']} — {spa.data['address']}" for spa in catalog.spas)
+    return REPLY_PROMPT_TEMPLATE.format(spa_info=spa_info)
+
+
+def _names_key(names) -> str:
+    """Khoá cache cho 1 tập tên spa: tên của catalog hiện tại → version catalog (không băm lại 10k tên)."""
+    catalog = get_catalog()
+    if names is catalog.spa_names:
+        return catalog.version
+    return hashlib.sha1("\x1f".join(names).encode("utf-8")).hexdigest()[:12]
+
 
 class TrainingVector(BaseController):
-    def __init__(self):
+    def __init__(self, client: OpenAI = None, stream: bool = False, session=None):
         self.dt_parser = ParseTimeText()
+        self.session = session  # ConversationSession của turn (nạp/ghi Redis 1 lần)
+        self.analysis = None  # MessageAnalysis của turn hiện tại
+        self._client = client
+        self.stream = stream  # True → reply trả về StreamedReply (SSE) thay vì JSON
+        self._skin_speculation = None  # lượt LLM YES/NO đang chạy nền (SKIN_GATE_MODE=speculative)
+        self._booking_flows = {}  # user_id → BookingFlow của turn (ghi 1 lần ở commit_booking)
+
+    @property
+    def client(self) -> OpenAI:
+        """LLM client được inject, mặc định client dùng chung của worker."""
+        return self._client or get_llm_client()
+
+    # ===== Per-turn analysis =====
+    def analyze(self, message: str) -> MessageAnalysis:
+        """Phân tích dùng chung cho cả turn (tạo mới nếu là câu khác)."""
+        if self.analysis is None or not self.analysis.matches(message):
+            self.analysis = MessageAnalysis(self, message)
+        return self.analysis
+
+    def _turn(self, message: str):
+        """Analysis của turn nếu `message` chính là câu đang xử lý, ngược lại None."""
+        a = self.analysis
+        return a if a is not None and a.matches(message) else None
 
     # ===== Storage / common =====
+    def _session_for(self, conversation_key):
+        s = self.session
+        return s if s is not None and s.owns(conversation_key) else None
+
+    def save_history(self, conversation_key, history):
+        s = self._session_for(conversation_key)
+        if s is not None and history is s.history:
+            s.history_changed()  # ghi cùng flush cuối turn
+        else:
+            get_conversation_store().save(conversation_key, history)
+
     def finalize_reply(self, reply, conversation_key, history):
+        self.drop_skin_speculation()
         reply_text = "\n".join(reply) if isinstance(reply, list) else reply
         history.append({"role": "assistant", "content": reply_text})
-        cache.set(conversation_key, history, timeout=86400)
+        self.save_history(conversation_key, history)
+        if self.stream:
+            return StreamedReply.single(reply_text)
         return self.json_response(reply_text)
 
+    # ===== Booking: máy trạng thái (apps.utils.booking_flow), nạp 1 lần + ghi 1 lần / turn =====
+    def booking_flow(self, user_id) -> BookingFlow:
+        flow = self._booking_flows.get(str(user_id))
+        if flow is None:
+            s = self._session_for(f"chat:{user_id}")
+            data = s.get("booking") if s is not None else cache.get(f"booking:{user_id}")
+            if isinstance(data, BookingDraft):
+                data = data.to_dict()
+            flow = self._booking_flows[str(user_id)] = BookingFlow(data)
+        return flow
+
+    def commit_booking(self):
+        """Ghi bản nháp đặt lịch đã đổi trong turn (gọi 1 lần cuối turn, trước session.flush)."""
+        for user_id, flow in self._booking_flows.items():
+            flow.commit(lambda data, _uid=user_id: self._save_booking(_uid, data))
+
+    def _save_booking(self, user_id, data):
+        if data is not None:
+            data = BookingDraft.from_dict(data)  # khung gọn (apps.utils.codec) khi ghi Redis
+        s = self._session_for(f"chat:{user_id}")
+        if s is not None:
+            s.set("booking", data)  # None → xoá khoá
+        elif data is None:
+            cache.delete(f"booking:{user_id}")
+        else:
+            cache.set(f"booking:{user_id}", data, timeout=1800)  # 30 phút
+
     def get_booking_context(self, user_id):
-        return cache.get(f"booking:{user_id}") or {"active": False}
+        return self.booking_flow(user_id).data
 
     def set_booking_context(self, user_id, ctx):
-        cache.set(f"booking:{user_id}", ctx, timeout=1800)  # 30 phút
+        self.booking_flow(user_id).replace(ctx)
 
     def clear_booking_context(self, user_id):
-        cache.delete(f"booking:{user_id}")
-
-    def reset_time_fields(self, ctx: dict) -> dict:
-        """Xoá sạch thông tin thời gian để tránh dính slot cũ."""
-        for k in ("slot", "available_slots", "confirmed"):
-            ctx.pop(k, None)
-        return ctx
+        self.booking_flow(user_id).fire(BookingEvent.CANCEL)
 
     # ===== Normalize / utils =====
     def _normalize(self, s: str) -> str:
-        s = (s or "").casefold().strip()
-        s = unicodedata.normalize("NFD", s)
-        s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-        def fold_char(ch: str) -> str:
-            if ch.isascii():
-                return ch
-            name = unicodedata.name(ch, "")
-            if name.startswith("LATIN") and " LETTER " in name and " WITH " in name:
-                base = name.split(" LETTER ", 1)[1].split(" WITH ", 1)[0]
-                for c in base:
-                    if c.isalpha():
-                        return c.lower()
-            if ch in ("đ", "Đ"):
-                return "d"
-            return ch
-        s = "".join(fold_char(ch) for ch in s)
-        s = re.sub(r"\s+", " ", s)
-        return s
-    
+        return fold_text(s)
+
+    def intent_signals(self, message: str):
+        """Tập nhóm từ khoá intent có trong câu (quét 1 lượt, xem keyword_matcher)."""
+        turn = self._turn(message)
+        if turn is not None:
+            return turn.signals
+        return scan_intents(self._normalize(message))
+
     def is_skin_question_local(self, message: str) -> bool:
         """
         Nhận diện nhanh các câu skincare chung (mụn, thâm, nám, routine, retinol...).
         Chỉ trả True nếu KHÔNG có ý định booking/ dịch vụ cụ thể.
         """
-        msg = self._normalize(message)
-
-        # Từ khóa chủ đề skincare (triệu chứng | routine | hoạt chất | bước skincare)
-        skin_terms = [
-            "mun", "mun an", "mun viem", "mun dau den", "mun dau trang",
-            "tham", "nam", "tan nhang", "lo chan long", "do dau", "da kho",
-            "kich ung", "kich ung da", "viem da",
-            "skincare", "routine", "chuong trinh duong da", "duong am", "tay da chet",
-            "tay trang", "sua rua mat", "cleanser", "toner", "serum", "kem chong nang",
-            "retinol", "tre", "bha", "aha", "paha", "niacinamide", "vitamin c", "ha", "hyaluronic"
-        ]
-        ask_terms = [
-            "lam sao", "nhu the nao", "giai phap", "nen dung", "chi minh", "tu van",
-            "cach tri", "tri nhu the nao", "co nen", "huong dan", "khac phuc", "meo"
-        ]
-
-        has_skin = any(t in msg for t in skin_terms)
-        has_ask  = any(t in msg for t in ask_terms) or "?" in message
-
+        sig = self.intent_signals(message)
         # Không lẫn với booking/dịch vụ
-        is_booking = self.is_booking_request(message)
-        looks_service_list = ("dich vu" in msg) or ("danh sach" in msg) or ("bang gia" in msg)
-
-        return (has_skin and (has_ask or True)) and (not is_booking) and (not looks_service_list)
+        return ("skin_term" in sig and "booking" not in sig and "earliest" not in sig
+                and "service_list_hint" not in sig)
 
     # ===== City detection =====
     def extract_city_keywords(self, spas):
-        city_map = {}
-        for spa in spas:
-            parts = [p.strip().lower() for p in spa["address"].split(",")]
-            if len(parts) >= 2:
-                city = parts[-1]
-                city_map.setdefault(city, set()).add(city)
-        city_map.setdefault("hồ chí minh", set()).update({
-            "hồ chí minh", "ho chi minh", "tp hcm", "tp.hcm", "tp. hcm", "hcm",
-            "sài gòn", "sai gon", "sg", "ho chi minh city"
-        })
-        city_map.setdefault("hà nội", set()).update({"hà nội", "ha noi", "hn", "ha noi city"})
-        return {k: list(v) for k, v in city_map.items()}
+        """{thành phố: [từ khoá]} (apps.utils.catalog_store.build_city_keywords)."""
+        return build_city_keywords(spas)
 
     def extract_city_from_message(self, message, city_keywords):
-        msg_norm = self._normalize(message)
-        for city, keys in city_keywords.items():
-            for k in keys:
-                if self._normalize(k) in msg_norm:
-                    return city
-        return None
+        return self._match_city(self._normalize(message), self._fold_city_keywords(city_keywords))
 
-    # ===== Spa / Service detection =====
-    
-    def detect_spa_in_message(self, message, spa_names):
-        msg_norm = self._normalize(message)
-        for name in spa_names:
-            name_norm = self._normalize(name)
-            if name_norm in msg_norm:
-                return name
-            if f"spa {name_norm}" in msg_norm or f"{name_norm} spa" in msg_norm:
-                return name
-        matches = get_close_matches(msg_norm, [self._normalize(s) for s in spa_names], n=1, cutoff=0.5)
-        if matches:
-            return next((s for s in spa_names if self._normalize(s) == matches[0]), None)
+    def detect_city(self, message):
+        """Thành phố trong câu theo catalog hiện tại; từ khoá đã bỏ dấu dựng 1 lần / snapshot ("city_keywords")."""
+        return self._match_city(self._normalize(message), get_catalog().derived("city_keywords"))
+
+    def _fold_city_keywords(self, city_keywords):
+        return [(city, self._normalize(k)) for city, keys in city_keywords.items() for k in keys]
+
+    @staticmethod
+    def _match_city(msg_norm, folded_keywords):
+        for city, k_norm in folded_keywords:
+            if k_norm in msg_norm:
+                return city
         return None
 
+    # ===== Spa / Service detection =====
     def find_exact_service_by_name(self, message, spa_services_dict):
-        msg = self._normalize(message)
-        for spa_name, services in spa_services_dict.items():
-            for s in services:
-                if self._normalize(s["name"]) in msg:
-                    return {"spa_name": spa_name, "service": s}
-        return None
+        entry = catalog_index_for(spa_services_dict).first_service_in_text(self._normalize(message))
+        return entry.as_match() if entry else None
 
     # ===== Intents =====
     def is_request_for_spa_list(self, message):
-        msg = self._normalize(message)
-        keys = ["tim spa o", "spa o", "danh sach spa", "spa gan", "spa quanh", "spa khu vuc", "spa tai"]
-        return any(k in msg for k in keys)
+        return "spa_list" in self.intent_signals(message)
 
     def is_request_for_spa_intro(self, message, spa_name):
         msg = message.lower(); name = spa_name.lower()
@@ -153,73 +223,51 @@ class TrainingVector(BaseController):
         ]
         return any(re.search(p, msg) for p in patterns)
 
-    def is_request_for_service_list(self, message):
-        if self.is_booking_request(message):
-            return False
-        msg = self._normalize(message)
-
-        # Ưu tiên khi có 'dich vu' + ý hỏi/liệt kê
-        if "dich vu" in msg:
-            cues = [" nao", " gi", " tot", "goi y", "danh sach", "liet ke",
-                    "co nhung", "nhung gi", "gom", "bao gom", "goi nao", "nen dung"]
-            if any(c in msg for c in cues):
-                return True
-
-        # Cụm list tường minh
-        if any(c in msg for c in ["danh sach", "liet ke", "bang gia", "bao gia"]):
-            return True
-
-        return False
-    
     def is_additional_booking(self, message: str) -> bool:
         """Nhận diện 'đặt hẹn thêm' để reset context cũ trước khi vào flow mới."""
-        msg = self._normalize(message)
-        keys = ["dat hen them", "dat them", "dat lich them", "them mot lich", "them lich"]
-        return any(k in msg for k in keys)
+        return "additional_booking" in self.intent_signals(message)
 
     def is_booking_request(self, message):
-        msg = self._normalize(message)
-        keywords = [
-            "dat lich", "dat hen", "booking", "book", "dat ngay",
-            "muon hen", "muon dat", "hen lich", "dat lich hen",
-            "dat slot", "giu cho", "giup minh dat", "dang ky lich",
-            # coi 'đặt thêm' cũng là booking
-            "dat hen them", "dat them", "dat lich them", "them mot lich", "them lich"
-        ]
-        return any(k in msg for k in keywords)
+        return "booking" in self.intent_signals(message)
+
+    def is_earliest_slot_request(self, message):
+        return "earliest" in self.intent_signals(message)
 
     def is_request_for_service_list(self, message):
-        if self.is_booking_request(message):
-            return False
-        msg = self._normalize(message)
-        keys = [
-            "danh sach dich vu", "danh sách dịch vụ", "bang gia", "bảng giá",
-            "cac dich vu", "các dịch vụ", "co gi", "có gì", "gom nhung gi", "gồm những gì",
-            "dich vu cua", "dịch vụ của"
-        ]
-        return any(k in msg for k in keys)
+        sig = self.intent_signals(message)
+        return "service_list" in sig and "booking" not in sig
 
     def is_referring_prev_service(self, message: str) -> bool:
         msg = message.lower()
         pats = [r"dịch vụ này", r"dịch vụ đó", r"dịch vụ trên", r"dịch vụ vừa rồi", r"dịch vụ vừa nêu", r"dịch vụ vừa xong"]
         return any(re.search(p, msg) for p in pats)
 
-    def infer_service_from_history(self, history):
-        for h in reversed(history):
-            content = h.get("content", "").lower()
-            for spa_name, services in spa_services.items():
-                for s in services:
-                    if s["name"].lower() in content:
-                        return {"spa_name": spa_name, "service_name": s["name"]}
-        return None
-
     # ===== Last list / focus =====
     def save_last_spa_list(self, conversation_key, spas):
         items = [{"name": s["name"], "address": s["address"]} for s in spas]
-        cache.set(f"{conversation_key}:last_spa_list", items, timeout=1800)
+        self._remember(conversation_key, "last_spa_list", items, 1800)
 
     def get_last_spa_list(self, conversation_key):
-        return cache.get(f"{conversation_key}:last_spa_list") or []
+        return self._recall(conversation_key, "last_spa_list") or []
+
+    def get_last_spa_focus(self, conversation_key):
+        return self._recall(conversation_key, "last_spa_focus")
+
+    def get_last_context(self, conversation_key):
+        return self._recall(conversation_key, "last_context")
+
+    def _remember(self, conversation_key, name, value, timeout):
+        s = self._session_for(conversation_key)
+        if s is not None:
+            s.set(name, value)
+            return
+        cache.set(f"{conversation_key}:{name}", value, timeout=timeout)
+
+    def _recall(self, conversation_key, name):
+        s = self._session_for(conversation_key)
+        if s is not None:
+            return s.get(name)
+        return cache.get(f"{conversation_key}:{name}")
 
     def reply_choose_spa_from_last_list(self, conversation_key, history, note=None):
         spa_list = self.get_last_spa_list(conversation_key)
@@ -286,51 +334,22 @@ class TrainingVector(BaseController):
         return results
 
     def get_spas_by_service_name(self, service_name):
-        target = self._normalize(service_name)
-        spas = []
-        for spa in spa_locations:
-            for s in spa_services.get(spa["name"], []):
-                if self._normalize(s["name"]) == target:
-                    spas.append(spa)
-                    break
+        return get_catalog_index().spas_for_service(service_name)
+
+    def extract_district(self, message):
+        """'quận 1' / 'q1' / 'q.3' → 'Quận 1'; không có → None."""
+        m = re.search(r"\b(?:quan|q\.?)\s*(\d{1,2})\b", self._normalize(message))
+        return f"Quận {int(m.group(1))}" if m else None
+
+    def find_spas_in_area(self, spas, city=None, district=None):
+        if city:
+            spas = self.find_spas_by_city(spas, city)
+        if district:
+            # so khớp nguyên từ: 'quận 1' không được khớp 'quận 10'
+            pat = re.compile(rf"\b{re.escape(self._normalize(district))}\b")
+            spas = [spa for spa in spas if pat.search(self._normalize(spa.get("address", "")))]
         return spas
     
-    def find_service_in_text_for_spa(self, message: str, spa_name: str):
-        """
-        Ưu tiên bắt dịch vụ CHỈ trong phạm vi spa_name (focus đúng spa).
-        Trả về tên dịch vụ (str) hoặc None nếu không nhận được.
-        """
-        msg = self._normalize(message)
-        services = spa_services.get(spa_name, [])
-        if not services:
-            return None
-
-        # (a) khớp nguyên cụm
-        for s in services:
-            if self._normalize(s["name"]) in msg:
-                return s["name"]
-
-        # (b) chấm điểm theo overlap token (>=2 token là đạt)
-        best_name, best_score = None, 0
-        for s in services:
-            name_norm = self._normalize(s["name"])
-            toks = [t for t in name_norm.split() if len(t) >= 2]
-            score = sum(1 for t in toks if t in msg)
-            if score > best_score:
-                best_score, best_name = score, s["name"]
-        if best_score >= 2:
-            return best_name
-
-        # (c) fuzzy nhẹ
-        from difflib import get_close_matches
-        names_norm = [self._normalize(s["name"]) for s in services]
-        match = get_close_matches(msg, names_norm, n=1, cutoff=0.6)
-        if match:
-            idx = names_norm.index(match[0])
-            return services[idx]["name"]
-
-        return None
-
     # ===== Replies =====
     def reply_spa_list(self, city, matched_spas, conversation_key, history):
         if not matched_spas:
@@ -355,7 +374,7 @@ class TrainingVector(BaseController):
         services = services_dict.get(spa_name, [])
         if not services:
             return self.finalize_reply(f"Hiện **{spa_name}** chưa cập nhật dịch vụ.", conversation_key, history)
-        cache.set(f"{conversation_key}:last_spa_focus", spa_name, timeout=1800)
+        self._remember(conversation_key, "last_spa_focus", spa_name, 1800)
         reply = [f"💆 Dịch vụ tại **{spa_name}**:"]
         for s in services:
             reply.append(f"- {s['name']}: {s['description']}")
@@ -364,8 +383,8 @@ class TrainingVector(BaseController):
     def reply_service_detail(self, exact, conversation_key, history):
         s = exact["service"]; spa_name = exact["spa_name"]
         reply = f"💆 **{s['name']}** tại **{spa_name}**:\n{s['description']}"
-        cache.set(f"{conversation_key}:last_context", {"spa_name": spa_name, "service_name": s["name"]}, timeout=900)
-        cache.set(f"{conversation_key}:last_spa_focus", spa_name, timeout=1800)
+        self._remember(conversation_key, "last_context", {"spa_name": spa_name, "service_name": s["name"]}, 900)
+        self._remember(conversation_key, "last_spa_focus", spa_name, 1800)
         return self.finalize_reply(reply, conversation_key, history)
 
     def reply_choose_service(self, service_names, conversation_key, history):
@@ -388,23 +407,16 @@ class TrainingVector(BaseController):
     # ===== Booking flow helpers =====
     def find_services_in_text(self, message, services_dict):
         msg = self._normalize(message)
-        found, all_names = [], set()
-        for spa_name, services in services_dict.items():
-            for s in services:
-                name_norm = self._normalize(s["name"])
-                all_names.add(name_norm)
-                if name_norm in msg:
-                    found.append({"spa_name": spa_name, "service": s}); continue
-                tokens = [t for t in name_norm.split() if len(t) >= 3]
-                if sum(1 for t in tokens if t in msg) >= 2:
-                    found.append({"spa_name": spa_name, "service": s})
+        index = catalog_index_for(services_dict)
+        found = [e.as_match() for e in index.services_in_text(msg, min_overlap=2, min_token_len=3)]
         if found:
             return found
-        for cand in get_close_matches(msg, list(all_names), n=3, cutoff=0.6):
-            for spa_name, services in services_dict.items():
-                for s in services:
-                    if self._normalize(s["name"]) == cand:
-                        found.append({"spa_name": spa_name, "service": s})
+        # fuzzy: index vector n-gram (bắt được viết sai / diễn đạt gần nghĩa)
+        seen = set()
+        for entry, _score in get_catalog_vectors(index).similar_services(msg, k=3):
+            if entry.folded not in seen:
+                seen.add(entry.folded)
+                found.extend(e.as_match() for e in index.services_by_folded[entry.folded])
         return found
 
     def reply_choose_service_for_spa(self, spa_name, service_names, conversation_key, history):
@@ -419,23 +431,133 @@ class TrainingVector(BaseController):
         lines.append("Vui lòng trả lời **số thứ tự** hoặc **tên dịch vụ**.")
         return self.finalize_reply("\n".join(lines), conversation_key, history)
 
-    def get_available_slots(self, spa_name):
-        base = datetime.now(); opts = []
-        for d in range(1, 4):
-            day = base + timedelta(days=d)
-            for h in [9, 11, 14, 16]:
-                dt = day.replace(hour=h, minute=0, second=0, microsecond=0)
-                opts.append(dt)
-        return [{"label": dt.strftime("%d/%m/%Y %H:%M"), "iso": dt.isoformat()} for dt in opts]
-
-    def ask_booking_info(self, slots, conversation_key, history):
-        reply = ["🗓️ Lịch trống gần nhất:"]
+    def get_available_slots(self, spa_name, service_name=None, start=None, end=None, limit=8):
+        """Giờ còn trống thật (bitmap lịch của spa), xem apps.utils.availability."""
+        return get_availability_store().find_slots(spa_name, service_name, start=start, end=end, limit=limit)
+
+    def find_earliest_slots(self, service_name, city=None, district=None, start=None, end=None, limit=5):
+        """
+        Giờ trống sớm nhất cho 1 dịch vụ ở mọi spa có dịch vụ đó (lọc theo khu vực nếu có),
+        dạng {"spa_name", "label", "iso"}. Chỉ 1 spa → như get_available_slots.
+        """
+        spas = self.find_spas_in_area(self.get_spas_by_service_name(service_name), city, district)
+        names = [spa["name"] for spa in spas]
+        if len(names) == 1:
+            slots = self.get_available_slots(names[0], service_name, start=start, end=end, limit=limit)
+            return [{"spa_name": names[0], **slot} for slot in slots]
+        return get_availability_store().earliest_slots(names, service_name, start=start, end=end, limit=limit)
+
+    def find_earliest_slots_for_services(self, service_names, city=None, district=None, start=None, end=None,
+                                         limit=5):
+        """
+        Như find_earliest_slots nhưng trên nhiều dịch vụ ('massage' → mọi dịch vụ massage):
+        gộp các dòng giờ (đã tăng dần) bằng heap, mỗi lựa chọn có thêm "service_name".
+        """
+        streams = [
+            [{**opt, "service_name": name}
+             for opt in self.find_earliest_slots(name, city=city, district=district, start=start, end=end, limit=limit)]
+            for name in service_names
+        ]
+        return list(islice(heapq.merge(*streams, key=lambda opt: opt["iso"]), limit))
+
+    def earliest_service_names(self, turn):
+        """
+        Dịch vụ cần tìm giờ cho câu hiện tại: đúng tên → 1 dịch vụ; nhắc chung ('massage') →
+        các dịch vụ khớp + mọi dịch vụ có chung từ đã khớp đó (theo thứ tự catalog).
+        """
+        exact = turn.exact_service
+        if exact:
+            return [exact["service"]["name"]]
+        matched = list(dict.fromkeys(m["service"]["name"] for m in turn.services))
+        if not matched:
+            return []
+        index = get_catalog_index()
+        msg_tokens = set(turn.tokens)
+        words = {t for name in matched for t in index.service_by_name(name).tokens
+                 if len(t) >= 3 and t in msg_tokens}
+        return list(dict.fromkeys(matched + [e.name for e in index.candidates(words)]))
+
+    def reply_earliest_slots(self, user_id, service_names, options, area, conversation_key, history):
+        if isinstance(service_names, str):
+            service_names = [service_names]
+        many = len(service_names) > 1
+        if many and options:
+            # tiêu đề chỉ nêu dịch vụ thực sự có giờ trống trong danh sách
+            service_names = list(dict.fromkeys(opt["service_name"] for opt in options))
+        title = " / ".join(service_names)
+        where = f" ở **{area}**" if area else ""
+        if not options:
+            return self.finalize_reply(
+                f"Hiện chưa tìm thấy giờ trống cho **{title}**{where}. "
+                "Bạn thử khu vực hoặc thời gian khác nhé.", conversation_key, history
+            )
+        addresses = {spa["name"]: spa.get("address", "") for spa in get_catalog().locations}
+        lines = [f"⏱️ Giờ trống sớm nhất cho **{title}**{where}:"]
+        for i, opt in enumerate(options, 1):
+            addr = addresses.get(opt["spa_name"])
+            service = f" · {opt['service_name']}" if many else ""
+            lines.append(f"{i}. {opt['label']} — **{opt['spa_name']}**{service}" + (f" ({addr})" if addr else ""))
+        lines.append("Vui lòng trả lời **số thứ tự** để đặt lịch.")
+        # nhiều dịch vụ → dịch vụ đi theo từng lựa chọn, chốt khi user chọn số
+        offer = (None if many else service_names[0], options)
+        self.booking_flow(user_id).fire(BookingEvent.OFFER_EARLIEST, offer)
+        return self.finalize_reply("\n".join(lines), conversation_key, history)
+
+    def reply_earliest_for_message(self, user_id, message, conversation_key, history):
+        """'massage sớm nhất ở quận 1 ngày mai' → N giờ trống sớm nhất; None nếu chưa rõ dịch vụ."""
+        turn = self.analyze(message)
+        # câu không nhắc dịch vụ nào mới dùng dịch vụ của bản nháp đang mở
+        service_names = self.earliest_service_names(turn)
+        if not service_names:
+            draft_service = self.booking_flow(user_id).get("service_name")
+            service_names = [draft_service] if draft_service else []
+        if not service_names:
+            return None
+        city, district = turn.city, self.extract_district(message)
+        start = end = None
+        rng = turn.appointment_range
+        if rng:
+            start, end, _title = rng
+        elif turn.datetime:
+            start = turn.datetime
+        if len(service_names) == 1:
+            options = self.find_earliest_slots(service_names[0], city=city, district=district, start=start, end=end)
+        else:
+            options = self.find_earliest_slots_for_services(service_names, city=city, district=district,
+                                                            start=start, end=end)
+        area = ", ".join(a.title() for a in (district, city) if a)
+        return self.reply_earliest_slots(user_id, service_names, options, area, conversation_key, history)
+
+    def pick_earliest_option(self, flow, message):
+        """Vòng trước gợi ý giờ sớm nhất nhiều spa → số thứ tự chọn luôn spa + giờ. True nếu đã chọn."""
+        m = re.match(r"^\s*(\d{1,2})\s*$", message or "")
+        return bool(m) and flow.pick_option(int(m.group(1)))
+
+    def ask_booking_info(self, slots, conversation_key, history, note=None):
+        reply = [note] if note else []
+        if not slots:
+            reply.append("🗓️ Hiện spa đã kín lịch trong những ngày tới.")
+            reply.append("Bạn có thể nhập thời gian khác (dd/mm/yyyy hh:mm) để mình kiểm tra.")
+            return self.finalize_reply("\n".join(reply), conversation_key, history)
+        reply.append("🗓️ Lịch trống gần nhất:")
         for i, s in enumerate(slots[:8], 1):
             reply.append(f"{i}. {s['label']}")
         reply.append("Vui lòng chọn số slot (ví dụ: 2), hoặc nhập thời gian bạn muốn (dd/mm/yyyy hh:mm).")
         return self.finalize_reply("\n".join(reply), conversation_key, history)
 
+    def reply_slot_taken(self, user_id, flow, conversation_key, history):
+        """Giữ chỗ thất bại lúc chốt (hết chỗ / ngoài giờ mở cửa) → bỏ slot cũ, gợi ý lại."""
+        label = flow.get("slot", {}).get("label", "")
+        spa_name = flow.get("spa_name")
+        slots = self.get_available_slots(spa_name, flow.get("service_name"))
+        flow.fire(BookingEvent.SLOT_TAKEN, slots)
+        note = f"⚠️ Khung giờ **{label}** tại **{spa_name}** không còn trống (hoặc ngoài giờ mở cửa)."
+        return self.ask_booking_info(slots, conversation_key, history, note=note)
+
     def parse_datetime_from_message(self, message):
+        turn = self._turn(message)
+        if turn is not None:
+            return turn.datetime
         return self.dt_parser.parse(message)
         # m = re.search(r"(\d{1,2})/(\d{1,2})/(\d{4})\s+(\d{1,2}):(\d{2})", message.strip())
         # if not m: return None
@@ -447,78 +569,61 @@ class TrainingVector(BaseController):
 
     # --- BỔ SUNG: nhận diện đổi giờ ---
     def is_change_time_request(self, message: str) -> bool:
-        msg = self._normalize(message)
-        keys = [
-            "doi gio", "doi thoi gian", "doi lich", "sua gio", "chinh gio",
-            "chuyen sang", "doi sang", "doi qua", "reschedule", "change time",
-            "doi thoi diem", "doi khung gio", "doi slot", "doi gio hen"
-        ]
-        return any(k in msg for k in keys)
+        return "change_time" in self.intent_signals(message)
 
-    def handle_booking_details(self, ctx, message):
+    def handle_booking_details(self, flow, message):
+        """
+        Bước chốt giờ + xác nhận. Trả về câu cần hỏi tiếp, hoặc None khi user đã ĐỒNG Ý
+        (flow chuyển sang DONE).
+        """
         msg = message.strip()
 
         # Nếu đã có slot và người dùng nói đổi giờ hoặc nhập giờ mới → cập nhật trước
-        already_has_slot = bool(ctx.get("slot"))
-        wants_change_time = getattr(self, "is_change_time_request", lambda _m: False)(msg)
+        wants_change_time = self.is_change_time_request(msg)
         parsed_new_dt = self.parse_datetime_from_message(msg)
 
-        if already_has_slot and (wants_change_time or parsed_new_dt):
+        if flow.get("slot") and (wants_change_time or parsed_new_dt):
             if parsed_new_dt:
-                prev_label = ctx["slot"]["label"]
-                ctx["previous_slot"] = ctx["slot"]
-                ctx["slot"] = {"label": parsed_new_dt.strftime("%d/%m/%Y %H:%M"),
-                            "iso": parsed_new_dt.isoformat()}
-                ctx.pop("available_slots", None)
-                ctx.pop("confirmed", None)
-                ask = (
+                flow.fire(BookingEvent.PICK_SLOT, slot_of(parsed_new_dt))
+                prev = flow.get("previous_slot") or flow.get("slot")
+                return (
                     "⏰ Đã cập nhật **thời gian** đặt hẹn:\n"
-                    f"- Trước đó: {prev_label}\n"
-                    f"- Mới: {ctx['slot']['label']}\n\n"
+                    f"- Trước đó: {prev['label']}\n"
+                    f"- Mới: {flow.get('slot')['label']}\n\n"
                     "Bạn xác nhận **ĐỒNG Ý** chứ?"
                 )
-                return False, ctx, ask
-            else:
-                # muốn đổi nhưng chưa nêu giờ → gợi ý slot
-                if ctx.get("spa_name"):
-                    slots = self.get_available_slots(ctx["spa_name"])
-                    ctx["available_slots"] = slots
-                    ask = ["Bạn muốn đổi sang **thời gian** nào? Lịch trống gần nhất:"]
-                    for i, s in enumerate(slots[:8], 1):
-                        ask.append(f"{i}. {s['label']}")
-                    ask.append("Vui lòng **chọn số** hoặc nhập **dd/mm/yyyy hh:mm**.")
-                    return False, ctx, "\n".join(ask)
-                else:
-                    return False, ctx, "Bạn muốn đổi sang **thời gian nào**? (định dạng **dd/mm/yyyy hh:mm**)."
+            # muốn đổi nhưng chưa nêu giờ → gợi ý slot
+            if flow.get("spa_name"):
+                slots = self.get_available_slots(flow.get("spa_name"), flow.get("service_name"))
+                flow.fire(BookingEvent.OFFER_SLOTS, slots)
+                ask = ["Bạn muốn đổi sang **thời gian** nào? Lịch trống gần nhất:"]
+                for i, s in enumerate(slots[:8], 1):
+                    ask.append(f"{i}. {s['label']}")
+                ask.append("Vui lòng **chọn số** hoặc nhập **dd/mm/yyyy hh:mm**.")
+                return "\n".join(ask)
+            return "Bạn muốn đổi sang **thời gian nào**? (định dạng **dd/mm/yyyy hh:mm**)."
+
+        # Số thứ tự → chọn trong các slot vừa gợi ý (kể cả khi đang đổi giờ)
+        m = re.match(r"^\s*(\d{1,2})\s*$", msg)
+        if m:
+            flow.pick_offered_slot(int(m.group(1)))
 
         # Nếu CHƯA có slot → bắt thời gian
-        if not ctx.get("slot"):
-            desired_dt = self.parse_datetime_from_message(msg)
-            if desired_dt:
-                ctx["slot"] = {"label": desired_dt.strftime("%d/%m/%Y %H:%M"),
-                            "iso": desired_dt.isoformat()}
-            else:
-                m = re.match(r"^\s*(\d{1,2})\s*$", msg)
-                if m and ctx.get("available_slots"):
-                    idx = int(m.group(1)) - 1
-                    if 0 <= idx < len(ctx["available_slots"]):
-                        ctx["slot"] = ctx["available_slots"][idx]
-                if not ctx.get("slot"):
-                    return False, ctx, "Mình chưa bắt được thời gian. Bạn chọn **số thứ tự** hoặc nhập **dd/mm/yyyy hh:mm** nhé."
+        if not flow.get("slot"):
+            if not parsed_new_dt:
+                return "Mình chưa bắt được thời gian. Bạn chọn **số thứ tự** hoặc nhập **dd/mm/yyyy hh:mm** nhé."
+            flow.fire(BookingEvent.PICK_SLOT, slot_of(parsed_new_dt))
 
         # Xác nhận (KHÔNG hỏi tên / SĐT)
-        confirm_text = (
+        if "confirm_strict" in self.intent_signals(msg) and flow.fire(BookingEvent.CONFIRM):
+            return None
+        return (
             "Xác nhận đặt hẹn:\n"
-            f"- Spa: {ctx['spa_name']}\n"
-            f"- Dịch vụ: {ctx['service_name']}\n"
-            f"- Thời gian: {ctx['slot']['label']}\n"
+            f"- Spa: {flow.get('spa_name')}\n"
+            f"- Dịch vụ: {flow.get('service_name')}\n"
+            f"- Thời gian: {flow.get('slot')['label']}\n"
             "Bạn xác nhận **ĐỒNG Ý** chứ?"
         )
-        if any(kw in msg.lower() for kw in ["đồng ý", "dong y", "xac nhan", "xác nhận", "confirm"]):
-            ctx["confirmed"] = True
-            return True, ctx, ""
-        else:
-            return False, ctx, confirm_text
 
     def confirm_booking(self, ctx):
         return (
@@ -538,56 +643,51 @@ class TrainingVector(BaseController):
         - Có 'lịch hẹn của tôi/của mình/booking của tôi'
         → KHÔNG bắt những câu 'đặt hẹn', 'muốn đặt hẹn', ...
         """
-        msg = self._normalize(message)
-
+        sig = self.intent_signals(message)
+        if "appt_word" not in sig:
+            return False
         # 1) cụm sở hữu 'của tôi / của mình' + 'lịch hẹn'
-        if ("lich hen" in msg or "booking" in msg) and any(
-            own in msg for own in ["cua toi", "cua minh", "toi"]
-        ):
-            return True
-
         # 2) động từ tra cứu + 'lịch hẹn'
-        lookup_verbs = ["xem", "kiem tra", "kiemtra", "danh sach", "liet ke", "liệt kê"]
-        if ("lich hen" in msg or "booking" in msg) and any(v in msg for v in lookup_verbs):
-            return True
-
-        return False
+        return "appt_owner" in sig or "lookup_verb" in sig
 
     def add_appointment(self, user_id: str, ctx: dict):
-        appt_key = f"appointments:{user_id}"
-        appts = cache.get(appt_key) or []
-        appt_id = f"APPT-{int(datetime.now().timestamp())}"
-        appts.append({
-            "id": appt_id,
-            "spa_name": ctx.get("spa_name"),
-            "service_name": ctx.get("service_name"),
-            "slot_label": ctx.get("slot", {}).get("label"),
-            "slot_iso": ctx.get("slot", {}).get("iso"),
-            # "customer_name": ctx.get("customer_name"),
-            # "phone": ctx.get("phone"),
-            "created_at": datetime.now().isoformat()
-        })
-        cache.set(appt_key, appts, timeout=30 * 24 * 3600)
-        return appt_id
+        """Giữ chỗ trên lịch spa rồi lưu lịch hẹn; None nếu slot đã hết chỗ / ngoài giờ mở cửa."""
+        slot_dt = self._safe_fromiso(ctx.get("slot", {}).get("iso"))
+        availability = get_availability_store()
+        reservation = None
+        if ctx.get("spa_name") and slot_dt:
+            reservation = availability.reserve(ctx["spa_name"], ctx.get("service_name"), slot_dt)
+            if reservation is None:
+                return None
+        appt_id = get_id_allocator().next_id()
+        try:
+            return get_appointment_repository().add(user_id, {
+                "id": appt_id,
+                "spa_name": ctx.get("spa_name"),
+                "service_name": ctx.get("service_name"),
+                "slot_label": ctx.get("slot", {}).get("label"),
+                "slot_iso": ctx.get("slot", {}).get("iso"),
+                "reservation": reservation.to_dict() if reservation else None,
+                # "customer_name": ctx.get("customer_name"),
+                # "phone": ctx.get("phone"),
+                "created_at": datetime.now().isoformat()
+            })
+        except Exception:
+            if reservation:
+                availability.release(reservation)
+            raise
 
     def get_appointments(self, user_id: str):
-        return cache.get(f"appointments:{user_id}") or []
+        """Mọi lịch hẹn của user, đã sắp theo giờ slot."""
+        return get_appointment_repository().all(user_id)
 
     def reply_my_appointments(self, user_id: str, conversation_key: str, history: list):
         appts = self.get_appointments(user_id)
         if not appts:
             return self.finalize_reply("Hiện bạn **chưa có lịch hẹn** nào trong hệ thống.", conversation_key, history)
 
-        def key_func(a):
-            try:
-                return datetime.fromisoformat(a.get("slot_iso"))
-            except Exception:
-                return datetime.max
-
-        appts_sorted = sorted(appts, key=key_func)
-
         lines = ["📒 **Lịch hẹn của bạn:**"]
-        for i, a in enumerate(appts_sorted, 1):
+        for i, a in enumerate(appts, 1):
             lines.append(
                 f"{i}. {a.get('slot_label','(chưa rõ)')} — **{a.get('spa_name','?')}** / {a.get('service_name','?')}\n"
                 f"   Mã lịch hẹn: `{a.get('id')}`"
@@ -643,33 +743,26 @@ class TrainingVector(BaseController):
         Ý định xem/kiểm tra lịch hẹn theo mốc thời gian (hôm nay/mai/hôm qua/tuần/tháng/…)
         hoặc hỏi dạng 'có lịch hẹn ... không'.
         """
-        msg = self._normalize(message)
-
-        has_calendar = any(k in msg for k in ["lich hen", "dat hen", "booking", "lich"])
-        if not has_calendar:
+        sig = self.intent_signals(message)
+        if "calendar" not in sig:
             return False
 
-        # Các cụm thời gian phổ biến
-        time_phrases = [
-            "hom nay", "ngay mai", "hom qua",
-            "tuan nay", "tuan sau", "tuan truoc",
-            "thang nay", "thang sau", "thang truoc",
-            "this week", "next week", "last week",
-            "this month", "next month", "last month",
-            "tu ", "toi ", "tới ", "den ", "đến ",  # 'từ ... đến ...'
-            "trong ", "ngay toi", "ngay toi", "tuan toi", "thang toi", "qua", "yesterday", "today", "tomorrow"
-        ]
-        has_time_phrase = any(tp in msg for tp in time_phrases)
-
+        # Các cụm thời gian phổ biến ('hôm nay', 'tuần sau', 'từ ... đến ...', 'trong N ngày tới'...)
+        has_time_phrase = "appt_time_phrase" in sig
         # Câu nghi vấn kiểu 'có ... không'
-        has_yesno_ask = (" co " in f" {msg} ") and (" khong" in msg or " không" in message)
-
+        has_yesno_ask = "yesno_co" in sig and "yesno_khong" in sig
         # Các động từ tra cứu (để mở rộng cover)
-        has_lookup_verb = any(k in msg for k in ["xem", "kiem tra", "kiemtra", "danh sach", "liet ke", "liệt kê"])
+        has_lookup_verb = "lookup_verb" in sig
 
         return has_time_phrase or has_yesno_ask or has_lookup_verb
 
     def parse_appointment_range(self, message: str):
+        turn = self._turn(message)
+        if turn is not None:
+            return turn.appointment_range
+        return self._parse_appointment_range(message)
+
+    def _parse_appointment_range(self, message: str):
         """
         Trả về (start_dt, end_dt, title) nếu nhận ra khoảng thời gian tra cứu; ngược lại None.
         Hỗ trợ: hôm nay/mai/hôm qua, tuần này/trước/sau, tháng này/trước/sau,
@@ -777,21 +870,9 @@ class TrainingVector(BaseController):
         if try_dt:
             return True
 
-        # 2) Từ khoá thời gian thường gặp (không đủ để parse nhưng là tín hiệu user đang nói về giờ/ngày)
-        time_keywords = [
-            # buổi
-            "sang", "trua", "chieu", "toi", "dem", "khuya",
-            # chỉ ngày
-            "hom nay", "ngay mai", "hom qua", "tuan nay", "tuan sau", "tuan truoc",
-            "thang nay", "thang sau", "thang truoc",
-            # am/pm
-            " am", " pm",
-            # cấu trúc giờ tiếng Việt
-            " gio", " gio ", " gio.", " gio,", "g", "h", "kem", "ruoi", "rưỡi",
-            # định dạng số giờ
-            ":",  # 09:00
-        ]
-        if any(k in f" {norm} " for k in time_keywords):
+        # 2) Từ khoá thời gian thường gặp (buổi, ngày, am/pm, 'giờ/kém/rưỡi', ':')
+        #    — không đủ để parse nhưng là tín hiệu user đang nói về giờ/ngày
+        if "time_hint" in self.intent_signals(raw):
             return True
 
         # 3) Mẫu số đơn giản: "9h", "9 g", "9 gio", "9 giờ"
@@ -801,54 +882,38 @@ class TrainingVector(BaseController):
         return False
 
     def is_confirm_message(self, message: str) -> bool:
-        msg = self._normalize(message)
-        return any(k in msg for k in ["dong y", "xac nhan", "confirm", "ok", "oke", "okie"])
+        return "confirm" in self.intent_signals(message)
 
     def find_service_in_text_for_spa(self, message: str, spa_name: str):
         """
         Match dịch vụ **trong phạm vi 1 spa cụ thể**.
         """
         msg = self._normalize(message)
-        services = [s["name"] for s in spa_services.get(spa_name, [])]
-        norm_map = {self._normalize(n): n for n in services}
+        index = get_catalog_index()
+        services = index.services_by_spa.get(spa_name, ())
         # khớp full cụm
-        for norm_name, original in norm_map.items():
-            if norm_name in msg:
-                return original
+        exact = index.first_service_in_text(msg, services)
+        if exact:
+            return exact.name
         # khớp overlap đơn giản
-        best, score = None, 0
-        for norm_name, original in norm_map.items():
-            toks = [t for t in norm_name.split() if len(t) >= 2]
-            sc = sum(1 for t in toks if t in msg)
-            if sc > score:
-                score, best = sc, original
-        return best if score > 0 else None
+        best, score = index.best_overlap(msg, 2, services)
+        return best.name if score > 0 else None
 
     def infer_service_from_history(self, history):
         """
         Fallback: tìm dịch vụ + spa được nhắc gần nhất trong history khi người dùng nói 'dịch vụ này'.
         """
+        index = get_catalog_index()
         for h in reversed(history):
-            content = self._normalize(h.get("content", ""))
-            for spa_name, services in spa_services.items():
-                for s in services:
-                    if self._normalize(s["name"]) in content:
-                        return {"spa_name": spa_name, "service_name": s["name"]}
+            entry = index.first_service_in_text(self._normalize(h.get("content", "")))
+            if entry:
+                return {"spa_name": entry.spa_name, "service_name": entry.name}
         return None
     #...
 
     def reply_my_appointments_in_range(self, user_id: str, start: datetime, end: datetime, title: str, conversation_key: str, history: list):
-        appts = self.get_appointments(user_id)
-        items = []
-        if appts:
-            s_vn, e_vn = self._ensure_vn(start), self._ensure_vn(end)
-            for a in appts:
-                dt = self._safe_fromiso(a.get("slot_iso"))
-                if not dt: continue
-                dvn = self._ensure_vn(dt)
-                if s_vn <= dvn < e_vn:
-                    items.append(a)
-            items.sort(key=lambda x: self._ensure_vn(self._safe_fromiso(x.get("slot_iso"))) or datetime.max)
+        # ZRANGEBYSCORE [start, end) — đã sắp theo giờ
+        items = get_appointment_repository().between(user_id, self._ensure_vn(start), self._ensure_vn(end))
 
         if not items:
             return self.finalize_reply(f"{title}\nKhông có lịch hẹn nào trong khoảng thời gian này.", conversation_key, history)
@@ -880,13 +945,12 @@ class TrainingVector(BaseController):
     def build_spa_alias_index(self, spa_names):
         """
         Trả về dict: {alias_norm: canonical_spa_name}
-        Cache 1 ngày để tái dùng.
+        Cache 2 tầng (CATALOG_CACHE) theo tập tên spa, Redis giữ 1 ngày.
         """
-        cache_key = "spa_alias_index_v1"
-        alias_map = cache.get(cache_key)
-        if alias_map:
-            return alias_map
+        return CATALOG_CACHE.get_or_build(f"spa_alias_index:{_names_key(spa_names)}",
+                                          lambda: self._build_spa_alias_index(spa_names))
 
+    def _build_spa_alias_index(self, spa_names):
         alias_map = {}
         for name in spa_names:
             norm_full = self._normalize(name)                # "tham my vien pmt"
@@ -918,82 +982,134 @@ class TrainingVector(BaseController):
                 a_norm = self._normalize(a)
                 if a_norm:
                     alias_map[a_norm] = name
-
-        cache.set(cache_key, alias_map, timeout=86400)
         return alias_map
 
+    def spa_alias_matcher(self, spa_names):
+        """Automaton alias đã compile (chỉ L1: 1 lần / tập tên spa / worker / version catalog)."""
+        return CATALOG_CACHE.get_or_build(f"spa_alias_matcher:{_names_key(spa_names)}",
+                                          lambda: PhraseAutomaton(self.build_spa_alias_index(spa_names)),
+                                          local_only=True)
+
     def detect_spa_in_message(self, message, spa_names):
         """
         Ưu tiên match alias (PMT, Serenity...) -> trả về tên spa chuẩn.
         Fallback: chứa nguyên tên bỏ dấu; fuzzy nhẹ khi cần.
         """
         msg_norm = self._normalize(message)
-        alias_map = self.build_spa_alias_index(spa_names)
-
-        # 1) match theo alias (ưu tiên)
-        hits = []
-        for alias_norm, canonical in alias_map.items():
-            # match theo word-boundary để tránh trùng lặp bậy
-            if re.search(rf"\b{re.escape(alias_norm)}\b", msg_norm):
-                hits.append((len(alias_norm), canonical))
-        if hits:
-            # chọn alias dài nhất để giảm mơ hồ
-            hits.sort(reverse=True)
-            return hits[0][1]
-
-        # 2) chứa nguyên tên đầy đủ (bỏ dấu)
-        for name in spa_names:
-            if self._normalize(name) in msg_norm:
+
+        # 1) match theo alias (ưu tiên) — word-boundary, chọn alias dài nhất để giảm mơ hồ
+        canonical = self.spa_alias_matcher(spa_names).longest(msg_norm)
+        if canonical:
+            return canonical
+
+        # 2) chứa nguyên tên đầy đủ (bỏ dấu) — tên của catalog hiện tại đã fold sẵn trong snapshot
+        catalog = get_catalog()
+        if spa_names is catalog.spa_names:
+            folded_names = catalog.derived("spa_names_folded")
+        else:
+            folded_names = [(self._normalize(s), s) for s in spa_names]
+        for folded, name in folded_names:
+            if folded in msg_norm:
                 return name
 
         # 3) fuzzy nhẹ
-        cand = get_close_matches(msg_norm, [self._normalize(s) for s in spa_names], n=1, cutoff=0.6)
+        cand = get_close_matches(msg_norm, [folded for folded, _name in folded_names], n=1, cutoff=0.6)
         if cand:
-            return next((s for s in spa_names if self._normalize(s) == cand[0]), None)
+            return next((name for folded, name in folded_names if folded == cand[0]), None)
 
         return None
 
     # ===== GPT =====
-    def is_general_skin_question_gpt(self, message, client: OpenAI):
-        system_msg = (
-            "Bạn là một bộ lọc phân loại câu hỏi.\n"
-            "Nếu người dùng hỏi về các vấn đề liên quan đến chăm sóc da, làm đẹp, mụn, thâm, nám, lão hóa, dưỡng da, spa nói chung (nhưng không hỏi tên dịch vụ cụ thể), trả lời: YES.\n"
-            "Nếu không phải, trả lời: NO.\n"
-            "Chỉ trả về một từ duy nhất: YES hoặc NO."
-        )
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": system_msg}, {"role": "user", "content": message}],
-        )
+    def is_general_skin_question(self, message, client: OpenAI = None):
+        """Bộ lọc skincare: model cục bộ trước, chỉ hỏi gpt-4o khi model không đủ tự tin."""
+        decision, _p = get_skin_classifier().decide(message)
+        if decision is not None:
+            metrics.incr("skin_gate.local")
+            return decision
+        metrics.incr("skin_gate.llm")
+        return self.is_general_skin_question_gpt(message, client)
+
+    def start_skin_gate(self, message, client: OpenAI = None):
+        """
+        Bản speculative của is_general_skin_question: model cục bộ đủ tự tin → True/False;
+        ngược lại đẩy lượt LLM ra pool và trả None để các bước cục bộ chạy tiếp.
+        """
+        decision, _p = get_skin_classifier().decide(message)
+        if decision is not None:
+            metrics.incr("skin_gate.local")
+            return decision
+        metrics.incr("skin_gate.llm")
+        spec = speculative.submit(self.is_general_skin_question_gpt, message, client or self.client)
+        if spec is None:  # pool đầy → tuần tự như cũ
+            return self.is_general_skin_question_gpt(message, client)
+        self._skin_speculation = spec
+        return None
+
+    def drop_skin_speculation(self):
+        """Đã có câu trả lời → huỷ/bỏ qua lượt LLM YES/NO đang chạy nền (nếu có)."""
+        spec, self._skin_speculation = self._skin_speculation, None
+        if spec is not None and not spec.done():
+            spec.cancel()
+
+    def is_general_skin_question_gpt(self, message, client: OpenAI = None, bypass_cache: bool = None):
+        """YES/NO qua gpt-4o, kết quả cache 2 tầng theo câu đã bỏ dấu (xem skin_question_cache)."""
+        if bypass_cache is None:
+            bypass_cache = skin_cache_bypass()
+        key = SKIN_QUESTION_CACHE.key_for(message)
+        if bypass_cache:
+            metrics.incr("skin_cache.bypass")
+        else:
+            cached = SKIN_QUESTION_CACHE.get(key)
+            if cached is not None:
+                return cached
+        result = self._classify_skin_question_gpt(message, client or self.client)
+        if not bypass_cache:
+            SKIN_QUESTION_CACHE.set(key, result)
+        return result
+
+    def _classify_skin_question_gpt(self, message, client: OpenAI):
+        prompt = get_prompt("skin_gate")
+        messages = [prompt.message(), {"role": "user", "content": message}]
+        completion = client.chat.completions.create(model="gpt-4o", messages=messages)
+        record_call(prompt, messages, completion)
         return completion.choices[0].message.content.strip().upper() == "YES"
 
     def reply_with_gpt_history(self, client: OpenAI, history, message, user_id):
+        # skincare hay fallback đều ra cùng câu trả lời GPT → không cần chờ bộ lọc YES/NO
+        self.drop_skin_speculation()
+        client = client or self.client
         conversation_key = f"chat:{user_id}"
-        spa_info = "\n".join([f"- {spa['name']} — {spa['address']}" for spa in spa_locations])
-        system_prompt = f"""
-Bạn là trợ lý tư vấn spa & chăm sóc da.
-
-DANH SÁCH SPA:
-{spa_info}
-
-QUY TẮC TRẢ LỜI:
-1) Danh sách spa theo vị trí → liệt kê đúng thành phố (chỉ trong danh sách).
-2) Tên spa → giới thiệu spa.
-3) Danh sách dịch vụ của spa → liệt kê dịch vụ của spa đó.
-4) Nếu người dùng nêu tên dịch vụ → giới thiệu chi tiết; nếu có ý định đặt hẹn → chuyển luồng đặt hẹn.
-5) Đặt hẹn → dùng thời gian user đã cung cấp (nếu có), hỏi tên/SĐT & xác nhận; không gợi ý slot nếu đã có thời gian.
-6) Skincare → trả lời đúng trọng tâm skincare.
-7) Ngoài phạm vi → nói: "Xin lỗi, tôi chỉ hỗ trợ các câu hỏi về làm đẹp, chăm sóc da và spa."
-8) Văn phong: thân thiện, rõ ràng, ngắn gọn, bám đúng chủ đề của tin nhắn.
-"""
-        if len(history) > 20:
-            history = history[-20:]
-        messages = [{"role": "system", "content": system_prompt}] + history
+        prompt = get_prompt("reply")
+        messages = [prompt.message()] + build_context(history, REPLY_BUDGET, client)
+        if self.stream:
+            record_call(prompt, messages)
+            return self._stream_gpt_reply(client, messages, history, conversation_key)
         try:
             completion = client.chat.completions.create(model="gpt-4o", messages=messages)
+            record_call(prompt, messages, completion)
             reply = completion.choices[0].message.content.strip()
         except Exception:
             reply = "⚠️ Đã có lỗi xảy ra khi gọi AI. Vui lòng thử lại sau."
         history.append({"role": "assistant", "content": reply})
-        cache.set(conversation_key, history, timeout=86400)
-        return self.json_response(reply)
\ No newline at end of file
+        self.save_history(conversation_key, history)
+        return self.json_response(reply)
+
+    def _stream_gpt_reply(self, client: OpenAI, messages, history, conversation_key):
+        """Stream token GPT qua SSE; lưu history 1 lần khi stream kết thúc."""
+        def chunks():
+            produced = False
+            try:
+                for event in client.chat.completions.create(model="gpt-4o", messages=messages, stream=True):
+                    delta = event.choices[0].delta.content if event.choices else None
+                    if delta:
+                        produced = True
+                        yield delta
+            except Exception:
+                if not produced:
+                    yield "⚠️ Đã có lỗi xảy ra khi gọi AI. Vui lòng thử lại sau."
+
+        def save(text):
+            history.append({"role": "assistant", "content": text.strip()})
+            self.save_history(conversation_key, history)
+
+        return StreamedReply(chunks(), on_complete=save)
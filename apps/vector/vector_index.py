@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Chỉ mục vector cục bộ (không cần mạng) cho so khớp gần đúng dịch vụ / spa.
+
+- Vector hoá: n-gram ký tự (3, 4) trên chuỗi đã bỏ dấu, băm (crc32) vào `dim` chiều,
+  trọng số log(1 + tf), chuẩn hoá L2 → ma trận float32 (mỗi dòng 1 mục).
+- Tìm kiếm: cosine top-k = 1 phép nhân ma trận `matrix @ q`.
+- Lưu trữ: `<name>-<fingerprint>.npy` (+ `.json` nhãn) trong VECTOR_INDEX_DIR,
+  nạp lại bằng `np.load(mmap_mode="r")`; đổi catalog → fingerprint khác → tự build lại.
+"""
+import hashlib
+import json
+import math
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from apps.utils.catalog_index import CatalogIndex, get_catalog_index
+from apps.utils.text_normalize import fold_text
+
+DEFAULT_DIM = int(os.getenv("VECTOR_INDEX_DIM", 2048))
+NGRAM_SIZES = (3, 4)
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "storage/vector")
+
+# Trọng số trường khi build vector dịch vụ: tên quan trọng hơn mô tả
+NAME_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.35
+
+# Ngưỡng cosine cho bước fuzzy dịch vụ (đo trên catalog: khớp đúng >= 0.4, câu không liên quan <= 0.2)
+SERVICE_MIN_SCORE = float(os.getenv("VECTOR_SERVICE_MIN_SCORE", 0.35))
+# Chỉ giữ các ứng viên gần điểm cao nhất (tránh kéo theo dịch vụ "na ná")
+SERVICE_SCORE_MARGIN = 0.12
+
+
+def _ngram_counts(text: str, sizes: Sequence[int] = NGRAM_SIZES) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for word in fold_text(text).split():
+        padded = f" {word} "
+        for n in sizes:
+            for i in range(max(1, len(padded) - n + 1)):
+                g = padded[i:i + n]
+                counts[g] = counts.get(g, 0) + 1
+    return counts
+
+
+def embed(text: str, dim: int = DEFAULT_DIM, weight: float = 1.0, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Vector băm n-gram (chưa chuẩn hoá nếu truyền `out` để cộng dồn nhiều trường)."""
+    vec = out if out is not None else np.zeros(dim, dtype=np.float32)
+    for g, c in _ngram_counts(text).items():
+        h = zlib.crc32(g.encode("utf-8"))
+        sign = 1.0 if (h >> 31) & 1 == 0 else -1.0  # giảm va chạm băm
+        vec[h % dim] += sign * weight * (1.0 + math.log(c))
+    if out is None:
+        _l2_normalize(vec)
+    return vec
+
+
+def _l2_normalize(vec: np.ndarray) -> np.ndarray:
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+class VectorIndex:
+    """Ma trận vector (n_items x dim) + nhãn tương ứng từng dòng."""
+
+    def __init__(self, labels: List[str], matrix: np.ndarray):
+        self.labels = labels
+        self.matrix = matrix
+        self.dim = matrix.shape[1] if matrix.ndim == 2 else DEFAULT_DIM
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[str, Sequence[Tuple[str, float]]]], dim: int = DEFAULT_DIM) -> "VectorIndex":
+        """items: [(nhãn, [(text, trọng số), ...]), ...]"""
+        labels, rows = [], []
+        for label, fields in items:
+            vec = np.zeros(dim, dtype=np.float32)
+            for text, weight in fields:
+                if text:
+                    embed(text, dim, weight, out=vec)
+            labels.append(label)
+            rows.append(_l2_normalize(vec))
+        matrix = np.vstack(rows) if rows else np.zeros((0, dim), dtype=np.float32)
+        return cls(labels, matrix)
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """Top-k (chỉ số dòng, cosine) theo thứ tự giảm dần."""
+        if not len(self.labels) or not (query or "").strip():
+            return []
+        scores = self.matrix @ embed(query, self.dim)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top if scores[i] >= min_score]
+
+    # ---------- Persist ----------
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # ghi file tạm rồi os.replace → worker khác không bao giờ mmap file đang ghi dở
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.labels, f, ensure_ascii=False)
+        os.replace(tmp, f"{path}.json")
+        with open(tmp, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.matrix, dtype=np.float32))
+        os.replace(tmp, f"{path}.npy")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["VectorIndex"]:
+        try:
+            matrix = np.load(f"{path}.npy", mmap_mode="r")
+            with open(f"{path}.json", encoding="utf-8") as f:
+                labels = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if matrix.shape[0] != len(labels):
+            return None
+        return cls(labels, matrix)
+
+
+def _fingerprint(items: List[Tuple[str, Sequence[Tuple[str, float]]]], dim: int) -> str:
+    h = hashlib.sha1(f"{dim}|{NGRAM_SIZES}".encode())
+    for label, fields in items:
+        h.update(label.encode("utf-8"))
+        for text, weight in fields:
+            h.update(f"|{weight}|{text}".encode("utf-8"))
+    return h.hexdigest()[:12]
+
+
+def load_or_build(name: str, items: List[Tuple[str, Sequence[Tuple[str, float]]]],
+                  dim: int = DEFAULT_DIM, index_dir: str = INDEX_DIR) -> VectorIndex:
+    """Nạp index đã lưu (mmap) nếu khớp fingerprint, ngược lại build + lưu (lỗi ghi → dùng bản trong RAM)."""
+    path = os.path.join(index_dir, f"{name}-{_fingerprint(items, dim)}")
+    index = VectorIndex.load(path)
+    if index is not None:
+        return index
+    index = VectorIndex.build(items, dim)
+    try:
+        index.save(path)
+    except OSError:
+        pass
+    return index
+
+
+# ============================
+#     CATALOG VECTOR INDEXES
+# ============================
+class CatalogVectors:
+    """Index vector cho dịch vụ (tên + mô tả) và spa (tên) của 1 CatalogIndex."""
+
+    def __init__(self, catalog: CatalogIndex, dim: int = DEFAULT_DIM):
+        self.catalog = catalog
+        self.services = load_or_build("services", [
+            (str(e.id), [(e.name, NAME_WEIGHT), (e.data.get("description", ""), DESCRIPTION_WEIGHT)])
+            for e in catalog.services
+        ], dim)
+        self.spa_names = list(dict.fromkeys(
+            [s.name for s in catalog.spas] + list(catalog.services_by_spa.keys())
+        ))
+        self.spas = load_or_build("spas", [(n, [(n, NAME_WEIGHT)]) for n in self.spa_names], dim)
+
+    def similar_services(self, text: str, k: int = 3, min_score: float = SERVICE_MIN_SCORE,
+                         margin: Optional[float] = SERVICE_SCORE_MARGIN):
+        """[(ServiceEntry, cosine)] — top-k trên ngưỡng, trong khoảng `margin` so với kết quả tốt nhất."""
+        hits = self.services.search(text, k, min_score)
+        if hits and margin is not None:
+            best = hits[0][1]
+            hits = [(i, sc) for i, sc in hits if sc >= best - margin]
+        return [(self.catalog.services[int(self.services.labels[i])], sc) for i, sc in hits]
+
+    def similar_spas(self, text: str, k: int = 5, min_score: float = 0.0) -> List[Tuple[str, float]]:
+        return [(self.spas.labels[i], score) for i, score in self.spas.search(text, k, min_score)]
+
+
+_VECTORS: Dict[int, CatalogVectors] = {}
+
+
+def get_catalog_vectors(catalog: Optional[CatalogIndex] = None) -> CatalogVectors:
+    """Index vector của catalog hiện tại (build/nạp 1 lần cho mỗi CatalogIndex)."""
+    catalog = catalog or get_catalog_index()
+    vectors = _VECTORS.get(id(catalog))
+    if vectors is None or vectors.catalog is not catalog:
+        vectors = CatalogVectors(catalog)
+        _VECTORS.clear()
+        _VECTORS[id(catalog)] = vectors
+    return vectors
+
+
+__all__ = ["VectorIndex", "CatalogVectors", "embed", "load_or_build", "get_catalog_vectors"]
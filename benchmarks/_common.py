@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Tiện ích chung cho các script benchmark: đường dẫn repo, app Flask tối thiểu, phân vị."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("CACHE_PUBSUB", "0")
+# index vector / model đã train nằm ở storage/ của repo dù chạy script từ thư mục nào
+os.environ.setdefault("VECTOR_INDEX_DIR", os.path.join(ROOT, "storage", "vector"))
+os.environ.setdefault("MODEL_DIR", os.path.join(ROOT, "storage", "models"))
+
+
+def make_app(redis_url=None, fake_redis=False):
+    """
+    App Flask chỉ có flask-caching (không MySQL / OpenAI):
+    redis_url → RedisCache thật; fake_redis → RedisCache trên fakeredis; mặc định SimpleCache.
+    """
+    from flask import Flask
+    from apps.extensions import cache
+
+    app = Flask("benchmark")
+    if redis_url:
+        app.config.update(CACHE_TYPE="RedisCache", CACHE_REDIS_URL=redis_url)
+    elif fake_redis:
+        import fakeredis
+        import redis
+        server = fakeredis.FakeServer()
+
+        class _FakeRedis(fakeredis.FakeRedis):
+            def __init__(self, *args, **kwargs):
+                for k in ("host", "port", "password", "db"):
+                    kwargs.pop(k, None)
+                super().__init__(server=server, **kwargs)
+
+        redis.Redis = _FakeRedis
+        app.config.update(CACHE_TYPE="RedisCache", CACHE_REDIS_HOST="localhost")
+    else:
+        app.config.update(CACHE_TYPE="SimpleCache")
+    cache.init_app(app)
+    return app
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[k]
+
+
+def fmt_ms(values):
+    return (f"p50={percentile(values, 50) * 1000:.2f}ms p99={percentile(values, 99) * 1000:.2f}ms "
+            f"mean={sum(values) / max(len(values), 1) * 1000:.2f}ms")
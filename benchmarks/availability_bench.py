@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Giữ chỗ đồng thời + tìm slot (user-019).
+
+- Hàng nghìn lượt giữ chỗ từ nhiều thread (và nhiều process nếu có --redis-url) vào 20 giờ
+  của cùng 1 spa; kiểm tra không ô nào bị 2 lượt giữ trên cùng 1 làn
+- So với bản "đọc - kiểm tra - SETBIT" không nguyên tử (để thấy lỗi giữ trùng)
+- Độ trễ find_slots 7 ngày
+
+    python benchmarks/availability_bench.py [--threads 64] [--per 50] [--procs 4] [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import multiprocessing as mp
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app
+
+from apps.extensions import cache
+from apps.utils.availability import (CELLS_PER_DAY, VN_TZ, MemoryAvailabilityStore, RedisAvailabilityStore,
+                                     cells_mask, lanes_of)
+
+SPA = "An Miên Spa"
+
+
+def _hours(days_ahead=3):
+    d = datetime.now(VN_TZ).date() + timedelta(days=days_ahead)
+    return [datetime(d.year, d.month, d.day, h, m, tzinfo=VN_TZ) for h in range(9, 19) for m in (0, 30)]
+
+
+class NaiveStore(RedisAvailabilityStore):
+    """Đọc bitmap, kiểm tra trong Python rồi SETBIT — không nguyên tử (chỉ để so sánh)."""
+
+    def _reserve(self, spa_name, day, start, cells, lanes):
+        key = self._key(spa_name, day)
+        need = cells_mask(start, start + cells)
+        for lane, busy in enumerate(lanes_of(self._read.get(key), lanes)):
+            if not busy & need:
+                time.sleep(0)  # nhường GIL như 1 round trip mạng
+                pipe = self._write.pipeline()
+                for i in range(cells):
+                    pipe.setbit(key, lane * CELLS_PER_DAY + start + i, 1)
+                pipe.execute()
+                return lane
+        return -1
+
+
+def overlaps(reservations):
+    seen, clashes = set(), 0
+    for r in reservations:
+        for c in range(r.start, r.start + r.cells):
+            key = (r.day, r.lane, c)
+            clashes += key in seen
+            seen.add(key)
+    return clashes
+
+
+def run_threads(app, store, hours, threads, per):
+    granted, lock = [], threading.Lock()
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        with app.app_context():
+            for _ in range(per):
+                r = store.reserve(SPA, None, rnd.choice(hours))
+                if r:
+                    with lock:
+                        granted.append(r)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return threads * per, granted, elapsed
+
+
+def _proc_worker(redis_url, hours, seed, per, queue):
+    app = make_app(redis_url=redis_url)
+    with app.app_context():
+        store = RedisAvailabilityStore(cache.cache)
+        rnd = random.Random(seed)
+        queue.put([r for r in (store.reserve(SPA, None, rnd.choice(hours)) for _ in range(per)) if r])
+
+
+def run_procs(redis_url, hours, procs, per):
+    queue = mp.Queue()
+    workers = [mp.Process(target=_proc_worker, args=(redis_url, hours, i, per, queue)) for i in range(procs)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    granted = [r for _ in workers for r in queue.get()]
+    for w in workers:
+        w.join()
+    return procs * per, granted, time.perf_counter() - started
+
+
+def report(label, result):
+    attempts, granted, elapsed = result
+    print(f"{label:24s} attempts={attempts:>6d} granted={len(granted):>4d} "
+          f"overlapping_cells={overlaps(granted):>4d} {attempts / elapsed:>10,.0f} attempts/s")
+
+
+def bench_find_slots(app, store, hours, n):
+    with app.app_context():
+        for h in hours[::3]:
+            store.reserve(SPA, None, h)
+        store.find_slots(SPA)
+        started = time.perf_counter()
+        for _ in range(n):
+            store.find_slots(SPA)
+        return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=64)
+    ap.add_argument("--per", type=int, default=50)
+    ap.add_argument("--procs", type=int, default=4)
+    ap.add_argument("--redis-url")
+    args = ap.parse_args()
+    hours = _hours()
+
+    app = make_app()
+    report("memory / threads", run_threads(app, MemoryAvailabilityStore(), hours, args.threads, args.per))
+    print(f"find_slots 7 days (memory): {bench_find_slots(app, MemoryAvailabilityStore(), _hours(4), 5000):.1f} us")
+
+    redis_app = make_app(redis_url=args.redis_url, fake_redis=not args.redis_url)
+    with redis_app.app_context():
+        backend = cache.cache
+        backend._write_client.flushdb()
+    label = "redis" if args.redis_url else "fakeredis"
+    report(f"{label} lua / threads", run_threads(redis_app, RedisAvailabilityStore(backend), hours, args.threads, args.per))
+    with redis_app.app_context():
+        backend._write_client.flushdb()
+    report(f"{label} naive / threads", run_threads(redis_app, NaiveStore(backend), hours, args.threads, args.per))
+    with redis_app.app_context():
+        backend._write_client.flushdb()
+    if args.redis_url:
+        report("redis lua / processes", run_procs(args.redis_url, hours, args.procs, args.threads * args.per // args.procs))
+    print(f"find_slots 7 days ({label}, 1 MGET): "
+          f"{bench_find_slots(redis_app, RedisAvailabilityStore(backend), _hours(4), 1000):.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Time-to-first-byte của /messages/v2 (JSON, chờ GPT sinh xong) vs /messages/v2/stream (SSE) (user-008).
+
+Model giả lập trong process theo dạng stream của OpenAI SDK:
+- --first-ms  : độ trễ tới token đầu tiên
+- --token-ms  : khoảng cách giữa các token, --tokens token / câu trả lời
+- Gọi không stream (endpoint JSON) → chờ đủ first + tokens × token rồi trả cả câu
+Đi qua Flask test client (buffered=False) → đo cả routing, khoá turn, nạp session và sse_response.
+TTFB của SSE = lúc nhận event đầu tiên; kèm thời gian tới event `done`.
+
+    python benchmarks/bench_sse.py [--turns 20] [--first-ms 300] [--token-ms 50] [--tokens 48]
+"""
+import argparse
+import time
+import types
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app, percentile
+
+from flask_restx import Api
+
+import apps.controllers.bot_controller as bot_controller
+from apps.dto.bot_dto import BotDto
+
+MESSAGES = ["da mặt bị mụn thì nên làm gì", "kem chống nắng loại nào tốt", "da dầu nên rửa mặt mấy lần",
+            "xin chào", "trị thâm sau mụn thế nào"]
+
+
+class StreamingCompletions:
+    def __init__(self, first_ms, token_ms, tokens):
+        self.first_s = first_ms / 1000.0
+        self.token_s = token_ms / 1000.0
+        self.tokens = [f"tok{i} " for i in range(tokens)]
+
+    def _chunks(self):
+        time.sleep(self.first_s)
+        for i, token in enumerate(self.tokens):
+            if i:
+                time.sleep(self.token_s)
+            delta = types.SimpleNamespace(content=token)
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        if "YES hoặc NO" in messages[0]["content"]:
+            text = "NO"
+        elif stream:
+            return self._chunks()
+        else:
+            text = "".join(chunk.choices[0].delta.content for chunk in self._chunks())
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def run_json(client, turns):
+    ttfb = []
+    for i in range(turns):
+        started = time.perf_counter()
+        response = client.post("/api/bots/messages/v2",
+                               json={"message": MESSAGES[i % len(MESSAGES)], "user_id": f"json-{i}"})
+        assert response.status_code == 200
+        ttfb.append(time.perf_counter() - started)  # JSON: byte đầu = cả câu trả lời
+    return ttfb, ttfb
+
+
+def run_sse(client, turns):
+    ttfb, total = [], []
+    for i in range(turns):
+        started = time.perf_counter()
+        response = client.post("/api/bots/messages/v2/stream",
+                               json={"message": MESSAGES[i % len(MESSAGES)], "user_id": f"sse-{i}"},
+                               buffered=False)
+        assert response.status_code == 200
+        first = None
+        for chunk in response.response:
+            if chunk and first is None:
+                first = time.perf_counter() - started
+        response.close()
+        ttfb.append(first)
+        total.append(time.perf_counter() - started)
+    return ttfb, total
+
+
+def report(label, ttfb, total):
+    def ms(values, p):
+        return percentile([v * 1000 for v in values], p)
+
+    print(f"{label:5s} TTFB p50={ms(ttfb, 50):6.0f}ms p99={ms(ttfb, 99):6.0f}ms   "
+          f"full reply p50={ms(total, 50):6.0f}ms   turns={len(ttfb)}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--first-ms", type=float, default=300)
+    ap.add_argument("--token-ms", type=float, default=50)
+    ap.add_argument("--tokens", type=int, default=48)
+    ap.add_argument("--fake-redis", action="store_true", help="RedisCache trên fakeredis thay vì SimpleCache")
+    args = ap.parse_args()
+
+    llm = types.SimpleNamespace(chat=types.SimpleNamespace(
+        completions=StreamingCompletions(args.first_ms, args.token_ms, args.tokens)))
+    bot_controller.get_llm_client = lambda: llm
+    app = make_app(fake_redis=args.fake_redis)
+    Api(app).add_namespace(BotDto.api, path="/api/bots")
+    client = app.test_client()
+    with app.app_context():
+        run_sse(client, 1)  # làm nóng: catalog, index, model cục bộ
+        report("json", *run_json(client, args.turns))
+        report("sse", *run_sse(client, args.turns))
+
+
+if __name__ == "__main__":
+    main()
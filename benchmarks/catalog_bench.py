@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Nạp catalog từ DB + đổi nóng (user-025), trên SQLite giả lập (mặc định 10k spa / 100k dịch vụ).
+
+- Thời gian SELECT, hash version, dựng snapshot (CatalogIndex + mọi cấu trúc dẫn xuất), bộ nhớ snapshot
+- Đường request: get_catalog() chỉ đọc 1 tham chiếu
+- request_reload(): bao lâu thì worker thấy snapshot mới; các thread đọc song song không bao giờ
+  thấy snapshot dở dang
+
+    python benchmarks/catalog_bench.py [--spas 10000] [--services 100000] [--db /tmp/catalog_bench.db]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import _common  # noqa: F401  (sys.path)
+from flask import Flask
+
+from apps.configs.mysql_config import db
+from apps.extensions import cache
+from apps.models.organization_model import OrganizationModel
+from apps.models.service_model import ServiceModel
+import apps.ai.intents  # noqa: F401  (đăng ký cấu trúc dẫn xuất của intents)
+from apps.utils.catalog_index import catalog_version
+from apps.utils.catalog_store import CatalogStore, build_snapshot, load_from_db, request_reload
+
+CITIES = ["Hồ Chí Minh", "Hà Nội", "Đà Nẵng", "Cần Thơ", "Huế", "Nha Trang"]
+WORDS = ["Chăm sóc", "Trị mụn", "Massage", "Gội đầu", "Tẩy da chết", "Peel", "Nâng cơ", "Triệt lông", "Phun mày"]
+
+
+def make_db_app(path):
+    app = Flask("catalog-benchmark")
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}", CACHE_TYPE="SimpleCache")
+    db.init_app(app)
+    cache.init_app(app)
+    return app
+
+
+def seed(spas, services, seed=1):
+    rnd = random.Random(seed)
+    db.create_all()
+    db.session.execute(OrganizationModel.__table__.insert(), [
+        {"id": i, "name": f"Spa {i} {rnd.choice(['Lotus', 'Mai', 'Hồng', 'An'])}",
+         "address": f"{i} Đường {i % 97}, Quận {i % 12}, {rnd.choice(CITIES)}",
+         "latitude": str(10 + rnd.random()), "longitude": str(106 + rnd.random())}
+        for i in range(1, spas + 1)])
+    db.session.execute(ServiceModel.__table__.insert(), [
+        {"id": j, "organization_id": 1 + j % spas, "name": f"{rnd.choice(WORDS)} {j % 50}",
+         "description": "Liệu trình " * 5, "deleted_at": None}
+        for j in range(1, services + 1)])
+    db.session.commit()
+
+
+def ms(started):
+    return (time.perf_counter() - started) * 1000
+
+
+def bench_build():
+    started = time.perf_counter()
+    locations, services = load_from_db()
+    fetch = ms(started)
+    started = time.perf_counter()
+    version = catalog_version(locations, services)
+    hashing = ms(started)
+    started = time.perf_counter()
+    snapshot = build_snapshot(locations, services, "db", version=version)
+    build = ms(started)
+    del snapshot
+    tracemalloc.start()
+    snapshot = build_snapshot(locations, services, "db", version=version)
+    size = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    print(f"spas={len(snapshot.locations)} services={len(snapshot.index.services)}")
+    print(f"select={fetch:.0f}ms hash={hashing:.0f}ms build_snapshot={build:.0f}ms snapshot={size:.0f}MB "
+          f"derived={sorted(snapshot._derived)}")
+
+
+def bench_reload(store):
+    started = time.perf_counter()
+    store.current()
+    print(f"first get_catalog (sync load): {ms(started):.0f}ms")
+    n = 200000
+    started = time.perf_counter()
+    for _ in range(n):
+        store.current()
+    print(f"get_catalog() request path: {ms(started) / n * 1000:.2f}us")
+
+    db.session.execute(ServiceModel.__table__.update().where(ServiceModel.id == 1)
+                       .values(name=f"Dịch vụ {time.time()}"))
+    db.session.commit()
+    stop, reads, torn = threading.Event(), [0], [0]
+
+    def reader(app):
+        with app.app_context():
+            while not stop.is_set():
+                s = store.current()
+                if (s.index.version != s.version or len(s.spa_names) != len(s.locations)
+                        or s.derived("spa_names_folded")[0][1] != s.spa_names[0]):
+                    torn[0] += 1
+                reads[0] += 1
+                time.sleep(0.0005)
+
+    from flask import current_app
+    app = current_app._get_current_object()
+    readers = [threading.Thread(target=reader, args=(app,)) for _ in range(4)]
+    for r in readers:
+        r.start()
+    old = store.current().version
+    started = time.perf_counter()
+    request_reload()
+    deadline = time.monotonic() + 120
+    while store.current().version == old and time.monotonic() < deadline:
+        time.sleep(0.01)
+    swap = ms(started)
+    stop.set()
+    for r in readers:
+        r.join()
+    print(f"hot reload visible after {swap:.0f}ms, reads during reload={reads[0]} torn={torn[0]} "
+          f"changed={store.current().version != old}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--spas", type=int, default=10000)
+    ap.add_argument("--services", type=int, default=100000)
+    ap.add_argument("--db", help="file SQLite (mặc định: file tạm, xoá khi xong)")
+    args = ap.parse_args()
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="catalog_bench_"), "catalog.db")
+    fresh = not os.path.exists(path)
+
+    app = make_db_app(path)
+    with app.app_context():
+        if fresh:
+            started = time.perf_counter()
+            seed(args.spas, args.services)
+            print(f"seeded {args.spas} spas / {args.services} services in {ms(started):.0f}ms ({path})")
+        bench_build()
+        bench_reload(CatalogStore(source="db"))
+    if not args.db:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
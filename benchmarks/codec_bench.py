@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Bytes + thời gian mã hoá giá trị nóng của hội thoại (user-023): định dạng cũ vs khung gọn.
+
+- Cũ: bản nháp = "!" + pickle (RedisSerializer của flask-caching), mục history = JSON dict
+- Mới: apps.utils.codec (list theo vị trí, slot = số phút, zlib khi có lợi)
+Phần 1: bản nháp điển hình (đang chọn giờ, 8 slot gợi ý) + 20 mục history — bytes, µs encode / decode.
+Phần 2 (--turns > 0): chạy kịch bản /messages/v2 trên fakeredis cho --users user, báo bytes / user
+theo từng khoá Redis.
+
+    python benchmarks/codec_bench.py [--users 8] [--turns 19] [--n 5000]
+"""
+import argparse
+import json
+import pickle
+import timeit
+import types
+from datetime import datetime, timedelta
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app
+
+from apps.utils.booking_flow import slot_of
+from apps.utils.codec import decode_booking, decode_entry, encode_booking, encode_entry
+
+SCRIPT = [
+    "xin chào", "tìm spa ở hồ chí minh", "1", "An Miên Spa giới thiệu", "danh sách dịch vụ của An Miên Spa",
+    "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược", "2", "đồng ý", "xem lịch hẹn của tôi",
+    "lịch hẹn ngày mai", "trị mụn thế nào", "massage", "đặt hẹn massage đá nóng 15/12/2030 14:00", "đồng ý",
+    "Chăm sóc da mụn là gì", "đặt lịch ở PMT", "đặt hẹn thêm", "acne studio", "1",
+]
+
+
+def sample_draft():
+    start = datetime(2030, 12, 15, 9, 0)
+    slots = [slot_of(start + timedelta(minutes=30 * i)) for i in range(8)]
+    return {"active": True, "spa_name": "An Miên Spa", "service_name": "Gội đầu dưỡng sinh thảo dược",
+            "available_slots": slots, "previous_slot": slots[0]}
+
+
+def sample_entries():
+    reply = "Dạ, An Miên Spa có các dịch vụ: " + ", ".join(["Gội đầu dưỡng sinh thảo dược (60 phút)"] * 4)
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": "đặt lịch gội đầu chiều mai" if i % 2 == 0
+             else reply} for i in range(20)]
+
+
+def legacy_booking(data):
+    return b"!" + pickle.dumps(data)
+
+
+def legacy_entry(entry):
+    return json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+
+def us(fn, n):
+    return min(timeit.repeat(fn, number=n, repeat=5)) / n * 1e6
+
+
+def report_values(n):
+    draft, entries = sample_draft(), sample_entries()
+    old_b, new_b = legacy_booking(draft), encode_booking(draft)
+    old_e, new_e = [legacy_entry(e) for e in entries], [encode_entry(e) for e in entries]
+    assert decode_booking(new_b) == draft and [decode_entry(e) for e in new_e] == entries
+    print(f"booking draft : legacy {len(old_b):5d} B  compact {len(new_b):5d} B")
+    print(f"20 entries    : legacy {sum(map(len, old_e)):5d} B  compact {sum(map(len, new_e)):5d} B")
+    print(f"encode draft  : legacy {us(lambda: legacy_booking(draft), n):6.1f} us  "
+          f"compact {us(lambda: encode_booking(draft), n):6.1f} us")
+    print(f"decode draft  : legacy {us(lambda: pickle.loads(old_b[1:]), n):6.1f} us  "
+          f"compact {us(lambda: decode_booking(new_b), n):6.1f} us")
+    print(f"decode 20 ent.: legacy {us(lambda: [json.loads(e) for e in old_e], n):6.1f} us  "
+          f"compact {us(lambda: [decode_entry(e) for e in new_e], n):6.1f} us")
+
+
+def report_redis(users, turns):
+    import apps.controllers.bot_controller as bot_controller
+    from apps.extensions import cache
+
+    message = types.SimpleNamespace(content="NO")
+    completion = types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(
+        completions=types.SimpleNamespace(create=lambda **kwargs: completion)))
+    bot_controller.get_llm_client = lambda: client
+    app = make_app(fake_redis=True)
+    with app.app_context():
+        api = bot_controller.MessageV2()
+        for u in range(users):
+            for text in SCRIPT[:turns]:
+                api.answer({"message": text, "user_id": f"codec{u}"})
+        r = cache.cache._write_client
+        sizes = {}
+        for key in r.scan_iter("*codec0*"):
+            key, kind = key.decode(), r.type(key).decode()
+            if kind == "list":
+                sizes[key] = sum(len(x) for x in r.lrange(key, 0, -1))
+            elif kind == "hash":
+                sizes[key] = sum(len(k) + len(v) for k, v in r.hgetall(key).items())
+            elif kind == "string":
+                sizes[key] = r.strlen(key)
+    print(f"redis payload, user codec0 after {turns} turns:")
+    for key, n in sorted(sizes.items()):
+        print(f"  {key:44s} {n:6d} B")
+    print(f"  total {sum(sizes.values())} B/user")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=8)
+    ap.add_argument("--turns", type=int, default=19)
+    ap.add_argument("--n", type=int, default=5000)
+    args = ap.parse_args()
+    report_values(args.n)
+    if args.turns:
+        report_redis(args.users, args.turns)
+
+
+if __name__ == "__main__":
+    main()
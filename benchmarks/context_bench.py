@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Token history gửi kèm prompt qua 100 turn (user-014): cách cũ vs build_context theo ngân sách.
+
+- Reply: cũ = 20 tin gần nhất; mới = REPLY_BUDGET token (+ tóm tắt phần cũ)
+- NLU  : cũ = cả history; mới = NLU_BUDGET token
+Tóm tắt chạy ngay trong turn (LLM giả lập trả bản tóm tắt cố định) để kết quả xác định.
+
+    python benchmarks/context_bench.py [--turns 100] [--seed 1]
+"""
+import argparse
+import random
+import statistics
+import types
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app
+
+from apps.ai.context_builder import NLU_BUDGET, REPLY_BUDGET, build_context, messages_tokens
+from apps.utils import metrics
+from apps.utils.conversation_store import get_conversation_store
+from apps.vector import speculative
+
+SUMMARY = ("- Khách quan tâm massage đá nóng tại An Miên Spa\n- Đã đặt lịch 15/12 lúc 14:00\n"
+           "- Đang hỏi về chăm sóc da mụn")
+USER_MESSAGES = [
+    "tìm spa ở hồ chí minh", "An Miên Spa giới thiệu", "danh sách dịch vụ của An Miên Spa",
+    "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược chiều mai", "trị mụn thế nào, da mình dầu và hay nổi mụn ẩn",
+    "xem lịch hẹn của tôi", "đồng ý", "2",
+]
+LONG_REPLY = "Dạ, An Miên Spa có các dịch vụ: " + ", ".join(["Gội đầu dưỡng sinh thảo dược (60 phút) – 250.000đ"] * 8)
+SHORT_REPLY = "Dạ, bạn muốn đặt vào khung giờ nào ạ?"
+
+
+class _Done:
+    """Kết quả chạy ngay (thay pool speculative để tóm tắt xác định)."""
+
+    def __init__(self, result):
+        self.result = result
+
+
+def summary_client():
+    message = types.SimpleNamespace(content=SUMMARY)
+    completion = types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+    return types.SimpleNamespace(chat=types.SimpleNamespace(
+        completions=types.SimpleNamespace(create=lambda **kwargs: completion)))
+
+
+def simulate(turns, seed):
+    rnd = random.Random(seed)
+    client = summary_client()
+    store = get_conversation_store()
+    key = "chat:context-bench"
+    store.clear(key)
+    full, rows = [], {"reply_old": [], "reply_new": [], "nlu_old": [], "nlu_new": []}
+    for _ in range(turns):
+        user = {"role": "user", "content": rnd.choice(USER_MESSAGES)}
+        window = store.window(key)
+        window.append(user)
+        full.append(user)
+        rows["reply_old"].append(messages_tokens(full[-20:]))
+        rows["nlu_old"].append(messages_tokens(full + [user]))
+        rows["reply_new"].append(messages_tokens(build_context(window, REPLY_BUDGET, client)))
+        rows["nlu_new"].append(messages_tokens(build_context(window, NLU_BUDGET, client) + [user]))
+        reply = {"role": "assistant", "content": rnd.choice([LONG_REPLY, SHORT_REPLY, SHORT_REPLY])}
+        window.append(reply)
+        full.append(reply)
+        store.save(key, window)
+    return rows
+
+
+def row(label, xs):
+    marks = " ".join(f"turn{t}={xs[t - 1]:5d}" for t in (10, 50, 100) if t <= len(xs))
+    return f"{label:28s} {marks} mean={statistics.mean(xs):7.1f} max={max(xs):5d} total={sum(xs)}"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=100)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    speculative.submit = lambda fn, *a, **kw: _Done(fn(*a, **kw))
+
+    app = make_app()
+    with app.app_context():
+        rows = simulate(args.turns, args.seed)
+    print(row("reply  old (last 20 msgs)", rows["reply_old"]))
+    print(row(f"reply  new (budget {REPLY_BUDGET})", rows["reply_new"]))
+    print(row("nlu    old (full history)", rows["nlu_old"]))
+    print(row(f"nlu    new (budget {NLU_BUDGET})", rows["nlu_new"]))
+    print("summary refreshes:", metrics.get("context.summary_refresh"))
+
+
+if __name__ == "__main__":
+    main()
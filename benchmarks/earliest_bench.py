@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tìm giờ trống sớm nhất trên nhiều spa (user-020).
+
+- Catalog giả N spa (mặc định 5000), 2 ngày đầu gần kín, các ngày sau ~20% ô bận
+- So vòng lặp find_slots từng spa + sắp xếp (cách cũ) với earliest_slots (1 lượt đọc / ngày, numpy)
+- Câu hỏi chung ('massage sớm nhất') trên nhiều dịch vụ: gộp các dòng giờ bằng heapq.merge
+
+    python benchmarks/earliest_bench.py [--spas 5000] [--services 4] [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import heapq
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app, percentile
+
+from apps.extensions import cache
+from apps.utils.availability import (CAPACITY, LANE_BYTES, VN_TZ, MemoryAvailabilityStore, RedisAvailabilityStore,
+                                     _day_key)
+
+
+def fill(store, names, days=4, seed=7):
+    """Ghi thẳng bitmap (cùng bố cục với Redis) cho mỗi spa / ngày."""
+    rnd = random.Random(seed)
+    today = datetime.now(VN_TZ).date()
+    raws = {}
+    for name in names:
+        for d in range(days):
+            density = 0.97 if d < 2 else 0.2
+            lanes = [sum(1 << (95 - c) for c in range(96) if rnd.random() < density) for _ in range(CAPACITY)]
+            raws[(name, today + timedelta(days=d))] = b"".join(lane.to_bytes(LANE_BYTES, "big") for lane in lanes)
+    if isinstance(store, MemoryAvailabilityStore):
+        store._days.update({(name, _day_key(day)): bytearray(raw) for (name, day), raw in raws.items()})
+    else:
+        pipe = store._write.pipeline(transaction=False)
+        for (name, day), raw in raws.items():
+            pipe.set(store._key(name, day), raw)
+        pipe.execute()
+
+
+def per_spa(store, names, limit=5):
+    """Cách cũ: find_slots từng spa rồi lấy N spa có giờ sớm nhất."""
+    heads = []
+    for name in names:
+        slots = store.find_slots(name, limit=1)
+        if slots:
+            heads.append((slots[0]["iso"], name))
+    return [name for _iso, name in heapq.nsmallest(limit, heads)]
+
+
+def many_services(store, names, services, limit=5):
+    streams = [[{**opt, "service_name": s} for opt in store.earliest_slots(names, s, limit=limit)] for s in services]
+    return list(islice(heapq.merge(*streams, key=lambda opt: opt["iso"]), limit))
+
+
+def timed(fn, reps):
+    fn()
+    samples = []
+    for _ in range(reps):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentile(samples, 50) * 1000
+
+
+def bench(label, app, store, names, services, reps):
+    with app.app_context():
+        fill(store, names)
+        fast = [o["spa_name"] for o in store.earliest_slots(names, limit=5)]
+        print(f"{label}: same top-5 as per-spa loop: {fast == per_spa(store, names)}")
+        print(f"  per-spa find_slots loop     : {timed(lambda: per_spa(store, names), reps):9.1f} ms")
+        print(f"  earliest_slots {len(names):>5d} spas   : "
+              f"{timed(lambda: store.earliest_slots(names, limit=5), reps):9.1f} ms")
+        print(f"  earliest_slots   500 spas   : {timed(lambda: store.earliest_slots(names[:500], limit=5), reps):9.1f} ms")
+        print(f"  {f'{len(services)} services merged':28s}: "
+              f"{timed(lambda: many_services(store, names, services), reps):9.1f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--spas", type=int, default=5000)
+    ap.add_argument("--services", type=int, default=4)
+    ap.add_argument("--reps", type=int, default=5)
+    ap.add_argument("--redis-url")
+    args = ap.parse_args()
+    names = [f"Synthetic Spa {i:05d}" for i in range(args.spas)]
+    services = [f"Synthetic Service {i}" for i in range(args.services)]
+
+    bench("memory", make_app(), MemoryAvailabilityStore(), names, services, args.reps)
+    redis_app = make_app(redis_url=args.redis_url, fake_redis=not args.redis_url)
+    with redis_app.app_context():
+        cache.cache._write_client.flushdb()
+        store = RedisAvailabilityStore(cache.cache)
+    bench("redis" if args.redis_url else "fakeredis", redis_app, store, names, services, max(args.reps // 2, 1))
+
+
+if __name__ == "__main__":
+    main()
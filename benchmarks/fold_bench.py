@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Bỏ dấu tiếng Việt (user-001): bản cũ (NFD + unicodedata.name từng ký tự) vs bảng str.translate
+tính sẵn vs LRU theo chuỗi.
+
+- Kiểm tra kết quả giống hệt bản cũ trên mọi code point U+0080..U+2FFF và toàn bộ text catalog
+- Đo µs / lần gọi trên câu chat thường gặp
+
+    python benchmarks/fold_bench.py [--n 20000]
+"""
+import argparse
+import re
+import time
+import unicodedata
+
+import _common  # noqa: F401  (sys.path)
+
+from apps.utils.spa_locations import spa_locations
+from apps.utils.spa_services import spa_services
+from apps.utils.text_normalize import fold_text
+
+MESSAGES = [
+    "Tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược ở An Miên Spa lúc 9h sáng mai",
+    "tìm spa ở hồ chí minh",
+    "lịch hẹn tuần này của tôi",
+    "đồng ý",
+]
+
+
+def legacy_fold(s):
+    """Bản trước user-001 (từng module tự cài)."""
+    s = (s or "").casefold().strip()
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+
+    def fold_char(ch):
+        if ch.isascii():
+            return ch
+        name = unicodedata.name(ch, "")
+        if name.startswith("LATIN") and " LETTER " in name and " WITH " in name:
+            base = name.split(" LETTER ", 1)[1].split(" WITH ", 1)[0]
+            for c in base:
+                if c.isalpha():
+                    return c.lower()
+        if ch in ("đ", "Đ"):
+            return "d"
+        return ch
+
+    s = "".join(fold_char(ch) for ch in s)
+    return re.sub(r"\s+", " ", s)
+
+
+def samples():
+    out = [x[k] for x in spa_locations for k in ("name", "address", "description")]
+    for items in spa_services.values():
+        out += [x[k] for x in items for k in ("name", "description")]
+    out += ["Tôi muốn ĐẶT LỊCH gội đầu 9h kém 15 tối mai 🙂", "  Xin   chào\tĐà Nẵng  ", "Ωμέγα ё ß ǅ ﬁ", None, ""]
+    return out + [chr(cp) for cp in range(0x80, 0x3000)]
+
+
+def per_call_us(fn, n):
+    started = time.perf_counter()
+    for i in range(n):
+        fn(MESSAGES[i % len(MESSAGES)])
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=20000)
+    args = ap.parse_args()
+
+    mismatches = [s for s in samples() if legacy_fold(s) != fold_text(s)]
+    print(f"mismatches vs legacy: {len(mismatches)} {mismatches[:5]}")
+
+    legacy = per_call_us(legacy_fold, args.n)
+    fold_text.cache_clear()
+    table = per_call_us(fold_text.__wrapped__, args.n)
+    cached = per_call_us(fold_text, args.n)
+    print(f"legacy {legacy:.1f}us  table {table:.1f}us  cached {cached:.2f}us  per call "
+          f"(speed-up x{legacy / table:.1f} / x{legacy / cached:.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Thông lượng + độ trùng của id lịch hẹn: timestamp giây (cũ) vs snowflake vs redis_block.
+
+    python benchmarks/id_allocator_bench.py [--threads 32] [--per 5000] [--procs 8] [--redis-url redis://localhost:6379/15]
+
+Không có --redis-url → redis_block chạy trên fakeredis (chỉ đo trong 1 process).
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps.utils.id_allocator import RedisBlockIdAllocator, SnowflakeIdAllocator  # noqa: E402
+
+
+def _legacy_id():
+    return f"APPT-{int(datetime.now().timestamp())}"
+
+
+def run_threads(next_id, threads, per):
+    out = [None] * threads
+
+    def run(i):
+        out[i] = [next_id() for _ in range(per)]
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    ids = [i for chunk in out for i in chunk]
+    return len(ids), len(set(ids)), len(ids) / elapsed
+
+
+def _proc_snowflake(worker_id, per, queue):
+    allocator = SnowflakeIdAllocator(worker_id)
+    queue.put([allocator.next_id() for _ in range(per)])
+
+
+def _proc_block(url, per, queue):
+    import redis
+    client = redis.Redis.from_url(url)
+    allocator = RedisBlockIdAllocator(lambda n: client.incrby("bench:id_alloc", n))
+    queue.put([allocator.next_id() for _ in range(per)])
+
+
+def run_procs(target, args_for, procs, per):
+    queue = mp.Queue()
+    workers = [mp.Process(target=target, args=(*args_for(i), per, queue)) for i in range(procs)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    ids = [i for _ in workers for i in queue.get()]
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    return len(ids), len(set(ids)), len(ids) / elapsed
+
+
+def report(label, result):
+    total, unique, rate = result
+    print(f"{label:28s} ids={total:>8d} unique={unique:>8d} dup={total - unique:>7d} {rate:>12,.0f} id/s")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=32)
+    ap.add_argument("--per", type=int, default=5000)
+    ap.add_argument("--procs", type=int, default=8)
+    ap.add_argument("--redis-url")
+    args = ap.parse_args()
+
+    report("legacy timestamp / threads", run_threads(_legacy_id, args.threads, min(args.per, 200)))
+    report("snowflake / threads", run_threads(SnowflakeIdAllocator(7).next_id, args.threads, args.per))
+    report("snowflake / processes", run_procs(_proc_snowflake, lambda i: (i,), args.procs, args.per * 10))
+
+    if args.redis_url:
+        import redis
+        client = redis.Redis.from_url(args.redis_url)
+        block = RedisBlockIdAllocator(lambda n: client.incrby("bench:id_alloc", n))
+        report("redis_block / threads", run_threads(block.next_id, args.threads, args.per))
+        report("redis_block / processes",
+               run_procs(_proc_block, lambda i: (args.redis_url,), args.procs, args.per * 10))
+    else:
+        import fakeredis
+        client = fakeredis.FakeRedis()
+        block = RedisBlockIdAllocator(lambda n: client.incrby("bench:id_alloc", n))
+        report("redis_block(fake) / threads", run_threads(block.next_id, args.threads, args.per))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Số round trip Redis mỗi request của /messages/v2 (user-016).
+
+Đếm ở client redis-py: mỗi lệnh gửi thẳng (`Redis.execute_command`, gồm cả EVALSHA của script)
+= 1 round trip, mỗi `Pipeline.execute` = 1 round trip dù chứa bao nhiêu lệnh.
+Chạy kịch bản hội thoại cố định (LLM giả, trả lời ngay) rồi báo p50 / mean / max mỗi turn
+và các lệnh gửi nhiều nhất. Mặc định fakeredis; --redis-url để đo trên Redis thật.
+
+Script chỉ dùng MessageV2.answer → chạy được trên checkout trước user-016 để lấy số "trước".
+
+    python benchmarks/roundtrip_bench.py [--rounds 3] [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import time
+import types
+from collections import Counter
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app, percentile
+
+import redis
+import redis.client
+
+import apps.controllers.bot_controller as bot_controller
+
+SCRIPT = [
+    "xin chào", "tìm spa ở hồ chí minh", "1", "An Miên Spa giới thiệu", "danh sách dịch vụ của An Miên Spa",
+    "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược", "2", "đồng ý", "xem lịch hẹn của tôi",
+    "lịch hẹn ngày mai", "trị mụn thế nào", "massage", "đặt hẹn massage đá nóng 15/12/2030 14:00", "đồng ý",
+    "Chăm sóc da mụn là gì", "spa ở quận 10", "Nấm spa có tốt không", "bảng giá", "body massage",
+]
+
+
+class InstantCompletions:
+    def create(self, model=None, messages=None, **kwargs):
+        text = "NO" if "YES hoặc NO" in messages[0]["content"] else "GPT-REPLY"
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+class RoundTrips:
+    """Đếm round trip của mọi client redis-py trong process (vá lớp, không vá instance)."""
+
+    def __init__(self):
+        self.count = 0
+        self.commands = Counter()
+
+    def install(self):
+        counter = self
+        execute_command = redis.Redis.execute_command
+        pipeline_execute = redis.client.Pipeline.execute
+
+        def counted_command(client, *args, **options):
+            if not isinstance(client, redis.client.Pipeline):
+                counter.count += 1
+                counter.commands[str(args[0]).upper()] += 1
+            return execute_command(client, *args, **options)
+
+        def counted_pipeline(pipe, *args, **kwargs):
+            if pipe.command_stack:
+                counter.count += 1
+                counter.commands["PIPELINE(" + ",".join(sorted({str(c[0][0]).upper() for c in pipe.command_stack})) + ")"] += 1
+            return pipeline_execute(pipe, *args, **kwargs)
+
+        redis.Redis.execute_command = counted_command
+        redis.client.Pipeline.execute = counted_pipeline
+
+
+def run(api, rounds, counter):
+    per_turn = []
+    for r in range(rounds):
+        user_id = f"rt-{r}-{time.time_ns()}"
+        for message in SCRIPT:
+            before = counter.count
+            api.answer({"message": message, "user_id": user_id})
+            per_turn.append(counter.count - before)
+    return per_turn
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--redis-url")
+    args = ap.parse_args()
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=InstantCompletions()))
+    bot_controller.get_llm_client = lambda: client
+    app = make_app(redis_url=args.redis_url, fake_redis=not args.redis_url)
+    counter = RoundTrips()
+    with app.app_context():
+        api = bot_controller.MessageV2()
+        run(api, 1, RoundTrips())  # làm nóng: catalog, index, model cục bộ, nạp script Lua
+        counter.install()
+        per_turn = run(api, args.rounds, counter)
+    print(f"round trip / turn: p50={percentile(per_turn, 50)} mean={sum(per_turn) / len(per_turn):.1f} "
+          f"max={max(per_turn)} turns={len(per_turn)}")
+    for command, n in counter.commands.most_common(8):
+        print(f"  {command:40s} {n / len(per_turn):5.2f} / turn")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Độ trễ turn /messages/v2 khi cổng skincare (LLM YES/NO) chạy tuần tự vs speculative (user-012).
+
+LLM giả lập trong process, có chèn độ trễ:
+- YES/NO: log-normal, trung vị --gate-ms (đuôi dài, chặn ở 2s)
+- câu trả lời GPT: cố định --reply-ms
+Model cục bộ bị ép "không chắc" (SKIN_LOCAL_CONFIDENCE=0.99) và bỏ cache → mọi câu đều qua LLM,
+đúng trường hợp speculative có lợi. Báo p50 / p90 / p99 cho từng chế độ.
+
+    python benchmarks/speculative_bench.py [--rounds 3] [--gate-ms 370] [--reply-ms 300]
+"""
+import argparse
+import math
+import os
+import random
+import time
+import types
+
+os.environ.setdefault("SKIN_LOCAL_CONFIDENCE", "0.99")
+os.environ.setdefault("SKIN_CACHE_BYPASS", "1")
+
+import _common  # noqa: F401  (sys.path)
+from _common import make_app, percentile
+
+import apps.controllers.bot_controller as bot_controller
+from apps.utils import metrics
+
+SCRIPT = [
+    "xin chào", "tìm spa ở hồ chí minh", "1", "An Miên Spa giới thiệu", "danh sách dịch vụ của An Miên Spa",
+    "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược", "2", "đồng ý", "xem lịch hẹn của tôi",
+    "lịch hẹn ngày mai", "trị mụn thế nào", "massage", "đặt hẹn massage đá nóng 15/12/2030 14:00", "đồng ý",
+    "Chăm sóc da mụn là gì", "spa ở quận 10", "Nấm spa có tốt không", "bảng giá", "body massage",
+]
+
+
+class SlowCompletions:
+    def __init__(self, gate_ms, reply_ms, seed=7):
+        self.gate_mu = math.log(gate_ms / 1000.0)
+        self.reply_s = reply_ms / 1000.0
+        self.rng = random.Random(seed)
+
+    def create(self, model=None, messages=None, **kwargs):
+        if "YES hoặc NO" in messages[0]["content"]:
+            time.sleep(min(2.0, self.rng.lognormvariate(self.gate_mu, 0.5)))
+            user = messages[-1]["content"].lower()
+            text = "YES" if ("mụn" in user or "da dầu" in user) else "NO"
+        else:
+            time.sleep(self.reply_s)
+            text = "GPT-REPLY"
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def run(api, mode, rounds):
+    os.environ["SKIN_GATE_MODE"] = mode
+    samples = []
+    for r in range(rounds):
+        user_id = f"spec-{mode}-{r}"
+        for message in SCRIPT:
+            started = time.perf_counter()
+            api.answer({"message": message, "user_id": user_id})
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def report(label, samples):
+    ms = [s * 1000 for s in samples]
+    print(f"{label:12s} p50={percentile(ms, 50):5.0f}ms p90={percentile(ms, 90):5.0f}ms "
+          f"p99={percentile(ms, 99):5.0f}ms mean={sum(ms) / len(ms):5.0f}ms turns={len(ms)}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=3)
+    ap.add_argument("--gate-ms", type=float, default=370)
+    ap.add_argument("--reply-ms", type=float, default=300)
+    args = ap.parse_args()
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(
+        completions=SlowCompletions(args.gate_ms, args.reply_ms)))
+    bot_controller.get_llm_client = lambda: client
+    app = make_app()
+    with app.app_context():
+        api = bot_controller.MessageV2()
+        run(api, "sequential", 1)  # làm nóng: catalog, index, model cục bộ
+        report("sequential", run(api, "sequential", args.rounds))
+        metrics.reset()
+        report("speculative", run(api, "speculative", args.rounds))
+        print("speculative:", metrics.snapshot().get("speculative"))
+
+
+if __name__ == "__main__":
+    main()
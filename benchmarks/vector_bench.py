@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+So khớp gần đúng dịch vụ (user-005): index vector n-gram vs difflib trên tên đã bỏ dấu (cách cũ).
+
+- Recall@1 / @3 trên bộ câu diễn đạt lại / viết sai có nhãn (QUERIES)
+- Độ trễ p50 / p99 mỗi câu trên catalog hiện tại và trên catalog giả lập lớn (--synthetic)
+
+    python benchmarks/vector_bench.py [--synthetic 10000] [--reps 200]
+"""
+import argparse
+import random
+import time
+from difflib import get_close_matches
+
+import _common  # noqa: F401  (sys.path)
+from _common import fmt_ms
+
+from apps.utils.catalog_index import get_catalog_index
+from apps.utils.text_normalize import fold_text
+from apps.vector.vector_index import DESCRIPTION_WEIGHT, NAME_WEIGHT, VectorIndex, get_catalog_vectors
+
+# (câu user, dịch vụ đúng)
+QUERIES = [
+    ("goi dau thao moc", "Gội đầu dưỡng sinh thảo dược"),
+    ("gội đầu dưỡng sinh", "Gội đầu dưỡng sinh thảo dược"),
+    ("mat xa da nong", "Massage đá nóng"),
+    ("massage body", "Body Massage"),
+    ("mát xa thái lan", "Massage Thái"),
+    ("bấm huyệt massage", "Massage và Bấm huyệt"),
+    ("detox da dau", "Detox da đầu"),
+    ("cham soc da mun", "Chăm sóc da mụn"),
+    ("triet long diode", "Triệt Lông công nghệ cao Diode Laser"),
+    ("thanh loc da co2", "Thanh lọc da CO2"),
+    ("tri mun cong nghe cao", "Liệu trình trị mụn công nghệ cao"),
+    ("lam sang da", "Liệu trình làm sáng da toàn diện"),
+    ("chăm sóc da cơ bản", "Chăm sóc da cơ bản"),
+    ("tôi muốn đặt lịch gội đầu thảo dược chiều mai", "Gội đầu dưỡng sinh thảo dược"),
+    ("cho mình hỏi giá massage đá nóng", "Massage đá nóng"),
+    ("massge thai", "Massage Thái"),
+]
+
+
+def difflib_top(index, query, k=3):
+    msg = fold_text(query)
+    return [index.services_by_folded[c][0].name
+            for c in get_close_matches(msg, index.folded_service_names(), n=k, cutoff=0.6)]
+
+
+def vector_top(vectors, query, k=3):
+    return [entry.name for entry, _score in vectors.similar_services(query, k=k, margin=None)]
+
+
+def recall(top_fn, k):
+    hits = sum(fold_text(expected) in {fold_text(n) for n in top_fn(q)[:k]} for q, expected in QUERIES)
+    return f"{hits}/{len(QUERIES)}"
+
+
+def latencies(fn, queries, reps):
+    out = []
+    for i in range(reps):
+        started = time.perf_counter()
+        fn(queries[i % len(queries)])
+        out.append(time.perf_counter() - started)
+    return out
+
+
+def synthetic(n, seed=3):
+    rnd = random.Random(seed)
+    words = ["gội", "đầu", "massage", "đá", "nóng", "thái", "trị", "mụn", "da", "chăm", "sóc", "triệt", "lông",
+             "laser", "detox", "thảo", "dược", "body", "bấm", "huyệt", "peel", "nâng", "cơ", "sáng"]
+    return [(str(i), [(" ".join(rnd.sample(words, 3)), NAME_WEIGHT), (" ".join(rnd.sample(words, 8)),
+                                                                       DESCRIPTION_WEIGHT)])
+            for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--synthetic", type=int, default=10000)
+    ap.add_argument("--reps", type=int, default=500)
+    args = ap.parse_args()
+
+    index = get_catalog_index()
+    vectors = get_catalog_vectors(index)
+    queries = [q for q, _ in QUERIES]
+    print(f"catalog: {len(index.services)} services, {len(QUERIES)} labelled queries")
+    print(f"  difflib recall@1={recall(lambda q: difflib_top(index, q), 1)} "
+          f"recall@3={recall(lambda q: difflib_top(index, q), 3)}")
+    print(f"  vector  recall@1={recall(lambda q: vector_top(vectors, q), 1)} "
+          f"recall@3={recall(lambda q: vector_top(vectors, q), 3)}")
+    print(f"  difflib {fmt_ms(latencies(lambda q: difflib_top(index, q), queries, args.reps))}")
+    print(f"  vector  {fmt_ms(latencies(lambda q: vector_top(vectors, q), queries, args.reps))}")
+
+    if args.synthetic:
+        items = synthetic(args.synthetic)
+        started = time.perf_counter()
+        big = VectorIndex.build(items)
+        print(f"synthetic: {args.synthetic} services, build {(time.perf_counter() - started):.1f}s")
+        names = [fold_text(fields[0][0]) for _label, fields in items]
+        print(f"  difflib {fmt_ms(latencies(lambda q: get_close_matches(fold_text(q), names, 3, 0.6), queries, 50))}")
+        print(f"  vector  {fmt_ms(latencies(lambda q: big.search(q, 3), queries, args.reps))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 from flask import Flask
 from dotenv import load_dotenv
 import os
+
+# nạp .env TRƯỚC khi import các module bên dưới: nhiều module (catalog_store,
+# turn_lock, conversation_store, tiered_cache...) đọc biến môi trường lúc import
+load_dotenv()
+
 from apps.configs.mysql_config import MysqlConfig
 from apps.configs.api_doc_config import ApiDocConfig
 from apps.route.route import Route
@@ -8,8 +13,8 @@ from flask_jwt_extended import JWTManager
 from apps.configs.config import Config
 from apps.configs.cors_config import CORSConfig
 from apps.extensions import cache
-
-load_dotenv()
+from apps.vector.skin_classifier import get_skin_classifier
+from apps.utils.catalog_store import get_catalog
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -20,6 +25,9 @@ MysqlConfig(app).connection()
 Route(api_doc).instance()
 JWTManager(app)
 cache.init_app(app)
+with app.app_context():
+  get_catalog()  # nạp catalog spa / dịch vụ trước request đầu tiên
+  get_skin_classifier()  # model lọc câu hỏi skincare: dẫn xuất của catalog, nạp (hoặc train) cùng snapshot
 @app.route('/')
 def index():
     return 'Home'
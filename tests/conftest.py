@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Fixture chung: app Flask tối thiểu (không MySQL, không OpenAI) với flask-caching
+- `app`        : SimpleCache → các store dùng bản in-memory
+- `redis_app`  : RedisCache trỏ vào fakeredis (có Lua qua lupa) → các store dùng bản Redis
+"""
+import os
+
+os.environ.setdefault("CACHE_PUBSUB", "0")  # không mở thread lắng nghe pub/sub trong test
+
+import fakeredis
+import pytest
+import redis
+from flask import Flask
+
+from apps.extensions import cache
+
+
+def _make_app(config: dict) -> Flask:
+    app = Flask(__name__)
+    app.config.update(TESTING=True, CACHE_DEFAULT_TIMEOUT=3600, **config)
+    cache.init_app(app)
+    return app
+
+
+@pytest.fixture
+def app():
+    app = _make_app({"CACHE_TYPE": "SimpleCache"})
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def fake_redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+
+    class _FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            for k in ("host", "port", "password", "db"):
+                kwargs.pop(k, None)
+            super().__init__(server=server, **kwargs)
+
+    monkeypatch.setattr(redis, "Redis", _FakeRedis)
+    return server
+
+
+@pytest.fixture
+def redis_app(fake_redis_server):
+    app = _make_app({"CACHE_TYPE": "RedisCache", "CACHE_REDIS_HOST": "localhost"})
+    with app.app_context():
+        yield app
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Lịch hẹn theo thời gian slot (user-017): chèn nguyên tử, tra khoảng, huỷ giữ chỗ khi lưu lỗi."""
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from apps.extensions import cache
+from apps.utils import appointment_repository
+from apps.utils.appointment_repository import (VN_TZ, AppointmentRepository, MemoryAppointmentRepository,
+                                               RedisAppointmentRepository, get_appointment_repository)
+from apps.utils.availability import get_availability_store, service_schedule
+from apps.vector.training_vector import TrainingVector
+
+USER = "repo-user"
+SPA = "An Miên Spa"
+SERVICE = "Gội đầu dưỡng sinh thảo dược"
+DAY = datetime(2031, 3, 11)
+
+
+def _record(appt_id, hh=None, mm=0, **extra):
+    slot = DAY.replace(hour=hh, minute=mm).isoformat() if hh is not None else None
+    return {"id": appt_id, "spa_name": SPA, "service_name": SERVICE, "slot_iso": slot, **extra}
+
+
+@pytest.fixture(params=["memory", "redis"])
+def repo(request):
+    if request.param == "memory":
+        request.getfixturevalue("app")
+        return MemoryAppointmentRepository()
+    request.getfixturevalue("redis_app")
+    return RedisAppointmentRepository(cache.cache)
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        AppointmentRepository()
+
+
+def test_same_id_is_never_overwritten(repo):
+    assert repo.add(USER, _record("APPT-1", 9, note="a")) == "APPT-1"
+    assert repo.add(USER, _record("APPT-1", 10, note="b")) == "APPT-1-2"
+    assert [(a["id"], a["note"]) for a in repo.all(USER)] == [("APPT-1", "a"), ("APPT-1-2", "b")]
+
+
+def test_insert_fails_when_every_id_candidate_is_taken(repo, monkeypatch):
+    monkeypatch.setattr(appointment_repository, "MAX_ID_SUFFIX", 2)
+    repo.add(USER, _record("APPT-1", 9))
+    repo.add(USER, _record("APPT-1", 10))
+    with pytest.raises(RuntimeError):
+        repo.add(USER, _record("APPT-1", 11))
+    assert [a["id"] for a in repo.all(USER)] == ["APPT-1", "APPT-1-2"]
+
+
+def test_concurrent_inserts_keep_every_record(repo):
+    threads, per = 8, 25
+    barrier = threading.Barrier(threads)
+    ids = []
+
+    def book():
+        barrier.wait()
+        for i in range(per):
+            ids.append(repo.add(USER, _record(f"APPT-{i}", 8 + i % 10)))  # mỗi id bị 8 luồng tranh
+
+    workers = [threading.Thread(target=book) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert len(set(ids)) == threads * per
+    assert sorted(a["id"] for a in repo.all(USER)) == sorted(ids)
+
+
+def test_all_is_sorted_by_slot_with_unparseable_slots_last(repo):
+    for appt_id, hh in [("c", 15), ("none", None), ("a", 9), ("b", 11)]:
+        repo.add(USER, _record(appt_id, hh))
+    assert [a["id"] for a in repo.all(USER)] == ["a", "b", "c", "none"]
+
+
+def test_between_is_half_open_and_sorted(repo):
+    for appt_id, hh in [("9h", 9), ("10h", 10), ("11h", 11), ("12h", 12)]:
+        repo.add(USER, _record(appt_id, hh))
+    assert [a["id"] for a in repo.between(USER, DAY.replace(hour=10), DAY.replace(hour=12))] == ["10h", "11h"]
+    assert repo.between(USER, DAY.replace(hour=12, minute=1), DAY.replace(hour=23)) == []
+    # mốc có tz khác vẫn so theo cùng 1 thời điểm: 03:00 UTC = 10:00 giờ VN
+    utc_10h = DAY.replace(hour=10, tzinfo=VN_TZ).astimezone(timezone.utc)
+    assert [a["id"] for a in repo.between(USER, utc_10h, utc_10h + timedelta(minutes=1))] == ["10h"]
+    assert repo.between("other-user", DAY, DAY + timedelta(days=1)) == []
+
+
+def test_legacy_list_is_migrated_once(repo):
+    cache.set(f"appointments:{USER}", [_record("old-2", 14), _record("old-1", 8)])
+    assert [a["id"] for a in repo.all(USER)] == ["old-1", "old-2"]
+    assert cache.get(f"appointments:{USER}") is None
+    repo.add(USER, _record("new", 10))
+    assert [a["id"] for a in repo.all(USER)] == ["old-1", "new", "old-2"]
+
+
+@pytest.fixture(params=["app", "redis_app"])
+def backend(request):
+    return request.getfixturevalue(request.param)
+
+
+def _user():
+    return f"{USER}-{uuid.uuid4().hex[:8]}"  # repo in-memory dùng chung cả process
+
+
+def _booking(hh):
+    slot = DAY.replace(hour=hh)
+    return {"spa_name": SPA, "service_name": SERVICE, "slot": {"iso": slot.isoformat(), "label": f"{hh}:00"}}
+
+
+def test_full_slot_is_not_booked_twice(backend):
+    tv, user = TrainingVector(), _user()
+    lanes = service_schedule(SPA, SERVICE).lanes
+    booked = [tv.add_appointment(user, _booking(10)) for _ in range(lanes)]
+    assert all(booked)
+    assert tv.add_appointment(user, _booking(10)) is None
+    assert len(get_appointment_repository().all(user)) == lanes
+
+
+def test_failed_insert_releases_the_reservation(backend, monkeypatch):
+    tv, user = TrainingVector(), _user()
+    lanes = service_schedule(SPA, SERVICE).lanes
+    repo = get_appointment_repository()
+
+    def broken_insert(*args, **kwargs):
+        raise RuntimeError("ghi lịch hẹn lỗi")
+
+    monkeypatch.setattr(repo, "_insert", broken_insert)
+    for _ in range(lanes + 1):
+        with pytest.raises(RuntimeError):
+            tv.add_appointment(user, _booking(15))
+    monkeypatch.undo()
+    # giữ chỗ đã được huỷ sau mỗi lần lưu lỗi → slot vẫn còn đủ làn
+    assert get_availability_store().find_slots(SPA, SERVICE, DAY.replace(hour=15, tzinfo=VN_TZ),
+                                               DAY.replace(hour=16, tzinfo=VN_TZ))
+    assert all(tv.add_appointment(user, _booking(15)) for _ in range(lanes))
+    assert len(repo.all(user)) == lanes
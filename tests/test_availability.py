@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Lịch trống + giữ chỗ (user-019): không giữ trùng, giờ lệch ô, giờ đã qua."""
+import threading
+from datetime import datetime, time, timedelta
+
+import pytest
+from flask import current_app
+
+from apps.extensions import cache
+from apps.utils.availability import (CELL_MINUTES, VN_TZ, AvailabilityStore, MemoryAvailabilityStore,
+                                     RedisAvailabilityStore, service_schedule)
+
+SPA = "An Miên Spa"
+SERVICE = "Gội đầu dưỡng sinh thảo dược"
+
+
+def _at(hh, mm, days=2):
+    day = datetime.now(VN_TZ).date() + timedelta(days=days)
+    return datetime.combine(day, time(hh, mm), VN_TZ)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        request.getfixturevalue("app")
+        return MemoryAvailabilityStore()
+    request.getfixturevalue("redis_app")
+    return RedisAvailabilityStore(cache.cache)
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        AvailabilityStore()
+
+
+def test_aligned_start_reserves_exact_duration(store):
+    sched = service_schedule(SPA, SERVICE)
+    r = store.reserve(SPA, SERVICE, _at(10, 0))
+    assert (r.start, r.cells) == (10 * 60 // CELL_MINUTES, sched.cells)
+
+
+def test_unaligned_start_covers_the_trailing_cell(store):
+    lanes = service_schedule(SPA, SERVICE).lanes
+    held = [store.reserve(SPA, SERVICE, _at(10, 10)) for _ in range(lanes)]
+    assert all(held)
+    # 10:10 + 60' kết thúc 11:10 → ô 11:00-11:15 đã bận ở mọi làn
+    assert held[0].cells == service_schedule(SPA, SERVICE).cells + 1
+    assert store.reserve(SPA, SERVICE, _at(11, 0)) is None
+    assert store.reserve(SPA, SERVICE, _at(11, 15)) is not None
+
+
+def test_past_start_is_rejected(store):
+    past = datetime.now(VN_TZ) - timedelta(minutes=5)
+    assert store.reserve(SPA, SERVICE, past) is None
+
+
+def test_release_frees_the_cells(store):
+    lanes = service_schedule(SPA, SERVICE).lanes
+    held = [store.reserve(SPA, SERVICE, _at(14, 10)) for _ in range(lanes)]
+    assert store.reserve(SPA, SERVICE, _at(14, 10)) is None
+    store.release(held[0])
+    assert store.reserve(SPA, SERVICE, _at(14, 10)) is not None
+
+
+def test_found_slots_are_reservable(store):
+    slots = store.find_slots(SPA, SERVICE, start=_at(0, 0), end=_at(0, 0, days=3))
+    assert slots
+    assert store.reserve(SPA, SERVICE, datetime.fromisoformat(slots[0]["iso"])) is not None
+
+
+def test_concurrent_reservations_never_double_book(store):
+    """~200 lượt giữ cùng 1 giờ từ 16 thread → đúng `lanes` lượt thành công, mỗi làn 1 lượt."""
+    app = current_app._get_current_object()
+    lanes = service_schedule(SPA, SERVICE).lanes
+    when = _at(16, 0)
+    results, barrier = [], threading.Barrier(16)
+
+    def worker():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(200 // 16 + 1):
+                results.append(store.reserve(SPA, SERVICE, when))
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    won = [r for r in results if r is not None]
+    assert len(won) == lanes
+    assert sorted(r.lane for r in won) == list(range(lanes))
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Máy trạng thái đặt lịch (user-022): bảng chuyển, bất biến trong hành động, ghi 1 lần / turn."""
+import pytest
+
+from apps.utils.booking_flow import (TRANSITIONS, BookingEvent as E, BookingFlow, BookingState as S, Transition,
+                                     compile_transitions, derive_state)
+
+SLOT_A = {"label": "15/12/2030 14:00", "iso": "2030-12-15T14:00:00"}
+SLOT_B = {"label": "15/12/2030 16:00", "iso": "2030-12-15T16:00:00"}
+OPTIONS = [{"spa_name": "Nấm Spa", "label": SLOT_A["label"], "iso": SLOT_A["iso"], "service_name": "Body Massage"}]
+
+NEED_SPA = {"active": True, "service_name": "Body Massage"}
+NEED_SLOT = {**NEED_SPA, "spa_name": "Nấm Spa"}
+AWAIT = {**NEED_SLOT, "slot": SLOT_A, "available_slots": [SLOT_A, SLOT_B]}
+DONE = {**AWAIT, "confirmed": True}
+
+
+@pytest.mark.parametrize("data, state", [
+    ({}, S.NEED_SERVICE),
+    ({"active": True}, S.NEED_SERVICE),
+    (NEED_SPA, S.NEED_SPA),
+    (NEED_SLOT, S.NEED_SLOT),
+    (AWAIT, S.AWAIT_CONFIRM),
+    (DONE, S.DONE),
+])
+def test_derive_state(data, state):
+    assert derive_state(data) is state
+
+
+def test_transition_table_compiles_without_duplicates():
+    table = compile_transitions(TRANSITIONS)
+    assert len(table) == sum(len(t.sources) for t in TRANSITIONS)
+    assert {event for _state, event in table} == set(E)
+
+
+def test_duplicate_transition_is_rejected():
+    dup = Transition(E.CONFIRM, frozenset({S.AWAIT_CONFIRM}), lambda d, v: None)
+    with pytest.raises(ValueError):
+        compile_transitions(TRANSITIONS + [dup])
+
+
+# (bản nháp, sự kiện, giá trị, trạng thái sau, các trường phải có, các trường phải mất)
+FIRE_CASES = [
+    ({}, E.START, None, S.NEED_SERVICE, {"active": True}, ()),
+    (AWAIT, E.PICK_SERVICE, "Massage Thái", S.NEED_SLOT, {"service_name": "Massage Thái"},
+     ("slot", "available_slots", "confirmed")),
+    (DONE, E.PICK_SERVICE, "Massage Thái", None, {}, ()),  # DONE: bị bỏ qua
+    (AWAIT, E.PICK_SERVICE, "Body Massage", S.AWAIT_CONFIRM, {"slot": SLOT_A}, ()),
+    (AWAIT, E.PICK_SPA, "An Miên Spa", S.NEED_SLOT, {"spa_name": "An Miên Spa"}, ("slot", "available_slots")),
+    (AWAIT, E.PICK_SPA, "Nấm Spa", S.AWAIT_CONFIRM, {"slot": SLOT_A}, ()),
+    (AWAIT, E.PICK_SLOT, SLOT_B, S.AWAIT_CONFIRM, {"slot": SLOT_B, "previous_slot": SLOT_A},
+     ("available_slots", "confirmed")),
+    (AWAIT, E.PICK_SLOT, SLOT_A, S.AWAIT_CONFIRM, {"slot": SLOT_A}, ("previous_slot",)),
+    (NEED_SPA, E.CONFIRM, None, None, {}, ()),
+    (AWAIT, E.CONFIRM, None, S.DONE, {"confirmed": True}, ()),
+    (DONE, E.SLOT_TAKEN, [SLOT_B], S.NEED_SLOT, {"available_slots": [SLOT_B]}, ("slot", "confirmed")),
+    (NEED_SLOT, E.SLOT_TAKEN, [SLOT_B], None, {}, ()),
+    (AWAIT, E.BOOKED, None, None, {}, ()),
+    (DONE, E.BOOKED, None, S.NEED_SERVICE, {"active": False}, ("service_name", "spa_name", "slot")),
+    (DONE, E.CANCEL, None, S.NEED_SERVICE, {"active": False}, ("service_name", "spa_name", "slot")),
+    (DONE, E.OFFER_EARLIEST, (None, OPTIONS), S.NEED_SERVICE, {"earliest_options": OPTIONS}, ("spa_name", "slot")),
+    ({"active": True, "earliest_options": OPTIONS}, E.PICK_OPTION, 1, S.AWAIT_CONFIRM,
+     {"service_name": "Body Massage", "spa_name": "Nấm Spa", "slot": SLOT_A}, ("earliest_options",)),
+]
+
+
+@pytest.mark.parametrize("data, event, value, state, present, absent", FIRE_CASES)
+def test_fire(data, event, value, state, present, absent):
+    flow = BookingFlow(data)
+    before = dict(flow.data)
+    fired = flow.fire(event, value)
+
+    if state is None:  # sự kiện không hợp lệ ở trạng thái này → bản nháp giữ nguyên
+        assert not fired
+        assert flow.data == before
+        assert flow.state is derive_state(before)
+        assert not flow.dirty
+        return
+    assert fired and flow.dirty
+    assert flow.state is state is derive_state(flow.data)
+    for key, expected in present.items():
+        assert flow.data[key] == expected
+    for key in absent:
+        assert key not in flow.data
+
+
+def test_fire_does_not_mutate_caller_data():
+    data = dict(AWAIT)
+    BookingFlow(data).fire(E.PICK_SPA, "An Miên Spa")
+    assert data == AWAIT
+
+
+def test_pick_offered_slot_bounds():
+    flow = BookingFlow(NEED_SLOT)
+    flow.fire(E.OFFER_SLOTS, [SLOT_A, SLOT_B])
+    assert not flow.pick_offered_slot(3)
+    assert flow.pick_offered_slot(2)
+    assert flow.data["slot"] == SLOT_B
+
+
+class _Saver:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, data):
+        self.calls.append(data)
+
+
+def test_commit_is_noop_when_clean():
+    save = _Saver()
+    assert not BookingFlow(AWAIT).commit(save)
+    assert save.calls == []
+
+
+def test_commit_writes_once_per_turn():
+    save = _Saver()
+    flow = BookingFlow(NEED_SLOT)
+    flow.fire(E.OFFER_SLOTS, [SLOT_A, SLOT_B])
+    flow.fire(E.PICK_SLOT, SLOT_A)
+    flow.fire(E.CONFIRM)
+    assert flow.commit(save)
+    assert not flow.commit(save)
+    assert save.calls == [{**NEED_SLOT, "slot": SLOT_A, "confirmed": True}]
+
+
+def test_commit_deletes_empty_draft():
+    save = _Saver()
+    flow = BookingFlow(DONE)
+    flow.fire(E.BOOKED)
+    assert flow.commit(save)
+    assert save.calls == [None]
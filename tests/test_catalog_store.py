@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""Snapshot catalog + cấu trúc dẫn xuất (user-025): bảng từ khoá thành phố dựng 1 lần, dùng chung."""
+import pytest
+
+from apps.ai.intents import map_city
+from apps.utils import catalog_store
+from apps.utils.catalog_store import build_snapshot, get_catalog, load_static
+from apps.vector.training_vector import TrainingVector
+
+
+def test_city_keywords_registered_once():
+    names = [name for name in catalog_store._DERIVED if "city" in name]
+    assert names == ["city_keywords"]
+
+
+def test_city_keywords_built_once_per_snapshot(monkeypatch):
+    calls = []
+    build = catalog_store.build_city_keywords
+    monkeypatch.setattr(catalog_store, "build_city_keywords", lambda spas: calls.append(1) or build(spas))
+    snapshot = build_snapshot(*load_static(), source="static")
+    assert snapshot.derived("city_keywords") is snapshot.derived("city_keywords")
+    assert calls == [1]
+
+
+@pytest.mark.parametrize("message, city", [
+    ("spa ở sài gòn", "hồ chí minh"),
+    ("spa o tp hcm", "hồ chí minh"),
+    ("spa ha noi", "hà nội"),
+    ("spa ở đà nẵng", None),
+])
+def test_intents_and_training_vector_share_the_table(app, message, city):
+    assert map_city(message) == city
+    assert TrainingVector().detect_city(message) == city
+    assert get_catalog().derived("city_keywords")
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Khung gọn cho bản nháp đặt lịch + mục history (user-023)."""
+import json
+import pickle
+from datetime import datetime, timedelta
+
+import pytest
+
+from apps.utils.booking_flow import slot_of
+from apps.utils.codec import (FLAG_ZLIB, MAGIC, BookingDraft, CodecError, CompactSerializer, decode_booking,
+                              decode_entry, encode_booking, encode_entry, unpack)
+
+SLOTS = [slot_of(datetime(2030, 12, 15, 9, 0) + timedelta(minutes=30 * i)) for i in range(8)]
+
+DRAFTS = [
+    {"active": False},
+    {"active": True, "service_name": "Massage Thái", "service_candidates": ["Massage Thái", "Body Massage"]},
+    {"active": True, "spa_name": "An Miên Spa", "service_name": "Gội đầu dưỡng sinh thảo dược",
+     "available_slots": SLOTS, "previous_slot": SLOTS[0]},
+    {"active": True, "spa_name": "Nấm Spa", "service_name": "Body Massage", "slot": SLOTS[2], "confirmed": True,
+     "time_range": {"start_iso": "2030-12-15T00:00:00", "end_iso": "2030-12-16T00:00:00"}},
+    {"active": True, "service_name": None, "earliest_options": [
+        {"spa_name": "Nấm Spa", "service_name": "Body Massage", **SLOTS[1]}]},
+    # slot không chuẩn (có tz) + trường lạ → vẫn giữ nguyên
+    {"active": True, "slot": {"label": "x", "iso": "2030-12-15T09:00:00+07:00"}, "note": "khách quen"},
+]
+
+
+@pytest.mark.parametrize("draft", DRAFTS)
+def test_booking_round_trip(draft):
+    expected = {k: v for k, v in draft.items() if v is not None}
+    assert decode_booking(encode_booking(draft)) == expected
+
+
+def test_compact_draft_is_smaller_than_pickle():
+    draft = DRAFTS[2]
+    assert len(encode_booking(draft)) * 2 < len(b"!" + pickle.dumps(draft))
+
+
+@pytest.mark.parametrize("entry", [
+    {"role": "user", "content": "đặt lịch gội đầu chiều mai"},
+    {"role": "assistant", "content": "Dạ " * 400},  # đủ dài để nén
+    {"role": "tool", "content": "x", "name": "lookup"},
+])
+def test_entry_round_trip(entry):
+    assert decode_entry(encode_entry(entry)) == entry
+
+
+def test_long_entries_are_compressed():
+    raw = encode_entry({"role": "assistant", "content": "Dạ " * 400})
+    assert raw[0] == MAGIC and raw[2] & FLAG_ZLIB
+
+
+def test_legacy_json_entry_still_decodes():
+    entry = {"role": "user", "content": "xin chào"}
+    assert decode_entry(json.dumps(entry, ensure_ascii=False).encode("utf-8")) == entry
+
+
+def test_unknown_version_or_kind_is_rejected():
+    raw = encode_booking(DRAFTS[1])
+    with pytest.raises(CodecError):
+        unpack(raw[:1] + b"\x09" + raw[2:], raw[2] >> 4)
+    with pytest.raises(CodecError):
+        decode_entry(raw)
+
+
+class _Pickle:
+    @staticmethod
+    def dumps(value):
+        return b"!" + pickle.dumps(value)
+
+    @staticmethod
+    def loads(raw):
+        return pickle.loads(raw[1:])
+
+
+def test_serializer_reads_legacy_pickled_drafts():
+    serializer = CompactSerializer(_Pickle)
+    draft = DRAFTS[3]
+    assert serializer.loads(_Pickle.dumps(draft)) == draft  # khoá cũ: dict pickle
+    packed = serializer.dumps(BookingDraft.from_dict(draft))
+    assert packed[0] == MAGIC
+    assert serializer.loads(packed).to_dict() == draft
+    assert serializer.loads(serializer.dumps({"other": 1})) == {"other": 1}
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""History gửi kèm prompt theo ngân sách token + tóm tắt phần cũ (user-014)."""
+import types
+
+import pytest
+
+from apps.ai import context_builder
+from apps.ai.context_builder import NLU_BUDGET, REPLY_BUDGET, build_context, fit_budget, messages_tokens
+from apps.utils.conversation_store import get_conversation_store
+
+SUMMARY = "- Khách quan tâm massage đá nóng tại An Miên Spa"
+LONG_REPLY = "Dạ, An Miên Spa có các dịch vụ: " + ", ".join(["Gội đầu dưỡng sinh thảo dược (60 phút) – 250.000đ"] * 8)
+
+
+class _Done:
+    def __init__(self, result):
+        self.result = result
+
+
+@pytest.fixture
+def summary_client(monkeypatch):
+    # tóm tắt chạy ngay trong turn thay vì ở pool nền
+    monkeypatch.setattr(context_builder.speculative, "submit", lambda fn, *a, **kw: _Done(fn(*a, **kw)))
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        message = types.SimpleNamespace(content=SUMMARY)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    client.calls = calls
+    return client
+
+
+def test_fit_budget_keeps_newest_and_always_the_last_message():
+    history = [{"role": "user", "content": f"tin số {i}"} for i in range(30)]
+    kept = fit_budget(history, budget=40, max_messages=12)
+    assert kept and kept[-1] == history[-1]
+    assert kept == history[-len(kept):]
+    assert messages_tokens(kept) <= 40
+    huge = [{"role": "assistant", "content": LONG_REPLY * 5}]
+    assert fit_budget(huge, budget=10) == huge
+
+
+def test_hundred_turns_stay_within_budget(app, summary_client):
+    store = get_conversation_store()
+    key = "chat:context-test"
+    store.clear(key)
+    reply_tokens, nlu_tokens = [], []
+    for turn in range(100):
+        window = store.window(key)
+        window.append({"role": "user", "content": "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược chiều mai"})
+        reply_tokens.append(messages_tokens(build_context(window, REPLY_BUDGET, summary_client)))
+        nlu_tokens.append(messages_tokens(build_context(window, NLU_BUDGET, summary_client)))
+        window.append({"role": "assistant", "content": LONG_REPLY if turn % 3 == 0 else "Dạ, khung giờ nào ạ?"})
+        store.save(key, window)
+
+    assert max(reply_tokens) <= REPLY_BUDGET
+    assert max(nlu_tokens) <= NLU_BUDGET
+    # không tăng theo độ dài hội thoại: 50 turn cuối không lớn hơn đỉnh của 50 turn đầu
+    assert max(reply_tokens[50:]) <= max(reply_tokens[:50])
+    assert summary_client.calls
+    context = build_context(store.window(key), REPLY_BUDGET, summary_client)
+    assert context[0]["role"] == "system" and SUMMARY in context[0]["content"]
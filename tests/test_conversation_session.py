@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Trạng thái per-user của 1 turn: nạp 1 round trip, ghi 1 round trip, handler chỉ đọc qua session (user-016)."""
+import types
+
+import redis
+import redis.client
+
+import apps.controllers.bot_controller as bot_controller
+from apps.utils.catalog_store import get_catalog
+from apps.utils.conversation_session import ConversationSession
+from apps.vector.cases.service_list import try_handle_service_list
+from apps.vector.training_vector import TrainingVector
+
+USER = "session-user"
+
+
+class _FakeCompletions:
+    def create(self, model=None, messages=None, **kwargs):
+        text = "NO" if "YES hoặc NO" in messages[0]["content"] else "GPT-REPLY"
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+def _record_round_trips(monkeypatch):
+    """Mỗi phần tử = 1 round trip: tên lệnh gửi thẳng, hoặc tuple các lệnh của 1 pipeline."""
+    trips = []
+    execute_command = redis.Redis.execute_command
+    pipeline_execute = redis.client.Pipeline.execute
+
+    def command(client, *args, **options):
+        if not isinstance(client, redis.client.Pipeline):
+            trips.append((str(args[0]).upper(), str(args[1]) if len(args) > 1 else ""))
+        return execute_command(client, *args, **options)
+
+    def pipeline(pipe, *args, **kwargs):
+        if pipe.command_stack:
+            trips.append(tuple(sorted({str(c[0][0]).upper() for c in pipe.command_stack})))
+        return pipeline_execute(pipe, *args, **kwargs)
+
+    monkeypatch.setattr(redis.Redis, "execute_command", command)
+    monkeypatch.setattr(redis.client.Pipeline, "execute", pipeline)
+    return trips
+
+
+def test_turn_loads_and_writes_user_state_once(redis_app, monkeypatch):
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_FakeCompletions()))
+    monkeypatch.setattr(bot_controller, "get_llm_client", lambda: client)
+    spa = next(iter(get_catalog().services))
+    api = bot_controller.MessageV2()
+    api.answer({"message": f"{spa} giới thiệu", "user_id": USER})
+
+    trips = _record_round_trips(monkeypatch)
+    _body, status = api.answer({"message": f"danh sách dịch vụ của {spa}", "user_id": USER})
+
+    assert status == 200
+    assert trips.count(("LRANGE", "MGET")) == 1  # history + mọi khoá per-user: 1 pipeline
+    # không đọc / ghi lẻ khoá per-user: ghi cuối turn đi trong script có fencing (EVALSHA)
+    assert not [t for t in trips if t[0] in ("GET", "SET", "DEL", "MGET") and ("chat:" in t[1] or "booking:" in t[1])]
+    assert ConversationSession.load(USER).get("last_spa_focus") == spa
+
+
+def test_service_list_case_reads_focus_from_session(app):
+    spa = next(iter(get_catalog().services))
+    session = ConversationSession.load(USER)
+    session.set("last_spa_focus", spa)
+    tv = TrainingVector(session=session)
+    ctx = tv.get_booking_context(USER)
+
+    handled = try_handle_service_list(tv, None, "danh sách dịch vụ", USER, session.conversation_key,
+                                      session.history, ctx)
+
+    assert handled
+    assert session.history[-1]["content"].startswith(f"💆 Dịch vụ tại **{spa}**")
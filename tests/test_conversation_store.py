@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""History append-only (user-013): cửa sổ đuôi, chuyển khoá cũ 1 lần, ghi cuối turn có fencing (script Lua)."""
+import uuid
+
+import pytest
+
+from apps.extensions import cache
+from apps.utils import metrics
+from apps.utils.conversation_store import (ConversationStore, ConversationWindow, MemoryConversationStore,
+                                           RedisConversationStore)
+from apps.utils.turn_lock import Lease, turn_lock
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request):
+    if request.param == "memory":
+        request.getfixturevalue("app")
+        return MemoryConversationStore(window=3, max_entries=5, ttl=60)
+    request.getfixturevalue("redis_app")
+    return RedisConversationStore(cache.cache, window=3, max_entries=5, ttl=60)
+
+
+@pytest.fixture
+def user():
+    return f"store-user-{uuid.uuid4().hex[:8]}"  # lock / version in-memory dùng chung cả process
+
+
+def _msgs(*texts):
+    return [{"role": "user", "content": t} for t in texts]
+
+
+def _texts(entries):
+    return [e["content"] for e in entries]
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        ConversationStore()
+
+
+def test_window_reads_the_tail_and_trims_to_max_entries(store, user):
+    key = f"chat:{user}"
+    store.append(key, *_msgs("1", "2", "3", "4"))
+    store.append(key, *_msgs("5", "6", "7"))
+    assert _texts(store.window(key)) == ["5", "6", "7"]
+    assert _texts(store.window(key, size=4)) == ["4", "5", "6", "7"]
+    assert _texts(store.all(key)) == ["3", "4", "5", "6", "7"]  # LTRIM / deque maxlen
+
+
+def test_save_appends_only_pending_entries(store, user):
+    key = f"chat:{user}"
+    store.append(key, *_msgs("a"))
+    window = store.window(key)
+    window.extend(_msgs("b", "c"))
+    assert _texts(window.pending()) == ["b", "c"]
+    store.save(key, window)
+    store.save(key, window)  # không còn gì chờ ghi
+    assert window.pending() == []
+    assert _texts(store.all(key)) == ["a", "b", "c"]
+    store.save(key, _msgs("x", "y"))  # list thường → ghi đè như cách cũ
+    assert _texts(store.all(key)) == ["x", "y"]
+
+
+def test_legacy_blob_is_migrated_once(store, user):
+    key = f"chat:{user}"
+    cache.set(key, _msgs(*"abcdefg"))
+    migrated = metrics.get("history.migrated")
+    assert _texts(store.window(key)) == ["e", "f", "g"]
+    assert cache.get(key) is None
+    assert _texts(store.all(key)) == ["c", "d", "e", "f", "g"]
+    assert metrics.get("history.migrated") == migrated + 1
+
+
+def test_empty_history_checks_the_legacy_key_once(store, user, monkeypatch):
+    key = f"chat:{user}"
+    reads = []
+    get = cache.get
+    monkeypatch.setattr(cache, "get", lambda k: reads.append(k) or get(k))
+    for _ in range(3):
+        assert store.load_turn(key, [f"booking:{user}"])[0] == []
+        assert store.all(key) == []
+    assert reads == [key]  # không phải 1 GET mỗi turn
+
+
+def test_legacy_check_is_retried_after_a_cache_error(store, user, monkeypatch):
+    key = f"chat:{user}"
+    cache.set(key, _msgs("old"))
+    get = cache.get
+
+    def down(k):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(cache, "get", down)
+    assert store.window(key) == []
+    monkeypatch.setattr(cache, "get", get)
+    assert _texts(store.window(key)) == ["old"]
+
+
+def test_flush_turn_writes_sets_deletes_and_entries(store, user):
+    key = f"chat:{user}"
+    cache.set(f"{key}:gone", "x")
+    assert store.flush_turn(key, _msgs("q", "a"), {f"{key}:ctx": ({"spa": "A"}, 60)}, [f"{key}:gone"])
+    window, values = store.load_turn(key, [f"{key}:ctx", f"{key}:gone"])
+    assert isinstance(window, ConversationWindow)
+    assert _texts(window) == ["q", "a"]
+    assert values == [{"spa": "A"}, None]
+
+
+@pytest.mark.parametrize("with_entries", [True, False])
+def test_fenced_flush_with_current_lease_writes_everything(store, user, with_entries):
+    key = f"chat:{user}"
+    cache.set(f"{key}:gone", "x")
+    store.append(key, *_msgs(*"1234"))
+    entries = _msgs("q", "a") if with_entries else []
+    with turn_lock(user, wait_ms=0) as lease:
+        assert store.flush_turn(key, entries, {f"{key}:ctx": ("v", 60), f"{key}:n": (3, 60)}, [f"{key}:gone"],
+                                lease=lease)
+    window, values = store.load_turn(key, [f"{key}:ctx", f"{key}:n", f"{key}:gone"], size=10)
+    assert values == ["v", 3, None]
+    assert _texts(window) == (["2", "3", "4", "q", "a"] if with_entries else ["1", "2", "3", "4"])
+    if isinstance(store, RedisConversationStore):
+        assert 0 < store._write.ttl(store._list_key(key)) <= 60
+        assert 0 < store._write.ttl(f"{store._prefix()}{key}:ctx") <= 60
+
+
+def test_fenced_flush_with_stale_lease_writes_nothing(store, user):
+    key = f"chat:{user}"
+    cache.set(f"{key}:keep", "x")
+    fenced = metrics.get("turn_lock.fenced_out")
+    with turn_lock(user, wait_ms=0) as lease:
+        # lease của turn trước (vd. hết TTL khi đang chạy): token cũ hơn token hiện tại
+        stale = Lease(lease.lock, user, lease.token - 1, "stale")
+        assert not store.flush_turn(key, _msgs("late"), {f"{key}:ctx": ("late", 60)}, [f"{key}:keep"],
+                                    lease=stale)
+    assert metrics.get("turn_lock.fenced_out") == fenced + 1
+    window, values = store.load_turn(key, [f"{key}:ctx", f"{key}:keep"])
+    assert window == [] and values == [None, "x"]
+
+
+def test_fenced_flush_is_one_script_call(redis_app, user, monkeypatch):
+    store = RedisConversationStore(cache.cache)
+    key = f"chat:{user}"
+    calls = []
+    monkeypatch.setattr(store._write, "pipeline", lambda *a, **k: calls.append("pipeline"))
+    with turn_lock(user, wait_ms=0) as lease:
+        script = store._fenced
+        monkeypatch.setattr(store, "_fenced", lambda **kw: calls.append("script") or script(**kw))
+        assert store.flush_turn(key, _msgs("q"), {f"{key}:ctx": ("v", 60)}, [f"{key}:gone"], lease=lease)
+    assert calls == ["script"]
+    assert _texts(store.window(key)) == ["q"]
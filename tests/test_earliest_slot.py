@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Hỏi giờ trống sớm nhất theo dịch vụ nhắc trong câu, không dùng dịch vụ cũ của bản nháp (user-020)."""
+import pytest
+
+from apps.utils.booking_flow import BookingEvent
+from apps.vector.training_vector import TrainingVector
+
+USER = "earliest-user"
+
+
+@pytest.fixture
+def tv(app):
+    return TrainingVector()
+
+
+def _open_draft(tv, service_name):
+    flow = tv.booking_flow(USER)
+    flow.fire(BookingEvent.START)
+    flow.fire(BookingEvent.PICK_SERVICE, service_name)
+
+
+def test_generic_service_searches_every_matching_service(tv):
+    _open_draft(tv, "Gội đầu dưỡng sinh thảo dược")
+
+    reply = tv.reply_earliest_for_message(USER, "massage sớm nhất ở quận 1", f"chat:{USER}", [])
+
+    assert reply is not None
+    flow = tv.booking_flow(USER)
+    options = flow.get("earliest_options")
+    assert options
+    assert {(o["spa_name"], o["service_name"]) for o in options} == {("An Miên Spa", "Massage và Bấm huyệt")}
+    assert flow.get("service_name") is None
+    text = reply[0]["context"]
+    assert "Massage và Bấm huyệt" in text
+    assert "Gội đầu" not in text
+
+    assert tv.pick_earliest_option(flow, "1")
+    assert flow.get("service_name") == "Massage và Bấm huyệt"
+    assert flow.get("spa_name") == "An Miên Spa"
+    assert flow.get("slot")["iso"] == options[0]["iso"]
+
+
+def test_generic_service_without_area_merges_in_time_order(tv):
+    reply = tv.reply_earliest_for_message(USER, "massage sớm nhất", f"chat:{USER}", [])
+
+    assert reply is not None
+    options = tv.booking_flow(USER).get("earliest_options")
+    assert [o["iso"] for o in options] == sorted(o["iso"] for o in options)
+    assert {o["service_name"] for o in options} <= {"Body Massage", "Massage Thái", "Massage đá nóng",
+                                                     "Massage và Bấm huyệt"}
+
+
+def test_exact_service_keeps_single_service_offer(tv):
+    tv.reply_earliest_for_message(USER, "body massage sớm nhất ở quận 10", f"chat:{USER}", [])
+
+    flow = tv.booking_flow(USER)
+    assert flow.get("service_name") == "Body Massage"
+    assert {o["spa_name"] for o in flow.get("earliest_options")} == {"Nấm Spa"}
+
+
+def test_draft_service_is_used_only_when_message_names_none(tv):
+    _open_draft(tv, "Body Massage")
+
+    assert tv.reply_earliest_for_message(USER, "giờ trống sớm nhất", f"chat:{USER}", []) is not None
+    assert tv.booking_flow(USER).get("service_name") == "Body Massage"
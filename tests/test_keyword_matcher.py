@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Automaton từ khoá cho kết quả y hệt cách so cũ (user-003 / user-004):
+- scan_intents  ≡ `any(k in msg for k in kws)` (nhóm đệm: `k in f" {msg} "`)
+- PhraseAutomaton.longest ≡ vòng `re.search(rf"\\b{re.escape(alias)}\\b", msg)` lấy alias dài nhất
+So trên catalog hiện tại + tập câu mẫu + câu ngẫu nhiên ghép từ chính các từ khoá / alias.
+"""
+import random
+import re
+
+import pytest
+
+from apps.ai.intents import build_spa_alias_index
+from apps.utils.catalog_store import get_catalog
+from apps.utils.text_normalize import fold_text
+from apps.vector.keyword_matcher import INTENT_KEYWORDS, PADDED_GROUPS, PhraseAutomaton, scan_intents
+from apps.vector.training_vector import TrainingVector
+
+SAMPLES = [
+    "xin chào", "tìm spa ở hồ chí minh", "1", "An Miên Spa giới thiệu", "danh sách dịch vụ của An Miên Spa",
+    "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược", "2", "đồng ý", "xem lịch hẹn của tôi",
+    "lịch hẹn ngày mai", "trị mụn thế nào", "massage", "đặt hẹn massage đá nóng 15/12/2030 14:00",
+    "Chăm sóc da mụn là gì", "spa ở quận 10", "Nấm spa có tốt không", "bảng giá", "body massage",
+    "đổi giờ sang 3h chiều", "có", "không", "có không", "ok", "từ thứ 2 đến thứ 6", "lúc 9 giờ", "9 giờ",
+    "9 giờ, được không", "9 giờ.", "10am", "3 pm", "tối nay", "từ", "tu", "đến", "gio", "giờ trống sớm nhất",
+    "massage sớm nhất ở quận 1", "đặt thêm 1 lịch", "dat lich hen", "kem chống nắng nên dùng loại nào",
+    "serum vitamin c có nên dùng không", "PMT", "spa pmt", "Serenity", "bella spa ở đâu", "thẩm mỹ viện hoa mai",
+    "", " ", "!!!", "spa_lily", "lily-spa", "spa lily.", "(pmt)", "pmtx", "xpmt",
+]
+
+
+def _old_scan(folded: str):
+    padded = f" {folded} "
+    return frozenset(name for name, kws in INTENT_KEYWORDS.items()
+                     if any(k in (padded if name in PADDED_GROUPS else folded) for k in kws))
+
+
+def _old_longest(alias_map, msg: str):
+    hits = []
+    for alias_norm, canonical in alias_map.items():
+        if re.search(rf"\b{re.escape(alias_norm)}\b", msg):
+            hits.append((len(alias_norm), canonical))
+    if hits:
+        hits.sort(reverse=True)
+        return hits[0][1]
+    return None
+
+
+def _catalog_messages():
+    catalog = get_catalog()
+    out = []
+    for spa in catalog.spa_names:
+        out += [spa, f"giới thiệu {spa}", f"{spa} ở đâu"]
+        for service in catalog.services.get(spa, [])[:5]:
+            out += [service["name"], f"đặt lịch {service['name']} ở {spa} lúc 3 giờ chiều",
+                    f"{service['name']} có tốt không"]
+    return out
+
+
+def _random_messages(words, n, seed):
+    rng = random.Random(seed)
+    glue = [" ", "", ",", ".", " - ", ":", "?"]
+    out = []
+    for _ in range(n):
+        parts = [rng.choice(words) for _ in range(rng.randint(1, 5))]
+        out.append("".join(p + rng.choice(glue) for p in parts).strip(rng.choice(["", " "])))
+    return out
+
+
+def _corpus(words, seed):
+    return [fold_text(m) for m in SAMPLES + _catalog_messages() + _random_messages(words, 3000, seed)]
+
+
+def test_scan_matches_substring_checks():
+    keywords = [k for kws in INTENT_KEYWORDS.values() for k in kws]
+    words = keywords + [k.strip() for k in keywords] + ["spa", "lich", "9", "x", "a", "gioi", "hom"]
+    for folded in _corpus(words, seed=3):
+        assert scan_intents(folded) == _old_scan(folded), folded
+
+
+@pytest.mark.parametrize("message, group, expected", [
+    # từ khoá có khoảng trắng biên ở nhóm thường: khoảng trắng phải có thật trong câu
+    ("tu 9h", "appt_time_phrase", True),
+    ("lich tu", "appt_time_phrase", False),   # "tu " không khớp ở cuối câu
+    ("tu", "appt_time_phrase", False),
+    ("co khong", "yesno_khong", True),
+    ("khong", "yesno_khong", False),          # " khong" cần khoảng trắng phía trước
+    # nhóm đệm: so trên " " + câu + " " → khớp cả ở đầu / cuối câu
+    ("co", "yesno_co", True),
+    ("co spa", "yesno_co", True),
+    ("con", "yesno_co", False),
+    ("gio", "time_hint", True),               # " gio" / " gio " khớp nhờ khoảng trắng đệm
+    ("9 gio.", "time_hint", True),
+    ("bat", "time_hint", False),
+])
+def test_boundary_space_keywords(message, group, expected):
+    folded = fold_text(message)
+    assert (group in scan_intents(folded)) is expected
+    assert (group in _old_scan(folded)) is expected
+
+
+@pytest.mark.parametrize("alias_source", ["intents", "training_vector"])
+def test_longest_alias_matches_regex_loop(alias_source):
+    spa_names = get_catalog().spa_names
+    if alias_source == "intents":
+        alias_map = build_spa_alias_index(spa_names)
+    else:
+        alias_map = TrainingVector()._build_spa_alias_index(spa_names)
+    matcher = PhraseAutomaton(alias_map)
+    words = list(alias_map) + [a + "x" for a in alias_map] + ["x" + a for a in alias_map] + ["spa", "o", "dau"]
+    for msg in _corpus(words, seed=4):
+        assert matcher.longest(msg) == _old_longest(alias_map, msg), msg
+
+
+def test_longest_prefers_the_longest_alias_then_the_old_tie_break():
+    matcher = PhraseAutomaton({"lily": "Spa Lily", "spa lily": "Spa Lily Q3", "ab": "B", "cd": "A"})
+    assert matcher.longest("den spa lily nhe") == "Spa Lily Q3"
+    assert matcher.longest("lilyx") is None
+    # cùng độ dài → như sort(reverse=True) trên (độ dài, tên chuẩn)
+    assert matcher.longest("ab cd") == _old_longest({"ab": "B", "cd": "A"}, "ab cd") == "B"
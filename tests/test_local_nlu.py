@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""NLU cục bộ (user-011): intent + slot + độ tự tin từ luật, chỉ hỏi LLM khi mơ hồ / không khớp."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from apps.ai import local_nlu
+from apps.ai.intents import VN, Intent, NLUResult
+from apps.ai.local_nlu import LOCAL_THRESHOLD, parse_message, parse_message_local
+from apps.utils import metrics
+from apps.vector.training_vector import TrainingVector
+
+SPA = "An Miên Spa"
+SERVICE = "Gội đầu dưỡng sinh thảo dược"
+BOOKING_CTX = {"active": True, "available_slots": [{"label": "9:00"}, {"label": "10:00"}]}
+
+
+def _local(message, ctx=None):
+    return parse_message_local(TrainingVector().analyze(message), ctx)
+
+
+@pytest.mark.parametrize("message, intent, fields", [
+    ("xin chào", Intent.GREETING, {}),
+    ("tìm spa ở hồ chí minh", Intent.LIST_SPAS, {"city_raw": "hồ chí minh"}),
+    (f"danh sách dịch vụ của {SPA}", Intent.LIST_SERVICES, {"spa_name_raw": SPA}),
+    ("xem lịch hẹn của tôi", Intent.APPT_LIST_ALL, {}),
+    (f"đặt lịch {SERVICE.lower()}", Intent.BOOKING, {"service_name_raw": SERVICE}),
+    (f"đặt lịch ở {SPA} lúc 15/12/2030 14:00", Intent.BOOKING,
+     {"spa_name_raw": SPA, "datetime_raw": f"đặt lịch ở {SPA} lúc 15/12/2030 14:00"}),
+    (SPA, Intent.SPA_INTRO, {"spa_name_raw": SPA}),
+    ("trị mụn thế nào", Intent.SKINCARE_QA, {}),
+    ("mệt mỏi muốn thư giãn", Intent.SUGGEST_RELAX, {}),
+])
+def test_confident_rules(app, message, intent, fields):
+    nlu = _local(message)
+    assert nlu.intent == intent
+    assert nlu.confidence >= LOCAL_THRESHOLD
+    assert {k: getattr(nlu, k) for k in fields} == fields
+
+
+def test_appointment_lookup_carries_the_time_range(app):
+    nlu = _local("lịch hẹn ngày mai")
+    assert nlu.intent == Intent.APPT_LOOKUP and nlu.confidence >= LOCAL_THRESHOLD
+    start = datetime.fromisoformat(nlu.time_range.start_iso)
+    end = datetime.fromisoformat(nlu.time_range.end_iso)
+    assert start.date() == (datetime.now(VN) + timedelta(days=1)).date()
+    assert end - start == timedelta(days=1)
+
+
+@pytest.mark.parametrize("message, fields", [
+    ("2", {}),                                # chọn slot theo số
+    ("14:30", {"datetime_raw": "14:30"}),     # nói giờ
+    ("đồng ý", {"is_confirm": True}),
+    ("đổi giờ sang 3h chiều", {}),
+])
+def test_booking_context_rules(app, message, fields):
+    nlu = _local(message, BOOKING_CTX)
+    assert nlu.intent == Intent.BOOKING and nlu.confidence >= LOCAL_THRESHOLD
+    assert {k: getattr(nlu, k) for k in fields} == fields
+
+
+@pytest.mark.parametrize("message", ["2", "đồng ý", "14:30"])
+def test_booking_replies_need_an_active_booking(app, message):
+    assert _local(message) == NLUResult(intent=Intent.FALLBACK, confidence=0.0)
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("hôm nay trời đẹp", Intent.FALLBACK),         # không luật nào khớp
+    ("bảng giá", Intent.LIST_SERVICES),             # không rõ spa
+    ("spa ở đâu", Intent.LIST_SPAS),                # không rõ thành phố
+    (f"{SPA} ở đâu, mệt mỏi quá", Intent.SPA_INTRO),  # 2 intent điểm sát nhau
+    (SERVICE, Intent.SERVICE_DETAIL),               # tên dịch vụ ≈ câu hỏi skincare
+])
+def test_vague_or_ambiguous_messages_stay_below_threshold(app, message, intent):
+    nlu = _local(message)
+    assert nlu.intent == intent
+    assert nlu.confidence < LOCAL_THRESHOLD
+
+
+def test_parse_message_skips_the_llm_when_confident(app, monkeypatch):
+    asked = []
+    monkeypatch.setattr(local_nlu, "parse_message_with_llm", lambda *args: asked.append(args))
+    before = metrics.get("nlu.local"), metrics.get("nlu.llm")
+    tv = TrainingVector()
+    nlu = parse_message(None, "tìm spa ở hồ chí minh", [], tv.analyze("tìm spa ở hồ chí minh"))
+    assert nlu.intent == Intent.LIST_SPAS and not asked
+    assert (metrics.get("nlu.local"), metrics.get("nlu.llm")) == (before[0] + 1, before[1])
+
+
+def test_parse_message_asks_the_llm_when_unsure(app, monkeypatch):
+    llm_result = NLUResult(intent=Intent.SPA_INTRO, spa_name_raw=SPA, confidence=0.9)
+    asked = []
+    monkeypatch.setattr(local_nlu, "parse_message_with_llm",
+                        lambda client, message, history: asked.append(message) or llm_result)
+    before = metrics.get("nlu.llm")
+    message = f"{SPA} ở đâu, mệt mỏi quá"
+    assert parse_message("client", message, [], TrainingVector().analyze(message)) is llm_result
+    assert asked == [message]
+    assert metrics.get("nlu.llm") == before + 1
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Mỗi bước phân tích (bỏ dấu, quét từ khoá, dò catalog, parse giờ) chạy tối đa 1 lần / turn (user-006)."""
+import types
+from collections import Counter
+
+import pytest
+
+import apps.controllers.ai_controller as ai_controller
+import apps.controllers.bot_controller as bot_controller
+import apps.vector.message_analysis as message_analysis
+import apps.vector.training_vector as training_vector
+from apps.vector.parse_time_text import ParseTimeText
+from apps.vector.training_vector import TrainingVector
+
+USER = "analysis-user"
+SCRIPT = [
+    "xin chào", "tìm spa ở hồ chí minh", "1", "An Miên Spa giới thiệu", "danh sách dịch vụ của An Miên Spa",
+    "tôi muốn đặt lịch gội đầu dưỡng sinh thảo dược", "2", "đồng ý", "xem lịch hẹn của tôi",
+    "lịch hẹn ngày mai", "trị mụn thế nào", "massage", "đặt hẹn massage đá nóng 15/12/2030 14:00", "đồng ý",
+    "massage sớm nhất ở quận 1", "Chăm sóc da mụn là gì", "spa ở quận 10", "Nấm spa có tốt không", "bảng giá",
+]
+# hàm nặng phía sau từng bước của MessageAnalysis (module, tên)
+STEPS = [
+    (message_analysis, "fold_text"),
+    (message_analysis, "scan_intents"),
+    (TrainingVector, "detect_spa_in_message"),
+    (TrainingVector, "find_services_in_text"),
+    (TrainingVector, "find_exact_service_by_name"),
+    (TrainingVector, "detect_city"),
+    (TrainingVector, "_parse_appointment_range"),
+    (ParseTimeText, "parse"),
+]
+
+
+class _FakeCompletions:
+    def create(self, model=None, messages=None, **kwargs):
+        text = "NO" if "YES hoặc NO" in messages[0]["content"] else "{}"
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture
+def recorder(app, monkeypatch):
+    """Ghi lại mọi MessageAnalysis được tạo + số lần gọi từng hàm nặng với đúng câu của turn."""
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_FakeCompletions()))
+    monkeypatch.setattr(bot_controller, "get_llm_client", lambda: client)
+    monkeypatch.setattr(ai_controller, "get_llm_client", lambda: client)
+    rec = types.SimpleNamespace(analyses=[], calls=Counter())
+
+    class RecordingAnalysis(message_analysis.MessageAnalysis):
+        def __init__(self, helper, message):
+            super().__init__(helper, message)
+            rec.analyses.append(self)
+
+    monkeypatch.setattr(training_vector, "MessageAnalysis", RecordingAnalysis)
+    for owner, name in STEPS:
+        original = getattr(owner, name)
+
+        def spy(*args, _original=original, _name=name, **kwargs):
+            rec.calls[_name, next((a for a in args if isinstance(a, str)), None)] += 1
+            return _original(*args, **kwargs)
+
+        monkeypatch.setattr(owner, name, spy)
+    return rec
+
+
+def _assert_once_per_turn(rec, message):
+    turn = [a for a in rec.analyses if a.matches(message)]
+    assert len(turn) == 1, message  # 1 MessageAnalysis dùng chung cho cả turn
+    assert turn[0].counters and all(n <= 1 for n in turn[0].counters.values()), (message, turn[0].stats())
+    repeated = {name: n for (name, text), n in rec.calls.items() if text == message and n > 1}
+    assert not repeated, (message, repeated)  # không bước nào bị tính lại ngoài analysis
+
+
+@pytest.mark.parametrize("controller", [bot_controller.MessageV2, ai_controller.PostAI])
+def test_each_step_runs_at_most_once_per_turn(recorder, controller):
+    api = controller()
+    for message in SCRIPT:
+        recorder.analyses.clear()
+        recorder.calls.clear()
+        _body, status = api.answer({"message": message, "user_id": USER})
+        assert status == 200
+        _assert_once_per_turn(recorder, message)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Registry system prompt (user-015): render 1 lần / version catalog, chuỗi y hệt giữa các lượt, metrics."""
+import hashlib
+import types
+
+import pytest
+
+from apps.ai import prompts
+from apps.ai.prompts import get_prompt, prompt_stats, record_call
+from apps.ai.tokens import count_tokens
+from apps.utils import metrics
+from apps.utils.catalog_index import CatalogIndex
+from apps.utils.catalog_store import get_catalog, load_static
+import apps.vector.training_vector  # noqa: F401  (đăng ký prompt "reply", "skin_gate")
+
+NAME = "test_prompt"
+
+
+def _catalog(extra_spa=None, version=None) -> CatalogIndex:
+    locations, services = load_static()
+    if extra_spa:
+        locations = locations + [{**locations[0], "name": extra_spa}]
+    return CatalogIndex.build(locations, services, version=version)
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Prompt thử NAME: ghi lại version catalog mỗi lần render; dọn bản render khi xong."""
+    calls = []
+    monkeypatch.setitem(prompts._RENDERERS, NAME, lambda catalog: calls.append(catalog.version) or
+                        "Danh sách spa:\n" + "\n".join(spa.name for spa in catalog.spas))
+    yield calls
+    for key in [k for k in prompts._RENDERED if k[0] == NAME]:
+        del prompts._RENDERED[key]
+
+
+def test_rendered_once_per_catalog_version(renders):
+    catalog = _catalog()
+    before = metrics.get("prompt.renders")
+    first = get_prompt(NAME, catalog)
+    assert get_prompt(NAME, catalog) is first
+    assert get_prompt(NAME, _catalog()) is first  # snapshot khác, cùng nội dung → cùng version
+    assert renders == [catalog.version]
+    assert metrics.get("prompt.renders") == before + 1
+    assert first.version == catalog.version
+    assert first.tokens == count_tokens(first.text)
+    assert first.digest == hashlib.sha1(first.text.encode("utf-8")).hexdigest()[:12]
+    assert first.message() == {"role": "system", "content": first.text}
+
+
+def test_new_catalog_version_rerenders_and_drops_the_old_one(renders):
+    old = get_prompt(NAME, _catalog())
+    new = get_prompt(NAME, _catalog(extra_spa="Spa Kiểm Thử"))
+    assert len(renders) == 2
+    assert new.version != old.version and new.digest != old.digest
+    assert "Spa Kiểm Thử" in new.text and "Spa Kiểm Thử" not in old.text
+    assert [k for k in prompts._RENDERED if k[0] == NAME] == [(NAME, new.version)]
+
+
+def test_default_catalog_is_the_current_snapshot(app, renders):
+    assert get_prompt(NAME).version == get_catalog().index.version
+
+
+@pytest.mark.parametrize("name", ["reply", "skin_gate"])
+def test_registered_prompts_are_byte_identical_between_calls(name):
+    catalog = _catalog()
+    first = get_prompt(name, catalog)
+    prompts._RENDERED.clear()  # render lại từ đầu vẫn ra đúng chuỗi đó
+    again = get_prompt(name, catalog)
+    assert again is not first
+    assert again.text == first.text and again.digest == first.digest
+
+
+def test_reply_prompt_lists_the_catalog_spas():
+    catalog = _catalog(extra_spa="Spa Kiểm Thử", version="prompt-test")
+    text = get_prompt("reply", catalog).text
+    assert all(spa.name in text for spa in catalog.spas)
+
+
+def _completion(cached_tokens):
+    details = types.SimpleNamespace(cached_tokens=cached_tokens)
+    return types.SimpleNamespace(usage=types.SimpleNamespace(prompt_tokens_details=details))
+
+
+def test_record_call_metrics(renders, monkeypatch):
+    monkeypatch.setattr(prompts, "CACHE_MIN_TOKENS", 50)
+    prompt = get_prompt(NAME, _catalog())
+    base = {k: metrics.get(f"prompt.{NAME}.{k}") for k in ("calls", "tokens", "cache_eligible", "cached_tokens")}
+    short = [prompt.message(), {"role": "user", "content": "hi"}]
+    long = short + [{"role": "user", "content": "rất dài " * 100}]
+
+    record_call(prompt, short)                         # không có completion (vd. stream)
+    record_call(prompt, long, _completion(1024))
+    record_call(prompt, long, _completion(None))       # provider không trả cached_tokens
+
+    delta = {k: metrics.get(f"prompt.{NAME}.{k}") - v for k, v in base.items()}
+    assert prompts.messages_tokens(short) < 50 <= prompts.messages_tokens(long)
+    assert delta == {
+        "calls": 3,
+        "tokens": prompts.messages_tokens(short) + 2 * prompts.messages_tokens(long),
+        "cache_eligible": 2,
+        "cached_tokens": 1024,
+    }
+    stats = prompt_stats()[NAME]
+    assert stats["version"] == prompt.version and stats["digest"] == prompt.digest
+    assert stats["static_tokens"] == prompt.tokens
+    assert stats["calls"] == metrics.get(f"prompt.{NAME}.calls")
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Cổng skincare cục bộ (user-010): độ tự tin của decide(), lưu / nạp model, fingerprint theo corpus + catalog."""
+import numpy as np
+import pytest
+
+from apps.utils.catalog_index import CatalogIndex
+from apps.utils.catalog_store import build_snapshot, get_catalog, load_static
+from apps.vector import skin_classifier
+from apps.vector.skin_classifier import SkinQuestionClassifier, build_seed_corpus, get_skin_classifier, load_or_train
+
+DIM = 256  # nhỏ cho test nhanh
+
+
+def _constant(bias: float, dim: int = DIM) -> SkinQuestionClassifier:
+    """Model trả cùng 1 xác suất sigmoid(bias) cho mọi câu."""
+    return SkinQuestionClassifier(np.zeros(dim), bias)
+
+
+def _with_spa(name: str):
+    """Catalog tĩnh + 1 spa (kèm 1 dịch vụ) mới."""
+    locations, services = load_static()
+    locations = locations + [{**locations[0], "name": name}]
+    services = {**services, name: [{**next(iter(services.values()))[0], "name": f"Liệu trình {name}"}]}
+    return locations, services
+
+
+@pytest.fixture
+def trained():
+    return SkinQuestionClassifier.train(build_seed_corpus(), DIM)
+
+
+@pytest.mark.parametrize("bias, threshold, expected", [
+    (3.0, 0.8, True),     # p ≈ 0.95
+    (-3.0, 0.8, False),   # p ≈ 0.05 → tự tin là KHÔNG
+    (0.0, 0.8, None),     # p = 0.5 → hỏi LLM
+    (1.0, 0.8, None),     # p ≈ 0.73 < ngưỡng
+    (1.0, 0.7, True),
+    (3.0, 0.99, None),
+])
+def test_decide_only_answers_when_confident(bias, threshold, expected):
+    decision, p = _constant(bias).decide("câu bất kỳ", threshold)
+    assert decision is expected
+    assert p == pytest.approx(1 / (1 + np.exp(-bias)))
+
+
+@pytest.mark.parametrize("text, label", [
+    ("trị mụn thế nào", True),
+    ("da mình bị tàn nhang", True),
+    ("xin chào", False),
+    ("tôi muốn đặt lịch", False),
+])
+def test_trained_model_separates_seed_sentences(trained, text, label):
+    decision, _p = trained.decide(text, threshold=0.6)
+    assert decision is label
+
+
+def test_save_load_round_trip(trained, tmp_path):
+    path = str(tmp_path / "nested" / "skin_gate.npz")
+    trained.save(path)
+    loaded = SkinQuestionClassifier.load(path)
+    assert loaded.dim == DIM
+    np.testing.assert_array_equal(loaded.weights, trained.weights)
+    assert loaded.bias == pytest.approx(trained.bias)
+    assert loaded.predict_proba("trị mụn thế nào") == pytest.approx(trained.predict_proba("trị mụn thế nào"))
+    assert [p.name for p in tmp_path.joinpath("nested").iterdir()] == ["skin_gate.npz"]  # không sót file tạm
+
+
+def test_load_returns_none_for_missing_or_broken_file(tmp_path):
+    assert SkinQuestionClassifier.load(str(tmp_path / "missing.npz")) is None
+    broken = tmp_path / "broken.npz"
+    broken.write_bytes(b"not a npz")
+    assert SkinQuestionClassifier.load(str(broken)) is None
+
+
+def test_model_file_is_reused_until_the_corpus_changes(tmp_path, monkeypatch):
+    trains = []
+    train = SkinQuestionClassifier.train.__func__
+    monkeypatch.setattr(SkinQuestionClassifier, "train",
+                        classmethod(lambda cls, corpus, dim: trains.append(dim) or train(cls, corpus, dim)))
+
+    first = load_or_train(dim=DIM, model_dir=str(tmp_path))
+    again = load_or_train(dim=DIM, model_dir=str(tmp_path))
+    assert trains == [DIM]  # lần 2 nạp từ file, không train lại
+    np.testing.assert_array_equal(again.weights, first.weights)
+
+    # catalog khác (thêm 1 spa) → corpus khác → fingerprint / file khác → train lại
+    load_or_train(dim=DIM, model_dir=str(tmp_path), catalog=CatalogIndex.build(*_with_spa("Spa Kiểm Thử")))
+    # số chiều khác → file khác
+    load_or_train(dim=DIM * 2, model_dir=str(tmp_path))
+    assert trains == [DIM, DIM, DIM * 2]
+    assert len(list(tmp_path.glob("skin_gate-*.npz"))) == 3
+
+
+def test_classifier_follows_the_catalog_snapshot(app, tmp_path, monkeypatch):
+    corpora = []
+
+    def fake_load_or_train(catalog=None):
+        corpora.append(build_seed_corpus(catalog))
+        return load_or_train(dim=DIM, model_dir=str(tmp_path), catalog=catalog)
+
+    monkeypatch.setattr(skin_classifier, "load_or_train", fake_load_or_train)
+    old = build_snapshot(*load_static(), source="static")
+    new = build_snapshot(*_with_spa("Spa Kiểm Thử"), source="static")
+    assert old.derived("skin_classifier") is old.derived("skin_classifier")  # 1 lần / snapshot
+    assert new.derived("skin_classifier") is not old.derived("skin_classifier")
+    assert len(corpora) == 2
+    assert ("Spa Kiểm Thử ở đâu", 0) in corpora[1] and ("Spa Kiểm Thử ở đâu", 0) not in corpora[0]
+    assert get_skin_classifier() is get_catalog().derived("skin_classifier")
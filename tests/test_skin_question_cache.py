@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Cache YES/NO của bộ lọc skincare (user-009): khoá bỏ dấu, cache cả NO, dùng chung giữa worker, bypass."""
+import types
+import uuid
+
+import pytest
+
+from apps.utils import metrics
+from apps.vector.skin_question_cache import SKIN_QUESTION_CACHE, SkinQuestionCache
+from apps.vector.training_vector import TrainingVector
+
+
+class _Client:
+    """gpt-4o giả: YES nếu câu có 'mun', ghi lại từng câu được hỏi."""
+
+    def __init__(self):
+        self.asked = []
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, model=None, messages=None, **kwargs):
+        question = messages[-1]["content"]
+        self.asked.append(question)
+        answer = "YES" if "mụn" in question or "mun" in question else "NO"
+        message = types.SimpleNamespace(content=f" {answer.lower()}\n")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture(params=["app", "redis_app"])
+def backend(request):
+    # bản đăng ký sống cả process: bỏ L1 + đọc lại version từ backend của test này
+    SKIN_QUESTION_CACHE.clear_local()
+    SKIN_QUESTION_CACHE._mark_stale()
+    yield request.getfixturevalue(request.param)
+    SKIN_QUESTION_CACHE.clear_local()
+    SKIN_QUESTION_CACHE._mark_stale()
+
+
+@pytest.fixture
+def client():
+    return _Client()
+
+
+def _tag():
+    return uuid.uuid4().hex[:6]  # version in-process dùng chung → mỗi test câu riêng
+
+
+def test_key_ignores_accents_and_case():
+    assert SkinQuestionCache.key_for("Trị MỤN thế nào?") == SkinQuestionCache.key_for("tri mun the nao?")
+
+
+def test_false_is_cached_not_treated_as_miss(backend):
+    cache = SkinQuestionCache()
+    key = f"gia xang {_tag()}"
+    assert cache.get(key) is None
+    cache.set(key, False)
+    assert cache.get(key) is False
+    cache.set(key, 1)
+    assert cache.get(key) is True
+
+
+def test_accent_variants_share_one_llm_call(backend, client):
+    tv, tag = TrainingVector(), _tag()
+    assert tv.is_general_skin_question_gpt(f"Trị mụn thế nào {tag}", client) is True
+    assert tv.is_general_skin_question_gpt(f"tri mun THE nao {tag}", client) is True
+    assert tv.is_general_skin_question_gpt(f"thời tiết {tag}", client) is False
+    assert tv.is_general_skin_question_gpt(f"thoi tiet {tag}", client) is False
+    assert len(client.asked) == 2
+
+
+def test_other_worker_reads_the_shared_result(backend, client):
+    tv, tag = TrainingVector(), _tag()
+    tv.is_general_skin_question_gpt(f"trị mụn {tag}", client)
+    other = SkinQuestionCache()  # L1 trống như worker khác, cùng L2
+    assert other.get(SkinQuestionCache.key_for(f"trị mụn {tag}")) is True
+    hits = metrics.get("skin_cache.l2_hit")
+    SKIN_QUESTION_CACHE.clear_local()
+    tv.is_general_skin_question_gpt(f"trị mụn {tag}", client)
+    assert len(client.asked) == 1
+    assert metrics.get("skin_cache.l2_hit") == hits + 1
+
+
+def test_bypass_always_asks_and_never_writes(backend, client, monkeypatch):
+    tv, question = TrainingVector(), f"trị mụn {_tag()}"
+    monkeypatch.setenv("SKIN_CACHE_BYPASS", "1")
+    bypassed = metrics.get("skin_cache.bypass")
+    for _ in range(2):
+        assert tv.is_general_skin_question_gpt(question, client) is True
+    assert len(client.asked) == 2
+    assert metrics.get("skin_cache.bypass") == bypassed + 2
+    assert SKIN_QUESTION_CACHE.get(SkinQuestionCache.key_for(question)) is None
+    assert SKIN_QUESTION_CACHE.stats()["bypass"] == bypassed + 2
+
+
+def test_invalidate_asks_again(backend, client):
+    tv, question = TrainingVector(), f"trị mụn {_tag()}"
+    tv.is_general_skin_question_gpt(question, client)
+    SKIN_QUESTION_CACHE.invalidate()
+    tv.is_general_skin_question_gpt(question, client)
+    assert client.asked == [question, question]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""Chạy đầu cơ lượt LLM song song với routing cục bộ (user-012)."""
+import threading
+
+from flask import current_app
+
+from apps.vector import speculative
+
+
+def test_runs_in_the_request_app_context(app):
+    spec = speculative.submit(lambda: current_app.name)
+    assert spec.result(timeout=5) == app.name
+
+
+def test_saturated_pool_falls_back_to_sequential(app):
+    gate = threading.Event()
+    held = [speculative.submit(gate.wait, 5) for _ in range(speculative.MAX_WORKERS)]
+    try:
+        assert all(held)
+        assert speculative.submit(lambda: None) is None
+    finally:
+        gate.set()
+        for spec in held:
+            spec.result(timeout=5)
+    assert speculative.submit(lambda: 1).result(timeout=5) == 1
+
+
+def test_cancel_after_start_is_ignored_and_frees_the_slot(app):
+    started, gate = threading.Event(), threading.Event()
+
+    def call():
+        started.set()
+        gate.wait(5)
+        return "YES"
+
+    spec = speculative.submit(call)
+    assert started.wait(5)
+    assert spec.cancel() == "ignored"
+    gate.set()
+    assert spec.result(timeout=5) == "YES"  # lượt gọi vẫn chạy xong ở nền
+    held = [speculative.submit(lambda: None) for _ in range(speculative.MAX_WORKERS)]
+    assert all(held)
+    for h in held:
+        h.result(timeout=5)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Endpoint SSE của chat: khung event, mã HTTP thật khi lỗi, nhả khoá turn khi response đóng (user-008)."""
+import functools
+import json
+import types
+
+import pytest
+from flask_restx import Api
+
+import apps.controllers.ai_controller as ai_controller
+import apps.controllers.bot_controller as bot_controller
+from apps.dto.ai_dto import AIDto
+from apps.dto.bot_dto import BotDto
+from apps.utils.conversation_session import ConversationSession
+from apps.utils.turn_lock import TurnLockTimeout, get_turn_lock, turn_lock
+
+USER = "sse-user"
+TOKENS = ["Nên ", "rửa mặt ", "dịu nhẹ."]
+ENDPOINTS = ["/api/bots/messages/v2/stream", "/api/ai/messages/stream"]
+
+
+class _StreamingCompletions:
+    """Model giả: stream=True → từng token TOKENS; lượt lọc skincare YES/NO → "NO"."""
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        if stream:
+            return iter(types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=t))])
+                        for t in TOKENS)
+        text = "NO" if "YES hoặc NO" in messages[0]["content"] else "{}"
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=None)
+
+
+@pytest.fixture(params=["memory", "redis"])
+def client(request, monkeypatch):
+    app = request.getfixturevalue("app" if request.param == "memory" else "redis_app")
+    llm = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_StreamingCompletions()))
+    monkeypatch.setattr(bot_controller, "get_llm_client", lambda: llm)
+    monkeypatch.setattr(ai_controller, "get_llm_client", lambda: llm)
+    api = Api(app)
+    api.add_namespace(BotDto.api, path="/api/bots")
+    api.add_namespace(AIDto.api, path="/api/ai")
+    return app.test_client()
+
+
+def _events(body: str):
+    """Tách body text/event-stream → [(tên event, data)]; mỗi event kết thúc bằng 1 dòng trống."""
+    assert body.endswith("\n\n")
+    events = []
+    for block in body[:-2].split("\n\n"):
+        name, data = block.split("\n")
+        assert name.startswith("event: ") and data.startswith("data: ")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def _is_free(user_id):
+    try:
+        get_turn_lock().acquire(user_id, wait_ms=0).release()
+        return True
+    except TurnLockTimeout:
+        return False
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_gpt_reply_streams_deltas_then_done(client, path):
+    response = client.post(path, json={"message": "da mặt bị mụn thì nên làm gì", "user_id": USER})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    events = _events(response.get_data(as_text=True))
+    assert events[:-1] == [("delta", {"text": t}) for t in TOKENS]
+    assert events[-1] == ("done", {"status": 200, "message": None, "context": "".join(TOKENS)})
+    # câu trả lời đầy đủ được ghi vào history khi stream xong, khoá turn đã nhả
+    assert ConversationSession.load(USER).history[-1] == {"role": "assistant", "content": "".join(TOKENS)}
+    assert _is_free(USER)
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_deterministic_reply_is_a_single_done_event(client, path):
+    response = client.post(path, json={"message": "danh sách spa ở hà nội", "user_id": USER})
+    assert response.status_code == 200
+    (name, data), = _events(response.get_data(as_text=True))
+    assert name == "done" and data["status"] == 200
+    assert ConversationSession.load(USER).history[-1] == {"role": "assistant", "content": data["context"]}
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_busy_turn_keeps_the_http_status(client, path, monkeypatch):
+    for controller in (bot_controller, ai_controller):
+        monkeypatch.setattr(controller, "turn_lock", functools.partial(turn_lock, wait_ms=0))
+    with turn_lock(USER):
+        response = client.post(path, json={"message": "xin chào", "user_id": USER})
+    assert response.status_code == 429
+    (name, data), = _events(response.get_data(as_text=True))
+    assert name == "done"
+    assert (data["status"], data["message"]) == (429, bot_controller.TURN_BUSY_MESSAGE)
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_invalid_payload_is_rejected_before_streaming(client, path):
+    response = client.post(path, json={"user_id": USER})
+    assert response.status_code == 400
+    assert response.mimetype != "text/event-stream"
+
+
+@pytest.mark.parametrize("path", ENDPOINTS)
+def test_closing_the_response_releases_the_turn_lock(client, path):
+    response = client.post(path, json={"message": "da mặt bị mụn thì nên làm gì", "user_id": USER},
+                           buffered=False)
+    assert response.status_code == 200
+    assert not _is_free(USER)  # stream chưa chạy: khoá còn giữ cho tới khi history được ghi
+    response.close()  # client ngắt trước byte đầu tiên
+    assert _is_free(USER)
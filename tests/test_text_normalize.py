@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Bỏ dấu tiếng Việt dùng chung (user-001)."""
+import pytest
+
+from apps.utils.text_normalize import fold_text
+
+
+@pytest.mark.parametrize("raw, folded", [
+    ("Gội đầu Dưỡng sinh", "goi dau duong sinh"),
+    ("  Xin   chào\tĐà Nẵng  ", "xin chao da nang"),
+    ("ĐẶT LỊCH 9h kém 15", "dat lich 9h kem 15"),
+    ("Ứng Hoà, Hà Nội", "ung hoa, ha noi"),
+    ("ạảấầẩẫậắằẳẵặẹẻẽếềểễệỉịọỏốồổỗộớờởỡợụủứừửữựỳỵỷỹ",
+     "aaaaaaaaaaaaeeeeeeeeiioooooooooooouuuuuuuyyyy"),
+    ("spa hcm", "spa hcm"),
+    ("", ""),
+    (None, ""),
+])
+def test_fold(raw, folded):
+    assert fold_text(raw) == folded
+
+
+def test_decomposed_input_folds_like_composed():
+    composed = "Nguyễn Thái Bình"
+    decomposed = "Nguyễn Thái Bình"
+    assert fold_text(decomposed) == fold_text(composed) == "nguyen thai binh"
+
+
+def test_characters_outside_the_table_are_kept():
+    assert fold_text("Ωμέγα 🙂") == "ωμεγα 🙂"
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Cache 2 tầng (user-024): version theo namespace giữa các worker, TTL / LRU của L1, pub/sub."""
+import time
+import types
+import uuid
+
+import pytest
+
+from apps.extensions import cache
+from apps.utils import metrics
+from apps.utils import tiered_cache as tiered_cache_module
+from apps.utils.tiered_cache import TieredCache
+
+
+@pytest.fixture(params=["app", "redis_app"])
+def backend(request):
+    return request.getfixturevalue(request.param)
+
+
+@pytest.fixture
+def namespace():
+    return f"test-{uuid.uuid4().hex[:8]}"  # metrics + version dùng chung cả process
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Đồng hồ monotonic giả của module (chỉnh bằng clock.now)."""
+    fake = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(tiered_cache_module, "time", types.SimpleNamespace(monotonic=lambda: fake.now,
+                                                                           sleep=time.sleep))
+    return fake
+
+
+def _workers(namespace, **kwargs):
+    """2 instance cùng namespace = 2 worker dùng chung L2 / version."""
+    return TieredCache(namespace, **kwargs), TieredCache(namespace, **kwargs)
+
+
+def test_second_worker_reads_through_l2(backend, namespace):
+    a, b = _workers(namespace)
+    a.set("k", {"v": 1})
+    assert b.get("k") == {"v": 1}
+    assert b.get("k") == {"v": 1}
+    assert metrics.get(f"{namespace}.l2_hit") == 1
+    assert metrics.get(f"{namespace}.l1_hit") == 1
+    assert cache.get(f"tc:{namespace}:0:k") == {"v": 1}
+
+
+def test_invalidate_drops_values_in_every_worker(backend, namespace, clock, monkeypatch):
+    monkeypatch.setattr(tiered_cache_module, "VERSION_CHECK_S", 5)
+    a, b = _workers(namespace)
+    a.set("k", "old")
+    assert b.get("k") == "old"  # nằm trong L1 của b
+
+    assert a.invalidate() == 1
+    assert a.get("k") is None
+    assert b.get("k") == "old"  # b chưa tới chu kỳ đọc lại version
+    clock.now += 5
+    assert b.get("k") is None  # version mới → mục L1 cũ và khoá L2 cũ đều bị bỏ qua
+    assert b.stats()["version"] == 1
+
+    b.set("k", "new")
+    assert a.get("k") == "new"
+    assert cache.get(f"tc:{namespace}:1:k") == "new"
+
+
+def test_unreachable_redis_keeps_the_known_version(redis_app, namespace, clock, monkeypatch):
+    monkeypatch.setattr(tiered_cache_module, "VERSION_CHECK_S", 0)
+    tc = TieredCache(namespace)
+    tc.invalidate()
+    tc.set("k", "v")
+
+    def down(*args, **kwargs):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(cache, "get", down)
+    monkeypatch.setattr(tiered_cache_module._versions(), "get", down)
+    assert tc.version() == 1
+    assert tc.get("k") == "v"          # L1 vẫn phục vụ
+    assert tc.get("missing") is None   # L2 lỗi → miss, không ném lỗi
+
+
+def test_l1_entries_expire_after_ttl(backend, namespace, clock):
+    tc = TieredCache(namespace, l1_ttl=10)
+    tc.set("k", "v", local_only=True)
+    clock.now += 9.9
+    assert tc.get("k", local_only=True) == "v"
+    clock.now += 0.1
+    assert tc.get("k", local_only=True) is None
+    assert tc.stats()["l1_size"] == 0
+
+
+def test_l1_ttl_falls_back_to_l2(backend, namespace, clock):
+    tc = TieredCache(namespace, l1_ttl=10)
+    tc.set("k", "v")
+    clock.now += 10
+    assert tc.get("k") == "v"
+    assert metrics.get(f"{namespace}.l2_hit") == 1
+
+
+def test_l1_is_bounded_lru(backend, namespace):
+    tc = TieredCache(namespace, l1_size=2)
+    for key in ("a", "b"):
+        tc.set(key, key.upper(), local_only=True)
+    assert tc.get("a", local_only=True) == "A"  # a mới dùng → b bị đẩy ra trước
+    tc.set("c", "C", local_only=True)
+    assert [tc.get(k, local_only=True) for k in ("a", "b", "c")] == ["A", None, "C"]
+
+
+def test_none_is_not_cached(backend, namespace):
+    tc = TieredCache(namespace)
+    builds = []
+    assert tc.get_or_build("k", lambda: builds.append(1)) is None
+    assert tc.get_or_build("k", lambda: builds.append(1)) is None
+    assert builds == [1, 1]
+    assert tc.get_or_build("x", lambda: builds.append(2) or "X") == "X"
+    assert tc.get_or_build("x", lambda: builds.append(2) or "X") == "X"
+    assert builds == [1, 1, 2]
+
+
+def test_hashed_keys(backend, namespace):
+    a, b = _workers(namespace, hash_keys=True)
+    key = "câu chat rất dài " * 20
+    a.set(key, "v")
+    assert b.get(key) == "v"
+    assert all(len(k) < 80 for k in (a._l2_key(key, 0), b._l2_key(key, 3)))
+
+
+def test_pubsub_marks_the_namespace_stale(redis_app, namespace, monkeypatch):
+    monkeypatch.setenv("CACHE_PUBSUB", "1")
+    monkeypatch.setattr(tiered_cache_module, "VERSION_CHECK_S", 3600)  # chỉ pub/sub mới làm b đọc lại
+    a, b = _workers(namespace)
+    monkeypatch.setitem(tiered_cache_module._NAMESPACES, namespace, b)  # b là bản đã đăng ký của worker này
+    a.set("k", "old")
+    assert b.get("k") == "old"  # lần đọc version đầu tiên cũng khởi động listener
+
+    listener = tiered_cache_module._versions()._listener
+    assert listener is not None and listener[1].is_alive()
+    deadline = time.monotonic() + 2
+    while a.invalidate() and b._checked_at and time.monotonic() < deadline:
+        time.sleep(0.02)  # listener có thể chưa SUBSCRIBE xong ở lần PUBLISH đầu
+    assert b._checked_at == 0.0
+    assert b.get("k") is None
+    assert b.stats()["version"] == a.stats()["version"]
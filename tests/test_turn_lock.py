@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Turn của cùng 1 user chạy tuần tự; khoá luôn được nhả, kể cả khi client SSE ngắt sớm (user-021)."""
+import gc
+import multiprocessing
+import os
+import threading
+import time
+import types
+import uuid
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+import apps.controllers.bot_controller as bot_controller
+from apps.extensions import cache
+from apps.utils import metrics, turn_lock as turn_lock_module
+from apps.utils.availability import CAPACITY, RedisAvailabilityStore, lanes_of
+from apps.utils.conversation_session import ConversationSession, conversation_key_for
+from apps.utils.conversation_store import get_conversation_store
+from apps.utils.sse import StreamedReply, sse_response
+from apps.utils.turn_lock import TurnLock, TurnLockTimeout, get_turn_lock, turn_lock, turn_lock_stats
+from apps.vector.training_vector import TrainingVector
+
+USER = "lock-user"
+TURNS = 8
+# Redis thật cho phép thử nhiều process (vd. redis://localhost:6379/15); không đặt → bỏ qua
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+PROCS = 4
+PROC_TURNS = 25
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend_app(request):
+    return request.getfixturevalue("app" if request.param == "memory" else "redis_app")
+
+
+def _is_free(user_id):
+    try:
+        get_turn_lock().acquire(user_id, wait_ms=0).release()
+        return True
+    except TurnLockTimeout:
+        return False
+
+
+def _streamed_turn(user_id, saved):
+    with turn_lock(user_id) as lease:
+        return lease.hold_until_complete(StreamedReply(iter(["a", "b"]), on_complete=saved.append))
+
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        TurnLock()
+
+
+def test_stream_releases_after_completion(backend_app):
+    saved = []
+    with backend_app.test_request_context():
+        response = sse_response(_streamed_turn(USER, saved))
+        assert not _is_free(USER)
+        body = "".join(response.response)
+        response.close()
+    assert saved == ["ab"]
+    assert '"context": "ab"' in body
+    assert _is_free(USER)
+
+
+def test_disconnect_before_first_chunk_releases(backend_app):
+    saved = []
+    with backend_app.test_request_context():
+        response = sse_response(_streamed_turn(USER, saved))
+        response.close()  # client ngắt trước next() đầu tiên: generator chưa từng chạy
+    assert saved == []
+    assert _is_free(USER)
+
+
+def test_dropped_reply_releases(backend_app):
+    reply = _streamed_turn(USER, [])
+    assert not _is_free(USER)
+    del reply
+    gc.collect()
+    assert _is_free(USER)
+
+
+def test_wait_metrics(app):
+    metrics.reset()
+    turn_lock_module._WAITS.clear()
+    held = threading.Event()
+
+    def holder():
+        with turn_lock(USER):
+            held.set()
+            time.sleep(0.05)
+
+    worker = threading.Thread(target=holder)
+    worker.start()
+    held.wait()
+    with turn_lock(USER):
+        pass
+    worker.join()
+    with pytest.raises(TurnLockTimeout):
+        with turn_lock(USER):
+            with turn_lock(USER, wait_ms=0):
+                pass
+
+    stats = turn_lock_stats()
+    assert (stats["acquired"], stats["contended"], stats["timeouts"]) == (3, 1, 1)
+    assert stats["wait_ms_max"] >= 30  # lượt thứ 2 chờ holder nhả (~50ms)
+    assert stats["wait_ms_p50"] <= stats["wait_ms_p95"] <= stats["wait_ms_max"]
+    assert metrics.snapshot()["turn_lock"] == stats
+
+
+def test_busy_stream_returns_real_status(app):
+    with app.test_request_context():
+        response = sse_response(bot_controller.MessageV2.json_response(None, 429, "busy"))
+    assert response.status_code == 429
+    assert '"status": 429' in "".join(response.response)
+
+
+class _FakeCompletions:
+    def create(self, model=None, messages=None, **kwargs):
+        text = "NO" if "YES hoặc NO" in messages[0]["content"] else "GPT-REPLY"
+        message = types.SimpleNamespace(content=text)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def test_concurrent_turns_book_once(redis_app, monkeypatch):
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_FakeCompletions()))
+    monkeypatch.setattr(bot_controller, "get_llm_client", lambda: client)
+    api = bot_controller.MessageV2()
+    api.answer({"message": "đặt hẹn massage đá nóng 15/12/2030 14:00", "user_id": USER})
+
+    barrier = threading.Barrier(TURNS)
+    replies = []
+
+    def turn():
+        with redis_app.app_context():
+            barrier.wait()
+            replies.append(api.answer({"message": "đồng ý", "user_id": USER}))
+
+    workers = [threading.Thread(target=turn) for _ in range(TURNS)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    assert [status for _body, status in replies] == [200] * TURNS
+    # mỗi turn ghi đúng 1 cặp user / assistant, không turn nào ghi đè turn khác
+    assert len(ConversationSession.load(USER).history) == 2 * (TURNS + 1)
+    appointments = TrainingVector().get_appointments(USER)
+    assert len(appointments) == 1
+    reservation = appointments[0]["reservation"]
+    store = RedisAvailabilityStore(cache.cache)
+    day = datetime.strptime(reservation["day"], "%Y%m%d").date()
+    raw, = store._load(reservation["spa_name"], [day])
+    assert sum(bin(lane).count("1") for lane in lanes_of(raw, CAPACITY)) == reservation["cells"]
+
+
+def _redis_app(url):
+    app = Flask("turn-lock-mp")
+    app.config.update(CACHE_TYPE="RedisCache", CACHE_REDIS_URL=url, CACHE_DEFAULT_TIMEOUT=3600)
+    cache.init_app(app)
+    return app
+
+
+def _process_turns(url, user_id, queue):
+    """1 worker: PROC_TURNS turn, mỗi turn đọc-sửa-ghi bộ đếm + append 1 mục history."""
+    turns = []
+    with _redis_app(url).app_context():
+        for i in range(PROC_TURNS):
+            with turn_lock(user_id) as lease:
+                session = ConversationSession.load(user_id, lease=lease)
+                session.set("last_context", (session.get("last_context") or 0) + 1)
+                session.history.append({"role": "user", "content": f"{os.getpid()}-{i}"})
+                turns.append((lease.token, session.flush()))
+    queue.put(turns)
+
+
+@pytest.mark.skipif(not REDIS_URL, reason="cần TEST_REDIS_URL (Redis thật) để chạy nhiều process")
+def test_multiprocess_turns_lose_no_appends():
+    user_id = f"mp-{uuid.uuid4().hex}"
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_process_turns, args=(REDIS_URL, user_id, queue)) for _ in range(PROCS)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=120)
+    assert [p.exitcode for p in procs] == [0] * PROCS
+    results = [queue.get(timeout=5) for _ in procs]
+
+    with _redis_app(REDIS_URL).app_context():
+        key = conversation_key_for(user_id)
+        store = get_conversation_store()
+        try:
+            history = store.all(key)
+            counter = ConversationSession.load(user_id).get("last_context")
+        finally:
+            store.clear(key)
+            lock = get_turn_lock()
+            lock._write.delete(lock.lease_key(user_id), lock.fence_key(user_id),
+                               ConversationSession._cache_key("last_context", user_id))
+
+    total = PROCS * PROC_TURNS
+    assert all(flushed for turns in results for _token, flushed in turns)  # không lượt ghi nào bị fence
+    assert len(history) == total and counter == total  # không turn nào ghi đè / mất lượt ghi
+    for turns in results:
+        tokens = [token for token, _flushed in turns]
+        assert tokens == sorted(tokens) and len(set(tokens)) == len(tokens)
+    assert sorted(token for turns in results for token, _flushed in turns) == list(range(1, total + 1))
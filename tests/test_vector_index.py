@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Index vector n-gram cho so khớp gần đúng dịch vụ / spa (user-005)."""
+import os
+
+import numpy as np
+import pytest
+
+from apps.utils.catalog_index import get_catalog_index
+from apps.vector.vector_index import VectorIndex, embed, get_catalog_vectors, load_or_build
+
+ITEMS = [
+    ("goi", [("Gội đầu dưỡng sinh thảo dược", 1.0)]),
+    ("da-nong", [("Massage đá nóng", 1.0)]),
+    ("mun", [("Chăm sóc da mụn", 1.0), ("Làm sạch, lấy nhân mụn", 0.35)]),
+]
+
+
+def test_embedding_ignores_diacritics_and_is_normalised():
+    a, b = embed("Gội đầu thảo dược"), embed("goi dau thao duoc")
+    assert np.allclose(a, b)
+    assert np.linalg.norm(a) == pytest.approx(1.0, abs=1e-5)
+
+
+def test_search_ranks_typos_and_paraphrases():
+    index = VectorIndex.build(ITEMS)
+    assert index.labels[index.search("mat xa da nong", k=1)[0][0]] == "da-nong"
+    assert index.labels[index.search("goi dau thao moc", k=1)[0][0]] == "goi"
+    assert index.search("lịch hẹn tuần sau", k=3, min_score=0.35) == []
+    assert index.search("", k=3) == []
+
+
+def test_saved_index_is_reopened_with_mmap(tmp_path):
+    built = load_or_build("services", ITEMS, index_dir=str(tmp_path))
+    files = sorted(os.listdir(tmp_path))
+    assert [f.rsplit(".", 1)[1] for f in files] == ["json", "npy"]
+
+    reopened = load_or_build("services", ITEMS, index_dir=str(tmp_path))
+    assert isinstance(reopened.matrix, np.memmap)
+    assert reopened.labels == built.labels
+    assert np.allclose(reopened.matrix, built.matrix)
+
+
+def test_catalog_change_gets_a_new_file(tmp_path):
+    load_or_build("services", ITEMS, index_dir=str(tmp_path))
+    load_or_build("services", ITEMS[:2], index_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 4
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("mat xa da nong", "Massage đá nóng"),
+    ("massage body", "Body Massage"),
+    ("triet long diode", "Triệt Lông công nghệ cao Diode Laser"),
+    ("tôi muốn đặt lịch gội đầu thảo dược chiều mai", "Gội đầu dưỡng sinh thảo dược"),
+])
+def test_catalog_services(app, query, expected):
+    hits = get_catalog_vectors(get_catalog_index()).similar_services(query, k=3)
+    assert hits and hits[0][0].name == expected